@@ -1,14 +1,31 @@
-from fastapi import APIRouter
+import math
 
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+from api.endpoints.admin import router as admin_router
 from api.endpoints.evses import router as evses_router
 from api.endpoints.locations import router as locations_router
 from api.endpoints.tariffs import router as tariffs_router
 from api.endpoints.checkouts import router as checkouts_router
 from api.endpoints.webhooks import router as webhooks_router
+from api.responses import ORJSONResponse
+from utils.circuit_breaker import CircuitOpenError
 
-api_router = APIRouter()
+# Encodes route results with orjson instead of the json module
+api_router = APIRouter(default_response_class=ORJSONResponse)
 api_router.include_router(evses_router, prefix="/evses", tags=["evses"])
 api_router.include_router(locations_router, prefix="/locations", tags=["locations"])
 api_router.include_router(tariffs_router, prefix="/tariffs", tags=["tariffs"])
 api_router.include_router(checkouts_router, prefix="/checkouts", tags=["checkouts"])
 api_router.include_router(webhooks_router, prefix="/webhooks", tags=["webhooks"])
+api_router.include_router(admin_router, prefix="/admin", tags=["admin"])
+
+
+async def circuit_open_handler(request: Request, exc: CircuitOpenError) -> JSONResponse:
+    """Answers requests failing fast on an open circuit with 503 and Retry-After."""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"{exc.name} is unavailable"},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
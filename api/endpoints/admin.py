@@ -0,0 +1,34 @@
+import secrets
+
+from anyio import to_thread
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from config import Config
+from utils.profiling import ProfilerBusyError, profile
+
+router = APIRouter()
+
+
+def require_admin_token(authorization: str | None = Header(default=None)) -> None:
+    # Admin endpoints do not exist unless a token is configured
+    if not Config.ADMIN_API_TOKEN:
+        raise HTTPException(status_code=404)
+    expected = f"Bearer {Config.ADMIN_API_TOKEN}"
+    if authorization is None or not secrets.compare_digest(
+        authorization.encode(), expected.encode()
+    ):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@router.post("/profile", dependencies=[Depends(require_admin_token)])
+async def create_profile(seconds: float = Query(default=10, gt=0, le=300)):
+    """Samples all threads of this process and returns the folded stacks."""
+    try:
+        sampler = await to_thread.run_sync(profile, seconds)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(
+        sampler.folded(),
+        headers={"Content-Disposition": 'attachment; filename="profile.folded"'},
+    )
@@ -1,23 +1,185 @@
+import hashlib
+from datetime import datetime, timedelta, timezone
+from typing import Iterator
+
 import stripe
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from orjson import dumps
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
+from api.responses import ModelResponse
+from config import Config
 from db.init_db import (
     get_db,
     Evse as EvseModel,
     Tariff as TariffModel,
     Location as LocationModel,
     Checkout as CheckoutModel,
+    MeterSample as MeterSampleModel,
 )
 
+from model.tariff_schedule import as_utc
 from schemas.checkouts import Checkout, CheckoutCreate, CheckoutCreateResponse
-from utils.utils import generate_pricing
+from utils.live_pricing import get_live_checkout
+from utils.meter_curve import downsample_meter_samples
+from utils.stripe_client import run_stripe_call
 
 router = APIRouter()
 
+METER_CURVE_FETCH_SIZE = 1000
+
 
 @router.post("/", response_model=CheckoutCreateResponse)
-def create_checkout(request_body: CheckoutCreate, db: Session = Depends(get_db)):
+async def create_checkout(
+    request_body: CheckoutCreate,
+    idempotency_key: str | None = Header(default=None, max_length=255),
+    db: Session = Depends(get_db),
+):
+    """
+    Creates a checkout and the Stripe Checkout Session for it.
+
+    Clients can send an `Idempotency-Key` header. Retries with the same key and body
+    return the already created checkout and Stripe session instead of creating new
+    ones, a different body with the same key is rejected. A reservation whose Stripe
+    session was not stored within STRIPE_CHECKOUT_RESERVATION_TIMEOUT_SECONDS is taken
+    over by the next retry.
+    """
+    request_hash = get_request_hash(request_body)
+    if idempotency_key is not None:
+        existing_checkout = await run_in_threadpool(
+            get_idempotent_checkout, db, idempotency_key, request_hash
+        )
+        if existing_checkout is not None:
+            return existing_checkout
+
+    try:
+        checkout_id, reserved_at, session_params = await run_in_threadpool(
+            reserve_checkout, db, request_body, idempotency_key, request_hash
+        )
+    except IntegrityError:
+        await run_in_threadpool(db.rollback)
+        if idempotency_key is None:
+            raise
+        # A concurrent request with the same idempotency key reserved it first
+        existing_checkout = await run_in_threadpool(
+            get_idempotent_checkout, db, idempotency_key, request_hash
+        )
+        if existing_checkout is None:
+            raise HTTPException(
+                status_code=409, detail="Checkout creation already in progress"
+            )
+        return existing_checkout
+
+    # No database transaction is open while waiting for Stripe. Stripe returns the
+    # same session for the same checkout, when its reservation was taken over.
+    try:
+        checkout = await run_stripe_call(
+            stripe.checkout.Session.create,
+            idempotency_key=f"checkout-{checkout_id}",
+            **session_params,
+        )
+    except Exception:
+        await run_in_threadpool(release_checkout, db, checkout_id, reserved_at)
+        raise
+
+    await run_in_threadpool(
+        complete_checkout, db, checkout_id, checkout.payment_intent, checkout.url
+    )
+
+    return CheckoutCreateResponse(
+        id=checkout_id,
+        url=checkout.url,
+    )
+
+
+def get_request_hash(request_body: CheckoutCreate) -> str:
+    return hashlib.sha256(request_body.model_dump_json().encode()).hexdigest()
+
+
+def get_stale_reservation_time() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(
+        seconds=Config.STRIPE_CHECKOUT_RESERVATION_TIMEOUT_SECONDS
+    )
+
+
+def get_idempotent_checkout(
+    db: Session, idempotency_key: str, request_hash: str
+) -> CheckoutCreateResponse | None:
+    """Returns the checkout created for the key, or None if there is none to wait for."""
+    try:
+        db_checkout = (
+            db.query(CheckoutModel)
+            .filter(CheckoutModel.idempotency_key == idempotency_key)
+            .first()
+        )
+        if db_checkout is None:
+            return None
+        if db_checkout.idempotency_request_hash not in (None, request_hash):
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key was already used with a different request",
+            )
+        if db_checkout.checkout_url is None:
+            if (
+                db_checkout.reserved_at is None
+                or as_utc(db_checkout.reserved_at) < get_stale_reservation_time()
+            ):
+                return None
+            raise HTTPException(
+                status_code=409, detail="Checkout creation already in progress"
+            )
+        return CheckoutCreateResponse(id=db_checkout.id, url=db_checkout.checkout_url)
+    finally:
+        # Return the connection to the pool before the next threadpool hop
+        db.rollback()
+
+
+def take_over_reservation(
+    db: Session, idempotency_key: str, request_hash: str, reserved_at: datetime
+) -> CheckoutModel | None:
+    # Only one request can take over a stale reservation
+    taken_over = (
+        db.query(CheckoutModel)
+        .filter(
+            CheckoutModel.idempotency_key == idempotency_key,
+            CheckoutModel.checkout_url.is_(None),
+            or_(
+                CheckoutModel.idempotency_request_hash.is_(None),
+                CheckoutModel.idempotency_request_hash == request_hash,
+            ),
+            or_(
+                CheckoutModel.reserved_at.is_(None),
+                CheckoutModel.reserved_at < get_stale_reservation_time(),
+            ),
+        )
+        .update({CheckoutModel.reserved_at: reserved_at}, synchronize_session=False)
+    )
+    if taken_over != 1:
+        return None
+    return (
+        db.query(CheckoutModel)
+        .filter(CheckoutModel.idempotency_key == idempotency_key)
+        .one()
+    )
+
+
+def reserve_checkout(
+    db: Session,
+    request_body: CheckoutCreate,
+    idempotency_key: str | None,
+    request_hash: str,
+) -> tuple[int, datetime, dict]:
+    """
+    Reserves the checkout and returns its id and reservation time with the Stripe
+    session parameters.
+
+    A stale reservation of the idempotency key is taken over and keeps its id, so
+    Stripe returns the session it may already have created for it.
+    """
     evse = db.query(EvseModel).filter(EvseModel.evse_id == request_body.evse_id).first()
     if evse is None:
         raise HTTPException(status_code=404, detail="EVSE not found")
@@ -36,14 +198,29 @@ def create_checkout(request_body: CheckoutCreate, db: Session = Depends(get_db))
     if location is None:
         raise HTTPException(status_code=404, detail="No Location for EVSE found")
 
-    db_checkout = CheckoutModel(connector_id=evse.connectors[0].id, tariff_id=tariff.id)
-    db.add(db_checkout)
-    db.commit()
-    db.refresh(db_checkout)
+    reserved_at = datetime.now(timezone.utc)
+    db_checkout = None
+    if idempotency_key is not None:
+        db_checkout = take_over_reservation(
+            db, idempotency_key, request_hash, reserved_at
+        )
+    if db_checkout is None:
+        db_checkout = CheckoutModel(
+            idempotency_key=idempotency_key,
+            idempotency_request_hash=(
+                request_hash if idempotency_key is not None else None
+            ),
+            reserved_at=reserved_at,
+        )
+        db.add(db_checkout)
+    db_checkout.connector_id = evse.connectors[0].id
+    db_checkout.tariff_id = tariff.id
+    db.flush()
 
-    checkout = stripe.checkout.Session.create(
-        payment_method_types=["card"],
-        line_items=[
+    checkout_id = db_checkout.id
+    session_params = {
+        "payment_method_types": ["card"],
+        "line_items": [
             {
                 "price_data": {
                     "currency": tariff.currency.lower(),
@@ -54,34 +231,109 @@ def create_checkout(request_body: CheckoutCreate, db: Session = Depends(get_db))
                 "quantity": 1,
             },
         ],
-        metadata={"checkoutId": db_checkout.id},
-        payment_intent_data={
+        "metadata": {"checkoutId": checkout_id},
+        "payment_intent_data": {
             "capture_method": "manual",
         },
-        stripe_account=location.operator.stripe_account_id,
-        mode="payment",
-        success_url=f"{request_body.success_url}/{db_checkout.id}",
-        cancel_url=request_body.cancel_url,
-    )
-    db_checkout.payment_intent_id = checkout.payment_intent
-    db.add(db_checkout)
+        "stripe_account": location.operator.stripe_account_id,
+        "mode": "payment",
+        "success_url": f"{request_body.success_url}/{checkout_id}",
+        "cancel_url": request_body.cancel_url,
+    }
     db.commit()
-    db.refresh(db_checkout)
 
-    return CheckoutCreateResponse(
-        id=db_checkout.id,
-        url=checkout.url,
+    return checkout_id, reserved_at, session_params
+
+
+def complete_checkout(
+    db: Session, checkout_id: int, payment_intent_id: str, checkout_url: str
+) -> None:
+    # A request whose reservation was taken over stores the same Stripe session
+    db.query(CheckoutModel).filter(CheckoutModel.id == checkout_id).update(
+        {
+            CheckoutModel.payment_intent_id: payment_intent_id,
+            CheckoutModel.checkout_url: checkout_url,
+        },
+        synchronize_session=False,
     )
+    db.commit()
+
+
+def release_checkout(db: Session, checkout_id: int, reserved_at: datetime) -> None:
+    """Removes a reserved checkout so a retry with the same idempotency key can run."""
+    db.rollback()
+    # Unless another request took over the reservation in the meantime
+    db.query(CheckoutModel).filter(
+        CheckoutModel.id == checkout_id, CheckoutModel.reserved_at == reserved_at
+    ).delete(synchronize_session=False)
+    db.commit()
 
 
 @router.get("/{id}", response_model=Checkout)
 def get_checkout(id: int, db: Session = Depends(get_db)):
-    db_checkout = db.query(CheckoutModel).filter(CheckoutModel.id == id).first()
+    """
+    Returns a checkout with its pricing up to now.
+
+    Polling a running session reads the database only after a change to the
+    checkout, like a meter update, as its pricing is cached in between.
+    """
+    live_checkout = get_live_checkout(db, id)
+    if live_checkout is None:
+        raise HTTPException(status_code=404, detail="charging.error.sessionnotfound")
+
+    return ModelResponse(live_checkout.checkout())
+
+
+@router.get("/{id}/meter-curve")
+def get_checkout_meter_curve(
+    id: int,
+    points: int = Query(default=200, ge=1, le=5000),
+    db: Session = Depends(get_db),
+):
+    """
+    Streams the energy and power curve of a checkout as JSON.
+
+    The recorded meter samples are downsampled to at most `points` points, each with
+    `time`, `transaction_kwh`, `power_active_import` (average of the interval) and
+    `transaction_soc`.
+    """
+    db_checkout = db.query(CheckoutModel.id).filter(CheckoutModel.id == id).first()
     if db_checkout is None:
         raise HTTPException(status_code=404, detail="charging.error.sessionnotfound")
 
-    output_checkout = Checkout(
-        **{**db_checkout.__dict__, "pricing": generate_pricing(db_checkout.id)}
+    start, end = (
+        db.query(
+            func.min(MeterSampleModel.sampled_at), func.max(MeterSampleModel.sampled_at)
+        )
+        .filter(MeterSampleModel.checkout_id == id)
+        .one()
     )
+    # The request session is closed before the response is streamed
+    return StreamingResponse(
+        stream_meter_curve(db.get_bind(), id, start, end, points),
+        media_type="application/json",
+    )
+
 
-    return output_checkout
+def stream_meter_curve(
+    bind, checkout_id: int, start: datetime, end: datetime, points: int
+) -> Iterator[bytes]:
+    yield b'{"checkout_id":%d,"points":[' % checkout_id
+    if start is not None:
+        with Session(bind=bind) as db:
+            samples = (
+                db.query(
+                    MeterSampleModel.sampled_at,
+                    MeterSampleModel.transaction_kwh,
+                    MeterSampleModel.power_active_import,
+                    MeterSampleModel.transaction_soc,
+                )
+                .filter(MeterSampleModel.checkout_id == checkout_id)
+                .order_by(MeterSampleModel.sampled_at, MeterSampleModel.id)
+                .yield_per(METER_CURVE_FETCH_SIZE)
+            )
+            separator = b""
+            for point in downsample_meter_samples(samples, start, end, points):
+                yield separator + dumps(point)
+                separator = b","
+    yield b"]}"
@@ -1,16 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 
 from db.init_db import get_db, Evse as EvseModel
 from schemas.evses import Evse as EvseSchema
+from utils.cache import topology_cache
+from utils.response_cache import cached_json_response
 
 router = APIRouter()
 
 
 @router.get("/{evse_id}", response_model=EvseSchema)
-async def read_evses(evse_id: str, db: Session = Depends(get_db)):
-    evse = db.query(EvseModel).filter(EvseModel.evse_id == evse_id).first()
-    if evse is None:
-        raise HTTPException(status_code=404, detail="EVSE not found")
+def read_evses(evse_id: str, request: Request, db: Session = Depends(get_db)):
+    def render() -> bytes:
+        evse = db.query(EvseModel).filter(EvseModel.evse_id == evse_id).first()
+        if evse is None:
+            raise HTTPException(status_code=404, detail="EVSE not found")
+        return EvseSchema.model_validate(evse).model_dump_json().encode()
 
-    return evse
+    return cached_json_response(request, topology_cache, f"evses:{evse_id}", render)
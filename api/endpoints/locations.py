@@ -1,16 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 
 from db.init_db import get_db, Location as LocationModel
 
 from schemas.locations import Location
+from utils.cache import topology_cache
+from utils.response_cache import cached_json_response
 
 router = APIRouter()
 
 
 @router.get("/{id}", response_model=Location)
-def get_location(id: int, db: Session = Depends(get_db)):
-    db_location = db.query(LocationModel).filter(LocationModel.id == id).first()
-    if db_location is None:
-        raise HTTPException(status_code=404, detail="Location not found")
-    return db_location
+def get_location(id: int, request: Request, db: Session = Depends(get_db)):
+    def render() -> bytes:
+        db_location = db.query(LocationModel).filter(LocationModel.id == id).first()
+        if db_location is None:
+            raise HTTPException(status_code=404, detail="Location not found")
+        return Location.model_validate(db_location).model_dump_json().encode()
+
+    return cached_json_response(request, topology_cache, f"locations:{id}", render)
@@ -1,16 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy.orm import Session, joinedload
 
 from db.init_db import get_db, Tariff as TariffModel
 
 from schemas.tariffs import Tariff
+from utils.cache import topology_cache
+from utils.response_cache import cached_json_response
 
 router = APIRouter()
 
 
 @router.get("/{id}", response_model=Tariff)
-def get_tariff(id: int, db: Session = Depends(get_db)):
-    db_location = db.query(TariffModel).filter(TariffModel.id == id).first()
-    if db_location is None:
-        raise HTTPException(status_code=404, detail="Tariff not found")
-    return db_location
+def get_tariff(id: int, request: Request, db: Session = Depends(get_db)):
+    def render() -> bytes:
+        db_tariff = (
+            db.query(TariffModel)
+            .options(joinedload(TariffModel.elements))
+            .filter(TariffModel.id == id)
+            .first()
+        )
+        if db_tariff is None:
+            raise HTTPException(status_code=404, detail="Tariff not found")
+        return Tariff.model_validate(db_tariff).model_dump_json().encode()
+
+    return cached_json_response(request, topology_cache, f"tariffs:{id}", render)
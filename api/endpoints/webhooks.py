@@ -1,58 +1,127 @@
 import json
-from uuid import uuid4
 import stripe
 from fastapi import APIRouter, Depends, HTTPException, Header, Request
 from logging import debug, exception
-from json import loads
+from orjson import JSONDecodeError, loads
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from config import Config
 from db.init_db import Connector, Evse, Transaction, get_db, Checkout as CheckoutModel
 from integrations.integration import OcppIntegration
 from schemas.checkouts import RequestStartStopStatusEnumType
+from utils.stripe_client import stripe_call
+from utils.stripe_webhook import verify_stripe_signature
+from utils.tracing import traced
+from utils.webhook_inbox import store_webhook_event
 
 router = APIRouter()
 
 
+# charge.succeed is in connect_event_types, as we are using Stripe Standard accounts
+# for which the events are coming via the Connect-Webhook.
+# If we would use Stripe Express accounts, the events would be coming via the Account-Webhook
+account_event_types = frozenset()
+connect_event_types = frozenset({"checkout.session.completed"})
+
+
 @router.post("/stripe")
+@traced("stripe_webhook")
 async def stripe_webhook(
     request: Request,
     STRIPE_SIGNATURE: str | None = Header(default=None),
     db: Session = Depends(get_db),
 ):
-    event = None
-    body = b""
-    async for chunk in request.stream():
-        body += chunk
-
-    # charge.succeed is in connect_event_types, as we are using Stripe Standard accounts
-    # for which the events are coming via the Connect-Webhook.
-    # If we would use Stripe Express accounts, the events would be coming via the Account-Webhook
-    account_event_types = []
-    connect_event_types = ["checkout.session.completed"]
+    # Starlette joins the streamed chunks into a single buffer
+    body = await request.body()
+
+    # The matching endpoint secret tells which webhook the event came through
     try:
-        event_type = loads(body.decode()).get("type")
-        debug(" [*WEBHOOK*] Event type {}".format(event_type))
-        if event_type in account_event_types:
-            event = stripe.Webhook.construct_event(
-                body, STRIPE_SIGNATURE, Config.STRIPE_ENDPOINT_SECRET_ACCOUNT
-            )
-        elif event_type in connect_event_types:
-            event = stripe.Webhook.construct_event(
-                body, STRIPE_SIGNATURE, Config.STRIPE_ENDPOINT_SECRET_CONNECT
-            )
-        else:
-            debug(" [*WEBHOOK*] Unhandled event type {}".format(event_type))
-            return {}
-    except ValueError as e:
-        raise e
+        endpoint_secret = verify_stripe_signature(
+            body,
+            STRIPE_SIGNATURE,
+            [
+                Config.STRIPE_ENDPOINT_SECRET_CONNECT,
+                Config.STRIPE_ENDPOINT_SECRET_ACCOUNT,
+            ],
+        )
     except stripe.error.SignatureVerificationError as e:
-        raise e
+        debug(" [*WEBHOOK*] Signature verification failed: %r", e.user_message)
+        raise HTTPException(status_code=400, detail="Invalid signature")
+
+    handled_event_types = (
+        connect_event_types
+        if endpoint_secret == Config.STRIPE_ENDPOINT_SECRET_CONNECT
+        else account_event_types
+    )
+    if not may_have_event_type(body, handled_event_types):
+        debug(" [*WEBHOOK*] Unhandled event type")
+        return {}
+
+    try:
+        event = loads(body)
+    except JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid payload")
 
-    # Handle the event
+    event_type = event.get("type")
+    debug(" [*WEBHOOK*] Event type {}".format(event_type))
+    if event_type not in handled_event_types:
+        debug(" [*WEBHOOK*] Unhandled event type {}".format(event_type))
+        return {}
+
+    # Store the event and acknowledge it right away, processing happens in the
+    # webhook inbox. Redeliveries of a stored event are acknowledged without work.
+    checkout_id = get_checkout_id(event)
+    inbox_event_id = await run_in_threadpool(
+        store_webhook_event, db, event, body, checkout_id
+    )
+    if inbox_event_id is None:
+        debug(" [*WEBHOOK*] Duplicate event {}".format(event.get("id")))
+        return {}
+
+    request.app.webhook_inbox.submit(inbox_event_id, checkout_id)
+    return {}
+
+
+def may_have_event_type(body: bytes, event_types: frozenset[str]) -> bool:
     """
-        Removed handling of account changes for now
+    Tells whether the body can be an event of one of `event_types`, without parsing it.
+
+    Most events Stripe sends are of types this service does not handle. The type of
+    a handled event appears in its body as a JSON string, bodies without any are
+    acknowledged without being parsed. A match can be in a nested object, so the
+    type is checked again after parsing.
     """
+    return any(f'"{event_type}"'.encode() in body for event_type in event_types)
+
+
+def get_checkout_id(event: dict) -> int | None:
+    metadata = (event.get("data") or {}).get("object", {}).get("metadata") or {}
+    try:
+        return int(metadata.get("checkoutId"))
+    except (TypeError, ValueError):
+        return None
+
+
+class WebhookProcessingError(Exception):
+    """An event that cannot be processed, retrying it would not help."""
+
+
+@traced("process_stripe_event")
+def process_stripe_event(
+    db: Session, event: dict, ocpp_integration: OcppIntegration
+) -> None:
+    """
+    Processes a verified Stripe event taken from the webhook inbox.
+
+    Runs in a worker thread of the inbox, the database, Stripe and CitrineOS calls
+    block it. Raises WebhookProcessingError for events that cannot be processed,
+    which are not retried. The inbox retries the event after errors of an
+    unavailable dependency, so every step can run again: the authorization is
+    stored under the same id token and charging is not started twice once its
+    remote start was accepted.
+    """
+    # Removed handling of account changes for now
     if event.get("type") == "checkout.session.completed":
         # A Stripe Checkout session completed
         # Payment was successful, try to start a charging session
@@ -71,20 +140,20 @@ async def stripe_webhook(
             paymentIntentId,
         )
 
-        ocpp_integration: OcppIntegration = request.app.ocpp_integration
         db_checkout = (
             db.query(CheckoutModel).filter(CheckoutModel.id == checkoutId).first()
         )
         if db_checkout is None:
-            raise HTTPException(
-                status_code=404, detail="No checkout found for payment intent"
-            )
+            raise WebhookProcessingError("No checkout found for payment intent")
+        if db_checkout.remote_request_status == RequestStartStopStatusEnumType.ACCEPTED:
+            debug(" [Stripe] Charging already started for checkout %r", checkoutId)
+            return
         db_checkout.authorization_amount = checkout_session.get("amount_total")
 
         if paymentIntentId and checkoutId and not transactionId:
-            await handle_web_portal(db, ocpp_integration, db_checkout, paymentIntentId)
+            handle_web_portal(db, ocpp_integration, db_checkout, paymentIntentId)
         elif paymentIntentId and checkoutId and stationId and transactionId:
-            await handle_scan_and_charge(
+            handle_scan_and_charge(
                 db,
                 ocpp_integration,
                 db_checkout,
@@ -93,12 +162,10 @@ async def stripe_webhook(
                 transactionId,
             )
         else:
-            raise HTTPException(status_code=404, detail="Metadata missing")
-
-    return
+            raise WebhookProcessingError("Metadata missing")
 
 
-async def handle_web_portal(
+def handle_web_portal(
     db: Session,
     ocpp_integration: OcppIntegration,
     db_checkout: CheckoutModel,
@@ -109,8 +176,8 @@ async def handle_web_portal(
     db.commit()
 
     # TODO: Remove this part when CitrineOS is correctly saving the idToken from RemoteStartRequests.
-    authorization = await ocpp_integration.create_authorization(
-        f"{Config.OCPP_REMOTESTART_IDTAG_PREFIX}{db_checkout.id}",
+    authorization = ocpp_integration.create_authorization(
+        remote_start_id_token(db_checkout),
         "Central",
         [
             (paymentIntentId, "PaymentIntentId"),
@@ -119,9 +186,7 @@ async def handle_web_portal(
     if authorization is None:
         debug(" [Stripe] Unable to create authorization for transaction")
         cancel_payment_intent(paymentIntentId)
-        raise HTTPException(
-            status_code=404, detail="Unable to create authorization for transaction"
-        )
+        raise WebhookProcessingError("Unable to create authorization for transaction")
 
     idToken = authorization["idToken"]
     request_body = {"remoteStartId": db_checkout.id, "idToken": idToken}
@@ -173,7 +238,7 @@ async def handle_web_portal(
     )
 
 
-async def handle_scan_and_charge(
+def handle_scan_and_charge(
     db: Session,
     ocpp_integration: OcppIntegration,
     db_checkout: CheckoutModel,
@@ -192,16 +257,14 @@ async def handle_scan_and_charge(
     if ocppTransaction is None:
         debug(" [Stripe] No transaction found for checkout session")
         cancel_payment_intent(paymentIntentId)
-        raise HTTPException(
-            status_code=404, detail="No transaction found for checkout session"
-        )
+        raise WebhookProcessingError("No transaction found for checkout session")
     if ocppTransaction.isActive is False:
         debug(" [Stripe] Transaction is not active")
         cancel_payment_intent(paymentIntentId)
-        raise HTTPException(status_code=404, detail="Transaction is not active")
+        raise WebhookProcessingError("Transaction is not active")
 
-    authorization = await ocpp_integration.create_authorization(
-        str(uuid4()),
+    authorization = ocpp_integration.create_authorization(
+        remote_start_id_token(db_checkout),
         "Central",
         [
             (transactionId, "TransactionId"),
@@ -211,9 +274,7 @@ async def handle_scan_and_charge(
     if authorization is None:
         debug(" [Stripe] Unable to create authorization for transaction")
         cancel_payment_intent(paymentIntentId)
-        raise HTTPException(
-            status_code=404, detail="Unable to create authorization for transaction"
-        )
+        raise WebhookProcessingError("Unable to create authorization for transaction")
 
     idToken = authorization["idToken"]
     request_body = {"remoteStartId": db_checkout.id, "idToken": idToken}
@@ -247,16 +308,28 @@ async def handle_scan_and_charge(
         "configuration"  # TODO set up programatic way to resolve module from action
     )
     action = "clearDisplayMessage"
-    ocpp_integration.send_citrineos_message(
-        station_id=stationId,
-        tenant_id=db_evse.tenant_id,
-        url_path=f"{citrineos_module}/{action}",
-        json_payload={"id": db_checkout.qr_code_message_id},
-    )
+    # Charging has started, a QR code left on the display must not fail the event
+    try:
+        ocpp_integration.send_citrineos_message(
+            station_id=stationId,
+            tenant_id=db_evse.tenant_id,
+            url_path=f"{citrineos_module}/{action}",
+            json_payload={"id": db_checkout.qr_code_message_id},
+        )
+    except Exception:
+        exception(
+            " [Stripe] Could not clear the QR code of checkout %r", db_checkout.id
+        )
+
+
+def remote_start_id_token(db_checkout: CheckoutModel) -> str:
+    # The same for every attempt, a retry updates the authorization it created
+    return f"{Config.OCPP_REMOTESTART_IDTAG_PREFIX}{db_checkout.id}"
 
 
 def cancel_payment_intent(paymentIntendId: str):
     try:
-        stripe.PaymentIntent.cancel(paymentIntendId)
+        with stripe_call():
+            stripe.PaymentIntent.cancel(paymentIntendId)
     except Exception as e:
         exception(" [Stripe] Error while canceling payment intent: %r", e.__str__())
@@ -0,0 +1,19 @@
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel
+
+__all__ = ["ModelResponse", "ORJSONResponse"]
+
+
+class ModelResponse(Response):
+    """
+    Renders a pydantic model with model_dump_json.
+
+    Serialization happens in a single pass in pydantic-core. Returning the model
+    itself makes FastAPI validate it against the response model again, convert it
+    to Python objects and then encode those, walking it twice.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: BaseModel) -> bytes:
+        return content.model_dump_json().encode()
@@ -25,18 +25,66 @@ class AppConfig:
     MESSAGE_BROKER_EXCHANGE_TYPE: str = "topic"
     MESSAGE_BROKER_EXCHANGE_NAME: str
     MESSAGE_BROKER_EVENT_CONSUMER_QUEUE_NAME: str
+    MESSAGE_BROKER_EMBEDDED_CONSUMER: bool = True
+    MESSAGE_BROKER_CONSUMER_WORKERS: int = 8
+    MESSAGE_BROKER_CONSUMER_DRAIN_TIMEOUT: int = 30
+    MESSAGE_BROKER_CONSUMER_METRICS_PORT: int = 0
+    MESSAGE_BROKER_PREFETCH_COUNT: int = 100
+    MESSAGE_BROKER_ACK_BATCH_SIZE: int = 1
+    MESSAGE_BROKER_ACK_BATCH_MAX_DELAY_MS: int = 50
+    MESSAGE_BROKER_THROUGHPUT_LOG_INTERVAL: int = 60
+    MESSAGE_BROKER_RETRY_DELAYS_MS: str = "1000,10000,60000,600000"
+    MESSAGE_BROKER_MAX_ATTEMPTS: int = 5
+    CIRCUIT_BREAKER_FAILURE_RATE: float = 0.5
+    CIRCUIT_BREAKER_MIN_CALLS: int = 10
+    CIRCUIT_BREAKER_WINDOW_SECONDS: int = 30
+    CIRCUIT_BREAKER_OPEN_SECONDS: int = 30
+    CIRCUIT_BREAKER_HALF_OPEN_CALLS: int = 1
+    ADMIN_API_TOKEN: str = ""
+    PROFILE_DURATION_SECONDS: int = 30
+    PROFILE_INTERVAL_MS: int = 5
+    PROFILE_OUTPUT_DIR: str = ""
+    EVENT_LOOP_LAG_THRESHOLD_MS: int = 100
+    TRACING_EXPORTER: str = ""
+    TRACING_OTLP_ENDPOINT: str = ""
+    TRACING_SERVICE_NAME: str = "citrineos-payment"
+    TRACING_SAMPLE_RATIO: float = 1.0
+    BACKPRESSURE_ENABLED: bool = True
+    BACKPRESSURE_MAX_LATENCY_MS: str = (
+        "postgres:500,stripe:5000,citrineos:3000,directus:5000"
+    )
+    BACKPRESSURE_MAX_ERROR_RATE: float = 0.5
+    BACKPRESSURE_MIN_CALLS: int = 5
+    BACKPRESSURE_MAX_IN_FLIGHT: int = 50
+    BACKPRESSURE_RESUME_AFTER_SECONDS: int = 5
+    CACHE_URL: str = ""
+    CACHE_MAX_ENTRIES: int = 10000
+    CACHE_TIMEOUT_SECONDS: int = 1
+    TOPOLOGY_CACHE_TTL_SECONDS: int = 30
+    LIVE_PRICING_CACHE_TTL_SECONDS: int = 60
+    TARIFF_TIME_ZONE: str = "UTC"
+    READINESS_TIMEOUT_SECONDS: int = 2
     WEBSERVER_HOST: str
     WEBSERVER_PORT: int
     WEBSERVER_PATH: str
+    WEBSERVER_WORKERS: int = 1
     DB_HOST: str
     DB_PORT: int
     DB_DATABASE: str
     DB_USER: str
     DB_PASSWORD: str
     DB_TABLE_PREFIX: str
+    DB_CREATE_SCHEMA: bool = True
     STRIPE_API_KEY: str
     STRIPE_ENDPOINT_SECRET_ACCOUNT: str
     STRIPE_ENDPOINT_SECRET_CONNECT: str
+    STRIPE_MAX_CONCURRENT_REQUESTS: int = 20
+    STRIPE_WEBHOOK_WORKERS: int = 4
+    STRIPE_WEBHOOK_RETRY_DELAYS_MS: str = "1000,10000,60000,600000"
+    STRIPE_WEBHOOK_MAX_ATTEMPTS: int = 5
+    STRIPE_WEBHOOK_PROCESSING_TIMEOUT_SECONDS: int = 600
+    STRIPE_REQUEST_TIMEOUT_SECONDS: int = 30
+    STRIPE_CHECKOUT_RESERVATION_TIMEOUT_SECONDS: int = 120
     AMPAY_DEFAULT_FEE: float
     AMPAY_COUNTRY_CODE_FOR_ADDING_TAX: str
     AMPAY_ADDING_TAX_RATE: int
@@ -46,10 +94,15 @@ class AppConfig:
     CITRINEOS_MESSAGE_API_URL: str
     CITRINEOS_DATA_API_URL: str
     CITRINEOS_SCAN_AND_CHARGE: bool
+    CITRINEOS_REQUEST_TIMEOUT_SECONDS: int = 10
+    OCPP_EVENT_DEDUP_CACHE_SIZE: int = 10000
+    OCPP_EVENT_DEDUP_WINDOW_HOURS: int = 48
+    OCPP_EVENT_DEDUP_CLAIM_TIMEOUT_SECONDS: int = 300
     CITRINEOS_DIRECTUS_URL: str
     CITRINEOS_DIRECTUS_LOGIN_EMAIL: str
     CITRINEOS_DIRECTUS_LOGIN_PASSWORD: str
     CITRINEOS_DIRECTUS_QR_CODE_FOLDER: str
+    CITRINEOS_DIRECTUS_REQUEST_TIMEOUT_SECONDS: int = 30
     CLIENT_URL: str
 
     """
@@ -65,6 +118,7 @@ class AppConfig:
             ENV_FILE = env.get("CONFIG_PATH")
         load_dotenv(dotenv_path=ENV_FILE)
 
+        type_hints = get_type_hints(AppConfig)
         for field in self.__annotations__:
             if not field.isupper():
                 continue
@@ -76,7 +130,7 @@ class AppConfig:
 
             # Cast env var value to expected type and raise AppConfigError on failure
             try:
-                var_type = get_type_hints(AppConfig)[field]
+                var_type = type_hints[field]
                 if var_type is bool:
                     value = _parse_bool(env.get(field, default_value))
                 else:
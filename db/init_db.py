@@ -1,3 +1,4 @@
+from contextlib import contextmanager
 from logging import info
 from config import Config
 
@@ -9,16 +10,24 @@ from sqlalchemy import (
     DateTime,
     ForeignKey,
     Float,
+    Index,
     Integer,
     String,
+    Text,
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 
+from utils.dependency_stats import instrument_engine
+from utils.metrics import DB_POOL_CONNECTIONS, DB_POOL_SIZE, set_gauge_function
 
 engine = create_engine(
     f"postgresql://{Config.DB_USER}:{Config.DB_PASSWORD}@{Config.DB_HOST}:{Config.DB_PORT}/{Config.DB_DATABASE}",
 )
+instrument_engine(engine)
+set_gauge_function(DB_POOL_CONNECTIONS.labels("checked_out"), engine.pool.checkedout)
+set_gauge_function(DB_POOL_CONNECTIONS.labels("idle"), engine.pool.checkedin)
+DB_POOL_SIZE.set(engine.pool.size())
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -109,6 +118,48 @@ class Tariff(Base):
     stripe_price_id = Column(String(255), unique=True)
 
     connectors = relationship("Connector", back_populates="tariff")
+    # Pricing joins them into its query, other reads of a tariff do not need them
+    elements = relationship(
+        "TariffElement",
+        back_populates="tariff",
+        order_by="TariffElement.id",
+    )
+
+
+# A time of use, tiered or idle price of a tariff, see model.tariff_schedule. The
+# flat prices of the tariff apply where none of its elements does.
+class TariffElement(Base):
+    __tablename__ = f"{Config.DB_TABLE_PREFIX}tariff_elements"
+
+    id = Column(Integer, primary_key=True, autoincrement="auto")
+    tariff_id = Column(
+        Integer,
+        ForeignKey(f"{Config.DB_TABLE_PREFIX}tariffs.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    dimension = Column(String(10), nullable=False)
+    price = Column(Float, nullable=False)
+    start_minute = Column(
+        Integer,
+    )
+    end_minute = Column(
+        Integer,
+    )
+    days_of_week = Column(
+        String(70),
+    )
+    min_kwh = Column(
+        Float,
+    )
+    max_kwh = Column(
+        Float,
+    )
+    grace_minutes = Column(
+        Integer,
+    )
+
+    tariff = relationship("Tariff", back_populates="elements")
 
 
 class Checkout(Base):
@@ -116,6 +167,16 @@ class Checkout(Base):
 
     id = Column(Integer, primary_key=True, autoincrement="auto", index=True)
     payment_intent_id = Column(String(255), index=True, unique=True)
+    idempotency_key = Column(String(255), index=True, unique=True)
+    idempotency_request_hash = Column(
+        String(64),
+    )
+    reserved_at = Column(
+        DateTime(timezone=True),
+    )
+    checkout_url = Column(
+        Text,
+    )
     authorization_amount = Column(
         Float,
     )
@@ -151,6 +212,86 @@ class Checkout(Base):
         Float,
     )
 
+    # Appended to without loading the existing samples
+    meter_samples = relationship("MeterSample", lazy="write_only", passive_deletes=True)
+
+
+class MeterSample(Base):
+    __tablename__ = f"{Config.DB_TABLE_PREFIX}meter_samples"
+
+    id = Column(Integer, primary_key=True, autoincrement="auto")
+    checkout_id = Column(
+        Integer,
+        ForeignKey(f"{Config.DB_TABLE_PREFIX}checkouts.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    sampled_at = Column(DateTime(timezone=True), nullable=False)
+    transaction_kwh = Column(
+        Float,
+    )
+    power_active_import = Column(
+        Float,
+    )
+    transaction_soc = Column(
+        Float,
+    )
+
+    __table_args__ = (
+        Index(
+            f"{Config.DB_TABLE_PREFIX}meter_samples_checkout_id_sampled_at",
+            "checkout_id",
+            "sampled_at",
+        ),
+    )
+
+
+class WebhookEvent(Base):
+    __tablename__ = f"{Config.DB_TABLE_PREFIX}webhook_events"
+
+    id = Column(Integer, primary_key=True, autoincrement="auto", index=True)
+    event_id = Column(String(255), index=True, nullable=False, unique=True)
+    event_type = Column(String(255), nullable=False)
+    checkout_id = Column(Integer, index=True)
+    payload = Column(Text, nullable=False)
+    status = Column(String(16), index=True, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(
+        Text,
+    )
+    received_at = Column(DateTime(timezone=True), nullable=False)
+    claimed_at = Column(
+        DateTime(timezone=True),
+    )
+    next_attempt_at = Column(
+        DateTime(timezone=True),
+    )
+    processed_at = Column(
+        DateTime(timezone=True),
+    )
+
+
+class ProcessedOcppEvent(Base):
+    __tablename__ = f"{Config.DB_TABLE_PREFIX}processed_ocpp_events"
+
+    id = Column(Integer, primary_key=True, autoincrement="auto", index=True)
+    station_id = Column(String(255), nullable=False)
+    transaction_id = Column(String(36), nullable=False)
+    sequence = Column(String(64), nullable=False)
+    event_type = Column(String(16), nullable=False)
+    status = Column(String(16), nullable=False)
+    received_at = Column(DateTime(timezone=True), index=True, nullable=False)
+    claimed_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "station_id",
+            "transaction_id",
+            "sequence",
+            "event_type",
+            name="processed_ocpp_event_key",
+        ),
+    )
+
 
 # CitrineOS Models
 # These are not complete.
@@ -201,6 +342,9 @@ class MessageInfo(Base):
 
 
 def init_db() -> None:
+    if not Config.DB_CREATE_SCHEMA:
+        info(" [init_db] Not creating database tables, DB_CREATE_SCHEMA is false.")
+        return
     # TODO: add Alembic migrations later
     # info(" [init_db] Deleting database tables.")
     # Base.metadata.drop_all(bind=engine,)
@@ -220,3 +364,9 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# For code outside of request handlers, like event and webhook handlers. The session
+# is closed when the block exits, otherwise its connection stays checked out until
+# the garbage collector finds it.
+db_session = contextmanager(get_db)
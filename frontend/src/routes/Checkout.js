@@ -40,6 +40,11 @@ export default function Checkout() {
   const navigate = useNavigate();
   const intl = useIntl();
   const { evseId } = useParams();
+  // Sent with every checkout attempt from this page, so retries reuse the same session
+  const idempotencyKey = React.useRef(
+    window.crypto?.randomUUID?.() ??
+      `${Date.now()}-${Math.random().toString(36).slice(2)}`,
+  );
 
   React.useEffect(() => {
     const setLocationData = (location) => {
@@ -104,11 +109,15 @@ export default function Checkout() {
     // TA accpeted, process checkout
     setState({ ...state, loading: true });
     axios
-      .post(`checkouts/`, {
-        evse_id: evseId,
-        success_url: `${httpProtocol}://${window.location.host}/charging/${evseId}`,
-        cancel_url: `${httpProtocol}://${window.location.host}/checkout/${evseId}`,
-      })
+      .post(
+        `checkouts/`,
+        {
+          evse_id: evseId,
+          success_url: `${httpProtocol}://${window.location.host}/charging/${evseId}`,
+          cancel_url: `${httpProtocol}://${window.location.host}/checkout/${evseId}`,
+        },
+        { headers: { 'Idempotency-Key': idempotencyKey.current } },
+      )
       .then(({ data }) => {
         // Check if checkout given,
         if (data?.url) {
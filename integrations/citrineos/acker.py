@@ -0,0 +1,107 @@
+import asyncio
+import time
+from collections import deque
+from logging import exception
+
+from aio_pika.abc import AbstractIncomingMessage
+
+
+class MessageAcker:
+    """
+    Acknowledges processed messages, optionally in batches.
+
+    With a batch size of 1 every message is acked on its own. With a larger batch
+    size, a single `basic.ack` with `multiple=True` acknowledges all messages up to
+    the newest one whose predecessors have all been settled. Workers finish messages
+    out of order, so a message still in progress is never covered by a batch ack.
+    A batch is sent once `batch_size` messages are ready, or after `max_delay`
+    seconds so a quiet queue does not hold on to its acks.
+
+    Failed messages are rejected and requeued messages nacked right away, on their
+    own, as they cannot be part of a positive ack.
+    """
+
+    def __init__(self, batch_size: int = 1, max_delay: float = 0.05):
+        self.batch_size = max(1, batch_size)
+        self.max_delay = max_delay
+        self.settled_count = 0
+        self._received: deque[AbstractIncomingMessage] = deque()
+        self._settled: set[int] = set()
+        self._acked_tags: set[int] = set()
+        self._ready: AbstractIncomingMessage | None = None
+        self._ready_count = 0
+        self._flush_task: asyncio.Task | None = None
+
+    def track(self, message: AbstractIncomingMessage) -> None:
+        """Registers a delivered message, in delivery order."""
+        if self.batch_size > 1:
+            self._received.append(message)
+
+    async def ack(self, message: AbstractIncomingMessage) -> None:
+        self.settled_count += 1
+        if self.batch_size == 1:
+            await message.ack()
+            return
+        self._acked_tags.add(message.delivery_tag)
+        await self._settle(message)
+
+    async def reject(self, message: AbstractIncomingMessage) -> None:
+        self.settled_count += 1
+        await message.reject(requeue=False)
+        await self._settle(message)
+
+    async def requeue(self, message: AbstractIncomingMessage) -> None:
+        await message.nack(requeue=True)
+        await self._settle(message)
+
+    async def flush(self) -> None:
+        """Acks all messages ready for a batch ack."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        message, self._ready, self._ready_count = self._ready, None, 0
+        if message is not None:
+            await message.ack(multiple=True)
+
+    async def _settle(self, message: AbstractIncomingMessage) -> None:
+        if self.batch_size == 1:
+            return
+        self._settled.add(message.delivery_tag)
+        # Move the watermark over every settled message at the head
+        while self._received and self._received[0].delivery_tag in self._settled:
+            head = self._received.popleft()
+            self._settled.discard(head.delivery_tag)
+            if head.delivery_tag in self._acked_tags:
+                self._acked_tags.discard(head.delivery_tag)
+                self._ready = head
+                self._ready_count += 1
+
+        if self._ready_count >= self.batch_size:
+            await self.flush()
+        elif self._ready is not None and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.max_delay)
+        self._flush_task = None
+        try:
+            await self.flush()
+        except Exception:
+            exception(" [CitrineOS] Could not acknowledge messages")
+
+
+class ThroughputMeter:
+    """Reports the rate of settled messages since the previous report."""
+
+    def __init__(self, acker: MessageAcker):
+        self.acker = acker
+        self._last_count = acker.settled_count
+        self._last_time = time.monotonic()
+
+    def rate(self) -> float:
+        now = time.monotonic()
+        count = self.acker.settled_count
+        elapsed = now - self._last_time
+        rate = (count - self._last_count) / elapsed if elapsed > 0 else 0.0
+        self._last_count, self._last_time = count, now
+        return rate
@@ -0,0 +1,113 @@
+import asyncio
+import time
+from logging import exception, info, warning
+from typing import Awaitable, Callable
+
+from config import Config
+from utils.dependency_stats import DependencyStats, dependency_stats
+from utils.metrics import CONSUMER_PAUSED, CONSUMER_PAUSES
+
+
+def parse_latency_limits(limits: str) -> dict[str, float]:
+    """Parses "name:milliseconds" pairs into latency limits in seconds."""
+    parsed = {}
+    for limit in limits.split(","):
+        if not limit.strip():
+            continue
+        name, _, milliseconds = limit.partition(":")
+        parsed[name.strip()] = int(milliseconds) / 1000
+    return parsed
+
+
+class AdmissionController:
+    """
+    Pauses event consumption while a downstream dependency is overloaded.
+
+    Every `check_interval` seconds the calls to each dependency over the last few
+    seconds are checked. A dependency is overloaded when it has more calls in flight
+    than allowed, or, once it has seen `min_calls` calls, when their average latency
+    or error rate is above its limit. The consumer is paused while any dependency is
+    overloaded and resumed after all of them were healthy for `resume_after`
+    seconds. Messages already delivered keep being processed while paused.
+    """
+
+    def __init__(
+        self,
+        pause: Callable[[], Awaitable[None]],
+        resume: Callable[[], Awaitable[None]],
+        stats: dict[str, DependencyStats] = dependency_stats,
+        latency_limits: dict[str, float] = None,
+        max_error_rate: float = Config.BACKPRESSURE_MAX_ERROR_RATE,
+        max_in_flight: int = Config.BACKPRESSURE_MAX_IN_FLIGHT,
+        min_calls: int = Config.BACKPRESSURE_MIN_CALLS,
+        resume_after: float = Config.BACKPRESSURE_RESUME_AFTER_SECONDS,
+        check_interval: float = 1,
+    ):
+        self.pause = pause
+        self.resume = resume
+        self.stats = stats
+        self.latency_limits = (
+            latency_limits
+            if latency_limits is not None
+            else parse_latency_limits(Config.BACKPRESSURE_MAX_LATENCY_MS)
+        )
+        self.max_error_rate = max_error_rate
+        self.max_in_flight = max_in_flight
+        self.min_calls = min_calls
+        self.resume_after = resume_after
+        self.check_interval = check_interval
+        self.throttled = False
+        self.throttle_count = 0
+        self.throttle_reasons: list[str] = []
+        self._healthy_since: float | None = None
+
+    def overloaded_dependencies(self) -> list[str]:
+        """Returns a reason for every overloaded dependency."""
+        reasons = []
+        for name, stats in self.stats.items():
+            if stats.in_flight > self.max_in_flight:
+                reasons.append(f"{name}: {stats.in_flight} calls in flight")
+                continue
+            calls, errors, latency = stats.snapshot()
+            if calls < self.min_calls:
+                continue
+            if errors / calls > self.max_error_rate:
+                reasons.append(f"{name}: {errors}/{calls} calls failed")
+            elif latency > self.latency_limits.get(name, float("inf")):
+                reasons.append(f"{name}: average latency {latency * 1000:.0f}ms")
+        return reasons
+
+    async def check(self) -> None:
+        reasons = self.overloaded_dependencies()
+        if reasons:
+            self._healthy_since = None
+            self.throttle_reasons = reasons
+            if not self.throttled:
+                warning(" [CitrineOS] Pausing event consumer: %s", "; ".join(reasons))
+                await self.pause()
+                self.throttled = True
+                self.throttle_count += 1
+                CONSUMER_PAUSES.inc()
+                CONSUMER_PAUSED.set(1)
+            return
+
+        if not self.throttled:
+            return
+        now = time.monotonic()
+        if self._healthy_since is None:
+            self._healthy_since = now
+        if now - self._healthy_since >= self.resume_after:
+            info(" [CitrineOS] Resuming event consumer")
+            await self.resume()
+            self.throttled = False
+            self.throttle_reasons = []
+            self._healthy_since = None
+            CONSUMER_PAUSED.set(0)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.check()
+            except Exception:
+                exception(" [CitrineOS] Error while checking backpressure")
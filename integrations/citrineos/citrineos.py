@@ -1,14 +1,21 @@
+import asyncio
 from enum import Enum
 from io import BytesIO
-import json
+import zlib
 from typing import List, Tuple
 from aio_pika import connect
-from aio_pika.abc import AbstractExchange, AbstractIncomingMessage
+from aio_pika.abc import (
+    AbstractConnection,
+    AbstractExchange,
+    AbstractIncomingMessage,
+    AbstractQueue,
+)
+from anyio import CapacityLimiter
 from fastapi import FastAPI
+from orjson import JSONDecodeError, loads
 from pydantic import BaseModel
 from pydantic_core import ValidationError
 import requests
-from sqlalchemy.orm import Session
 import stripe
 import qrcode
 
@@ -16,21 +23,45 @@ from config import Config
 from logging import debug, exception, info, warning
 from db.init_db import (
     MessageInfo as MessageInfoModel,
-    get_db,
+    db_session,
     Checkout as CheckoutModel,
     Evse as EvseModel,
     Location as LocationModel,
+    MeterSample as MeterSampleModel,
     Tariff as TariffModel,
 )
 
+from integrations.citrineos.acker import MessageAcker, ThroughputMeter
+from integrations.citrineos.backpressure import AdmissionController
+from integrations.citrineos.retry import EventRetryRouter
 from integrations.integration import FileIntegration, OcppIntegration
 from schemas.status_notification import StatusNotificationRequest
 from schemas.transaction_event import (
-    MeasurandEnumType,
     TransactionEventEnumType,
     TriggerReasonEnumType,
     TransactionEventRequest,
 )
+from utils.cache import topology_cache
+from utils.dependency_stats import CITRINEOS
+from utils.http_client import request_dependency
+from utils.meter_values import (
+    ENERGY,
+    POWER,
+    SOC,
+    InvalidMeterValueError,
+    extract_meter_readings,
+)
+from utils.metrics import (
+    CONSUMER_THROUGHPUT,
+    CONSUMER_WAITING_MESSAGES,
+    EVENT_HANDLER_DURATION,
+    EVENTS,
+    GAUGE_REFRESH_INTERVAL,
+    timed,
+)
+from utils.ocpp_event_dedup import OcppEventDeduplicator, get_transaction_event_key
+from utils.stripe_client import stripe_call
+from utils.tracing import start_span, traced
 
 
 class CitrineOsEventAction(str, Enum):
@@ -38,20 +69,66 @@ class CitrineOsEventAction(str, Enum):
     STATUSNOTIFICATION = "StatusNotification"
 
 
-class CitrineOSevent(BaseModel):
-    action: CitrineOsEventAction
-    payload: dict
+HANDLED_ACTIONS = frozenset(action.value for action in CitrineOsEventAction)
 
 
 class CitrineOSeventHeaders(BaseModel):
     stationId: str
 
 
+class InvalidCitrineOSevent(Exception):
+    pass
+
+
+def decode_incoming_event(
+    event_message: AbstractIncomingMessage,
+) -> Tuple[CitrineOsEventAction, dict] | None:
+    """
+    Parses the message body and returns the action and payload of handled events.
+
+    The action is checked on the message headers before the body is parsed and on
+    the body afterwards, so events this service does not handle are skipped without
+    building any model. The payload is validated once, by the caller.
+    """
+    header_action = (event_message.headers or {}).get("action")
+    if header_action is not None and header_action not in HANDLED_ACTIONS:
+        return None
+    try:
+        event = loads(event_message.body)
+    except JSONDecodeError as e:
+        raise InvalidCitrineOSevent(f"Body is not JSON: {e}")
+    if not isinstance(event, dict):
+        raise InvalidCitrineOSevent("Body is not a JSON object")
+    action = event.get("action")
+    if action not in HANDLED_ACTIONS:
+        return None
+    return CitrineOsEventAction(action), event.get("payload")
+
+
+def event_station_id(event_message: AbstractIncomingMessage) -> str:
+    return str((event_message.headers or {}).get("stationId"))
+
+
+async def connect_message_broker() -> AbstractConnection:
+    return await connect(
+        ssl=Config.MESSAGE_BROKER_SSL_ACTIVE,
+        host=Config.MESSAGE_BROKER_HOST,
+        port=Config.MESSAGE_BROKER_PORT,
+        login=Config.MESSAGE_BROKER_USER,
+        password=Config.MESSAGE_BROKER_PASSWORD,
+        virtualhost=Config.MESSAGE_BROKER_VHOST,
+    )
+
+
 class CitrineOSIntegration(OcppIntegration):
     def __init__(self, fileIntegration: FileIntegration):
         self.fileIntegration = fileIntegration
+        self.event_deduplicator = OcppEventDeduplicator()
+        self.consumer_acker: MessageAcker | None = None
+        self.consumer_throughput: float = 0.0
+        self.admission_controller: AdmissionController | None = None
 
-    async def create_authorization(
+    def create_authorization(
         self,
         idToken: str,
         idTokenType: str,
@@ -81,7 +158,13 @@ class CitrineOSIntegration(OcppIntegration):
             f"&type={idToken['type']}"
         )
 
-        response = requests.put(request_url, json=request_body)
+        response = request_dependency(
+            CITRINEOS,
+            "PUT",
+            request_url,
+            timeout=Config.CITRINEOS_REQUEST_TIMEOUT_SECONDS,
+            json=request_body,
+        )
         if response.status_code == 200:
             return request_body
         exception(" [CitrineOS] Error while creating authorization: %r", response)
@@ -96,21 +179,23 @@ class CitrineOSIntegration(OcppIntegration):
             f"&tenantId={tenant_id}"
         )
 
-        return requests.post(request_url, json=json_payload)
+        return request_dependency(
+            CITRINEOS,
+            "POST",
+            request_url,
+            timeout=Config.CITRINEOS_REQUEST_TIMEOUT_SECONDS,
+            json=json_payload,
+        )
 
-    async def receive_events(self, app: FastAPI = None) -> None:
+    async def connect_event_queue(
+        self,
+    ) -> Tuple[AbstractConnection, AbstractExchange, AbstractQueue, EventRetryRouter]:
         # Perform connection
-        connection = await connect(
-            ssl=Config.MESSAGE_BROKER_SSL_ACTIVE,
-            host=Config.MESSAGE_BROKER_HOST,
-            port=Config.MESSAGE_BROKER_PORT,
-            login=Config.MESSAGE_BROKER_USER,
-            password=Config.MESSAGE_BROKER_PASSWORD,
-            virtualhost=Config.MESSAGE_BROKER_VHOST,
-        )
+        connection = await connect_message_broker()
 
         # Creating a channel
         channel = await connection.channel()
+        await channel.set_qos(prefetch_count=Config.MESSAGE_BROKER_PREFETCH_COUNT)
         exchange: AbstractExchange = await channel.declare_exchange(
             name=Config.MESSAGE_BROKER_EXCHANGE_NAME,
             type=Config.MESSAGE_BROKER_EXCHANGE_TYPE,
@@ -141,77 +226,254 @@ class CitrineOSIntegration(OcppIntegration):
                 arguments=arguments,
             )
 
+        # Failed events are retried after a delay, then dead-lettered
+        retry_router = EventRetryRouter(channel.default_exchange)
+        await retry_router.declare(channel)
+
         info(" [CitrineOS] Awaiting events with keys: %r ", arguments_list.__str__())
+        return connection, exchange, queue, retry_router
 
-        # Start listening the queue with name 'hello'
-        async with queue.iterator() as qiterator:
-            message: AbstractIncomingMessage
-            async for message in qiterator:
-                try:
-                    async with (
-                        message.process()
-                    ):  # Processor acknowledges messages implicitly
-                        debug(
-                            f" [CitrineOS] event_message({message.headers.__str__()})"
-                        )
-                        await self.process_incoming_event(
-                            event_message=message, exchange=exchange
-                        )
-                        debug(
-                            " [CitrineOS] Event processed successfully: %r",
-                            message.headers.__str__(),
-                        )
-                except Exception:
-                    exception(" [CitrineOS] Processing error for message %r", message)
+    async def receive_events(
+        self,
+        app: FastAPI = None,
+        workers: int = Config.MESSAGE_BROKER_CONSUMER_WORKERS,
+        stop: asyncio.Event = None,
+        ack_batch_size: int = Config.MESSAGE_BROKER_ACK_BATCH_SIZE,
+    ) -> None:
+        """
+        Consumes events until `stop` is set, then drains the messages in progress.
+
+        Messages are processed by `workers` asyncio tasks. All events of a station go
+        to the same worker, so they are processed in the order they were received.
+        Messages received but not yet started when stopping are requeued. Failed
+        messages are retried with a backoff and dead-lettered after the last attempt,
+        later events of the station are parked behind them in the retry queue.
+        While a downstream dependency is overloaded, no new messages are consumed.
+        """
+        connection, exchange, queue, retry_router = await self.connect_event_queue()
+        acker = MessageAcker(
+            batch_size=ack_batch_size,
+            max_delay=Config.MESSAGE_BROKER_ACK_BATCH_MAX_DELAY_MS / 1000,
+        )
+        self.consumer_acker = acker
+        self.handler_limiter = CapacityLimiter(max(1, workers))
+        worker_queues = [asyncio.Queue() for _ in range(max(1, workers))]
+        worker_tasks = [
+            asyncio.create_task(
+                self._process_events(worker_queue, exchange, acker, retry_router)
+            )
+            for worker_queue in worker_queues
+        ]
+        report_tasks = [
+            asyncio.create_task(self._report_throughput(acker)),
+            asyncio.create_task(self._report_waiting_messages(queue)),
+        ]
+
+        async def on_message(message: AbstractIncomingMessage) -> None:
+            acker.track(message)
+            station_id = event_station_id(message)
+            worker_queues[
+                zlib.crc32(station_id.encode()) % len(worker_queues)
+            ].put_nowait(message)
+
+        consumer_tag = await queue.consume(on_message)
+
+        async def pause() -> None:
+            nonlocal consumer_tag
+            if consumer_tag is not None:
+                await queue.cancel(consumer_tag)
+                consumer_tag = None
+
+        async def resume() -> None:
+            nonlocal consumer_tag
+            if consumer_tag is None:
+                consumer_tag = await queue.consume(on_message)
+
+        admission_task = None
+        if Config.BACKPRESSURE_ENABLED:
+            self.admission_controller = AdmissionController(pause, resume)
+            admission_task = asyncio.create_task(self.admission_controller.run())
+        try:
+            await (stop or asyncio.Event()).wait()
+        finally:
+            info(" [CitrineOS] Stopping event consumer, draining messages in progress")
+            if admission_task is not None:
+                admission_task.cancel()
+                await asyncio.gather(admission_task, return_exceptions=True)
+            await pause()
+            for worker_queue in worker_queues:
+                await self._requeue_waiting_events(worker_queue, acker)
+                worker_queue.put_nowait(None)
+            await asyncio.wait(
+                worker_tasks, timeout=Config.MESSAGE_BROKER_CONSUMER_DRAIN_TIMEOUT
+            )
+            for task in worker_tasks:
+                task.cancel()
+            for task in report_tasks:
+                task.cancel()
+            await acker.flush()
+            await connection.close()
+            info(" [CitrineOS] Event consumer stopped")
+
+    async def _process_events(
+        self,
+        worker_queue: asyncio.Queue,
+        exchange: AbstractExchange,
+        acker: MessageAcker,
+        retry_router: EventRetryRouter,
+    ) -> None:
+        while True:
+            message: AbstractIncomingMessage = await worker_queue.get()
+            if message is None:
+                return
+            station_id = event_station_id(message)
+            if retry_router.is_waiting(station_id, message):
+                # Keep the order of the station, it goes after its failed event
+                ok = await retry_router.park(station_id, message)
+            else:
+                error = await self._process_event(message, exchange)
+                if error is None:
+                    retry_router.succeeded(station_id, message)
+                    ok = True
+                else:
+                    ok = await retry_router.route_failed(message, error, station_id)
+            settle = acker.ack if ok else acker.reject
+            try:
+                await settle(message)
+            except Exception:
+                exception(" [CitrineOS] Could not acknowledge message %r", message)
+
+    async def _process_event(
+        self, message: AbstractIncomingMessage, exchange: AbstractExchange
+    ) -> Exception | None:
+        """Returns the error processing the message failed with, if any."""
+        try:
+            debug(f" [CitrineOS] event_message({message.headers.__str__()})")
+            headers = message.headers or {}
+            with start_span(
+                f"{Config.MESSAGE_BROKER_EVENT_CONSUMER_QUEUE_NAME} process",
+                kind="consumer",
+                attributes={
+                    "messaging.system": "rabbitmq",
+                    "messaging.destination.name": (
+                        Config.MESSAGE_BROKER_EVENT_CONSUMER_QUEUE_NAME
+                    ),
+                    "citrineos.action": str(headers.get("action")),
+                    "citrineos.station_id": str(headers.get("stationId")),
+                },
+                carrier=headers,
+            ):
+                await self.process_incoming_event(
+                    event_message=message, exchange=exchange
+                )
+            debug(
+                " [CitrineOS] Event processed successfully: %r",
+                message.headers.__str__(),
+            )
+        except Exception as e:
+            exception(" [CitrineOS] Processing error for message %r", message)
+            return e
+        return None
+
+    async def _requeue_waiting_events(
+        self, worker_queue: asyncio.Queue, acker: MessageAcker
+    ) -> None:
+        while not worker_queue.empty():
+            message: AbstractIncomingMessage = worker_queue.get_nowait()
+            try:
+                await acker.requeue(message)
+            except Exception:
+                exception(" [CitrineOS] Could not requeue message %r", message)
+
+    async def _report_throughput(self, acker: MessageAcker) -> None:
+        meter = ThroughputMeter(acker)
+        while True:
+            await asyncio.sleep(Config.MESSAGE_BROKER_THROUGHPUT_LOG_INTERVAL)
+            self.consumer_throughput = meter.rate()
+            CONSUMER_THROUGHPUT.set(self.consumer_throughput)
+            controller = self.admission_controller
+            if controller is not None and controller.throttled:
+                info(
+                    " [CitrineOS] Consumer throughput: %.1f messages/s, paused: %s",
+                    self.consumer_throughput,
+                    "; ".join(controller.throttle_reasons),
+                )
+            else:
+                info(
+                    " [CitrineOS] Consumer throughput: %.1f messages/s",
+                    self.consumer_throughput,
+                )
 
+    async def _report_waiting_messages(self, queue: AbstractQueue) -> None:
+        # A passive declare returns the number of messages ready in the queue
+        while True:
+            try:
+                declared = await queue.channel.declare_queue(queue.name, passive=True)
+                CONSUMER_WAITING_MESSAGES.set(declared.declaration_result.message_count)
+            except Exception:
+                exception(" [CitrineOS] Could not read the length of the event queue")
+            await asyncio.sleep(GAUGE_REFRESH_INTERVAL)
+
+    @traced("process_incoming_event")
     async def process_incoming_event(
         self, event_message: AbstractIncomingMessage, exchange: AbstractExchange
     ) -> None:
         try:
-            decoded_body = event_message.body.decode()
-            citrine_os_event = CitrineOSevent(**json.loads(decoded_body))
+            decoded_event = decode_incoming_event(event_message)
+            if decoded_event is None:
+                debug(
+                    " [CitrineOS] Skipping unhandled event: %r",
+                    event_message.headers,
+                )
+                return
+            action, payload = decoded_event
 
-            if citrine_os_event.action == CitrineOsEventAction.TRANSACTIONEVENT:
-                citrine_os_event_headers = CitrineOSeventHeaders(
-                    **event_message.headers
+            if action == CitrineOsEventAction.TRANSACTIONEVENT:
+                citrine_os_event_headers = CitrineOSeventHeaders.model_validate(
+                    event_message.headers
                 )
-                transaction_event = TransactionEventRequest(**citrine_os_event.payload)
-                if (
-                    transaction_event.eventType == TransactionEventEnumType.Started
-                    or transaction_event.triggerReason
-                    == TriggerReasonEnumType.RemoteStart
-                ):
-                    await self.process_transaction_started(
-                        transaction_event=transaction_event,
-                        citrine_os_event_headers=citrine_os_event_headers,
-                    )
-                elif transaction_event.eventType == TransactionEventEnumType.Updated:
-                    await self.process_transaction_updated(
-                        transaction_event=transaction_event,
+                transaction_event = TransactionEventRequest.model_validate(payload)
+                EVENTS.labels(action.value, transaction_event.eventType.value).inc()
+                event_key = get_transaction_event_key(
+                    citrine_os_event_headers.stationId, transaction_event
+                )
+                if not await self.event_deduplicator.claim(event_key):
+                    info(
+                        " [CitrineOS] Dropping already processed TransactionEvent: %r",
+                        event_key,
                     )
-                elif transaction_event.eventType == TransactionEventEnumType.Ended:
-                    await self.process_transaction_ended(
+                    return
+                try:
+                    await self.process_transaction_event(
                         transaction_event=transaction_event,
+                        citrine_os_event_headers=citrine_os_event_headers,
                     )
+                except Exception:
+                    await self.event_deduplicator.release(event_key)
+                    raise
+                await self.event_deduplicator.complete(event_key)
                 return
-            elif citrine_os_event.action == CitrineOsEventAction.STATUSNOTIFICATION:
-                citrine_os_event_headers = CitrineOSeventHeaders(
-                    **event_message.headers
-                )
-                status_notification = StatusNotificationRequest(
-                    **citrine_os_event.payload
+            elif action == CitrineOsEventAction.STATUSNOTIFICATION:
+                citrine_os_event_headers = CitrineOSeventHeaders.model_validate(
+                    event_message.headers
                 )
+                status_notification = StatusNotificationRequest.model_validate(payload)
+                EVENTS.labels(action.value, "").inc()
                 await self.process_status_notification(
                     status_notification=status_notification,
                     citrine_os_event_headers=citrine_os_event_headers,
                 )
+        except InvalidMeterValueError as e:
+            warning(
+                " [CitrineOS] Received valid TransactionEvent, but invalid meter value: %r",
+                e,
+            )
+        except InvalidCitrineOSevent as e:
+            debug(
+                " [CitrineOS] Received event which is not valid CitrineOS event: %r", e
+            )
         except ValidationError as e:
-            if e.title == CitrineOSevent.__name__:
-                debug(
-                    " [CitrineOS] Received event which is not valid CitrineOS event: %r",
-                    e.errors(),
-                )
-            elif e.title == TransactionEventRequest.__name__:
+            if e.title == TransactionEventRequest.__name__:
                 warning(
                     " [CitrineOS] Received valid TransactionEvent, but fields missing: %r",
                     e.errors(),
@@ -222,6 +484,32 @@ class CitrineOSIntegration(OcppIntegration):
             exception(" [CitrineOS] Processing error for incoming event: %r", e.__str__)
             raise e
 
+    async def process_transaction_event(
+        self,
+        transaction_event: TransactionEventRequest,
+        citrine_os_event_headers: CitrineOSeventHeaders,
+    ) -> None:
+        # The handlers run their database, Stripe and HTTP calls in worker threads,
+        # so the event loop keeps serving the other consumer workers meanwhile
+        if (
+            transaction_event.eventType == TransactionEventEnumType.Started
+            or transaction_event.triggerReason == TriggerReasonEnumType.RemoteStart
+        ):
+            await self.process_transaction_started(
+                transaction_event=transaction_event,
+                citrine_os_event_headers=citrine_os_event_headers,
+            )
+        elif transaction_event.eventType == TransactionEventEnumType.Updated:
+            await self.process_transaction_updated(
+                transaction_event=transaction_event,
+            )
+        elif transaction_event.eventType == TransactionEventEnumType.Ended:
+            await self.process_transaction_ended(
+                transaction_event=transaction_event,
+            )
+
+    @timed(EVENT_HANDLER_DURATION, "process_transaction_started")
+    @traced("process_transaction_started")
     async def process_transaction_started(
         self,
         transaction_event: TransactionEventRequest,
@@ -246,73 +534,116 @@ class CitrineOSIntegration(OcppIntegration):
                 transaction_event=transaction_event
             )
 
+    @timed(EVENT_HANDLER_DURATION, "process_transaction_started_scan_and_charge")
+    @traced("process_transaction_started_scan_and_charge")
     async def process_transaction_started_scan_and_charge(
         self,
         transaction_event: TransactionEventRequest,
         citrine_os_event_headers: CitrineOSeventHeaders,
+    ) -> None:
+        await self.run_handler_sync(
+            self._process_transaction_started_scan_and_charge,
+            transaction_event,
+            citrine_os_event_headers,
+        )
+
+    def _process_transaction_started_scan_and_charge(
+        self,
+        transaction_event: TransactionEventRequest,
+        citrine_os_event_headers: CitrineOSeventHeaders,
     ) -> None:
         transactionId = transaction_event.transactionInfo.transactionId
         stationId = citrine_os_event_headers.stationId
 
-        db: Session = next(get_db())
-        # If pricing is found to vary by evse, we need to change triggerReasonNoAuthArray to mandate events that know the evse
-        # Then add a filter below, EvseModel.ocpp_evse_id == transaction_event.evse.id
-        evse = db.query(EvseModel).filter(EvseModel.station_id == stationId).first()
-        if evse is None:
-            raise Exception("EVSE not found")
-
-        tariff = (
-            db.query(TariffModel)
-            .filter(TariffModel.id == evse.connectors[0].tariff_id)
-            .first()
-        )
-        if tariff is None:
-            raise Exception("No Tariff for EVSE found")
+        with db_session() as db:
+            # If pricing is found to vary by evse, we need to change triggerReasonNoAuthArray to mandate events that know the evse
+            # Then add a filter below, EvseModel.ocpp_evse_id == transaction_event.evse.id
+            evse = db.query(EvseModel).filter(EvseModel.station_id == stationId).first()
+            if evse is None:
+                raise Exception("EVSE not found")
+
+            tariff = (
+                db.query(TariffModel)
+                .filter(TariffModel.id == evse.connectors[0].tariff_id)
+                .first()
+            )
+            if tariff is None:
+                raise Exception("No Tariff for EVSE found")
 
-        location = (
-            db.query(LocationModel).filter(LocationModel.id == evse.location_id).first()
-        )
-        if location is None:
-            raise Exception("No Location for EVSE found")
+            location = (
+                db.query(LocationModel)
+                .filter(LocationModel.id == evse.location_id)
+                .first()
+            )
+            if location is None:
+                raise Exception("No Location for EVSE found")
 
-        db_checkout = CheckoutModel(
-            connector_id=evse.connectors[0].id, tariff_id=tariff.id
-        )
-        db_checkout = self.update_checkout_with_meter_values(
-            transaction_event=transaction_event, db_checkout=db_checkout
-        )
-        db.add(db_checkout)
-        db.commit()
-        db.refresh(db_checkout)
-
-        if tariff.stripe_price_id is None:
-            price = stripe.Price.create(
-                currency=tariff.currency.lower(),
-                metadata={"tariffId": tariff.id},
-                product_data={"name": "Charging Session Authorization Amount"},
-                tax_behavior="inclusive",
-                unit_amount=int(tariff.authorization_amount * 100),
+            db_checkout = CheckoutModel(
+                connector_id=evse.connectors[0].id, tariff_id=tariff.id
+            )
+            db_checkout = self.update_checkout_with_meter_values(
+                transaction_event=transaction_event, db_checkout=db_checkout
             )
-            tariff.stripe_price_id = price.id
-            db.add(tariff)
+            db.add(db_checkout)
             db.commit()
 
-        payment_link_url = await self.create_payment_link(
-            stripe_price_id=tariff.stripe_price_id,
-            stripe_account_id=location.operator.stripe_account_id,
+            mostRecentMessageInfoForStation = (
+                db.query(MessageInfoModel)
+                .filter(MessageInfoModel.stationId == stationId)
+                .order_by(MessageInfoModel.id.desc())
+                .first()
+            )
+            nextMessageId = (
+                0
+                if mostRecentMessageInfoForStation is None
+                else mostRecentMessageInfoForStation.id + 1
+            )
+
+            checkout_id = db_checkout.id
+            tariff_id = tariff.id
+            stripe_price_id = tariff.stripe_price_id
+            currency = tariff.currency
+            authorization_amount = tariff.authorization_amount
+            stripe_account_id = location.operator.stripe_account_id
+            evse_id = evse.evse_id
+            tenant_id = evse.tenant_id
+
+        # No database connection is held while Stripe, Directus and CitrineOS answer
+        if stripe_price_id is None:
+            with stripe_call():
+                price = stripe.Price.create(
+                    currency=currency.lower(),
+                    metadata={"tariffId": tariff_id},
+                    product_data={"name": "Charging Session Authorization Amount"},
+                    tax_behavior="inclusive",
+                    unit_amount=int(authorization_amount * 100),
+                )
+            stripe_price_id = price.id
+            with db_session() as db:
+                db.query(TariffModel).filter(TariffModel.id == tariff_id).update(
+                    {TariffModel.stripe_price_id: stripe_price_id},
+                    synchronize_session=False,
+                )
+                db.commit()
+            topology_cache.delete(f"tariffs:{tariff_id}")
+
+        payment_link_url = self.create_payment_link(
+            stripe_price_id=stripe_price_id,
+            stripe_account_id=stripe_account_id,
             stationId=stationId,
-            evseId=evse.evse_id,
+            evseId=evse_id,
             transactionId=transactionId,
-            checkoutId=db_checkout.id,
+            checkoutId=checkout_id,
         )
 
-        qr_code_img = qrcode.make(payment_link_url)
-        # Save the image to an in-memory buffer
-        buffer = BytesIO()
-        debug(type(qr_code_img))
-        debug(dir(qr_code_img))
-        qr_code_img.save(buffer)
-        buffer.seek(0)  # Rewind the buffer to the beginning
+        with start_span("qrcode"):
+            qr_code_img = qrcode.make(payment_link_url)
+            # Save the image to an in-memory buffer
+            buffer = BytesIO()
+            debug(type(qr_code_img))
+            debug(dir(qr_code_img))
+            qr_code_img.save(buffer)
+            buffer.seek(0)  # Rewind the buffer to the beginning
 
         qr_code_img_url = self.fileIntegration.upload_file(
             buffer,
@@ -321,17 +652,6 @@ class CitrineOSIntegration(OcppIntegration):
             f"QRCode_{stationId}_{transactionId}",
         )
 
-        mostRecentMessageInfoForStation = (
-            db.query(MessageInfoModel)
-            .filter(MessageInfoModel.stationId == stationId)
-            .order_by(MessageInfoModel.id.desc())
-            .first()
-        )
-        nextMessageId = (
-            0
-            if mostRecentMessageInfoForStation is None
-            else mostRecentMessageInfoForStation.id + 1
-        )
         set_display_message_request = {
             "message": {
                 "id": nextMessageId,
@@ -340,22 +660,24 @@ class CitrineOSIntegration(OcppIntegration):
                 "message": {"format": "URI", "content": qr_code_img_url},
             }
         }
-        citrineos_module = (
-            "configuration"  # TODO set up programatic way to resolve module from action
-        )
+        # TODO set up programatic way to resolve module from action
+        citrineos_module = "configuration"
         action = "setDisplayMessage"
 
         self.send_citrineos_message(
             station_id=stationId,
-            tenant_id=evse.tenant_id,
+            tenant_id=tenant_id,
             url_path=f"{citrineos_module}/{action}",
             json_payload=set_display_message_request,
         )
-        db_checkout.qr_code_message_id = nextMessageId
-        db.add(db_checkout)
-        db.commit()
+        with db_session() as db:
+            db.query(CheckoutModel).filter(CheckoutModel.id == checkout_id).update(
+                {CheckoutModel.qr_code_message_id: nextMessageId},
+                synchronize_session=False,
+            )
+            db.commit()
 
-    async def create_payment_link(
+    def create_payment_link(
         self,
         stripe_price_id: str,
         stripe_account_id: str,
@@ -364,196 +686,205 @@ class CitrineOSIntegration(OcppIntegration):
         transactionId: str,
         checkoutId: int,
     ) -> str:
-        transactionPaymentLink = stripe.PaymentLink.create(
-            after_completion={
-                "redirect": {
-                    "url": f"{Config.CLIENT_URL}/charging/{evseId}/{checkoutId}"
+        with stripe_call():
+            transactionPaymentLink = stripe.PaymentLink.create(
+                after_completion={
+                    "redirect": {
+                        "url": f"{Config.CLIENT_URL}/charging/{evseId}/{checkoutId}"
+                    },
+                    "type": "redirect",
                 },
-                "type": "redirect",
-            },
-            line_items=[
-                {
-                    "price": stripe_price_id,
-                    "quantity": 1,
-                }
-            ],
-            metadata={
-                "stationId": stationId,
-                "transactionId": transactionId,
-                "checkoutId": checkoutId,
-            },
-            payment_intent_data={
-                "capture_method": "manual",
-            },
-            payment_method_types=["card"],
-            restrictions={"completed_sessions": {"limit": int(1)}},
-            stripe_account=stripe_account_id,
-        )
+                line_items=[
+                    {
+                        "price": stripe_price_id,
+                        "quantity": 1,
+                    }
+                ],
+                metadata={
+                    "stationId": stationId,
+                    "transactionId": transactionId,
+                    "checkoutId": checkoutId,
+                },
+                payment_intent_data={
+                    "capture_method": "manual",
+                },
+                payment_method_types=["card"],
+                restrictions={"completed_sessions": {"limit": int(1)}},
+                stripe_account=stripe_account_id,
+            )
         return transactionPaymentLink.url
 
+    @timed(EVENT_HANDLER_DURATION, "process_transaction_started_remote")
+    @traced("process_transaction_started_remote")
     async def process_transaction_started_remote(
         self, transaction_event: TransactionEventRequest
     ) -> None:
-        db: Session = next(get_db())
-        db_checkout = (
-            db.query(CheckoutModel)
-            .filter(CheckoutModel.id == transaction_event.transactionInfo.remoteStartId)
-            .first()
+        await self.run_handler_sync(
+            self._process_transaction_started_remote, transaction_event
         )
-        if db_checkout is None:
-            info(
-                " [CitrineOS] Checkout not found for transaction start event: %r",
-                transaction_event,
+
+    def _process_transaction_started_remote(
+        self, transaction_event: TransactionEventRequest
+    ) -> None:
+        with db_session() as db:
+            db_checkout = (
+                db.query(CheckoutModel)
+                .filter(
+                    CheckoutModel.id == transaction_event.transactionInfo.remoteStartId
+                )
+                .first()
             )
-            return
+            if db_checkout is None:
+                info(
+                    " [CitrineOS] Checkout not found for transaction start event: %r",
+                    transaction_event,
+                )
+                return
 
-        db_checkout.transaction_start_time = transaction_event.timestamp
-        db_checkout.remote_request_transaction_id = (
-            transaction_event.transactionInfo.transactionId
-        )
-        db_checkout = self.update_checkout_with_meter_values(
-            transaction_event=transaction_event, db_checkout=db_checkout
-        )
-        db.add(db_checkout)
-        db.commit()
-        db.refresh(db_checkout)
-        return
+            db_checkout.transaction_start_time = transaction_event.timestamp
+            db_checkout.remote_request_transaction_id = (
+                transaction_event.transactionInfo.transactionId
+            )
+            db_checkout = self.update_checkout_with_meter_values(
+                transaction_event=transaction_event, db_checkout=db_checkout
+            )
+            db.add(db_checkout)
+            db.commit()
+            db.refresh(db_checkout)
+            return
 
+    @timed(EVENT_HANDLER_DURATION, "process_transaction_updated")
+    @traced("process_transaction_updated")
     async def process_transaction_updated(
         self, transaction_event: TransactionEventRequest
     ) -> None:
-        db: Session = next(get_db())
-        db_checkout = (
-            db.query(CheckoutModel)
-            .filter(CheckoutModel.id == transaction_event.transactionInfo.remoteStartId)
-            .first()
+        await self.run_handler_sync(
+            self._process_transaction_updated, transaction_event
         )
-        if db_checkout is None:
-            info(
-                " [CitrineOS] Checkout not found for transaction update event: %r",
-                transaction_event,
+
+    def _process_transaction_updated(
+        self, transaction_event: TransactionEventRequest
+    ) -> None:
+        with db_session() as db:
+            db_checkout = (
+                db.query(CheckoutModel)
+                .filter(
+                    CheckoutModel.id == transaction_event.transactionInfo.remoteStartId
+                )
+                .first()
             )
-            return
+            if db_checkout is None:
+                info(
+                    " [CitrineOS] Checkout not found for transaction update event: %r",
+                    transaction_event,
+                )
+                return
 
-        db_checkout = self.update_checkout_with_meter_values(
-            transaction_event=transaction_event, db_checkout=db_checkout
-        )
-        db.add(db_checkout)
-        db.commit()
-        db.refresh(db_checkout)
-        return
+            db_checkout = self.update_checkout_with_meter_values(
+                transaction_event=transaction_event, db_checkout=db_checkout
+            )
+            db.add(db_checkout)
+            db.commit()
+            db.refresh(db_checkout)
+            return
 
+    @timed(EVENT_HANDLER_DURATION, "process_transaction_ended")
+    @traced("process_transaction_ended")
     async def process_transaction_ended(
         self, transaction_event: TransactionEventRequest
     ) -> None:
-        db: Session = next(get_db())
-        db_checkout = (
-            db.query(CheckoutModel)
-            .filter(CheckoutModel.id == transaction_event.transactionInfo.remoteStartId)
-            .first()
-        )
-        if db_checkout is None:
-            info(
-                " [CitrineOS] Checkout not found for transaction end event: %r",
-                transaction_event,
+        checkout_id = await self.run_handler_sync(self._end_checkout, transaction_event)
+        if checkout_id is not None:
+            await self.capture_payment_transaction(app=None, checkout_id=checkout_id)
+
+    def _end_checkout(self, transaction_event: TransactionEventRequest) -> int | None:
+        with db_session() as db:
+            db_checkout = (
+                db.query(CheckoutModel)
+                .filter(
+                    CheckoutModel.id == transaction_event.transactionInfo.remoteStartId
+                )
+                .first()
             )
-            return
-
-        db_checkout = self.update_checkout_with_meter_values(
-            transaction_event=transaction_event, db_checkout=db_checkout
-        )
-        db_checkout.transaction_end_time = transaction_event.timestamp
-        db.add(db_checkout)
-        db.commit()
-        db.refresh(db_checkout)
-
-        await self.capture_payment_transaction(app=None, checkout_id=db_checkout.id)
+            if db_checkout is None:
+                info(
+                    " [CitrineOS] Checkout not found for transaction end event: %r",
+                    transaction_event,
+                )
+                return None
 
-        return
+            db_checkout = self.update_checkout_with_meter_values(
+                transaction_event=transaction_event, db_checkout=db_checkout
+            )
+            db_checkout.transaction_end_time = transaction_event.timestamp
+            db.add(db_checkout)
+            db.commit()
+            return db_checkout.id
 
     def update_checkout_with_meter_values(
         self, transaction_event: TransactionEventRequest, db_checkout: CheckoutModel
     ) -> CheckoutModel:
-        if (
-            transaction_event.meterValue is not None
-            and len(transaction_event.meterValue) > 0
-        ):
-            latest_meter_value = transaction_event.meterValue[
-                len(transaction_event.meterValue) - 1
-            ]
-            for sampled_value in latest_meter_value.sampledValue:
-                if (
-                    sampled_value.measurand
-                    == MeasurandEnumType.EnergyActiveImportRegister
-                    and sampled_value.phase is None
-                ):
-                    new_kwh_value = sampled_value.value
-                    if (
-                        sampled_value.unitOfMeasure.unit is None
-                        or sampled_value.unitOfMeasure.unit == "Wh"
-                    ):
-                        new_kwh_value = new_kwh_value / 1000
-                    if sampled_value.unitOfMeasure.multiplier is not None:
-                        new_kwh_value = (
-                            new_kwh_value * 10**sampled_value.unitOfMeasure.multiplier
-                        )
-                    if db_checkout.transaction_last_meter_reading is None:
-                        db_checkout.transaction_kwh = 0
-                    if db_checkout.transaction_last_meter_reading is not None:
-                        db_checkout.transaction_kwh += (
-                            new_kwh_value - db_checkout.transaction_last_meter_reading
-                        )
-                    db_checkout.transaction_last_meter_reading = new_kwh_value
-
-                elif (
-                    sampled_value.measurand == MeasurandEnumType.PowerActiveImport
-                    and sampled_value.phase is None
-                ):
-                    new_power_value = sampled_value.value
-                    if (
-                        sampled_value.unitOfMeasure.unit is None
-                        or sampled_value.unitOfMeasure.unit == "W"
-                    ):
-                        new_power_value = new_power_value / 1000
-                    if sampled_value.unitOfMeasure.multiplier is not None:
-                        new_power_value = (
-                            new_power_value * 10**sampled_value.unitOfMeasure.multiplier
-                        )
-                    db_checkout.power_active_import = new_power_value
-
-                elif (
-                    sampled_value.measurand == MeasurandEnumType.SoC
-                    and sampled_value.phase is None
-                ):
-                    new_soc_value = sampled_value.value
-                    if sampled_value.unitOfMeasure.multiplier is not None:
-                        new_soc_value = (
-                            new_soc_value * 10**sampled_value.unitOfMeasure.multiplier
-                        )
-                    db_checkout.transaction_soc = new_soc_value
+        readings = extract_meter_readings(transaction_event.meterValue)
+        for measurand, value in readings:
+            if measurand == ENERGY:
+                if db_checkout.transaction_last_meter_reading is None:
+                    db_checkout.transaction_kwh = 0
+                if db_checkout.transaction_last_meter_reading is not None:
+                    db_checkout.transaction_kwh += (
+                        value - db_checkout.transaction_last_meter_reading
+                    )
+                db_checkout.transaction_last_meter_reading = value
+            elif measurand == POWER:
+                db_checkout.power_active_import = value
+            elif measurand == SOC:
+                db_checkout.transaction_soc = value
+        if readings:
+            # Inserted with the checkout update, in the same transaction
+            db_checkout.meter_samples.add(
+                MeterSampleModel(
+                    sampled_at=transaction_event.timestamp,
+                    transaction_kwh=db_checkout.transaction_kwh,
+                    power_active_import=db_checkout.power_active_import,
+                    transaction_soc=db_checkout.transaction_soc,
+                )
+            )
         return db_checkout
 
+    @timed(EVENT_HANDLER_DURATION, "process_status_notification")
+    @traced("process_status_notification")
     async def process_status_notification(
         self,
         status_notification: StatusNotificationRequest,
         citrine_os_event_headers: CitrineOSeventHeaders,
     ) -> None:
-        db: Session = next(get_db())
-        db_evse = (
-            db.query(EvseModel)
-            .filter(EvseModel.station_id == citrine_os_event_headers.stationId)
-            .filter(EvseModel.ocpp_evse_id == status_notification.evseId)
-            .first()
+        await self.run_handler_sync(
+            self._process_status_notification,
+            status_notification,
+            citrine_os_event_headers,
         )
-        if db_evse is None:
-            info(
-                " [CitrineOS] EVSE not found for status notification event: %r",
-                status_notification,
+
+    def _process_status_notification(
+        self,
+        status_notification: StatusNotificationRequest,
+        citrine_os_event_headers: CitrineOSeventHeaders,
+    ) -> None:
+        with db_session() as db:
+            db_evse = (
+                db.query(EvseModel)
+                .filter(EvseModel.station_id == citrine_os_event_headers.stationId)
+                .filter(EvseModel.ocpp_evse_id == status_notification.evseId)
+                .first()
             )
-            return
+            if db_evse is None:
+                info(
+                    " [CitrineOS] EVSE not found for status notification event: %r",
+                    status_notification,
+                )
+                return
 
-        db_evse.status = status_notification.connectorStatus
-        db.add(db_evse)
-        db.commit()
-        db.refresh(db_evse)
-        return
+            db_evse.status = status_notification.connectorStatus
+            db.add(db_evse)
+            db.commit()
+            db.refresh(db_evse)
+            topology_cache.delete(f"evses:{db_evse.evse_id}")
+            return
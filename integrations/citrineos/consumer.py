@@ -0,0 +1,71 @@
+"""
+Standalone CitrineOS event consumer.
+
+Runs the message broker consumer without the web app, so it can be scaled
+independently of the API:
+
+    python -m integrations.citrineos.consumer
+
+Set MESSAGE_BROKER_EMBEDDED_CONSUMER=false for the web app when running it.
+SIGINT and SIGTERM stop consuming and drain the events in progress. SIGUSR1
+writes a profile of the process to PROFILE_OUTPUT_DIR. Its metrics are served
+on MESSAGE_BROKER_CONSUMER_METRICS_PORT, if set.
+"""
+
+import asyncio
+import signal
+from logging import basicConfig, info
+
+from config import Config
+from db.init_db import init_db
+from integrations.citrineos.citrineos import CitrineOSIntegration
+from integrations.directus.directus import DirectusIntegration
+from utils.metrics import start_metrics_server
+from utils.profiling import EventLoopLagMonitor, install_profile_signal_handler
+from utils.stripe_client import configure_stripe
+from utils.tracing import configure_tracing
+
+
+async def consume(integration: CitrineOSIntegration) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stop.set)
+
+    lag_monitor = EventLoopLagMonitor()
+    if Config.EVENT_LOOP_LAG_THRESHOLD_MS > 0:
+        lag_monitor.start()
+
+    info(
+        " [CitrineOS] Starting event consumer with %d workers",
+        Config.MESSAGE_BROKER_CONSUMER_WORKERS,
+    )
+    try:
+        await integration.receive_events(stop=stop)
+    finally:
+        lag_monitor.stop()
+
+
+def main() -> None:
+    basicConfig(format=Config.LOG_FORMAT, level=Config.LOG_LEVEL)
+    configure_stripe()
+    configure_tracing()
+    install_profile_signal_handler()
+    init_db()
+    if Config.MESSAGE_BROKER_CONSUMER_METRICS_PORT:
+        start_metrics_server(Config.MESSAGE_BROKER_CONSUMER_METRICS_PORT)
+        info(
+            " [CitrineOS] Serving metrics on port %d",
+            Config.MESSAGE_BROKER_CONSUMER_METRICS_PORT,
+        )
+
+    file_integration = DirectusIntegration(
+        Config.CITRINEOS_DIRECTUS_URL,
+        Config.CITRINEOS_DIRECTUS_LOGIN_EMAIL,
+        Config.CITRINEOS_DIRECTUS_LOGIN_PASSWORD,
+    )
+    asyncio.run(consume(CitrineOSIntegration(file_integration)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,592 @@
+"""
+Generates synthetic CitrineOS event streams and replays them for benchmarking.
+
+    python -m integrations.citrineos.event_stream generate --stations 100 --hours 24 \\
+        --output events.jsonl
+    python -m integrations.citrineos.event_stream replay events.jsonl --rate 200
+    python -m integrations.citrineos.event_stream replay events.jsonl --speed 60 \\
+        --in-process
+
+Every station plugs in, charges and unplugs in a loop: a StatusNotification
+Occupied, a TransactionEvent Started, an Updated with meter values every
+--meter-interval seconds, an Ended and a StatusNotification Available. Streams are
+written as JSON lines holding the offset of the event in seconds and the headers
+and body CitrineOS publishes, so they can be replayed to the broker as they are.
+
+Replays publish to the message broker exchange for a running consumer. With
+--in-process, events are processed by this process instead, against the configured
+database and dependencies, and the time spent waiting, in handlers and in calls to
+each dependency is reported.
+"""
+
+import argparse
+import asyncio
+import heapq
+import random
+import sys
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+from itertools import count, islice
+from logging import basicConfig, exception
+from statistics import quantiles
+from typing import IO, Awaitable, Callable, Iterable, Iterator, NamedTuple
+
+from aio_pika import Message
+from aio_pika.abc import AbstractExchange
+from orjson import dumps, loads
+
+from config import Config
+from db.init_db import init_db
+from integrations.citrineos.citrineos import (
+    CitrineOSIntegration,
+    connect_message_broker,
+)
+from integrations.directus.directus import DirectusIntegration
+from utils.metrics import (
+    DEPENDENCY_CALL_DURATION,
+    EVENT_HANDLER_DURATION,
+    Histogram,
+    histogram_totals,
+)
+from utils.stripe_client import configure_stripe
+
+# Rated power of the generated stations, from AC wallboxes to DC chargers
+STATION_POWER_KW = (7.4, 11, 22, 50, 150)
+BATTERY_CAPACITY_KWH = 60
+
+
+class StreamEvent(NamedTuple):
+    at: float  # seconds since the start of the stream
+    headers: dict
+    body: dict
+
+
+def stream_event(
+    at: float, start: datetime, station_id: str, tenant_id: str, action: str, payload
+) -> StreamEvent:
+    """Wraps `payload` in the message headers and body of a CitrineOS event."""
+    at = round(at, 3)
+    timestamp = (start + timedelta(seconds=at)).isoformat()
+    payload["timestamp"] = timestamp
+    for meter_value in payload.get("meterValue", []):
+        meter_value["timestamp"] = timestamp
+    event_group = "transactions" if action == "TransactionEvent" else "availability"
+    headers = {
+        "action": action,
+        "state": "1",
+        "stationId": station_id,
+        "tenantId": tenant_id,
+        "origin": "cs",
+        "eventGroup": event_group,
+    }
+    body = {
+        "origin": "cs",
+        "eventGroup": event_group,
+        "action": action,
+        "state": 1,
+        "context": {
+            "correlationId": str(uuid.uuid5(uuid.NAMESPACE_URL, f"{station_id}/{at}")),
+            "stationId": station_id,
+            "tenantId": tenant_id,
+            "timestamp": timestamp,
+        },
+        "payload": payload,
+        "protocol": "ocpp2.0.1",
+    }
+    return StreamEvent(at, headers, body)
+
+
+def station_events(
+    station_id: str,
+    rng: random.Random,
+    start: datetime,
+    hours: float,
+    meter_interval: float,
+    session_minutes: float,
+    idle_minutes: float,
+    tenant_id: str = "1",
+    remote_start_ids: Iterator[int] | None = None,
+) -> Iterator[StreamEvent]:
+    """
+    Yields the events of one station in order, for sessions starting within `hours`.
+
+    Idle times between sessions are exponentially distributed around `idle_minutes`,
+    session durations vary by half of `session_minutes` either way. Sessions are
+    remote starts of the checkouts in `remote_start_ids` if given, otherwise they
+    are authorized with an RFID card.
+    """
+    max_power_kw = rng.choice(STATION_POWER_KW)
+    meter_wh = rng.uniform(0, 1_000_000)
+    at = rng.expovariate(1 / (idle_minutes * 60))
+    transaction_numbers = count(1)
+
+    def event(action: str, payload: dict) -> StreamEvent:
+        return stream_event(at, start, station_id, tenant_id, action, payload)
+
+    def status(connector_status: str) -> StreamEvent:
+        return event(
+            "StatusNotification",
+            {"connectorId": 1, "evseId": 1, "connectorStatus": connector_status},
+        )
+
+    while at < hours * 3600:
+        transaction_info = {
+            "transactionId": f"{station_id}-{next(transaction_numbers)}",
+        }
+        if remote_start_ids is not None:
+            transaction_info["remoteStartId"] = next(remote_start_ids)
+        power_w = max_power_kw * 1000 * rng.uniform(0.6, 1.0)
+        soc = rng.uniform(10, 60)
+        seq_nos = count()
+
+        def transaction_event(
+            event_type: str, trigger_reason: str, **extra
+        ) -> StreamEvent:
+            return event(
+                "TransactionEvent",
+                {
+                    "eventType": event_type,
+                    "triggerReason": trigger_reason,
+                    "seqNo": next(seq_nos),
+                    "transactionInfo": dict(transaction_info, **extra),
+                    "evse": {"id": 1, "connectorId": 1},
+                    "meterValue": [
+                        {
+                            "sampledValue": [
+                                {"value": round(meter_wh, 1)},
+                                {
+                                    "value": round(power_w),
+                                    "measurand": "Power.Active.Import",
+                                    "unitOfMeasure": {"unit": "W"},
+                                },
+                                {
+                                    "value": round(soc, 1),
+                                    "measurand": "SoC",
+                                    "unitOfMeasure": {"unit": "Percent"},
+                                },
+                            ],
+                        }
+                    ],
+                },
+            )
+
+        def charge(seconds: float) -> None:
+            nonlocal at, meter_wh, soc
+            at += seconds
+            meter_wh += power_w * seconds / 3600
+            soc = min(100.0, soc + power_w * seconds / 36 / BATTERY_CAPACITY_KWH / 1000)
+
+        yield status("Occupied")
+        at += rng.uniform(5, 30)
+        if remote_start_ids is not None:
+            started = transaction_event("Started", "RemoteStart")
+        else:
+            started = transaction_event("Started", "Authorized")
+            started.body["payload"]["idToken"] = {
+                "idToken": f"{rng.getrandbits(32):08X}",
+                "type": "ISO14443",
+            }
+        yield started
+
+        session_end = at + session_minutes * 60 * rng.uniform(0.5, 1.5)
+        while at + meter_interval < session_end:
+            charge(meter_interval)
+            yield transaction_event("Updated", "MeterValuePeriodic")
+        charge(session_end - at)
+        yield transaction_event("Ended", "EVDeparted", stoppedReason="EVDisconnected")
+
+        at += rng.uniform(5, 60)
+        yield status("Available")
+        at += rng.expovariate(1 / (idle_minutes * 60))
+
+
+def generate_events(
+    stations: int,
+    hours: float,
+    meter_interval: float = 60,
+    session_minutes: float = 45,
+    idle_minutes: float = 90,
+    station_prefix: str = "station-",
+    tenant_id: str = "1",
+    first_remote_start_id: int | None = None,
+    start: datetime | None = None,
+    seed: int = 0,
+) -> Iterator[StreamEvent]:
+    """
+    Yields the events of all stations ordered by time.
+
+    The stations are generated lazily and merged, so streams of many days are never
+    held in memory. The same arguments and `seed` generate the same stream.
+    """
+    start = start or datetime.now(timezone.utc)
+    rng = random.Random(seed)
+    remote_start_ids = (
+        count(first_remote_start_id) if first_remote_start_id is not None else None
+    )
+    return heapq.merge(
+        *(
+            station_events(
+                f"{station_prefix}{number}",
+                random.Random(rng.getrandbits(64)),
+                start,
+                hours,
+                meter_interval,
+                session_minutes,
+                idle_minutes,
+                tenant_id,
+                remote_start_ids,
+            )
+            for number in range(1, stations + 1)
+        ),
+        key=lambda event: event.at,
+    )
+
+
+def write_events(events: Iterable[StreamEvent], file: IO[bytes]) -> int:
+    written = 0
+    for event in events:
+        file.write(dumps(event._asdict()) + b"\n")
+        written += 1
+    return written
+
+
+def read_events(file: IO[bytes]) -> Iterator[StreamEvent]:
+    for line in file:
+        if line.strip():
+            yield StreamEvent(**loads(line))
+
+
+def event_label(event: StreamEvent) -> str:
+    action = event.headers["action"]
+    if action == "TransactionEvent":
+        return f"{action} {event.body['payload']['eventType']}"
+    return action
+
+
+class ReplayStats:
+    def __init__(self):
+        self.published = 0
+        self.elapsed = 0.0
+        # How late each event was published compared to its schedule, in seconds
+        self.lags: list[float] = []
+
+
+async def replay_events(
+    events: Iterable[StreamEvent],
+    publish: Callable[[StreamEvent], Awaitable[None]],
+    rate: float | None = None,
+    speed: float | None = None,
+) -> ReplayStats:
+    """
+    Publishes the events in order, on schedule.
+
+    With `rate`, events are published at `rate` events per second, ignoring their
+    offsets. With `speed`, the offsets are kept, divided by `speed`. Without either,
+    each event is published as soon as the previous one was. An event is never
+    published early, but it is published late if `publish` cannot keep up.
+    """
+    loop = asyncio.get_running_loop()
+    stats = ReplayStats()
+    started = loop.time()
+    for index, event in enumerate(events):
+        due = None
+        if rate is not None:
+            due = index / rate
+        elif speed is not None:
+            due = event.at / speed
+        if due is not None:
+            delay = started + due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            stats.lags.append(max(0.0, loop.time() - started - due))
+        await publish(event)
+        stats.published += 1
+    stats.elapsed = loop.time() - started
+    return stats
+
+
+def broker_publisher(
+    exchange: AbstractExchange,
+) -> Callable[[StreamEvent], Awaitable[None]]:
+    """Publishes events to the CitrineOS exchange, bound by header like CitrineOS."""
+
+    async def publish(event: StreamEvent) -> None:
+        await exchange.publish(
+            Message(
+                body=dumps(event.body),
+                headers=event.headers,
+                content_type="application/json",
+            ),
+            routing_key="",
+        )
+
+    return publish
+
+
+class ReplayedMessage:
+    """The parts of an incoming broker message read by process_incoming_event."""
+
+    def __init__(self, event: StreamEvent):
+        self.body = dumps(event.body)
+        self.headers = event.headers
+        self.content_type = "application/json"
+        self.message_id = None
+
+
+class InProcessConsumer:
+    """
+    Processes replayed events with `workers` tasks, like the broker consumer does.
+
+    Events of a station always go to the same worker, so they are processed in
+    order. The time each event waited for its worker and the time it was processed
+    are recorded per event type.
+    """
+
+    def __init__(self, integration: CitrineOSIntegration, workers: int):
+        self.integration = integration
+        self.waits: dict[str, list[float]] = {}
+        self.durations: dict[str, list[float]] = {}
+        self.errors = 0
+        self._worker_queues = [asyncio.Queue() for _ in range(max(1, workers))]
+        self._worker_tasks = [
+            asyncio.create_task(self._process(worker_queue))
+            for worker_queue in self._worker_queues
+        ]
+
+    async def publish(self, event: StreamEvent) -> None:
+        station_id = str(event.headers.get("stationId"))
+        self._worker_queues[
+            zlib.crc32(station_id.encode()) % len(self._worker_queues)
+        ].put_nowait((event, time.perf_counter()))
+
+    async def drain(self) -> None:
+        for worker_queue in self._worker_queues:
+            worker_queue.put_nowait(None)
+        await asyncio.gather(*self._worker_tasks)
+
+    async def _process(self, worker_queue: asyncio.Queue) -> None:
+        while True:
+            item = await worker_queue.get()
+            if item is None:
+                return
+            event, published_at = item
+            label = event_label(event)
+            started = time.perf_counter()
+            try:
+                await self.integration.process_incoming_event(
+                    event_message=ReplayedMessage(event), exchange=None
+                )
+            except Exception:
+                exception(" [CitrineOS] Processing error for replayed event")
+                self.errors += 1
+            self.waits.setdefault(label, []).append(started - published_at)
+            self.durations.setdefault(label, []).append(time.perf_counter() - started)
+
+
+def histogram_deltas(
+    histogram: Histogram, before: dict[tuple[str, ...], tuple[int, float]]
+) -> dict[str, tuple[int, float]]:
+    """Returns the count and sum observed since `before` per label values."""
+    deltas = {}
+    for values, (total_count, total_sum) in histogram_totals(histogram).items():
+        count_before, sum_before = before.get(values, (0, 0.0))
+        if total_count > count_before:
+            deltas["/".join(values)] = (
+                total_count - count_before,
+                total_sum - sum_before,
+            )
+    return deltas
+
+
+def percentile(values: list[float], percent: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return quantiles(values, n=100)[percent - 1]
+
+
+def format_report(
+    stats: ReplayStats,
+    consumer: InProcessConsumer | None = None,
+    handlers: dict[str, tuple[int, float]] | None = None,
+    dependencies: dict[str, tuple[int, float]] | None = None,
+) -> list[str]:
+    lines = [
+        f"Replayed {stats.published} events in {stats.elapsed:.2f}s "
+        f"({stats.published / stats.elapsed if stats.elapsed else 0:.1f} events/s)"
+    ]
+    if stats.lags:
+        lines.append(
+            f"  schedule lag: p50={percentile(stats.lags, 50) * 1000:.1f}ms "
+            f"p99={percentile(stats.lags, 99) * 1000:.1f}ms "
+            f"max={max(stats.lags) * 1000:.1f}ms"
+        )
+    if consumer is None:
+        return lines
+
+    lines.append(f"  processing errors: {consumer.errors}")
+    for label in sorted(consumer.durations):
+        waits, durations = consumer.waits[label], consumer.durations[label]
+        lines.append(
+            f"  {label}: {len(durations)} events, "
+            f"wait p50={percentile(waits, 50) * 1000:.1f}ms "
+            f"p99={percentile(waits, 99) * 1000:.1f}ms, "
+            f"processing p50={percentile(durations, 50) * 1000:.1f}ms "
+            f"p99={percentile(durations, 99) * 1000:.1f}ms"
+        )
+    for stage, totals in [("handler", handlers), ("dependency", dependencies)]:
+        for name, (calls, seconds) in sorted((totals or {}).items()):
+            lines.append(
+                f"  {stage} {name}: {calls} calls, {seconds:.2f}s total, "
+                f"{seconds / calls * 1000:.1f}ms mean"
+            )
+    return lines
+
+
+async def replay_to_broker(
+    events: Iterable[StreamEvent], rate: float | None, speed: float | None
+) -> list[str]:
+    connection = await connect_message_broker()
+    async with connection:
+        channel = await connection.channel()
+        exchange = await channel.declare_exchange(
+            name=Config.MESSAGE_BROKER_EXCHANGE_NAME,
+            type=Config.MESSAGE_BROKER_EXCHANGE_TYPE,
+        )
+        stats = await replay_events(events, broker_publisher(exchange), rate, speed)
+    return format_report(stats)
+
+
+async def replay_in_process(
+    events: Iterable[StreamEvent],
+    integration: CitrineOSIntegration,
+    workers: int,
+    rate: float | None,
+    speed: float | None,
+) -> list[str]:
+    handlers_before = histogram_totals(EVENT_HANDLER_DURATION)
+    dependencies_before = histogram_totals(DEPENDENCY_CALL_DURATION)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    consumer = InProcessConsumer(integration, workers)
+    stats = await replay_events(events, consumer.publish, rate, speed)
+    await consumer.drain()
+    # Until the last event was processed, not just published
+    stats.elapsed = loop.time() - started
+    return format_report(
+        stats,
+        consumer,
+        histogram_deltas(EVENT_HANDLER_DURATION, handlers_before),
+        histogram_deltas(DEPENDENCY_CALL_DURATION, dependencies_before),
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="write a synthetic event stream")
+    generate.add_argument("--stations", type=int, default=10)
+    generate.add_argument("--hours", type=float, default=24)
+    generate.add_argument(
+        "--meter-interval",
+        type=float,
+        default=60,
+        help="seconds between TransactionEvent Updated meter values",
+    )
+    generate.add_argument("--session-minutes", type=float, default=45)
+    generate.add_argument(
+        "--idle-minutes",
+        type=float,
+        default=90,
+        help="mean time between the sessions of a station",
+    )
+    generate.add_argument("--station-prefix", default="station-")
+    generate.add_argument("--tenant-id", default="1")
+    generate.add_argument(
+        "--first-remote-start-id",
+        type=int,
+        default=None,
+        help="remote start sessions with consecutive checkout ids from this one",
+    )
+    generate.add_argument(
+        "--start",
+        type=datetime.fromisoformat,
+        default=None,
+        help="ISO timestamp of the start of the stream [now]",
+    )
+    generate.add_argument("--seed", type=int, default=0)
+    generate.add_argument("--output", default="-", help="file to write [stdout]")
+
+    replay = commands.add_parser("replay", help="replay an event stream")
+    replay.add_argument("file", help="file to read, - for stdin")
+    pace = replay.add_mutually_exclusive_group()
+    pace.add_argument("--rate", type=float, help="events per second")
+    pace.add_argument(
+        "--speed", type=float, help="replay the recorded timing this many times faster"
+    )
+    replay.add_argument("--limit", type=int, default=None, help="replay N events")
+    replay.add_argument(
+        "--in-process",
+        action="store_true",
+        help="process the events in this process instead of publishing them",
+    )
+    replay.add_argument(
+        "--workers", type=int, default=Config.MESSAGE_BROKER_CONSUMER_WORKERS
+    )
+    args = parser.parse_args()
+
+    basicConfig(format=Config.LOG_FORMAT, level=Config.LOG_LEVEL)
+    if args.command == "generate":
+        events = generate_events(
+            args.stations,
+            args.hours,
+            meter_interval=args.meter_interval,
+            session_minutes=args.session_minutes,
+            idle_minutes=args.idle_minutes,
+            station_prefix=args.station_prefix,
+            tenant_id=args.tenant_id,
+            first_remote_start_id=args.first_remote_start_id,
+            start=args.start,
+            seed=args.seed,
+        )
+        if args.output == "-":
+            written = write_events(events, sys.stdout.buffer)
+        else:
+            with open(args.output, "wb") as file:
+                written = write_events(events, file)
+        print(f"Wrote {written} events", file=sys.stderr)
+        return
+
+    file = sys.stdin.buffer if args.file == "-" else open(args.file, "rb")
+    with file:
+        events = read_events(file)
+        if args.limit is not None:
+            events = islice(events, args.limit)
+        if args.in_process:
+            lines = asyncio.run(
+                replay_in_process(
+                    events, consumer_integration(), args.workers, args.rate, args.speed
+                )
+            )
+        else:
+            lines = asyncio.run(replay_to_broker(events, args.rate, args.speed))
+    print("\n".join(lines))
+
+
+def consumer_integration() -> CitrineOSIntegration:
+    """Sets up the integration the way the standalone consumer does."""
+    configure_stripe()
+    init_db()
+    return CitrineOSIntegration(
+        DirectusIntegration(
+            Config.CITRINEOS_DIRECTUS_URL,
+            Config.CITRINEOS_DIRECTUS_LOGIN_EMAIL,
+            Config.CITRINEOS_DIRECTUS_LOGIN_PASSWORD,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
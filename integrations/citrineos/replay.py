@@ -0,0 +1,84 @@
+"""
+Re-injects dead-lettered CitrineOS events into the event queue.
+
+    python -m integrations.citrineos.replay [--limit N]
+
+Replayed events start over with a fresh attempt count. Each event is only removed
+from the dead-letter queue once the broker confirmed its copy in the event queue.
+"""
+
+import argparse
+import asyncio
+from logging import basicConfig, info
+
+from aio_pika.abc import AbstractExchange, AbstractQueue
+
+from config import Config
+from integrations.citrineos.citrineos import connect_message_broker
+from integrations.citrineos.retry import (
+    ATTEMPTS_HEADER,
+    LAST_ERROR_HEADER,
+    RETRY_ID_HEADER,
+    EventRetryRouter,
+    copy_message,
+)
+
+
+async def replay_dead_letters(
+    dead_letter_queue: AbstractQueue,
+    exchange: AbstractExchange,
+    queue_name: str,
+    limit: int | None = None,
+) -> int:
+    """
+    Moves events from the dead-letter queue back to the event queue.
+
+    Returns:
+        int - The number of replayed events.
+    """
+    replayed = 0
+    while limit is None or replayed < limit:
+        message = await dead_letter_queue.get(no_ack=False, fail=False)
+        if message is None:
+            break
+        headers = dict(message.headers or {})
+        headers.pop(ATTEMPTS_HEADER, None)
+        headers.pop(LAST_ERROR_HEADER, None)
+        headers.pop(RETRY_ID_HEADER, None)
+        await exchange.publish(copy_message(message, headers), routing_key=queue_name)
+        await message.ack()
+        replayed += 1
+    return replayed
+
+
+async def replay(limit: int | None) -> int:
+    connection = await connect_message_broker()
+    async with connection:
+        channel = await connection.channel()
+        retry_router = EventRetryRouter(channel.default_exchange)
+        await retry_router.declare(channel)
+        dead_letter_queue = await channel.declare_queue(
+            retry_router.dead_letter_queue_name, durable=True
+        )
+        return await replay_dead_letters(
+            dead_letter_queue,
+            channel.default_exchange,
+            retry_router.queue_name,
+            limit=limit,
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--limit", type=int, default=None, help="replay at most this many events"
+    )
+    args = parser.parse_args()
+
+    basicConfig(format=Config.LOG_FORMAT, level=Config.LOG_LEVEL)
+    replayed = asyncio.run(replay(args.limit))
+    info(" [CitrineOS] Replayed %d dead-lettered events", replayed)
+
+
+if __name__ == "__main__":
+    main()
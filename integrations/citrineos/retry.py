@@ -0,0 +1,187 @@
+from logging import exception, warning
+import time
+import uuid
+
+from aio_pika import DeliveryMode, Message
+from aio_pika.abc import AbstractChannel, AbstractExchange, AbstractIncomingMessage
+
+from config import Config
+
+ATTEMPTS_HEADER = "retry-attempts"
+LAST_ERROR_HEADER = "retry-last-error"
+RETRY_ID_HEADER = "retry-id"
+
+
+def parse_retry_delays(delays: str) -> list[int]:
+    """Parses a comma separated list of delays in milliseconds."""
+    return [int(delay) for delay in delays.split(",") if delay.strip()]
+
+
+class EventRetryRouter:
+    """
+    Sends failed events to a retry queue or, after the last attempt, to the
+    dead-letter queue.
+
+    Each retry queue holds messages for a fixed delay (`x-message-ttl`) and then
+    dead-letters them back to the event queue through the default exchange, so
+    they reach this consumer only and not other services bound to the CitrineOS
+    exchange. The nth failure of an event goes to the nth retry queue, later
+    failures to the last one.
+
+    While a failed event of a station waits in a retry queue, later events of the
+    station are parked behind it: an unchanged copy is published to the same retry
+    queue. All messages of a retry queue wait for the same delay, so they come back
+    in order and the failed event is processed again before them. Which events are
+    waiting is only known to this process, after a restart the parked events are
+    processed as they come back.
+    """
+
+    def __init__(
+        self,
+        exchange: AbstractExchange,
+        queue_name: str = Config.MESSAGE_BROKER_EVENT_CONSUMER_QUEUE_NAME,
+        retry_delays: list[int] = None,
+        max_attempts: int = Config.MESSAGE_BROKER_MAX_ATTEMPTS,
+    ):
+        self.exchange = exchange
+        self.queue_name = queue_name
+        self.retry_delays = (
+            retry_delays
+            if retry_delays is not None
+            else parse_retry_delays(Config.MESSAGE_BROKER_RETRY_DELAYS_MS)
+        )
+        self.max_attempts = max(1, max_attempts)
+        # Station id to the retry id of its waiting event, the retry queue it waits
+        # in and the time it is expected back by at the latest
+        self._waiting: dict[str, tuple[str, str, float]] = {}
+
+    @property
+    def retry_queue_names(self) -> list[str]:
+        return [f"{self.queue_name}.retry.{delay}ms" for delay in self.retry_delays]
+
+    @property
+    def dead_letter_queue_name(self) -> str:
+        return f"{self.queue_name}.dead"
+
+    async def declare(self, channel: AbstractChannel) -> None:
+        for delay, name in zip(self.retry_delays, self.retry_queue_names):
+            await channel.declare_queue(
+                name,
+                durable=True,
+                arguments={
+                    "x-message-ttl": delay,
+                    "x-dead-letter-exchange": "",
+                    "x-dead-letter-routing-key": self.queue_name,
+                },
+            )
+        await channel.declare_queue(self.dead_letter_queue_name, durable=True)
+
+    def is_waiting(self, station_id: str, message: AbstractIncomingMessage) -> bool:
+        """True if the message has to wait behind a failed event of its station."""
+        waiting = self._waiting.get(station_id)
+        if waiting is None:
+            return False
+        retry_id, routing_key, expected_by = waiting
+        if (message.headers or {}).get(RETRY_ID_HEADER) == retry_id:
+            return False
+        if time.monotonic() > expected_by:
+            # The failed event did not come back, e.g. its retry queue was purged
+            warning(
+                " [CitrineOS] Event of station %s waiting in %s did not come back",
+                station_id,
+                routing_key,
+            )
+            del self._waiting[station_id]
+            return False
+        return True
+
+    async def park(self, station_id: str, message: AbstractIncomingMessage) -> bool:
+        """
+        Publishes an unchanged copy of the message behind the failed event of its
+        station.
+
+        Returns:
+            bool - True if the copy was published and the message can be acked.
+        """
+        routing_key = self._waiting[station_id][1]
+        try:
+            await self.exchange.publish(
+                copy_message(message, dict(message.headers or {})),
+                routing_key=routing_key,
+            )
+        except Exception:
+            exception(" [CitrineOS] Could not park event in %s", routing_key)
+            return False
+        return True
+
+    def succeeded(self, station_id: str, message: AbstractIncomingMessage) -> None:
+        """Releases the events parked behind the message, if it was waiting."""
+        self._release(station_id, message)
+
+    def _release(self, station_id: str, message: AbstractIncomingMessage) -> None:
+        waiting = self._waiting.get(station_id)
+        if waiting and (message.headers or {}).get(RETRY_ID_HEADER) == waiting[0]:
+            del self._waiting[station_id]
+
+    async def route_failed(
+        self,
+        message: AbstractIncomingMessage,
+        error: Exception,
+        station_id: str | None = None,
+    ) -> bool:
+        """
+        Publishes a copy of a failed message for a later attempt. Later events of
+        the station are parked behind it until it succeeded or was dead-lettered.
+
+        Returns:
+            bool - True if the copy was published and the message can be acked.
+        """
+        headers = dict(message.headers or {})
+        attempts = int(headers.get(ATTEMPTS_HEADER, 0)) + 1
+        headers[ATTEMPTS_HEADER] = attempts
+        headers[LAST_ERROR_HEADER] = repr(error)[:1000]
+        retry_id = headers.setdefault(RETRY_ID_HEADER, str(uuid.uuid4()))
+
+        delay = None
+        if attempts < self.max_attempts and self.retry_delays:
+            index = min(attempts, len(self.retry_delays)) - 1
+            delay = self.retry_delays[index]
+            routing_key = self.retry_queue_names[index]
+        else:
+            routing_key = self.dead_letter_queue_name
+            warning(
+                " [CitrineOS] Dead-lettering event after %d attempts: %r",
+                attempts,
+                message.headers,
+            )
+
+        published = True
+        try:
+            await self.exchange.publish(
+                copy_message(message, headers), routing_key=routing_key
+            )
+        except Exception:
+            exception(" [CitrineOS] Could not publish failed event to %s", routing_key)
+            published = False
+
+        if station_id is not None:
+            if published and delay is not None:
+                # Broker and consumer lag may delay it, give up waiting well after
+                self._waiting[station_id] = (
+                    retry_id,
+                    routing_key,
+                    time.monotonic() + 2 * delay / 1000 + 60,
+                )
+            else:
+                self._release(station_id, message)
+        return published
+
+
+def copy_message(message: AbstractIncomingMessage, headers: dict) -> Message:
+    return Message(
+        body=message.body,
+        headers=headers,
+        content_type=message.content_type,
+        message_id=message.message_id,
+        delivery_mode=DeliveryMode.PERSISTENT,
+    )
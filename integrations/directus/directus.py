@@ -5,6 +5,8 @@ import requests
 from config import Config
 from logging import exception, warning
 from integrations.integration import FileIntegration
+from utils.dependency_stats import DIRECTUS
+from utils.http_client import request_dependency
 
 REFRESH_TOKEN_REQUEST_BUFFER = 500  # in milliseconds
 
@@ -30,7 +32,13 @@ class DirectusIntegration(FileIntegration):
         self.email: str = email
         self.password: str = password
         self.static_token: str = static_token
-        self.login()
+        self._token: str = None
+        self._login_lock = threading.Lock()
+
+    def connect(self):
+        with self._login_lock:
+            if self._token is None:
+                self.login()
 
     def login(self):
         if self.static_token:
@@ -42,7 +50,11 @@ class DirectusIntegration(FileIntegration):
             payload = {"email": self.email, "password": self.password}
             request_url = f"{self.url}/{endpoint}"
 
-            response = requests.post(request_url, json=payload)
+            response = requests.post(
+                request_url,
+                json=payload,
+                timeout=Config.CITRINEOS_DIRECTUS_REQUEST_TIMEOUT_SECONDS,
+            )
 
             response_payload = response.json().get("data")
             self._token = response_payload["access_token"]
@@ -51,6 +63,7 @@ class DirectusIntegration(FileIntegration):
                 response_payload["expires"] - REFRESH_TOKEN_REQUEST_BUFFER
             )  # in milliseconds
             timer = threading.Timer(expires / 1000, self.refresh_auth)
+            timer.daemon = True
             timer.start()
         except Exception as e:
             exception(
@@ -65,7 +78,11 @@ class DirectusIntegration(FileIntegration):
             payload = {"refresh_token": self.refresh_token, "mode": "json"}
 
             request_url = f"{self.url}/{endpoint}"
-            response = requests.post(request_url, json=payload)
+            response = requests.post(
+                request_url,
+                json=payload,
+                timeout=Config.CITRINEOS_DIRECTUS_REQUEST_TIMEOUT_SECONDS,
+            )
             response_payload = response.json().get("data")
 
             self._token = response_payload["access_token"]
@@ -74,6 +91,7 @@ class DirectusIntegration(FileIntegration):
                 response_payload["expires"] - REFRESH_TOKEN_REQUEST_BUFFER
             )  # in milliseconds
             timer = threading.Timer(expires / 1000, self.refresh_auth)
+            timer.daemon = True
             timer.start()
         except Exception as e:
             warning(
@@ -99,6 +117,7 @@ class DirectusIntegration(FileIntegration):
     def upload_file(
         self, file: BytesIO, mime_type: str, filename: str, filetitle: str
     ) -> str:
+        self.connect()
         data = {
             "filename_disk": filename,
             "filename_download": filename,
@@ -108,8 +127,14 @@ class DirectusIntegration(FileIntegration):
         }
         files = {"file": (filename, file, mime_type)}
         request_url = f"{self.url}/files"
-        response = requests.post(
-            request_url, data=data, files=files, auth=BearerAuth(self._token)
+        response = request_dependency(
+            DIRECTUS,
+            "POST",
+            request_url,
+            timeout=Config.CITRINEOS_DIRECTUS_REQUEST_TIMEOUT_SECONDS,
+            data=data,
+            files=files,
+            auth=BearerAuth(self._token),
         )
         response_payload = response.json().get("data")
         return f"{self.url}/assets/{response_payload['id']}"  # Query params could be added for image transformations, such as width/height
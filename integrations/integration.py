@@ -1,63 +1,94 @@
 from io import BytesIO
 from logging import error, info
-from typing import List, Tuple
+from typing import Any, Callable, List, Tuple, TypeVar
+from anyio import CapacityLimiter, to_thread
 from fastapi import FastAPI
 import requests
 import stripe
-from sqlalchemy.orm import Session
 
-from db.init_db import get_db, Checkout, Connector, Evse, Location, Operator
+from db.init_db import db_session, Checkout, Connector, Evse, Location, Operator
+from utils.metrics import PAYMENT_CAPTURES
+from utils.stripe_client import stripe_call
 from utils.utils import generate_pricing
 
+T = TypeVar("T")
+
 
 class OcppIntegration:
+    # Set by the event consumer, None runs handlers in the shared threadpool
+    handler_limiter: CapacityLimiter | None = None
+
     def __init__(self) -> None:
         pass
 
     async def receive_events(self, app: FastAPI = None) -> None:
         pass
 
+    async def run_handler_sync(self, func: Callable[..., T], *args: Any) -> T:
+        """
+        Runs the blocking part of an event handler in a worker thread.
+
+        The consumer gives handlers a limiter of their own, sized to its workers, so
+        they do not wait for threads behind sync API routes when the consumer is
+        embedded in the web app.
+        """
+        return await to_thread.run_sync(func, *args, limiter=self.handler_limiter)
+
     async def capture_payment_transaction(
         self, app: FastAPI = None, checkout_id: int = None
     ) -> None:
         """Capture the payment transaction for the given checkout_id."""
-        db: Session = next(get_db())
-        db_checkout = db.query(Checkout).filter(Checkout.id == checkout_id).first()
-        if db_checkout is None:
-            error(
-                f" [integrations] CAPTURE ERROR - Could not find Checkout: {checkout_id}"
-            )
-            return
-
-        db_operator: Operator = (
-            db.query(Operator)
-            .filter(
-                Connector.id == db_checkout.connector_id,
+        await self.run_handler_sync(self._capture_payment_transaction, checkout_id)
+
+    def _capture_payment_transaction(self, checkout_id: int) -> None:
+        with db_session() as db:
+            db_checkout = db.query(Checkout).filter(Checkout.id == checkout_id).first()
+            if db_checkout is None:
+                error(
+                    f" [integrations] CAPTURE ERROR - Could not find Checkout: {checkout_id}"
+                )
+                return
+
+            db_operator: Operator = (
+                db.query(Operator)
+                .filter(
+                    Connector.id == db_checkout.connector_id,
+                )
+                .filter(
+                    Evse.id == Connector.evse_id,
+                )
+                .filter(
+                    Location.id == Evse.location_id,
+                )
+                .first()
             )
-            .filter(
-                Evse.id == Connector.evse_id,
-            )
-            .filter(
-                Location.id == Evse.location_id,
-            )
-            .first()
-        )
+            payment_intent_id = db_checkout.payment_intent_id
+            stripe_account_id = db_operator.stripe_account_id
 
+        # The session is closed before calling Stripe, so a slow Stripe does not hold
+        # a database connection
         pricing = generate_pricing(checkout_id=checkout_id)
 
-        suc_intent = stripe.PaymentIntent.capture(
-            intent=db_checkout.payment_intent_id,
-            stripe_account=db_operator.stripe_account_id,
-            amount_to_capture=pricing.total_costs_gross,
-        )
+        try:
+            with stripe_call():
+                suc_intent = stripe.PaymentIntent.capture(
+                    intent=payment_intent_id,
+                    stripe_account=stripe_account_id,
+                    amount_to_capture=pricing.total_costs_gross,
+                )
+        except Exception:
+            PAYMENT_CAPTURES.labels("error").inc()
+            raise
 
         if suc_intent.status != "succeeded":
+            PAYMENT_CAPTURES.labels("failed").inc()
             error(
-                f"CAPTURE ERROR - Could not capture the costs for Checkout: {db_checkout.id}"
+                f"CAPTURE ERROR - Could not capture the costs for Checkout: {checkout_id}"
             )
             return
 
-        info(f"CAPTURE SUCCESS - Captured the costs for Checkout: {db_checkout.id}")
+        PAYMENT_CAPTURES.labels("succeeded").inc()
+        info(f"CAPTURE SUCCESS - Captured the costs for Checkout: {checkout_id}")
         return
 
     """
@@ -73,7 +104,7 @@ class OcppIntegration:
         obj: an Authorization object or None if an error occurred.
     """
 
-    async def create_authorization(
+    def create_authorization(
         self,
         idToken: str,
         idTokenType: str,
@@ -92,6 +123,15 @@ class FileIntegration:
     def __init__(self) -> None:
         pass
 
+    """
+    Connects to the file storage, unless already connected.
+
+    Called before the first upload, or during startup to connect early.
+    """
+
+    def connect(self) -> None:
+        pass
+
     """
     Uploads a file to FileIntegration.
     
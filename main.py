@@ -1,107 +1,177 @@
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from api.api import api_router
-from asyncio import get_event_loop
-from config import Config
-from fastapi import APIRouter, FastAPI, Request
+import time
+from asyncio import Event, create_task, gather, to_thread
+from contextlib import asynccontextmanager
+from functools import partial
+from logging import basicConfig, info, warning
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from logging import basicConfig
-from integrations.directus.directus import DirectusIntegration
-from integrations.citrineos.citrineos import CitrineOSIntegration
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from uvicorn import run
-import stripe
 
+from api.api import api_router, circuit_open_handler
+from api.endpoints.webhooks import process_stripe_event
+from config import Config
 from db.init_db import init_db
+from integrations.citrineos.citrineos import CitrineOSIntegration
+from integrations.directus.directus import DirectusIntegration
 from integrations.integration import FileIntegration, OcppIntegration
+from utils.circuit_breaker import CircuitOpenError
+from utils.frontend import FrontendIndex, FrontendStaticFiles
+from utils.metrics import CONTENT_TYPE, RequestMetricsMiddleware, render_metrics
+from utils.profiling import EventLoopLagMonitor, install_profile_signal_handler
+from utils.readiness import check_readiness
+from utils.stripe_client import configure_stripe
+from utils.tracing import TracingMiddleware, configure_tracing
+from utils.webhook_inbox import WebhookInbox
 
 basicConfig(format=Config.LOG_FORMAT, level=Config.LOG_LEVEL)
 
-""" Create the Fast API web app and define cors. API router used to attach root path from Config. """
-app = FastAPI(
-    title=Config.OPENAPI_TITLE,
-)
-router = APIRouter()
-
-origins = [
-    "*",
-]
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-""" On startup of the web app also start the event consumer and set stripe api key """
-stripe.api_key = Config.STRIPE_API_KEY
-
-file_integration: FileIntegration = DirectusIntegration(
-    Config.CITRINEOS_DIRECTUS_URL,
-    Config.CITRINEOS_DIRECTUS_LOGIN_EMAIL,
-    Config.CITRINEOS_DIRECTUS_LOGIN_PASSWORD,
-)
-ocpp_integration: OcppIntegration = CitrineOSIntegration(file_integration)
-app.ocpp_integration = ocpp_integration
-
 
-@app.on_event("startup")
-async def startup_event():
-    loop = get_event_loop()
-    loop.create_task(coro=ocpp_integration.receive_events())
+def create_app(frontend_directory: str = "frontend/build") -> FastAPI:
+    """
+    Creates the web app and defines cors, without connecting to any service.
 
+    The database schema is created and Directus is logged into in the lifespan
+    handler, when a server starts the app, so importing this module and creating
+    the app stay fast and work while those services are down.
+    """
+    app = FastAPI(
+        title=Config.OPENAPI_TITLE,
+        lifespan=lifespan,
+    )
 
-""" Add the API router to the web app """
-app.include_router(
-    api_router,
-    prefix=Config.WEBSERVER_PATH,
-)
-
-
-""" Add a health check route """
-
+    origins = [
+        "*",
+    ]
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.add_middleware(RequestMetricsMiddleware)
+    app.add_middleware(TracingMiddleware)
 
-@app.get("/health_check")
-async def health_check():
-    return {"status": "healthy"}
+    configure_stripe()
 
+    """ Integrations connect on first use, Directus logs in on the first upload """
+    file_integration: FileIntegration = DirectusIntegration(
+        Config.CITRINEOS_DIRECTUS_URL,
+        Config.CITRINEOS_DIRECTUS_LOGIN_EMAIL,
+        Config.CITRINEOS_DIRECTUS_LOGIN_PASSWORD,
+    )
+    ocpp_integration: OcppIntegration = CitrineOSIntegration(file_integration)
+    app.file_integration = file_integration
+    app.ocpp_integration = ocpp_integration
 
-""" Add the frontend web app """
-templates = Jinja2Templates(directory="frontend/build")
-frontend_routes = ["/", "/checkout/{evse_id}", "/charging/{evse_id}/{checkout_id}"]
+    app.webhook_inbox = WebhookInbox(
+        handler=partial(process_stripe_event, ocpp_integration=ocpp_integration),
+    )
 
+    app.event_consumer_stop = Event()
+    app.event_consumer_task = None
+    app.event_loop_lag_monitor = EventLoopLagMonitor()
 
-async def serve_frontend(
-    request: Request,
-):
-    return templates.TemplateResponse(
-        "index.html",
-        {
-            "request": request,
-            "CLIENT_API_URL": Config.CLIENT_URL + "/api",
-        },
+    """ Add the API router to the web app """
+    app.include_router(
+        api_router,
+        prefix=Config.WEBSERVER_PATH,
     )
+    app.add_exception_handler(CircuitOpenError, circuit_open_handler)
+
+    """ Add a health check route """
+
+    @app.get("/health_check")
+    async def health_check():
+        return {"status": "healthy"}
+
+    @app.get("/ready")
+    async def ready():
+        """Whether the database, broker and cache can be reached, for load balancers"""
+        is_ready, checks = await check_readiness(app.event_consumer_task)
+        return JSONResponse(
+            {"status": "ready" if is_ready else "not_ready", "checks": checks},
+            status_code=200 if is_ready else 503,
+        )
+
+    @app.get("/metrics")
+    def metrics():
+        # Runs in the threadpool, in multiprocess mode it reads a file per process
+        return Response(content=render_metrics(), media_type=CONTENT_TYPE)
+
+    """ Add the frontend web app """
+    index = FrontendIndex(
+        frontend_directory, {"CLIENT_API_URL": Config.CLIENT_URL + "/api"}
+    )
+    frontend_routes = ["/", "/checkout/{evse_id}", "/charging/{evse_id}/{checkout_id}"]
+
+    async def serve_frontend(
+        request: Request,
+    ):
+        return index.response(request.headers)
+
+    for route in frontend_routes:
+        app.get(route, response_class=HTMLResponse)(serve_frontend)
+    app.mount(
+        "/",
+        FrontendStaticFiles(
+            directory=frontend_directory,
+        ),
+        name="frontend",
+    )
+    return app
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """On startup of the web app also start the event consumer"""
+    started = time.perf_counter()
+    configure_tracing()
+    # Directus is only needed for Scan and Charge, so startup does not wait for it
+    connect_task = create_task(connect_file_integration(app.file_integration))
+    await to_thread(init_db)
+
+    if Config.MESSAGE_BROKER_EMBEDDED_CONSUMER:
+        app.event_consumer_task = create_task(
+            app.ocpp_integration.receive_events(stop=app.event_consumer_stop)
+        )
+    await app.webhook_inbox.start()
+    if Config.EVENT_LOOP_LAG_THRESHOLD_MS > 0:
+        app.event_loop_lag_monitor.start()
+    install_profile_signal_handler()
+    info(" [Startup] Started in %dms", (time.perf_counter() - started) * 1000)
+
+    yield
+
+    connect_task.cancel()
+    if app.event_consumer_task is not None:
+        app.event_consumer_stop.set()
+        await gather(app.event_consumer_task, return_exceptions=True)
+    await app.webhook_inbox.stop()
+    app.event_loop_lag_monitor.stop()
+
+
+async def connect_file_integration(file_integration: FileIntegration) -> None:
+    if not Config.CITRINEOS_SCAN_AND_CHARGE:
+        return
+    try:
+        await to_thread(file_integration.connect)
+    except Exception:
+        warning(" [Startup] Could not connect to Directus, retrying on first upload")
 
 
-for route in frontend_routes:
-    app.get(route, response_class=HTMLResponse)(serve_frontend)
-app.mount(
-    "/",
-    StaticFiles(
-        directory="frontend/build",
-    ),
-    name="frontend",
-)
-
+def __getattr__(name: str):
+    # `uvicorn main:app` creates the app on first access instead of on import
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Check if DB is reachable
-# db = get_db()
-# db.execute(text("select (1)"))
-init_db()
 
 if __name__ == "__main__":
     try:
-        run(app, host=Config.WEBSERVER_HOST, port=Config.WEBSERVER_PORT)
+        run(create_app(), host=Config.WEBSERVER_HOST, port=Config.WEBSERVER_PORT)
     except Exception as e:
         # logger.error(e)
         raise e
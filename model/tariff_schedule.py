@@ -0,0 +1,322 @@
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from functools import lru_cache
+from typing import Iterator, NamedTuple, Sequence
+from zoneinfo import ZoneInfo
+
+ENERGY = "energy"
+TIME = "time"
+IDLE = "idle"
+DAYS_OF_WEEK = (
+    "MONDAY",
+    "TUESDAY",
+    "WEDNESDAY",
+    "THURSDAY",
+    "FRIDAY",
+    "SATURDAY",
+    "SUNDAY",
+)
+MINUTES_IN_DAY = 24 * 60
+MINUTES_IN_WEEK = 7 * MINUTES_IN_DAY
+
+
+class RateElement(NamedTuple):
+    """
+    A price of a tariff with the restrictions under which it applies.
+
+    `price` is per kWh for the energy dimension and per minute for time and idle.
+    `start_minute` and `end_minute` are minutes of the day in the tariff's time
+    zone, the window wraps past midnight if the end is before the start.
+    `days_of_week` is a comma separated list of DAYS_OF_WEEK. `min_kwh` and
+    `max_kwh` bound the energy charged in the session so far, for tiers. Idle
+    minutes are charged after `grace_minutes` without energy being delivered.
+    """
+
+    dimension: str
+    price: float
+    start_minute: int | None = None
+    end_minute: int | None = None
+    days_of_week: str | None = None
+    min_kwh: float | None = None
+    max_kwh: float | None = None
+    grace_minutes: int | None = None
+
+    def applies_at(self, minute_of_week: int) -> bool:
+        day, minute = divmod(minute_of_week, MINUTES_IN_DAY)
+        if self.days_of_week is not None and DAYS_OF_WEEK[
+            day
+        ] not in self.days_of_week.split(","):
+            return False
+        if self.start_minute is None or self.end_minute is None:
+            return True
+        if self.start_minute <= self.end_minute:
+            return self.start_minute <= minute < self.end_minute
+        return minute >= self.start_minute or minute < self.end_minute
+
+
+class Rates(NamedTuple):
+    """The prices applying in a period of the week."""
+
+    # (from_kwh, price_kwh) by ascending kWh charged in the session so far
+    energy_tiers: tuple[tuple[float, float], ...]
+    price_minute: float
+    idle_price_minute: float
+    idle_grace_minutes: float
+
+    def energy_costs(self, charged_kwh: float, kwh: float) -> float:
+        """Returns the costs of `kwh` more after `charged_kwh`, split at the tiers."""
+        tiers = self.energy_tiers
+        index = bisect_right(tiers, (charged_kwh, float("inf"))) - 1
+        costs = 0.0
+        while kwh > 0:
+            tier_end = tiers[index + 1][0] if index + 1 < len(tiers) else float("inf")
+            in_tier = min(kwh, tier_end - charged_kwh)
+            costs += in_tier * tiers[index][1]
+            charged_kwh += in_tier
+            kwh -= in_tier
+            index += 1
+        return costs
+
+
+class SessionCosts(NamedTuple):
+    energy: Decimal
+    time: Decimal
+    idle: Decimal
+    idle_minutes: Decimal
+
+
+class RateSchedule:
+    """
+    The prices of a tariff over a week, compiled from its rate elements.
+
+    The week is split at every minute a restriction starts or ends, each period
+    holds the prices applying in it. Pricing a session walks its meter readings
+    and the periods it crosses once, so its cost grows with their number, not with
+    the number of elements.
+    """
+
+    def __init__(
+        self,
+        boundaries: list[int],
+        rates: list[Rates],
+        time_zone: str = "UTC",
+    ):
+        self.boundaries = boundaries
+        self.rates = rates
+        self.time_zone = ZoneInfo(time_zone)
+
+    def periods(
+        self, start: datetime, end: datetime
+    ) -> Iterator[tuple[datetime, datetime, Rates]]:
+        """Splits `start` to `end` at the period boundaries, with the rates of each."""
+        moment = start
+        while moment < end:
+            local = moment.astimezone(self.time_zone).replace(tzinfo=None)
+            week_start = datetime(local.year, local.month, local.day) - timedelta(
+                days=local.weekday()
+            )
+            offset = (local - week_start) / timedelta(minutes=1)
+            index = bisect_right(self.boundaries, offset) - 1
+            next_boundary = (
+                self.boundaries[index + 1]
+                if index + 1 < len(self.boundaries)
+                else MINUTES_IN_WEEK
+            )
+            period_end = (
+                (week_start + timedelta(minutes=next_boundary))
+                .replace(tzinfo=self.time_zone)
+                .astimezone(timezone.utc)
+            )
+            # A boundary skipped when daylight saving time starts ends its period
+            # as many minutes after the skip as it is after the skipped time. One
+            # in the hour repeated when it ends was passed in its first occurrence.
+            if period_end <= moment:
+                period_end = moment + timedelta(minutes=next_boundary - offset)
+            period_end = min(period_end, end)
+            yield moment, period_end, self.rates[index]
+            moment = period_end
+
+    def rates_at(self, moment: datetime) -> Rates:
+        local = moment.astimezone(self.time_zone)
+        offset = local.weekday() * MINUTES_IN_DAY + local.hour * 60 + local.minute
+        return self.rates[bisect_right(self.boundaries, offset) - 1]
+
+    def price_session(
+        self,
+        start_time: datetime | None,
+        end_time: datetime,
+        kwh: float,
+        meter_readings: Sequence[tuple[datetime, float]] = (),
+        ended: bool = True,
+    ) -> SessionCosts:
+        """
+        Prices a session from its start and end and the energy charged in it.
+
+        `meter_readings` are the times and the kWh charged in the session so far,
+        in order. Energy between two readings is spread evenly over the time between
+        them, without readings over the whole session. Minutes between two readings
+        without energy delivered are idle. So are the minutes after the last reading
+        once the session `ended` without more energy delivered. In a running
+        session they are only idle if the last reading already showed no increase,
+        the next reading may still bring energy. Time is charged for the whole
+        session, idle minutes past the grace period are charged on top.
+        """
+        end_time = as_utc(end_time)
+        start_time = as_utc(start_time) if start_time is not None else end_time
+        start, end = start_time.timestamp(), end_time.timestamp()
+        points = [(start, 0.0, False)]
+        points.extend(
+            (sampled_at, reading, True)
+            for sampled_at, reading in (
+                (as_utc(sampled_at).timestamp(), reading)
+                for sampled_at, reading in meter_readings
+                if reading is not None
+            )
+            if start <= sampled_at <= end
+        )
+        points.append((end, max(kwh or 0.0, points[-1][1]), False))
+
+        # Readings and periods are walked together, a period is only looked up
+        # when a reading passes the end of the previous one
+        periods = self.periods(start_time, end_time)
+        rates = self.rates_at(start_time)
+        period_end = start
+        energy = time = idle = idle_minutes = 0.0
+        idle_elapsed = 0.0
+        charged_kwh = 0.0
+        for (from_time, from_kwh, from_reading), (to_time, to_kwh, to_reading) in zip(
+            points, points[1:]
+        ):
+            delivered = max(to_kwh - from_kwh, 0.0)
+            seconds = to_time - from_time
+            if seconds <= 0:
+                energy += rates.energy_costs(charged_kwh, delivered)
+                charged_kwh += delivered
+                continue
+            is_idle = (
+                delivered == 0
+                and from_reading
+                and (to_reading or ended or idle_elapsed > 0)
+            )
+            if not is_idle:
+                idle_elapsed = 0.0
+            moment = from_time
+            while moment < to_time:
+                if moment >= period_end:
+                    _, next_period_end, rates = next(periods)
+                    period_end = next_period_end.timestamp()
+                segment_end = min(to_time, period_end)
+                minutes = (segment_end - moment) / 60
+                time += minutes * rates.price_minute
+                if is_idle:
+                    billable = max(
+                        0.0,
+                        idle_elapsed
+                        + minutes
+                        - max(idle_elapsed, rates.idle_grace_minutes),
+                    )
+                    idle += billable * rates.idle_price_minute
+                    idle_minutes += billable
+                    idle_elapsed += minutes
+                elif delivered:
+                    segment_kwh = delivered * (segment_end - moment) / seconds
+                    energy += rates.energy_costs(charged_kwh, segment_kwh)
+                    charged_kwh += segment_kwh
+                moment = segment_end
+
+        return SessionCosts(
+            energy=Decimal.from_float(energy),
+            time=Decimal.from_float(time),
+            idle=Decimal.from_float(idle),
+            idle_minutes=Decimal.from_float(idle_minutes),
+        )
+
+
+def as_utc(moment: datetime) -> datetime:
+    # SQLite drops the timezone of stored datetimes, which are in UTC
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+@lru_cache(maxsize=1024)
+def compile_rate_schedule(
+    elements: tuple[RateElement, ...],
+    price_kwh: float | None = None,
+    price_minute: float | None = None,
+    time_zone: str = "UTC",
+) -> RateSchedule:
+    """
+    Compiles the rate elements of a tariff into a weekly schedule.
+
+    The first element of a dimension applying at a time and to the energy charged
+    so far sets the price, the flat `price_kwh` and `price_minute` of the tariff
+    apply where none does. Schedules are cached by their elements and prices, so
+    each tariff is compiled once per process and again after it changed.
+    """
+    boundaries = {0}
+    for element in elements:
+        for day in range(7):
+            if element.days_of_week is not None:
+                boundaries.add(day * MINUTES_IN_DAY)
+            if element.start_minute is not None and element.end_minute is not None:
+                boundaries.add(day * MINUTES_IN_DAY + element.start_minute)
+                boundaries.add(day * MINUTES_IN_DAY + element.end_minute)
+    boundaries.discard(MINUTES_IN_WEEK)
+
+    compiled_boundaries: list[int] = []
+    compiled_rates: list[Rates] = []
+    for boundary in sorted(boundaries):
+        applying = [element for element in elements if element.applies_at(boundary)]
+        rates = Rates(
+            energy_tiers=energy_tiers(
+                [element for element in applying if element.dimension == ENERGY],
+                price_kwh or 0.0,
+            ),
+            price_minute=next(
+                (element.price for element in applying if element.dimension == TIME),
+                price_minute or 0.0,
+            ),
+            idle_price_minute=next(
+                (element.price for element in applying if element.dimension == IDLE),
+                0.0,
+            ),
+            idle_grace_minutes=next(
+                (
+                    element.grace_minutes or 0
+                    for element in applying
+                    if element.dimension == IDLE
+                ),
+                0,
+            ),
+        )
+        # Neighbouring periods with the same prices are one period
+        if not compiled_rates or compiled_rates[-1] != rates:
+            compiled_boundaries.append(boundary)
+            compiled_rates.append(rates)
+    return RateSchedule(compiled_boundaries, compiled_rates, time_zone)
+
+
+def energy_tiers(
+    elements: list[RateElement], flat_price: float
+) -> tuple[tuple[float, float], ...]:
+    thresholds = {0.0}
+    for element in elements:
+        thresholds.update(
+            kwh for kwh in (element.min_kwh, element.max_kwh) if kwh is not None
+        )
+    tiers: list[tuple[float, float]] = []
+    for threshold in sorted(thresholds):
+        price = next(
+            (
+                element.price
+                for element in elements
+                if (element.min_kwh is None or element.min_kwh <= threshold)
+                and (element.max_kwh is None or threshold < element.max_kwh)
+            ),
+            flat_price,
+        )
+        if not tiers or tiers[-1][1] != price:
+            tiers.append((threshold, price))
+    return tuple(tiers)
@@ -1,6 +1,10 @@
 from moneyed import Money
 from datetime import datetime, timezone
 from decimal import Decimal
+from functools import cached_property
+from typing import Sequence
+
+from model.tariff_schedule import RateSchedule, SessionCosts
 
 
 ZERO = Decimal("0")
@@ -8,6 +12,15 @@ HUNDRED = Decimal("100")
 SECONDS_IN_MINUTE = Decimal("60")
 
 
+def current_time_for(start_time: datetime) -> datetime:
+    """Returns the current time, without timezone if `start_time` has none."""
+    now = datetime.now(timezone.utc)
+    # SQLite drops the timezone of stored datetimes, which are in UTC
+    if start_time.tzinfo is None:
+        now = now.replace(tzinfo=None)
+    return now
+
+
 class TransactionSummary:
     def __init__(
         self,
@@ -20,10 +33,15 @@ class TransactionSummary:
         price_kwh: float,
         price_minute: float,
         price_session: float,
+        rate_schedule: RateSchedule | None = None,
+        meter_readings: Sequence[tuple[datetime, float]] = (),
+        now: datetime | None = None,
     ):
         self.kwh = kwh
         self.start_time = start_time
         self.end_time = end_time
+        # The time a running session is priced at, the current time if not given
+        self.now = now
 
         self.currency = currency
         self.tax_rate = tax_rate
@@ -32,29 +50,56 @@ class TransactionSummary:
         self.price_kwh = price_kwh
         self.price_minute = price_minute
         self.price_session = price_session
+        # Prices the energy, time and idle minutes instead of the flat prices
+        self.rate_schedule = rate_schedule
+        self.meter_readings = meter_readings
+
+    # Costs are computed once per summary, the totals read them many times. The time
+    # of a running session is taken on first use, so all costs of a summary are for
+    # the same point in time.
+    @cached_property
+    def schedule_costs(self) -> SessionCosts | None:
+        if self.rate_schedule is None:
+            return None
+        session_end_time = self.end_time or self.now
+        if session_end_time is None:
+            session_end_time = current_time_for(
+                self.start_time or datetime.now(timezone.utc)
+            )
+        return self.rate_schedule.price_session(
+            self.start_time,
+            session_end_time,
+            self.kwh,
+            self.meter_readings,
+            ended=self.end_time is not None,
+        )
 
-    @property
+    @cached_property
     def energy_costs(self) -> Money | None:
+        if self.schedule_costs is not None:
+            return Money(amount=self.schedule_costs.energy, currency=self.currency)
         if self.kwh is not None and self.price_kwh is not None:
             return Money(amount=self.price_kwh, currency=self.currency) * self.kwh
         else:
             return None
 
-    @property
+    @cached_property
     def time_consumption_min(self) -> Decimal:
         if self.start_time is None:
             return ZERO
 
-        session_end_time = (
-            self.end_time if self.end_time is not None else datetime.now(timezone.utc)
-        )
+        session_end_time = self.end_time or self.now
+        if session_end_time is None:
+            session_end_time = current_time_for(self.start_time)
         return (
             Decimal.from_float((session_end_time - self.start_time).total_seconds())
             / SECONDS_IN_MINUTE
         )
 
-    @property
+    @cached_property
     def time_costs(self) -> Money | None:
+        if self.schedule_costs is not None:
+            return Money(amount=self.schedule_costs.time, currency=self.currency)
         if self.time_consumption_min is not None and self.price_minute is not None:
             return (
                 Money(amount=self.price_minute, currency=self.currency)
@@ -63,11 +108,23 @@ class TransactionSummary:
         else:
             return None
 
+    @property
+    def idle_consumption_min(self) -> Decimal | None:
+        if self.schedule_costs is None:
+            return None
+        return self.schedule_costs.idle_minutes
+
+    @cached_property
+    def idle_costs(self) -> Money | None:
+        if self.schedule_costs is None:
+            return None
+        return Money(amount=self.schedule_costs.idle, currency=self.currency)
+
     @property
     def session_consumption(self) -> int:
         return 1
 
-    @property
+    @cached_property
     def session_costs(self) -> Money | None:
         if self.price_session is not None:
             return Money(amount=self.price_session, currency=self.currency)
@@ -78,13 +135,15 @@ class TransactionSummary:
     def payment_costs_tax_rate(self) -> int:
         return 0  # currently 0. needed for reverse charge scenarios
 
-    @property
+    @cached_property
     def total_costs_net(self) -> Money:
         result = Money(amount="0", currency=self.currency)
         if self.energy_costs is not None:
             result += self.energy_costs
         if self.time_costs is not None:
             result += self.time_costs
+        if self.idle_costs is not None:
+            result += self.idle_costs
         if self.session_costs is not None:
             result += self.session_costs
         return result
@@ -30,6 +30,8 @@ class Pricing(BaseModel):
     energy_costs: int | None = None
     time_consumption_min: float | None = None
     time_costs: int | None = None
+    idle_consumption_min: float | None = None
+    idle_costs: int | None = None
     session_consumption: int | None = None
     session_costs: int | None = None
     payment_costs_tax_rate: int = 0  # Used for tax reverse charge scenarios
@@ -53,4 +55,4 @@ class Checkout(CheckoutBase):
     transaction_kwh: float | None
     power_active_import: float | None
     transaction_soc: float | None
-    pricing: Pricing | None
+    pricing: Pricing | None = None
@@ -1,6 +1,19 @@
 from pydantic import BaseModel, ConfigDict
 
 
+class TariffElement(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    dimension: str
+    price: float
+    start_minute: int | None
+    end_minute: int | None
+    days_of_week: str | None
+    min_kwh: float | None
+    max_kwh: float | None
+    grace_minutes: int | None
+
+
 class TariffBase(BaseModel):
     id: int
     price_kwh: float | None
@@ -9,6 +22,7 @@ class TariffBase(BaseModel):
     currency: str
     tax_rate: float
     authorization_amount: float
+    elements: list[TariffElement] = []
     # Add other fields as needed
 
 
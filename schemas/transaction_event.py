@@ -1,5 +1,6 @@
 from datetime import datetime
 from enum import Enum
+from typing import Any
 from pydantic import BaseModel
 
 
@@ -126,7 +127,9 @@ class TransactionEventRequest(BaseModel):
     eventType: TransactionEventEnumType
     timestamp: datetime
     triggerReason: TriggerReasonEnumType
+    seqNo: int | None = None
     transactionInfo: TransactionType
     idToken: IdTokenType | None = None
     evse: OcppEvseType | None = None
-    meterValue: list[MeterValueType] | None = None
+    # Raw list of MeterValueType, read by utils.meter_values.extract_meter_readings
+    meterValue: list[Any] | None = None
@@ -0,0 +1,134 @@
+"""
+Multi-process server.
+
+Runs WEBSERVER_WORKERS web worker processes and a single CitrineOS event
+consumer process next to them:
+
+    python server.py
+
+The web workers do not consume events, so each event is processed once however
+many workers serve the API. The consumer is restarted if it exits unexpectedly,
+and drained when the server shuts down.
+
+The consumer drops EVSEs and checkouts it changes from the caches, which only
+reaches the web workers through a cache shared by all processes. Without
+CACHE_URL, a single web worker is run with the consumer embedded in it instead.
+
+With PROMETHEUS_MULTIPROC_DIR set, /metrics of any web worker covers all
+processes. The values of earlier runs are removed from it on start.
+"""
+
+import os
+import subprocess
+import sys
+import threading
+from logging import basicConfig, error, info, warning
+
+import uvicorn
+
+from config import Config
+from utils.cache import cache_backend
+from utils.metrics import MULTIPROCESS, clear_multiprocess_metrics, mark_process_dead
+
+CONSUMER_COMMAND = [sys.executable, "-m", "integrations.citrineos.consumer"]
+CONSUMER_RESTART_DELAY_SECONDS = 5
+
+
+class ConsumerSupervisor:
+    """Runs the standalone event consumer in a child process and restarts it."""
+
+    def __init__(
+        self,
+        command: list[str] = CONSUMER_COMMAND,
+        restart_delay: float = CONSUMER_RESTART_DELAY_SECONDS,
+    ):
+        self.command = command
+        self.restart_delay = restart_delay
+        self.process: subprocess.Popen | None = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._supervise, name="consumer-supervisor", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Lets the consumer drain its events in progress, killing it if it hangs."""
+        with self._lock:
+            self._stopping.set()
+            process = self.process
+        if process is not None and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=Config.MESSAGE_BROKER_CONSUMER_DRAIN_TIMEOUT + 5)
+            except subprocess.TimeoutExpired:
+                warning(" [Server] Event consumer did not stop in time, killing it")
+                process.kill()
+                process.wait()
+        self._thread.join()
+
+    def _supervise(self) -> None:
+        while True:
+            with self._lock:
+                if self._stopping.is_set():
+                    break
+                info(" [Server] Starting event consumer")
+                # Its own session, so a Ctrl+C in the terminal reaches it only
+                # through stop() and it does not stop draining half way
+                self.process = subprocess.Popen(self.command, start_new_session=True)
+            return_code = self.process.wait()
+            mark_process_dead(self.process.pid)
+            if self._stopping.is_set():
+                break
+            warning(
+                " [Server] Event consumer exited with %d, restarting in %ss",
+                return_code,
+                self.restart_delay,
+            )
+            self._stopping.wait(self.restart_delay)
+
+
+def main() -> None:
+    basicConfig(format=Config.LOG_FORMAT, level=Config.LOG_LEVEL)
+    if not cache_backend().shared:
+        if Config.WEBSERVER_WORKERS > 1:
+            error(
+                " [Server] WEBSERVER_WORKERS=%d requires a cache shared by all "
+                "processes, set CACHE_URL",
+                Config.WEBSERVER_WORKERS,
+            )
+            raise SystemExit(1)
+        info(" [Server] No shared cache, consuming events in the web process")
+        uvicorn.run("main:app", host=Config.WEBSERVER_HOST, port=Config.WEBSERVER_PORT)
+        return
+
+    # Inherited by the web workers, which import the config again. A single worker
+    # runs in this process, which already did.
+    os.environ["MESSAGE_BROKER_EMBEDDED_CONSUMER"] = "false"
+    Config.MESSAGE_BROKER_EMBEDDED_CONSUMER = False
+
+    if MULTIPROCESS:
+        clear_multiprocess_metrics()
+    else:
+        info(
+            " [Server] /metrics covers a single process, set PROMETHEUS_MULTIPROC_DIR "
+            "to collect the metrics of all workers and the consumer"
+        )
+
+    consumer = ConsumerSupervisor()
+    consumer.start()
+    try:
+        uvicorn.run(
+            "main:app",
+            host=Config.WEBSERVER_HOST,
+            port=Config.WEBSERVER_PORT,
+            workers=Config.WEBSERVER_WORKERS,
+        )
+    finally:
+        consumer.stop()
+
+
+if __name__ == "__main__":
+    main()
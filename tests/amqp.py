@@ -0,0 +1,189 @@
+import asyncio
+import json
+import os
+
+os.environ.setdefault("CONFIG_PATH", ".env.test")
+
+from pamqp import commands, frame
+
+from integrations.citrineos.retry import EventRetryRouter
+
+
+class FakeChannel:
+    """
+    Settles delivery tags the way a broker channel does.
+
+    Every ack, nack and reject is marshalled into an AMQP frame and written to
+    /dev/null, so per-frame cost is paid like on a real connection.
+    """
+
+    def __init__(self):
+        self.unsettled: dict[int, FakeMessage] = {}
+        self.next_delivery_tag = 1
+        self.frames = 0
+        self.declared_queues: dict[str, dict | None] = {}
+        self.queues: dict[str, FakeQueue] = {}
+        self._sink = os.open(os.devnull, os.O_WRONLY)
+
+    async def declare_queue(
+        self, name: str, durable: bool = False, arguments=None, passive: bool = False
+    ):
+        if passive:
+            queue = self.queues[name]
+            queue.declaration_result = commands.Queue.DeclareOk(
+                name, message_count=len(queue.ready)
+            )
+            return queue
+        self.declared_queues[name] = arguments
+        return FakeQueue(self, name)
+
+    def deliver(self, message: "FakeMessage") -> None:
+        message.channel = self
+        message.delivery_tag = self.next_delivery_tag
+        self.next_delivery_tag += 1
+        self.unsettled[message.delivery_tag] = message
+
+    async def basic_ack(self, delivery_tag: int, multiple: bool = False) -> None:
+        self._write(commands.Basic.Ack(delivery_tag=delivery_tag, multiple=multiple))
+        for message in self._settle(delivery_tag, multiple):
+            message.acked = True
+
+    async def basic_nack(
+        self, delivery_tag: int, multiple: bool = False, requeue: bool = True
+    ) -> None:
+        self._write(
+            commands.Basic.Nack(
+                delivery_tag=delivery_tag, multiple=multiple, requeue=requeue
+            )
+        )
+        for message in self._settle(delivery_tag, multiple):
+            message.requeued = requeue
+            message.rejected = not requeue
+
+    async def basic_reject(self, delivery_tag: int, requeue: bool = False) -> None:
+        self._write(commands.Basic.Reject(delivery_tag=delivery_tag, requeue=requeue))
+        for message in self._settle(delivery_tag, False):
+            message.requeued = requeue
+            message.rejected = not requeue
+
+    def close(self) -> None:
+        os.close(self._sink)
+
+    def _write(self, command) -> None:
+        self.frames += 1
+        os.write(self._sink, frame.marshal(command, 1))
+
+    def _settle(self, delivery_tag: int, multiple: bool) -> list["FakeMessage"]:
+        if delivery_tag not in self.unsettled:
+            raise AssertionError(f"Delivery tag {delivery_tag} is already settled")
+        tags = (
+            [tag for tag in self.unsettled if tag <= delivery_tag]
+            if multiple
+            else [delivery_tag]
+        )
+        return [self.unsettled.pop(tag) for tag in tags]
+
+
+class FakeMessage:
+    """Stands in for aio_pika's IncomingMessage and records how it was settled."""
+
+    def __init__(self, body: dict | bytes, headers: dict | None = None):
+        self.body = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.headers = headers or {}
+        self.content_type = "application/json"
+        self.message_id = None
+        self.channel: FakeChannel | None = None
+        self.delivery_tag: int | None = None
+        self.acked = False
+        self.requeued = False
+        self.rejected = False
+
+    async def ack(self, multiple: bool = False):
+        await self.channel.basic_ack(self.delivery_tag, multiple=multiple)
+
+    async def nack(self, multiple: bool = False, requeue: bool = True):
+        await self.channel.basic_nack(
+            self.delivery_tag, multiple=multiple, requeue=requeue
+        )
+
+    async def reject(self, requeue: bool = False):
+        await self.channel.basic_reject(self.delivery_tag, requeue=requeue)
+
+
+class FakeQueue:
+    """
+    Delivers published messages to the registered consumer callback.
+
+    Messages published while no consumer is registered wait in `ready` until one is.
+    """
+
+    def __init__(
+        self, channel: FakeChannel | None = None, name: str = "paymentService"
+    ):
+        self.channel = channel or FakeChannel()
+        self.name = name
+        self.channel.queues[name] = self
+        self.callback = None
+        self.cancelled = False
+        self.ready: list[FakeMessage] = []
+
+    async def consume(self, callback):
+        self.callback = callback
+        while self.ready and self.callback is not None:
+            await self.publish(self.ready.pop(0))
+        return "consumer-1"
+
+    async def cancel(self, consumer_tag):
+        self.cancelled = True
+        self.callback = None
+
+    async def publish(self, message: FakeMessage):
+        if self.callback is None:
+            self.ready.append(message)
+            return
+        self.channel.deliver(message)
+        await self.callback(message)
+
+    async def get(self, no_ack: bool = False, fail: bool = True):
+        if not self.ready:
+            return None
+        message = self.ready.pop(0)
+        self.channel.deliver(message)
+        return message
+
+
+class FakeExchange:
+    """Records published messages by routing key."""
+
+    def __init__(self):
+        self.published: list[tuple[str, object]] = []
+
+    async def publish(self, message, routing_key: str):
+        self.published.append((routing_key, message))
+
+
+class FakeConnection:
+    def __init__(self, channel: FakeChannel):
+        self.channel = channel
+        self.closed = False
+
+    async def close(self):
+        self.channel.close()
+        self.closed = True
+
+
+def a_connected_queue():
+    """Returns what connect_event_queue returns, backed by fakes."""
+    queue = FakeQueue()
+    retry_router = EventRetryRouter(
+        FakeExchange(), queue_name="paymentService", retry_delays=[10, 100]
+    )
+    return FakeConnection(queue.channel), None, queue, retry_router
+
+
+async def wait_until(condition, timeout: float = 1) -> None:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("Condition not met in time")
+        await asyncio.sleep(0.001)
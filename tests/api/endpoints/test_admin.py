@@ -0,0 +1,41 @@
+import os
+import unittest
+from unittest.mock import patch
+
+os.environ.setdefault("CONFIG_PATH", ".env.test")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.endpoints import admin
+from api.endpoints.admin import router as admin_router
+
+
+class ProfileEndpointTests(unittest.TestCase):
+    def setUp(self):
+        app = FastAPI()
+        app.include_router(admin_router, prefix="/admin")
+        self.client = TestClient(app)
+
+    def create_profile(self, token: str | None = "secret"):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        return self.client.post("/admin/profile?seconds=0.05", headers=headers)
+
+    def test_disabled_without_admin_token(self):
+        with patch.object(admin.Config, "ADMIN_API_TOKEN", ""):
+            response = self.create_profile()
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_rejects_wrong_token(self):
+        with patch.object(admin.Config, "ADMIN_API_TOKEN", "secret"):
+            self.assertEqual(self.create_profile("wrong").status_code, 401)
+            self.assertEqual(self.create_profile(None).status_code, 401)
+
+    def test_returns_folded_stacks(self):
+        with patch.object(admin.Config, "ADMIN_API_TOKEN", "secret"):
+            response = self.create_profile()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("attachment", response.headers["Content-Disposition"])
+        self.assertRegex(response.text, r"MainThread;.* \d+\n")
@@ -0,0 +1,351 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from tests.database import add_charging_station, sqlite_sessionmaker
+
+from api.api import circuit_open_handler
+from api.endpoints.checkouts import get_request_hash, router as checkouts_router
+from db.init_db import Checkout, MeterSample, get_db
+from schemas.checkouts import CheckoutCreate
+from utils.cache import LocalCacheBackend, pricing_cache
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError, circuit_breakers
+from utils.dependency_stats import STRIPE
+from utils.live_pricing import LiveCheckout
+
+
+class CreateCheckoutTests(unittest.TestCase):
+    def setUp(self):
+        self.SessionLocal = sqlite_sessionmaker()
+        with self.SessionLocal() as db:
+            add_charging_station(db, evse_id="DE*ABC*E1")
+
+        app = FastAPI()
+        app.include_router(checkouts_router, prefix="/checkouts")
+        app.add_exception_handler(CircuitOpenError, circuit_open_handler)
+        app.dependency_overrides[get_db] = self.get_db
+        self.client = TestClient(app)
+
+        self.session_count = 0
+        stripe_patcher = patch(
+            "api.endpoints.checkouts.stripe.checkout.Session.create",
+            side_effect=self.create_stripe_session,
+        )
+        self.create_session_mock = stripe_patcher.start()
+        self.addCleanup(stripe_patcher.stop)
+
+    def get_db(self):
+        db = self.SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def create_stripe_session(self, **params):
+        self.session_count += 1
+        return SimpleNamespace(
+            payment_intent=f"pi_{self.session_count}",
+            url=f"https://checkout.stripe.test/{self.session_count}",
+        )
+
+    def create_checkout(
+        self,
+        idempotency_key=None,
+        evse_id="DE*ABC*E1",
+        cancel_url="https://pay.test/checkout/DE*ABC*E1",
+    ):
+        headers = {}
+        if idempotency_key is not None:
+            headers["Idempotency-Key"] = idempotency_key
+        return self.client.post(
+            "/checkouts/",
+            json={
+                "evse_id": evse_id,
+                "success_url": "https://pay.test/charging/DE*ABC*E1",
+                "cancel_url": cancel_url,
+            },
+            headers=headers,
+        )
+
+    def add_reservation(self, idempotency_key, reserved_at):
+        with self.SessionLocal() as db:
+            db_checkout = Checkout(
+                idempotency_key=idempotency_key,
+                idempotency_request_hash=get_request_hash(
+                    CheckoutCreate(
+                        evse_id="DE*ABC*E1",
+                        success_url="https://pay.test/charging/DE*ABC*E1",
+                        cancel_url="https://pay.test/checkout/DE*ABC*E1",
+                    )
+                ),
+                reserved_at=reserved_at,
+            )
+            db.add(db_checkout)
+            db.commit()
+            return db_checkout.id
+
+    def test_creates_checkout_and_stripe_session(self):
+        response = self.create_checkout()
+
+        self.assertEqual(response.status_code, 200)
+        checkout_id = response.json()["id"]
+        self.assertEqual(response.json()["url"], "https://checkout.stripe.test/1")
+
+        params = self.create_session_mock.call_args.kwargs
+        self.assertEqual(params["metadata"], {"checkoutId": checkout_id})
+        self.assertEqual(
+            params["success_url"], f"https://pay.test/charging/DE*ABC*E1/{checkout_id}"
+        )
+        self.assertEqual(params["stripe_account"], "acct_DE*ABC*E1")
+        self.assertEqual(params["line_items"][0]["price_data"]["unit_amount"], 1000)
+        self.assertEqual(params["idempotency_key"], f"checkout-{checkout_id}")
+
+        with self.SessionLocal() as db:
+            db_checkout = db.query(Checkout).filter(Checkout.id == checkout_id).one()
+            self.assertEqual(db_checkout.payment_intent_id, "pi_1")
+            self.assertEqual(db_checkout.checkout_url, "https://checkout.stripe.test/1")
+
+    def test_open_stripe_circuit_answers_service_unavailable(self):
+        breaker = CircuitBreaker(STRIPE, min_calls=1, open_seconds=30)
+        breaker.after_call(failed=True)
+
+        with patch.dict(circuit_breakers, {STRIPE: breaker}):
+            response = self.create_checkout()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "30")
+        self.create_session_mock.assert_not_called()
+
+    def test_retry_with_same_idempotency_key_returns_existing_session(self):
+        first = self.create_checkout(idempotency_key="attempt-1")
+        retry = self.create_checkout(idempotency_key="attempt-1")
+
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(self.create_session_mock.call_count, 1)
+        with self.SessionLocal() as db:
+            self.assertEqual(db.query(Checkout).count(), 1)
+
+    def test_different_idempotency_keys_create_separate_checkouts(self):
+        first = self.create_checkout(idempotency_key="attempt-1")
+        second = self.create_checkout(idempotency_key="attempt-2")
+
+        self.assertNotEqual(first.json()["id"], second.json()["id"])
+        self.assertEqual(self.create_session_mock.call_count, 2)
+
+    def test_requests_without_idempotency_key_always_create_checkouts(self):
+        self.create_checkout()
+        self.create_checkout()
+
+        self.assertEqual(self.create_session_mock.call_count, 2)
+
+    def test_same_idempotency_key_with_different_request_is_rejected(self):
+        self.create_checkout(idempotency_key="attempt-1")
+
+        response = self.create_checkout(
+            idempotency_key="attempt-1", cancel_url="https://pay.test/other"
+        )
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.create_session_mock.call_count, 1)
+
+    def test_reserved_checkout_without_session_is_conflict(self):
+        self.add_reservation("attempt-1", datetime.now(timezone.utc))
+
+        response = self.create_checkout(idempotency_key="attempt-1")
+
+        self.assertEqual(response.status_code, 409)
+        self.create_session_mock.assert_not_called()
+
+    def test_stale_reservation_is_taken_over(self):
+        checkout_id = self.add_reservation(
+            "attempt-1", datetime.now(timezone.utc) - timedelta(hours=1)
+        )
+
+        response = self.create_checkout(idempotency_key="attempt-1")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["id"], checkout_id)
+        self.assertEqual(
+            self.create_session_mock.call_args.kwargs["idempotency_key"],
+            f"checkout-{checkout_id}",
+        )
+        with self.SessionLocal() as db:
+            self.assertEqual(db.query(Checkout).count(), 1)
+
+    def test_stripe_failure_keeps_reservation_taken_over_by_another_request(self):
+        def take_over(**params):
+            with self.SessionLocal() as db:
+                db.query(Checkout).update(
+                    {Checkout.reserved_at: datetime.now(timezone.utc)}
+                )
+                db.commit()
+            raise Exception("Stripe unavailable")
+
+        self.create_session_mock.side_effect = take_over
+        with self.assertRaises(Exception):
+            self.create_checkout(idempotency_key="attempt-1")
+
+        with self.SessionLocal() as db:
+            self.assertEqual(db.query(Checkout).count(), 1)
+
+    def test_stripe_failure_releases_idempotency_key(self):
+        self.create_session_mock.side_effect = [
+            Exception("Stripe unavailable"),
+            self.create_stripe_session(),
+        ]
+        with self.assertRaises(Exception):
+            self.create_checkout(idempotency_key="attempt-1")
+
+        response = self.create_checkout(idempotency_key="attempt-1")
+
+        self.assertEqual(response.status_code, 200)
+        with self.SessionLocal() as db:
+            self.assertEqual(db.query(Checkout).count(), 1)
+
+    def test_unknown_evse_is_not_found(self):
+        response = self.create_checkout(evse_id="unknown")
+
+        self.assertEqual(response.status_code, 404)
+        self.create_session_mock.assert_not_called()
+
+
+class CheckoutMeterCurveTests(unittest.TestCase):
+    def setUp(self):
+        self.SessionLocal = sqlite_sessionmaker()
+        with self.SessionLocal() as db:
+            checkout = Checkout()
+            db.add(checkout)
+            db.commit()
+            self.checkout_id = checkout.id
+
+        app = FastAPI()
+        app.include_router(checkouts_router, prefix="/checkouts")
+        app.dependency_overrides[get_db] = self.get_db
+        self.client = TestClient(app)
+
+    def get_db(self):
+        db = self.SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def test_streams_downsampled_curve(self):
+        start = datetime(2024, 5, 1, 10, 0)
+        with self.SessionLocal() as db:
+            db.add_all(
+                MeterSample(
+                    checkout_id=self.checkout_id,
+                    sampled_at=start + timedelta(minutes=n),
+                    transaction_kwh=n * 0.2,
+                    power_active_import=11.0 + n % 2,
+                    transaction_soc=40 + n,
+                )
+                for n in range(60)
+            )
+            db.commit()
+
+        response = self.client.get(
+            f"/checkouts/{self.checkout_id}/meter-curve", params={"points": 10}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        curve = response.json()
+        self.assertEqual(curve["checkout_id"], self.checkout_id)
+        self.assertEqual(len(curve["points"]), 10)
+        self.assertEqual(curve["points"][-1]["transaction_kwh"], 59 * 0.2)
+        self.assertEqual(curve["points"][-1]["transaction_soc"], 99)
+        self.assertEqual(curve["points"][0]["power_active_import"], 11.5)
+
+    def test_checkout_without_samples_has_empty_curve(self):
+        response = self.client.get(f"/checkouts/{self.checkout_id}/meter-curve")
+
+        self.assertEqual(
+            response.json(), {"checkout_id": self.checkout_id, "points": []}
+        )
+
+    def test_unknown_checkout_is_not_found(self):
+        response = self.client.get("/checkouts/999/meter-curve")
+
+        self.assertEqual(response.status_code, 404)
+
+
+class GetCheckoutTests(unittest.TestCase):
+    def setUp(self):
+        self.SessionLocal = sqlite_sessionmaker()
+        with self.SessionLocal() as db:
+            evse = add_charging_station(db, evse_id="DE*ABC*E1")
+            checkout = Checkout(
+                payment_intent_id="pi_1",
+                connector_id=evse.connectors[0].id,
+                tariff_id=evse.connectors[0].tariff_id,
+                remote_request_status="Accepted",
+                transaction_start_time=datetime(2024, 5, 1, 10, 0),
+                transaction_end_time=datetime(2024, 5, 1, 11, 30),
+                transaction_kwh=20.0,
+            )
+            db.add(checkout)
+            db.commit()
+            self.checkout_id = checkout.id
+
+        app = FastAPI()
+        app.include_router(checkouts_router, prefix="/checkouts")
+        app.dependency_overrides[get_db] = self.get_db
+        self.client = TestClient(app)
+        for patcher in [
+            patch("db.init_db.SessionLocal", self.SessionLocal),
+            patch.object(pricing_cache, "_backend", LocalCacheBackend()),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_db(self):
+        db = self.SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def test_returns_checkout_with_pricing(self):
+        response = self.client.get(f"/checkouts/{self.checkout_id}")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "application/json")
+        checkout = response.json()
+        self.assertEqual(checkout["id"], self.checkout_id)
+        self.assertEqual(checkout["remote_request_status"], "Accepted")
+        self.assertEqual(checkout["transaction_start_time"], "2024-05-01T10:00:00")
+        self.assertEqual(checkout["pricing"]["currency"], "USD")
+        self.assertEqual(checkout["pricing"]["energy_costs"], 600)
+        self.assertEqual(checkout["pricing"]["time_consumption_min"], 90)
+        self.assertEqual(checkout["pricing"]["time_costs"], 450)
+        self.assertEqual(checkout["pricing"]["session_costs"], 300)
+
+    def test_polling_reads_database_after_meter_updates_only(self):
+        with patch(
+            "utils.live_pricing.LiveCheckout.from_rows", wraps=LiveCheckout.from_rows
+        ) as from_rows:
+            first = self.client.get(f"/checkouts/{self.checkout_id}").json()
+            self.client.get(f"/checkouts/{self.checkout_id}")
+            with self.SessionLocal() as db:
+                db.get(Checkout, self.checkout_id).transaction_kwh = 30.0
+                db.commit()
+            updated = self.client.get(f"/checkouts/{self.checkout_id}").json()
+
+        self.assertEqual(from_rows.call_count, 2)
+        self.assertEqual(first["pricing"]["energy_costs"], 600)
+        self.assertEqual(updated["pricing"]["energy_costs"], 900)
+
+    def test_unknown_checkout_is_not_found(self):
+        response = self.client.get("/checkouts/999")
+
+        self.assertEqual(response.status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
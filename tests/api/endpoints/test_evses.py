@@ -0,0 +1,158 @@
+import asyncio
+import unittest
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from tests.database import add_charging_station, sqlite_sessionmaker
+
+from api.endpoints.evses import router as evses_router
+from api.endpoints.locations import router as locations_router
+from api.endpoints.tariffs import router as tariffs_router
+from db.init_db import Evse, TariffElement, get_db
+from integrations.citrineos.citrineos import (
+    CitrineOSeventHeaders,
+    CitrineOSIntegration,
+)
+from schemas.status_notification import StatusNotificationRequest
+from utils.cache import LocalCacheBackend, topology_cache
+
+
+class CachedReadEndpointsTests(unittest.TestCase):
+    def setUp(self):
+        self.SessionLocal = sqlite_sessionmaker()
+        with self.SessionLocal() as db:
+            evse = add_charging_station(db, evse_id="DE*ABC*E1")
+            self.location_id = evse.location_id
+            self.tariff_id = evse.connectors[0].tariff_id
+
+        app = FastAPI()
+        app.include_router(evses_router, prefix="/evses")
+        app.include_router(locations_router, prefix="/locations")
+        app.include_router(tariffs_router, prefix="/tariffs")
+        app.dependency_overrides[get_db] = self.get_db
+        self.client = TestClient(app)
+        self.queries = 0
+        self.queried_on_event_loop = False
+
+        patcher = patch.object(topology_cache, "_backend", LocalCacheBackend())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_db(self):
+        db = self.SessionLocal()
+        original_query = db.query
+
+        def query(*args, **kwargs):
+            self.queries += 1
+            self.queried_on_event_loop |= is_event_loop_thread()
+            return original_query(*args, **kwargs)
+
+        db.query = query
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def test_serves_repeated_requests_from_cache(self):
+        for path in [
+            "/evses/DE*ABC*E1",
+            f"/locations/{self.location_id}",
+            f"/tariffs/{self.tariff_id}",
+        ]:
+            with self.subTest(path=path):
+                self.queries = 0
+                first = self.client.get(path)
+                second = self.client.get(path)
+
+                self.assertEqual(first.status_code, 200)
+                self.assertEqual(second.content, first.content)
+                self.assertEqual(second.headers["etag"], first.headers["etag"])
+                self.assertEqual(self.queries, 1)
+
+    def test_queries_outside_of_the_event_loop(self):
+        for path in [
+            "/evses/DE*ABC*E1",
+            f"/locations/{self.location_id}",
+            f"/tariffs/{self.tariff_id}",
+        ]:
+            with self.subTest(path=path):
+                self.assertEqual(self.client.get(path).status_code, 200)
+
+        self.assertFalse(self.queried_on_event_loop)
+
+    def test_serializes_like_the_response_model(self):
+        response = self.client.get("/evses/DE*ABC*E1")
+
+        self.assertEqual(response.headers["content-type"], "application/json")
+        self.assertEqual(response.json()["evse_id"], "DE*ABC*E1")
+        self.assertEqual(response.json()["status"], "Available")
+        self.assertEqual(response.json()["connectors"][0]["power_type"], "AC_3_PHASE")
+
+    def test_tariff_includes_its_elements(self):
+        with self.SessionLocal() as db:
+            db.add(
+                TariffElement(
+                    tariff_id=self.tariff_id,
+                    dimension="idle",
+                    price=0.10,
+                    grace_minutes=15,
+                )
+            )
+            db.commit()
+
+        response = self.client.get(f"/tariffs/{self.tariff_id}")
+
+        [element] = response.json()["elements"]
+        self.assertEqual(element["dimension"], "idle")
+        self.assertEqual(element["price"], 0.10)
+        self.assertEqual(element["grace_minutes"], 15)
+
+    def test_answers_not_modified_for_current_etag(self):
+        etag = self.client.get("/evses/DE*ABC*E1").headers["etag"]
+
+        response = self.client.get("/evses/DE*ABC*E1", headers={"if-none-match": etag})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response.headers["etag"], etag)
+
+    def test_does_not_cache_not_found(self):
+        self.assertEqual(self.client.get("/evses/DE*ABC*E2").status_code, 404)
+        with self.SessionLocal() as db:
+            add_charging_station(db, evse_id="DE*ABC*E2")
+
+        self.assertEqual(self.client.get("/evses/DE*ABC*E2").status_code, 200)
+
+    def test_status_notification_drops_cached_evse(self):
+        before = self.client.get("/evses/DE*ABC*E1")
+
+        with patch("db.init_db.SessionLocal", self.SessionLocal):
+            asyncio.run(
+                CitrineOSIntegration(None).process_status_notification(
+                    StatusNotificationRequest(
+                        timestamp=datetime.now(timezone.utc),
+                        connectorId=1,
+                        evseId=1,
+                        connectorStatus="Occupied",
+                    ),
+                    CitrineOSeventHeaders(stationId="station-DE*ABC*E1"),
+                )
+            )
+        after = self.client.get("/evses/DE*ABC*E1")
+
+        self.assertEqual(before.json()["status"], "Available")
+        self.assertEqual(after.json()["status"], "Occupied")
+        self.assertNotEqual(after.headers["etag"], before.headers["etag"])
+        with self.SessionLocal() as db:
+            self.assertEqual(db.query(Evse).one().status, "Occupied")
+
+
+def is_event_loop_thread() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
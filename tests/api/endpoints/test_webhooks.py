@@ -0,0 +1,285 @@
+import json
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+
+import stripe
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from tests.database import add_charging_station, sqlite_sessionmaker
+
+from api.endpoints.webhooks import (
+    WebhookProcessingError,
+    process_stripe_event,
+    router as webhooks_router,
+)
+from config import Config
+from db.init_db import Checkout, Transaction, WebhookEvent, get_db
+from utils.circuit_breaker import CircuitOpenError
+
+
+class StripeWebhookTests(unittest.TestCase):
+    def setUp(self):
+        self.SessionLocal = sqlite_sessionmaker()
+
+        app = FastAPI()
+        app.include_router(webhooks_router, prefix="/webhooks")
+        app.dependency_overrides[get_db] = self.get_db
+        app.webhook_inbox = Mock()
+        self.inbox = app.webhook_inbox
+        self.client = TestClient(app)
+
+    def get_db(self):
+        db = self.SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def post_event(self, event: dict, secret: str = None):
+        payload = json.dumps(event).encode()
+        return self.client.post(
+            "/webhooks/stripe",
+            content=payload,
+            headers={
+                "Stripe-Signature": a_signature_header(
+                    payload, secret or Config.STRIPE_ENDPOINT_SECRET_CONNECT
+                )
+            },
+        )
+
+    def test_stores_event_and_submits_it_to_inbox(self):
+        response = self.post_event(a_checkout_completed_event("evt_1", "42"))
+
+        self.assertEqual(response.status_code, 200)
+        with self.SessionLocal() as db:
+            db_event = db.query(WebhookEvent).one()
+            self.assertEqual(db_event.event_id, "evt_1")
+            self.assertEqual(db_event.checkout_id, 42)
+        self.inbox.submit.assert_called_once_with(db_event.id, 42)
+
+    def test_redelivered_event_is_acknowledged_without_processing(self):
+        self.post_event(a_checkout_completed_event("evt_1", "42"))
+        response = self.post_event(a_checkout_completed_event("evt_1", "42"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.inbox.submit.call_count, 1)
+
+    def test_unhandled_event_type_is_not_stored(self):
+        event = a_checkout_completed_event("evt_1", "42")
+        event["type"] = "payment_intent.created"
+
+        response = self.post_event(event)
+
+        self.assertEqual(response.status_code, 200)
+        self.inbox.submit.assert_not_called()
+        with self.SessionLocal() as db:
+            self.assertEqual(db.query(WebhookEvent).count(), 0)
+
+    def test_unhandled_event_type_is_acknowledged_without_parsing(self):
+        event = a_checkout_completed_event("evt_1", "42")
+        event["type"] = "payment_intent.created"
+
+        with patch("api.endpoints.webhooks.loads") as loads:
+            response = self.post_event(event)
+
+        self.assertEqual(response.status_code, 200)
+        loads.assert_not_called()
+
+    def test_handled_type_only_in_nested_object_is_not_stored(self):
+        event = a_checkout_completed_event("evt_1", "42")
+        event["type"] = "payment_intent.created"
+        event["data"]["object"]["description"] = "checkout.session.completed"
+
+        response = self.post_event(event)
+
+        self.assertEqual(response.status_code, 200)
+        self.inbox.submit.assert_not_called()
+
+    def test_invalid_signature_is_rejected(self):
+        response = self.post_event(
+            a_checkout_completed_event("evt_1", "42"), secret="whsec_unknown"
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.inbox.submit.assert_not_called()
+
+
+class ProcessStripeEventTests(unittest.TestCase):
+    def setUp(self):
+        self.SessionLocal = sqlite_sessionmaker()
+        with self.SessionLocal() as db:
+            evse = add_charging_station(db, evse_id="DE*ABC*E1")
+            checkout = Checkout(
+                connector_id=evse.connectors[0].id,
+                tariff_id=evse.connectors[0].tariff_id,
+            )
+            db.add(checkout)
+            db.commit()
+            self.checkout_id = checkout.id
+
+        self.ocpp_integration = Mock()
+        self.ocpp_integration.create_authorization.side_effect = (
+            lambda id_token, *args: {"idToken": {"idToken": id_token}}
+        )
+        self.ocpp_integration.send_citrineos_message.return_value = SimpleNamespace(
+            status_code=200, json=lambda: {"success": True}
+        )
+        patcher = patch("api.endpoints.webhooks.stripe.PaymentIntent.cancel")
+        self.cancel = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def process(self, **metadata):
+        event = a_checkout_completed_event("evt_1", str(self.checkout_id))
+        event["data"]["object"]["metadata"].update(metadata)
+        with self.SessionLocal() as db:
+            process_stripe_event(db, event, self.ocpp_integration)
+
+    def checkout(self) -> Checkout:
+        with self.SessionLocal() as db:
+            return db.query(Checkout).one()
+
+    def add_transaction(self, is_active: bool) -> None:
+        with self.SessionLocal() as db:
+            db.add(
+                Transaction(
+                    stationId="station-DE*ABC*E1",
+                    transactionId="tx-1",
+                    isActive=is_active,
+                )
+            )
+            db.commit()
+
+    def remote_starts(self) -> list[dict]:
+        return [
+            call.kwargs["json_payload"]
+            for call in self.ocpp_integration.send_citrineos_message.call_args_list
+            if call.kwargs["url_path"] == "evdriver/requestStartTransaction"
+        ]
+
+    def test_web_portal_payment_starts_charging(self):
+        self.process()
+
+        self.assertEqual(
+            self.remote_starts(),
+            [
+                {
+                    "remoteStartId": self.checkout_id,
+                    "idToken": {"idToken": f"PAY_{self.checkout_id}"},
+                    "evseId": 1,
+                }
+            ],
+        )
+        self.assertEqual(self.checkout().payment_intent_id, "pi_1")
+        self.assertEqual(self.checkout().remote_request_status, "Accepted")
+
+    def test_retry_after_accepted_remote_start_does_not_start_again(self):
+        self.process()
+        self.process()
+
+        self.assertEqual(len(self.remote_starts()), 1)
+        self.ocpp_integration.create_authorization.assert_called_once()
+
+    def test_retry_after_failed_remote_start_reuses_the_authorization(self):
+        self.ocpp_integration.send_citrineos_message.side_effect = [
+            CircuitOpenError("CitrineOS", 30),
+            self.ocpp_integration.send_citrineos_message.return_value,
+        ]
+
+        with self.assertRaises(CircuitOpenError):
+            self.process()
+        self.process()
+
+        first, second = self.ocpp_integration.create_authorization.call_args_list
+        self.assertEqual(first, second)
+        self.assertEqual(self.checkout().remote_request_status, "Accepted")
+
+    def test_unknown_checkout_is_not_processable(self):
+        event = a_checkout_completed_event("evt_1", str(self.checkout_id + 1))
+
+        with self.SessionLocal() as db, self.assertRaises(WebhookProcessingError):
+            process_stripe_event(db, event, self.ocpp_integration)
+
+    def test_missing_payment_intent_is_not_processable(self):
+        event = a_checkout_completed_event("evt_1", str(self.checkout_id))
+        event["data"]["object"]["payment_intent"] = None
+
+        with self.SessionLocal() as db, self.assertRaises(WebhookProcessingError):
+            process_stripe_event(db, event, self.ocpp_integration)
+
+        self.ocpp_integration.send_citrineos_message.assert_not_called()
+
+    def test_failed_authorization_cancels_the_payment(self):
+        self.ocpp_integration.create_authorization.side_effect = None
+        self.ocpp_integration.create_authorization.return_value = None
+
+        with self.assertRaises(WebhookProcessingError):
+            self.process()
+
+        self.cancel.assert_called_once_with("pi_1")
+        self.assertEqual(self.remote_starts(), [])
+
+    def test_scan_and_charge_starts_charging_and_clears_the_qr_code(self):
+        self.add_transaction(is_active=True)
+
+        self.process(stationId="station-DE*ABC*E1", transactionId="tx-1")
+
+        [remote_start] = self.remote_starts()
+        self.assertEqual(remote_start["remoteStartId"], self.checkout_id)
+        self.assertEqual(remote_start["idToken"]["idToken"], f"PAY_{self.checkout_id}")
+        self.assertEqual(
+            self.ocpp_integration.send_citrineos_message.call_args.kwargs["url_path"],
+            "configuration/clearDisplayMessage",
+        )
+        self.assertEqual(self.checkout().remote_request_status, "Accepted")
+
+    def test_scan_and_charge_of_ended_transaction_cancels_the_payment(self):
+        self.add_transaction(is_active=False)
+
+        with self.assertRaises(WebhookProcessingError):
+            self.process(stationId="station-DE*ABC*E1", transactionId="tx-1")
+
+        self.cancel.assert_called_once_with("pi_1")
+        self.ocpp_integration.create_authorization.assert_not_called()
+
+    def test_uncleared_qr_code_does_not_fail_the_event(self):
+        self.add_transaction(is_active=True)
+        self.ocpp_integration.send_citrineos_message.side_effect = [
+            self.ocpp_integration.send_citrineos_message.return_value,
+            CircuitOpenError("CitrineOS", 30),
+        ]
+
+        with patch("api.endpoints.webhooks.exception"):
+            self.process(stationId="station-DE*ABC*E1", transactionId="tx-1")
+
+        self.assertEqual(self.checkout().remote_request_status, "Accepted")
+
+
+def a_checkout_completed_event(event_id: str, checkout_id: str) -> dict:
+    return {
+        "id": event_id,
+        "object": "event",
+        "type": "checkout.session.completed",
+        "data": {
+            "object": {
+                "object": "checkout.session",
+                "amount_total": 1000,
+                "payment_intent": "pi_1",
+                "metadata": {"checkoutId": checkout_id},
+            }
+        },
+    }
+
+
+def a_signature_header(payload: bytes, secret: str) -> str:
+    timestamp = int(time.time())
+    signature = stripe.WebhookSignature._compute_signature(
+        f"{timestamp}.{payload.decode()}", secret
+    )
+    return f"t={timestamp},v1={signature}"
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from statistics import quantiles
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import httpx
+from fastapi import FastAPI
+
+from tests.database import add_charging_station, sqlite_sessionmaker
+
+import utils.stripe_client
+from api.endpoints.checkouts import router as checkouts_router
+from api.endpoints.tariffs import router as tariffs_router
+from config import Config
+from db.init_db import get_db
+
+STRIPE_LATENCY_SECONDS = 0.5
+STRIPE_CONCURRENCY = 50
+CHECKOUTS = 1000
+CLIENTS = 200
+
+
+@unittest.skipUnless(os.environ.get("RUN_BENCHMARKS"), "set RUN_BENCHMARKS=1 to run")
+class CheckoutLoadTest(unittest.TestCase):
+    """
+    Creates checkouts concurrently against a Stripe stand-in with fixed latency and
+    reports the sustained creation rate, while a sync read route is polled to show
+    that slow Stripe calls do not starve the shared threadpool.
+    """
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.SessionLocal = sqlite_sessionmaker(f"sqlite:///{tmp_dir.name}/load.db")
+        with self.SessionLocal() as db:
+            add_charging_station(db, evse_id="DE*ABC*E1")
+
+        self.app = FastAPI()
+        self.app.include_router(checkouts_router, prefix="/checkouts")
+        self.app.include_router(tariffs_router, prefix="/tariffs")
+        self.app.dependency_overrides[get_db] = self.get_db
+
+        patchers = [
+            patch(
+                "api.endpoints.checkouts.stripe.checkout.Session.create",
+                side_effect=self.create_stripe_session,
+            ),
+            patch.object(Config, "STRIPE_MAX_CONCURRENT_REQUESTS", STRIPE_CONCURRENCY),
+            patch.object(utils.stripe_client, "_stripe_limiter", None),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_db(self):
+        db = self.SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def create_stripe_session(self, **params):
+        time.sleep(STRIPE_LATENCY_SECONDS)  # the Stripe SDK blocks its thread
+        checkout_id = params["metadata"]["checkoutId"]
+        return SimpleNamespace(
+            payment_intent=f"pi_{checkout_id}",
+            url=f"https://checkout.stripe.test/{checkout_id}",
+        )
+
+    def test_sustained_checkout_creation_rate(self):
+        checkout_latencies, read_latencies, elapsed = asyncio.run(self.run_load())
+
+        rate = len(checkout_latencies) / elapsed
+        print(
+            f"\n[checkout load] {len(checkout_latencies)} checkouts in {elapsed:.2f}s "
+            f"= {rate:.1f}/s (stripe latency {STRIPE_LATENCY_SECONDS * 1000:.0f}ms, "
+            f"stripe concurrency {STRIPE_CONCURRENCY}, {CLIENTS} clients)"
+        )
+        print(f"[checkout load] checkout latency {summary(checkout_latencies)}")
+        print(f"[checkout load] GET /tariffs latency {summary(read_latencies)}")
+
+        # Stripe latency bounds throughput at STRIPE_CONCURRENCY / latency
+        self.assertGreater(rate, 0.7 * STRIPE_CONCURRENCY / STRIPE_LATENCY_SECONDS)
+        # Sync routes are not stuck behind threads blocked on Stripe
+        self.assertLess(percentile(read_latencies, 50), STRIPE_LATENCY_SECONDS / 10)
+
+    async def run_load(self):
+        transport = httpx.ASGITransport(app=self.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            remaining = iter(range(CHECKOUTS))
+            checkout_latencies = []
+            read_latencies = []
+            done = asyncio.Event()
+
+            async def create_checkouts():
+                for index in remaining:
+                    started = time.perf_counter()
+                    response = await client.post(
+                        "/checkouts/",
+                        json={
+                            "evse_id": "DE*ABC*E1",
+                            "success_url": "https://pay.test/charging/DE*ABC*E1",
+                            "cancel_url": "https://pay.test/checkout/DE*ABC*E1",
+                        },
+                        headers={"Idempotency-Key": f"load-{index}"},
+                    )
+                    response.raise_for_status()
+                    checkout_latencies.append(time.perf_counter() - started)
+
+            async def read_tariffs():
+                while not done.is_set():
+                    started = time.perf_counter()
+                    response = await client.get("/tariffs/1")
+                    response.raise_for_status()
+                    read_latencies.append(time.perf_counter() - started)
+                    await asyncio.sleep(0.01)
+
+            reader = asyncio.create_task(read_tariffs())
+            started = time.perf_counter()
+            await asyncio.gather(*(create_checkouts() for _ in range(CLIENTS)))
+            elapsed = time.perf_counter() - started
+            done.set()
+            await reader
+
+        return checkout_latencies, read_latencies, elapsed
+
+
+def percentile(values, percent):
+    return quantiles(values, n=100)[percent - 1]
+
+
+def summary(latencies):
+    return (
+        f"p50={percentile(latencies, 50) * 1000:.1f}ms "
+        f"p99={percentile(latencies, 99) * 1000:.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import asyncio
+import os
+import time
+import unittest
+from unittest.mock import AsyncMock, patch
+
+os.environ.setdefault("CONFIG_PATH", ".env.test")
+
+from tests.amqp import FakeMessage, a_connected_queue, wait_until
+
+from integrations.citrineos.citrineos import CitrineOSIntegration
+
+MESSAGES = 20000
+STATIONS = 200
+
+
+@unittest.skipUnless(os.environ.get("RUN_BENCHMARKS"), "set RUN_BENCHMARKS=1 to run")
+class ConsumerAckBenchmark(unittest.TestCase):
+    """
+    Compares the ack frames sent and the consumer throughput with per-message and
+    batched acks. The fake channel writes frames to /dev/null, so the throughput
+    does not show the round trips saved against a real broker, only the frames do.
+    """
+
+    def test_batched_acks(self):
+        frames = {}
+        for batch_size in [1, 50]:
+            rate, frames[batch_size] = asyncio.run(consume(batch_size))
+            print(
+                f"\n[consumer acks] batch size {batch_size}: "
+                f"{rate:.0f} messages/s, {frames[batch_size]} ack frames"
+            )
+
+        self.assertEqual(frames[1], MESSAGES)
+        self.assertLess(frames[50], MESSAGES / 50 * 2)
+
+
+async def consume(batch_size: int) -> tuple[float, int]:
+    integration = CitrineOSIntegration(fileIntegration=None)
+    connection, exchange, queue, _ = connected_queue = a_connected_queue()
+    processed = 0
+
+    async def process_incoming_event(event_message, exchange):
+        nonlocal processed
+        processed += 1
+
+    with (
+        patch.object(
+            integration,
+            "connect_event_queue",
+            new_callable=AsyncMock,
+            return_value=connected_queue,
+        ),
+        patch.object(
+            integration, "process_incoming_event", side_effect=process_incoming_event
+        ),
+    ):
+        stop = asyncio.Event()
+        consumer = asyncio.create_task(
+            integration.receive_events(workers=8, stop=stop, ack_batch_size=batch_size)
+        )
+        await wait_until(lambda: queue.callback is not None)
+        messages = [
+            FakeMessage(b"{}", {"stationId": f"CS{n % STATIONS}"})
+            for n in range(MESSAGES)
+        ]
+
+        started = time.perf_counter()
+        for n, message in enumerate(messages):
+            await queue.publish(message)
+            if n % 100 == 0:
+                await asyncio.sleep(0)
+        await wait_until(lambda: processed == MESSAGES, timeout=60)
+        await integration.consumer_acker.flush()
+        seconds = time.perf_counter() - started
+
+        frames = queue.channel.frames
+        stop.set()
+        await consumer
+
+    assert all(message.acked for message in messages)
+    return MESSAGES / seconds, frames
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,209 @@
+import json
+import os
+import time
+import unittest
+
+os.environ.setdefault("CONFIG_PATH", ".env.test")
+
+import orjson
+from pydantic import BaseModel
+
+from tests.amqp import FakeMessage
+
+from integrations.citrineos.citrineos import (
+    CitrineOSeventHeaders,
+    CitrineOsEventAction,
+    decode_incoming_event,
+)
+from schemas.status_notification import StatusNotificationRequest
+from schemas.transaction_event import (
+    MeasurandEnumType,
+    MeterValueType,
+    TransactionEventRequest,
+)
+from utils.meter_values import extract_meter_readings
+
+MESSAGES = 20000
+
+
+class LegacyCitrineOSevent(BaseModel):
+    action: CitrineOsEventAction
+    payload: dict
+
+
+@unittest.skipUnless(os.environ.get("RUN_BENCHMARKS"), "set RUN_BENCHMARKS=1 to run")
+class EventDecodingBenchmark(unittest.TestCase):
+    """Compares the CPU cost of decoding CitrineOS events per message."""
+
+    def test_decoding_cost_per_message(self):
+        for name, message in [
+            ("TransactionEvent", a_meter_value_message()),
+            ("StatusNotification", a_status_notification_message()),
+        ]:
+
+            def legacy_decode():
+                event = LegacyCitrineOSevent(**json.loads(message.body.decode()))
+                CitrineOSeventHeaders(**message.headers)
+                if event.action == CitrineOsEventAction.TRANSACTIONEVENT:
+                    TransactionEventRequest(**event.payload)
+                else:
+                    StatusNotificationRequest(**event.payload)
+
+            def decode():
+                action, payload = decode_incoming_event(message)
+                CitrineOSeventHeaders.model_validate(message.headers)
+                if action == CitrineOsEventAction.TRANSACTIONEVENT:
+                    TransactionEventRequest.model_validate(payload)
+                else:
+                    StatusNotificationRequest.model_validate(payload)
+
+            legacy_seconds = timed(legacy_decode, MESSAGES)
+            seconds = timed(decode, MESSAGES)
+            print(
+                f"\n[event decoding] {name} ({len(message.body)} bytes): "
+                f"legacy {legacy_seconds / MESSAGES * 1e6:.1f}us, "
+                f"now {seconds / MESSAGES * 1e6:.1f}us per message"
+            )
+            self.assertLess(seconds, legacy_seconds)
+
+    def test_meter_value_extraction(self):
+        meter_values = orjson.loads(a_meter_value_message().body)["payload"][
+            "meterValue"
+        ]
+
+        def legacy_extract():
+            latest_meter_value = [
+                MeterValueType(**meter_value) for meter_value in meter_values
+            ][-1]
+            for sampled_value in latest_meter_value.sampledValue:
+                if sampled_value.phase is None and sampled_value.measurand in (
+                    MeasurandEnumType.EnergyActiveImportRegister,
+                    MeasurandEnumType.PowerActiveImport,
+                    MeasurandEnumType.SoC,
+                ):
+                    sampled_value.value * 10**sampled_value.unitOfMeasure.multiplier
+
+        legacy_seconds = timed(legacy_extract, MESSAGES)
+        seconds = timed(lambda: extract_meter_readings(meter_values), MESSAGES)
+        print(
+            f"\n[event decoding] meter value extraction: "
+            f"legacy {legacy_seconds / MESSAGES * 1e6:.2f}us, "
+            f"now {seconds / MESSAGES * 1e6:.2f}us per message"
+        )
+        self.assertLess(seconds, legacy_seconds / 2)
+
+    def test_skipping_unhandled_events(self):
+        message = a_meter_value_message()
+        message.headers["action"] = "MeterValues"
+        message.body = message.body.replace(b"TransactionEvent", b"MeterValues")
+
+        def legacy_skip():
+            try:
+                LegacyCitrineOSevent(**json.loads(message.body.decode()))
+            except ValueError:
+                pass
+
+        legacy_seconds = timed(legacy_skip, MESSAGES)
+        seconds = timed(lambda: decode_incoming_event(message), MESSAGES)
+        print(
+            f"\n[event decoding] unhandled event: "
+            f"legacy {legacy_seconds / MESSAGES * 1e6:.2f}us, "
+            f"now {seconds / MESSAGES * 1e6:.2f}us per message"
+        )
+        self.assertLess(seconds, legacy_seconds / 10)
+
+
+def timed(func, count: int, repeat: int = 5) -> float:
+    """Returns the best time of `repeat` runs, scaled to `count` calls."""
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(count // repeat):
+            func()
+        runs.append(time.perf_counter() - started)
+    return min(runs) * repeat
+
+
+def a_meter_value_message() -> FakeMessage:
+    """A periodic TransactionEvent with the sampled values of a 3-phase AC charger."""
+    sampled_values = [
+        {
+            "value": 12345.6,
+            "measurand": "Energy.Active.Import.Register",
+            "unitOfMeasure": {"unit": "Wh", "multiplier": 0},
+        },
+        {
+            "value": 11.04,
+            "measurand": "Power.Active.Import",
+            "unitOfMeasure": {"unit": "kW", "multiplier": 0},
+        },
+        {"value": 57, "measurand": "SoC", "unitOfMeasure": {"unit": "Percent"}},
+    ]
+    for phase in ["L1", "L2", "L3"]:
+        sampled_values.append(
+            {
+                "value": 16.0,
+                "measurand": "Current.Import",
+                "phase": phase,
+                "unitOfMeasure": {"unit": "A"},
+            }
+        )
+        sampled_values.append(
+            {
+                "value": 230.2,
+                "measurand": "Voltage",
+                "phase": f"{phase}-N",
+                "unitOfMeasure": {"unit": "V"},
+            }
+        )
+    return FakeMessage(
+        {
+            "action": "TransactionEvent",
+            "state": 1,
+            "context": {
+                "correlationId": "7e0c3e1a-3a0b-4c3e-9b0c-1a7a3f0e9d11",
+                "stationId": "CS01",
+                "tenantId": "T01",
+                "timestamp": "2024-05-01T10:00:00.000Z",
+            },
+            "payload": {
+                "eventType": "Updated",
+                "timestamp": "2024-05-01T10:00:00.000Z",
+                "triggerReason": "MeterValuePeriodic",
+                "seqNo": 12,
+                "transactionInfo": {
+                    "transactionId": "8f2d5b4e-0a7c-4f0e-9a56-3c2b1d0e4f6a",
+                    "chargingState": "Charging",
+                    "remoteStartId": 42,
+                },
+                "evse": {"id": 1, "connectorId": 1},
+                "meterValue": [
+                    {
+                        "timestamp": "2024-05-01T10:00:00.000Z",
+                        "sampledValue": sampled_values,
+                    }
+                ],
+            },
+        },
+        {"stationId": "CS01", "action": "TransactionEvent", "state": "1"},
+    )
+
+
+def a_status_notification_message() -> FakeMessage:
+    return FakeMessage(
+        {
+            "action": "StatusNotification",
+            "state": 1,
+            "payload": {
+                "timestamp": "2024-05-01T10:00:00.000Z",
+                "connectorId": 1,
+                "evseId": 1,
+                "connectorStatus": "Occupied",
+            },
+        },
+        {"stationId": "CS01", "action": "StatusNotification", "state": "1"},
+    )
+
+
+if __name__ == "__main__":
+    unittest.main()
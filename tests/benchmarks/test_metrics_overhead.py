@@ -0,0 +1,132 @@
+import asyncio
+import os
+import time
+import unittest
+
+os.environ.setdefault("CONFIG_PATH", ".env.test")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, text
+
+from tests.database import add_charging_station, sqlite_sessionmaker
+
+from api.endpoints.evses import router as evses_router
+from db.init_db import get_db
+from utils.dependency_stats import instrument_engine
+from utils.metrics import RequestMetricsMiddleware
+
+REQUESTS = 500
+CALLS = 20000
+
+
+@unittest.skipUnless(os.environ.get("RUN_BENCHMARKS"), "set RUN_BENCHMARKS=1 to run")
+class MetricsOverheadBenchmark(unittest.TestCase):
+    """
+    Compares the cost of collecting metrics for a request with the request itself.
+
+    The request is a GET of an EVSE from SQLite, about the cheapest API request, so
+    the share of metrics is largest. The overhead is the extra time of the request
+    middleware plus the extra time of the SQL statement hooks times the number of
+    statements the request runs.
+    """
+
+    def test_overhead_is_below_one_percent_of_request_time(self):
+        request_seconds, statements = time_request()
+        middleware_seconds = time_middleware_overhead()
+        statement_seconds = time_statement_overhead()
+        overhead = middleware_seconds + statements * statement_seconds
+
+        print(
+            f"\n[metrics] request {request_seconds * 1e6:.0f}us, "
+            f"middleware {middleware_seconds * 1e6:.2f}us, "
+            f"{statements} statements x {statement_seconds * 1e6:.2f}us, "
+            f"overhead {overhead / request_seconds:.2%}"
+        )
+        self.assertLess(overhead, request_seconds * 0.01)
+
+
+def time_request() -> tuple[float, int]:
+    SessionLocal = sqlite_sessionmaker()
+    with SessionLocal() as db:
+        add_charging_station(db, evse_id="DE*ABC*E1")
+
+    def override_get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+    app.include_router(evses_router, prefix="/evses")
+    app.dependency_overrides[get_db] = override_get_db
+    client = TestClient(app)
+
+    statements = 0
+
+    def count_statement(*args):
+        nonlocal statements
+        statements += 1
+
+    engine = SessionLocal.kw["bind"]
+    event.listen(engine, "before_cursor_execute", count_statement)
+    client.get("/evses/DE*ABC*E1")
+    event.remove(engine, "before_cursor_execute", count_statement)
+
+    return timed(lambda: client.get("/evses/DE*ABC*E1"), REQUESTS), statements
+
+
+def time_middleware_overhead() -> float:
+    scope = {"type": "http", "method": "GET", "path": "/"}
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(message):
+        pass
+
+    def run(asgi_app):
+        async def requests():
+            for _ in range(CALLS):
+                await asgi_app(scope, None, send)
+
+        return lambda: asyncio.run(requests())
+
+    return overhead(run(app), run(RequestMetricsMiddleware(app))) / CALLS
+
+
+def time_statement_overhead() -> float:
+    def run(engine):
+        statement = text("select 1")
+
+        def statements():
+            with engine.connect() as connection:
+                for _ in range(CALLS):
+                    connection.execute(statement)
+
+        return statements
+
+    instrumented_engine = create_engine("sqlite://")
+    instrument_engine(instrumented_engine)
+    return overhead(run(create_engine("sqlite://")), run(instrumented_engine)) / CALLS
+
+
+def overhead(bare, instrumented) -> float:
+    """Returns the extra seconds of `instrumented`, alternating runs to cancel drift."""
+    bare_seconds = instrumented_seconds = float("inf")
+    for _ in range(7):
+        bare_seconds = min(bare_seconds, timed(bare, 1, runs=1))
+        instrumented_seconds = min(instrumented_seconds, timed(instrumented, 1, runs=1))
+    return max(0.0, instrumented_seconds - bare_seconds)
+
+
+def timed(func, calls: int, runs: int = 5) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        started = time.perf_counter()
+        for _ in range(calls):
+            func()
+        best = min(best, time.perf_counter() - started)
+    return best / calls
@@ -0,0 +1,284 @@
+import json
+import math
+import os
+import timeit
+import unittest
+import warnings
+from datetime import datetime, timezone
+from statistics import median
+from unittest.mock import Mock, patch
+
+os.environ.setdefault("CONFIG_PATH", ".env.test")
+
+import orjson
+
+from tests.database import add_charging_station, sqlite_sessionmaker
+
+from api.responses import ModelResponse
+from db.init_db import Checkout
+from integrations.citrineos.citrineos import CitrineOSIntegration
+from integrations.citrineos.event_stream import generate_events
+from model.transaction_summary import TransactionSummary
+from schemas.transaction_event import TransactionEventRequest
+from utils.live_pricing import LiveCheckout
+from utils.utils import generate_pricing
+
+BASELINES_PATH = os.environ.get(
+    "BENCHMARK_BASELINES", os.path.join(os.path.dirname(__file__), "baselines.json")
+)
+UPDATE_BASELINES = bool(os.environ.get("UPDATE_BENCHMARK_BASELINES"))
+ROUNDS = 30
+ROUND_SECONDS = 0.05
+SIGNIFICANCE = 0.01
+# Slowdowns of the median below this pass, however significant. Raise it on noisy
+# machines, like shared CI runners.
+MIN_SLOWDOWN = float(os.environ.get("BENCHMARK_MIN_SLOWDOWN", "0.15"))
+# And so do slowdowns of less than this many microseconds per call
+MIN_SLOWDOWN_US = float(os.environ.get("BENCHMARK_MIN_SLOWDOWN_US", "1"))
+
+
+@unittest.skipUnless(os.environ.get("RUN_BENCHMARKS"), "set RUN_BENCHMARKS=1 to run")
+class MicroBenchmarks(unittest.TestCase):
+    """
+    Times the hot paths of pricing and meter processing against stored baselines.
+
+    Each benchmark is timed in ROUNDS rounds of as many calls as take ROUND_SECONDS.
+    Every round is preceded by a round of a fixed reference workload and its time
+    is recorded relative to that, so a slower machine or a busy neighbour slows
+    both alike. The first run stores the relative times in BENCHMARK_BASELINES,
+    UPDATE_BENCHMARK_BASELINES=1 replaces them. Later runs fail a benchmark if its
+    rounds are slower than the baseline's in a one-sided Mann-Whitney U test at
+    SIGNIFICANCE and its median is both more than BENCHMARK_MIN_SLOWDOWN and more
+    than BENCHMARK_MIN_SLOWDOWN_US per call slower.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.baselines = {}
+        if os.path.exists(BASELINES_PATH):
+            with open(BASELINES_PATH) as file:
+                # Baselines in seconds from before the reference are re-recorded
+                cls.baselines = json.load(file).get("relative_to_reference", {})
+        cls.baselines_changed = False
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.baselines_changed:
+            with open(BASELINES_PATH, "w") as file:
+                json.dump(
+                    {"relative_to_reference": cls.baselines},
+                    file,
+                    indent=2,
+                    sort_keys=True,
+                )
+                file.write("\n")
+
+    def test_transaction_summary_properties(self):
+        def price():
+            summary = TransactionSummary(
+                kwh=23.456,
+                start_time=datetime(2024, 8, 15, 9, 0, tzinfo=timezone.utc),
+                end_time=datetime(2024, 8, 15, 10, 12, 30, tzinfo=timezone.utc),
+                currency="EUR",
+                tax_rate=19,
+                payment_fee=1.5,
+                price_kwh=0.39,
+                price_minute=0.02,
+                price_session=1.0,
+            )
+            # Everything generate_pricing reads
+            return (
+                summary.energy_costs,
+                summary.time_consumption_min,
+                summary.time_costs,
+                summary.session_costs,
+                summary.total_costs_net,
+                summary.tax_costs,
+                summary.total_costs_gross,
+                summary.payment_costs_gross,
+                summary.payment_costs_net,
+            )
+
+        self.assert_no_regression("transaction_summary_properties", price)
+
+    def test_generate_pricing(self):
+        session_factory = sqlite_sessionmaker()
+        with session_factory() as session:
+            evse = add_charging_station(session)
+            checkout = Checkout(
+                connector_id=evse.connectors[0].id,
+                tariff_id=evse.connectors[0].tariff_id,
+                transaction_kwh=23.456,
+                transaction_start_time=datetime(2024, 8, 15, 9, 0),
+                transaction_end_time=datetime(2024, 8, 15, 10, 12, 30),
+            )
+            session.add(checkout)
+            session.commit()
+            checkout_id = checkout.id
+
+        with patch("db.init_db.SessionLocal", session_factory):
+            self.assert_no_regression(
+                "generate_pricing", lambda: generate_pricing(checkout_id)
+            )
+
+    def test_live_checkout_read(self):
+        session_factory = sqlite_sessionmaker()
+        with session_factory() as session:
+            evse = add_charging_station(session)
+            checkout = Checkout(
+                payment_intent_id="pi_1",
+                connector_id=evse.connectors[0].id,
+                tariff_id=evse.connectors[0].tariff_id,
+                transaction_kwh=23.456,
+                transaction_start_time=datetime(2024, 8, 15, 9, 0),
+            )
+            session.add(checkout)
+            session.commit()
+            live_checkout = LiveCheckout.from_rows(checkout, evse.connectors[0].tariff)
+        entry = live_checkout.to_bytes()
+
+        # A poll of a running session between two meter updates
+        self.assert_no_regression(
+            "live_checkout_read",
+            lambda: ModelResponse(LiveCheckout.from_bytes(entry).checkout()).body,
+        )
+
+    def test_update_checkout_with_meter_values(self):
+        integration = CitrineOSIntegration(Mock())
+        transaction_event = TransactionEventRequest.model_validate(
+            a_transaction_event_updated()
+        )
+
+        def update():
+            checkout = Checkout(
+                transaction_kwh=12.5, transaction_last_meter_reading=100
+            )
+            integration.update_checkout_with_meter_values(
+                transaction_event=transaction_event, db_checkout=checkout
+            )
+
+        self.assert_no_regression("update_checkout_with_meter_values", update)
+
+    def test_transaction_event_parsing(self):
+        payload = a_transaction_event_updated()
+        body = orjson.dumps(payload)
+
+        self.assert_no_regression(
+            "transaction_event_model_validate",
+            lambda: TransactionEventRequest.model_validate(payload),
+        )
+        self.assert_no_regression(
+            "transaction_event_model_validate_json",
+            lambda: TransactionEventRequest.model_validate_json(body),
+        )
+
+    def assert_no_regression(self, name: str, func) -> None:
+        samples, reference = measure(func)
+        baseline = self.baselines.get(name)
+        if baseline is None or UPDATE_BASELINES:
+            self.baselines[name] = samples
+            type(self).baselines_changed = True
+            print(
+                f"\n[{name}] median={median(samples):.3f} x reference "
+                f"({median(samples) * reference * 1e6:.2f}us, baseline recorded)"
+            )
+            return
+
+        slowdown = median(samples) / median(baseline) - 1
+        slowdown_us = (median(samples) - median(baseline)) * reference * 1e6
+        p_value = mann_whitney_p_value(samples, baseline)
+        print(
+            f"\n[{name}] median={median(samples):.3f} x reference "
+            f"baseline={median(baseline):.3f} x reference "
+            f"({slowdown:+.1%}, {slowdown_us:+.2f}us, p={p_value:.2g})"
+        )
+        if (
+            p_value < SIGNIFICANCE
+            and slowdown > MIN_SLOWDOWN
+            and slowdown_us > MIN_SLOWDOWN_US
+        ):
+            self.fail(
+                f"{name} is {slowdown:.1%} ({slowdown_us:.2f}us) slower than its "
+                f"baseline (p={p_value:.2g})"
+            )
+
+
+def a_transaction_event_updated() -> dict:
+    """A TransactionEvent Updated with energy, power and SoC readings."""
+    return next(
+        event.body["payload"]
+        for event in generate_events(stations=1, hours=24)
+        if event.body["payload"].get("eventType") == "Updated"
+    )
+
+
+def reference_workload() -> None:
+    """Parsing, string formatting and arithmetic, like the code measured here."""
+    payload = json.loads('{"timestamp": "2024-08-15T09:00:00Z", "value": 23.456}')
+    value = 0.0
+    for index in range(20):
+        value += float(payload["value"]) * index / 7
+    f"{payload['timestamp']}:{value:.2f}".split(":")
+
+
+def measure(func) -> tuple[list[float], float]:
+    """
+    Returns the time per call of `func` in each of ROUNDS rounds relative to the
+    reference workload timed right before it, and the median seconds per call of
+    the reference workload.
+    """
+    timer = timeit.Timer(func)
+    reference_timer = timeit.Timer(reference_workload)
+    # Deprecation warnings are ignored outside of tests, recording them costs time
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        number = calls_per_round(timer)
+        reference_number = calls_per_round(reference_timer)
+        samples, reference = [], []
+        for _ in range(ROUNDS):
+            reference.append(
+                reference_timer.timeit(reference_number) / reference_number
+            )
+            samples.append(timer.timeit(number) / number / reference[-1])
+    return samples, median(reference)
+
+
+def calls_per_round(timer: timeit.Timer) -> int:
+    number = 1
+    while timer.timeit(number) < ROUND_SECONDS:
+        number *= 2
+    return number
+
+
+def mann_whitney_p_value(samples: list[float], baseline: list[float]) -> float:
+    """
+    Returns the p-value of `samples` being slower than `baseline`.
+
+    One-sided Mann-Whitney U test with the normal approximation, which is accurate
+    for the 20 or more samples taken here. Ties get the mean of their ranks.
+    """
+    values = sorted(
+        [(value, 0) for value in samples] + [(value, 1) for value in baseline]
+    )
+    ranks = [0.0] * len(values)
+    tie_correction = 0.0
+    start = 0
+    while start < len(values):
+        end = start
+        while end + 1 < len(values) and values[end + 1][0] == values[start][0]:
+            end += 1
+        for index in range(start, end + 1):
+            ranks[index] = (start + end) / 2 + 1
+        ties = end - start + 1
+        tie_correction += ties**3 - ties
+        start = end + 1
+
+    n1, n2 = len(samples), len(baseline)
+    n = n1 + n2
+    rank_sum = sum(rank for rank, (_, group) in zip(ranks, values) if group == 0)
+    u = rank_sum - n1 * (n1 + 1) / 2
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - tie_correction / (n * (n - 1))))
+    if sigma == 0:
+        return 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / sigma
+    return math.erfc(z / math.sqrt(2)) / 2
@@ -0,0 +1,75 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+IMPORT_TIME_BUDGET_SECONDS = 1.5
+CREATE_APP_BUDGET_SECONDS = 0.2
+RUNS = 5
+
+
+@unittest.skipUnless(os.environ.get("RUN_BENCHMARKS"), "set RUN_BENCHMARKS=1 to run")
+class StartupBenchmark(unittest.TestCase):
+    """
+    Keeps importing main and creating the app under their budgets.
+
+    Every web worker and consumer pays for both when it starts. They are measured
+    with python -X importtime in fresh interpreters, taking the fastest of RUNS so
+    the file system cache is warm. The modules with the highest self time are
+    printed, they are the ones to import lazily when the budget is exceeded.
+    """
+
+    def test_startup_time(self):
+        with tempfile.TemporaryDirectory() as frontend_directory:
+            with open(os.path.join(frontend_directory, "index.html"), "w") as file:
+                file.write("<html></html>")
+            runs = [self.start(frontend_directory) for _ in range(RUNS)]
+
+        import_seconds, create_app_seconds, self_times = min(runs)
+        print(
+            f"\n[startup] import main: {import_seconds * 1000:.0f}ms "
+            f"(budget {IMPORT_TIME_BUDGET_SECONDS * 1000:.0f}ms), "
+            f"create_app: {create_app_seconds * 1000:.0f}ms "
+            f"(budget {CREATE_APP_BUDGET_SECONDS * 1000:.0f}ms)"
+        )
+        for module, seconds in sorted(self_times.items(), key=lambda item: -item[1])[
+            :10
+        ]:
+            print(f"[startup]   {module}: {seconds * 1000:.1f}ms")
+        self.assertLess(import_seconds, IMPORT_TIME_BUDGET_SECONDS)
+        self.assertLess(create_app_seconds, CREATE_APP_BUDGET_SECONDS)
+
+    def start(self, frontend_directory: str) -> tuple[float, float, dict]:
+        """Returns the import time of main, the time of create_app and self times."""
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-X",
+                "importtime",
+                "-c",
+                "import time, main\n"
+                "started = time.perf_counter()\n"
+                f"main.create_app({frontend_directory!r})\n"
+                "print(time.perf_counter() - started)",
+            ],
+            env={
+                **os.environ,
+                "CONFIG_PATH": os.environ.get("CONFIG_PATH", ".env.test"),
+            },
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        import_seconds = None
+        self_times = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            self_us, cumulative_us, module = line[len("import time:") :].split("|")
+            if not self_us.strip().isdigit():
+                continue  # the header line
+            self_times[module.strip()] = int(self_us) / 1e6
+            if module.strip() == "main":
+                import_seconds = int(cumulative_us) / 1e6
+        return import_seconds, float(result.stdout.splitlines()[-1]), self_times
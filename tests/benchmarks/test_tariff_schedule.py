@@ -0,0 +1,107 @@
+import os
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from model.tariff_schedule import (
+    ENERGY,
+    IDLE,
+    MINUTES_IN_DAY,
+    TIME,
+    RateElement,
+    compile_rate_schedule,
+)
+
+START = datetime(2024, 5, 6, tzinfo=timezone.utc)
+# A price for every hour of weekdays, another for weekends, two energy tiers and
+# an idle fee: a period boundary every hour of the week
+ELEMENTS = (
+    *(
+        RateElement(
+            ENERGY,
+            0.20 + hour / 100,
+            start_minute=hour * 60,
+            end_minute=(hour + 1) * 60,
+            days_of_week="MONDAY,TUESDAY,WEDNESDAY,THURSDAY,FRIDAY",
+            max_kwh=40,
+        )
+        for hour in range(24)
+    ),
+    RateElement(ENERGY, 0.18, min_kwh=40),
+    RateElement(TIME, 0.01, days_of_week="SATURDAY,SUNDAY"),
+    *(
+        RateElement(
+            TIME, 0.02 + hour / 1000, start_minute=hour * 60, end_minute=(hour + 1) * 60
+        )
+        for hour in range(24)
+    ),
+    RateElement(IDLE, 0.10, grace_minutes=30),
+)
+
+
+@unittest.skipUnless(os.environ.get("RUN_BENCHMARKS"), "set RUN_BENCHMARKS=1 to run")
+class TariffScheduleBenchmark(unittest.TestCase):
+    """
+    Prices long sessions with a meter reading per minute across hourly rates.
+
+    The compiled schedule walks the readings and the periods they cross once. The
+    reference looks up the applying elements for every minute, which is what
+    pricing without a compiled schedule takes.
+    """
+
+    def test_prices_in_linear_time(self):
+        schedule = compile_rate_schedule(ELEMENTS, 0.30, 0.05)
+        seconds = {}
+        for days in (1, 7, 28):
+            readings = meter_readings(days)
+            end = readings[-1][0]
+            started = time.perf_counter()
+            costs = schedule.price_session(START, end, readings[-1][1], readings)
+            seconds[days] = time.perf_counter() - started
+            self.assertGreater(costs.energy, 0)
+            self.assertGreater(costs.idle, 0)
+
+        started = time.perf_counter()
+        price_per_minute(meter_readings(1))
+        reference_seconds = time.perf_counter() - started
+
+        print(
+            "\n[tariff schedule] "
+            + ", ".join(
+                f"{days}d {days * MINUTES_IN_DAY} readings {call_seconds * 1e3:.1f}ms"
+                for days, call_seconds in seconds.items()
+            )
+            + f", per minute lookup 1d {reference_seconds * 1e3:.1f}ms"
+        )
+        self.assertLess(seconds[28], seconds[7] * 4 * 1.5)
+        self.assertLess(seconds[1] * 5, reference_seconds)
+        # A month of readings a minute is priced well within a request
+        self.assertLess(seconds[28], 1)
+
+
+def meter_readings(days: int) -> list[tuple[datetime, float]]:
+    """Charges 11 kW for 3 hours of every 4, idle in between."""
+    readings = []
+    kwh = 0.0
+    for minute in range(days * MINUTES_IN_DAY + 1):
+        if minute and minute % 240 < 180:
+            kwh += 11 / 60
+        readings.append((START + timedelta(minutes=minute), kwh))
+    return readings
+
+
+def price_per_minute(readings: list[tuple[datetime, float]]) -> float:
+    costs = 0.0
+    for (moment, from_kwh), (_, to_kwh) in zip(readings, readings[1:]):
+        minute_of_week = (
+            moment.weekday() * MINUTES_IN_DAY + moment.hour * 60 + moment.minute
+        )
+        applying = [
+            element for element in ELEMENTS if element.applies_at(minute_of_week)
+        ]
+        energy = next(element for element in applying if element.dimension == ENERGY)
+        price_minute = next(
+            element for element in applying if element.dimension == TIME
+        )
+        costs += (to_kwh - from_kwh) * energy.price + price_minute.price
+    return costs
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import os
+import time
+import unittest
+
+os.environ.setdefault("CONFIG_PATH", ".env.test")
+
+import httpx
+import orjson
+import stripe
+from fastapi import FastAPI
+
+from api.endpoints.webhooks import connect_event_types, router as webhooks_router
+from config import Config
+from db.init_db import get_db
+from utils.stripe_webhook import verify_stripe_signature
+
+WEBHOOKS = 5000
+
+
+@unittest.skipUnless(os.environ.get("RUN_BENCHMARKS"), "set RUN_BENCHMARKS=1 to run")
+class WebhookIngestBenchmark(unittest.TestCase):
+    """Compares webhook ingest cost and measures route throughput for 1k webhooks/s."""
+
+    def test_ingest_cost_per_webhook(self):
+        secrets = [Config.STRIPE_ENDPOINT_SECRET_CONNECT]
+        for event_type in ["checkout.session.completed", "payment_intent.created"]:
+            payload, header = a_signed_event(event_type)
+
+            def legacy_ingest():
+                chunks = [payload[i : i + 1024] for i in range(0, len(payload), 1024)]
+                body = b""
+                for chunk in chunks:
+                    body += chunk
+                if json.loads(body.decode()).get("type") in connect_event_types:
+                    stripe.Webhook.construct_event(body, header, secrets[0])
+
+            def ingest():
+                body = b"".join(
+                    [payload[i : i + 1024] for i in range(0, len(payload), 1024)]
+                )
+                verify_stripe_signature(body, header, secrets)
+                orjson.loads(body).get("type")
+
+            legacy_seconds = timed(legacy_ingest, WEBHOOKS)
+            seconds = timed(ingest, WEBHOOKS)
+            print(
+                f"\n[webhook ingest] {event_type} ({len(payload)} bytes): "
+                f"legacy {legacy_seconds / WEBHOOKS * 1e6:.1f}us, "
+                f"now {seconds / WEBHOOKS * 1e6:.1f}us per webhook"
+            )
+            if event_type in connect_event_types:
+                self.assertLess(seconds, legacy_seconds)
+            else:
+                # Unhandled events used to skip signature verification entirely
+                self.assertLess(seconds, 1.5 * legacy_seconds)
+
+    def test_route_throughput(self):
+        app = FastAPI()
+        app.include_router(webhooks_router, prefix="/webhooks")
+        app.dependency_overrides[get_db] = lambda: None
+        payload, header = a_signed_event("payment_intent.created")
+
+        async def post_webhooks(count: int, clients: int = 20):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://test"
+            ) as client:
+
+                async def post():
+                    for _ in range(count // clients):
+                        response = await client.post(
+                            "/webhooks/stripe",
+                            content=payload,
+                            headers={"Stripe-Signature": header},
+                        )
+                        response.raise_for_status()
+
+                await asyncio.gather(*(post() for _ in range(clients)))
+
+        started = time.perf_counter()
+        asyncio.run(post_webhooks(1000))
+        elapsed = time.perf_counter() - started
+
+        rate = 1000 / elapsed
+        print(
+            f"\n[webhook ingest] route: 1000 webhooks in {elapsed:.2f}s = {rate:.0f}/s"
+        )
+        self.assertGreater(rate, 1000)
+
+
+def timed(func, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return time.perf_counter() - started
+
+
+def a_signed_event(event_type: str) -> tuple[bytes, str]:
+    """Builds a checkout.session-sized Stripe event signed with the connect secret."""
+    event = {
+        "id": "evt_1PqQ2RA1b2c3d4e5f6g7h8i9",
+        "object": "event",
+        "account": "acct_1Nv0FGQ9RKHgCVdK",
+        "api_version": "2023-10-16",
+        "created": int(time.time()),
+        "data": {
+            "object": {
+                "id": "cs_test_a1b2c3d4e5f6g7h8i9j0",
+                "object": "checkout.session",
+                "amount_subtotal": 5000,
+                "amount_total": 5000,
+                "automatic_tax": {"enabled": False, "liability": None, "status": None},
+                "cancel_url": "https://pay.example.com/checkout/DE*ABC*E1",
+                "created": int(time.time()),
+                "currency": "eur",
+                "customer_details": {
+                    "address": {
+                        "city": None,
+                        "country": "DE",
+                        "line1": None,
+                        "line2": None,
+                        "postal_code": "10115",
+                        "state": None,
+                    },
+                    "email": "driver@example.com",
+                    "name": "Jane Driver",
+                    "phone": None,
+                    "tax_exempt": "none",
+                    "tax_ids": [],
+                },
+                "expires_at": int(time.time()) + 86400,
+                "livemode": False,
+                "metadata": {"checkoutId": "1234"},
+                "mode": "payment",
+                "payment_intent": "pi_3PqQ2RA1b2c3d4e5",
+                "payment_method_types": ["card"],
+                "payment_status": "unpaid",
+                "status": "complete",
+                "success_url": "https://pay.example.com/charging/DE*ABC*E1/1234",
+                "total_details": {
+                    "amount_discount": 0,
+                    "amount_shipping": 0,
+                    "amount_tax": 0,
+                },
+                "url": None,
+            }
+        },
+        "livemode": False,
+        "pending_webhooks": 1,
+        "request": {"id": None, "idempotency_key": None},
+        "type": event_type,
+    }
+    payload = json.dumps(event, indent=2).encode()
+    timestamp = int(time.time())
+    signature = stripe.WebhookSignature._compute_signature(
+        f"{timestamp}.{payload.decode()}", Config.STRIPE_ENDPOINT_SECRET_CONNECT
+    )
+    return payload, f"t={timestamp},v1={signature}"
+
+
+if __name__ == "__main__":
+    unittest.main()
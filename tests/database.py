@@ -0,0 +1,64 @@
+import os
+
+os.environ.setdefault("CONFIG_PATH", ".env.test")
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from db.init_db import Base, Connector, Evse, Location, Operator, Tariff
+
+
+def sqlite_sessionmaker(url: str = "sqlite://", **engine_options) -> sessionmaker:
+    """Creates the payment schema in a SQLite database and returns a session factory."""
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False, "timeout": 30},
+        poolclass=StaticPool if url == "sqlite://" else None,
+        **engine_options,
+    )
+    if url != "sqlite://":
+
+        @event.listens_for(engine, "connect")
+        def _enable_wal(dbapi_connection, connection_record):
+            dbapi_connection.execute("pragma journal_mode=wal")
+
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def add_charging_station(db, evse_id: str = "DE*ABC*E1", **tariff_overrides) -> Evse:
+    """Adds an operator, location, tariff, EVSE and connector and returns the EVSE."""
+    tariff_values = {
+        "price_kwh": 0.30,
+        "price_minute": 0.05,
+        "price_session": 3.00,
+        "currency": "USD",
+        "tax_rate": 23,
+        "authorization_amount": 10.00,
+        "payment_fee": 1,
+    }
+    tariff_values.update(tariff_overrides)
+
+    operator = Operator(name=f"Operator {evse_id}", stripe_account_id=f"acct_{evse_id}")
+    location = Location(location_id=f"location-{evse_id}", operator=operator)
+    tariff = Tariff(**tariff_values)
+    evse = Evse(
+        evse_id=evse_id,
+        ocpp_evse_id=1,
+        status="Available",
+        station_id=f"station-{evse_id}",
+        tenant_id="T01",
+        location=location,
+    )
+    connector = Connector(
+        connector_id="1",
+        power_type="AC_3_PHASE",
+        max_voltage=400,
+        max_amperage=32,
+        evse=evse,
+        tariff=tariff,
+    )
+    db.add_all([operator, location, tariff, evse, connector])
+    db.commit()
+    return evse
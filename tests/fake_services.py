@@ -0,0 +1,178 @@
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from typing import Callable
+from urllib.parse import parse_qs, urlsplit
+
+# Answers a request with a status code and a JSON body
+Route = Callable[[re.Match, dict, bytes], tuple[int, dict]]
+
+
+class FakeService:
+    """
+    Serves JSON routes over HTTP on a free local port from a background thread.
+
+    Every request waits `latency` seconds before it is answered, which stands in for
+    the round trip to the real service. Requests are counted by route name.
+    """
+
+    def __init__(self, name: str, routes: list[tuple[str, str, Route]], latency=0.0):
+        self.name = name
+        self.routes = [
+            (method, re.compile(pattern), route) for method, pattern, route in routes
+        ]
+        self.latency = latency
+        self.requests: Counter[str] = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeService":
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name=f"fake-{self.name}", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def handle(self, method: str, path: str, body: bytes) -> tuple[int, dict]:
+        url = urlsplit(path)
+        # Base URLs joined with a trailing slash end up with "//" in the path
+        url_path = re.sub("/+", "/", url.path)
+        for route_method, pattern, route in self.routes:
+            match = pattern.fullmatch(url_path)
+            if route_method == method and match:
+                with self._lock:
+                    self.requests[route.__name__] += 1
+                time.sleep(self.latency)
+                return route(match, parse_qs(url.query), body)
+        return 404, {"error": f"No route for {method} {url_path}"}
+
+    def _handler_class(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_request(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                status, payload = service.handle(self.command, self.path, body)
+                response = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            do_GET = do_POST = do_PUT = do_DELETE = do_request
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def fake_stripe(latency: float = 0.0) -> FakeService:
+    """The Stripe API calls made for checkouts, payment links and captures."""
+    ids = count(1)
+
+    def create_checkout_session(match, query, body):
+        params = parse_qs(body.decode())
+        checkout_id = params["metadata[checkoutId]"][0]
+        return 200, {
+            "id": f"cs_{checkout_id}",
+            "object": "checkout.session",
+            "payment_intent": f"pi_{checkout_id}",
+            "url": f"https://checkout.stripe.test/{checkout_id}",
+        }
+
+    def create_price(match, query, body):
+        return 200, {"id": f"price_{next(ids)}", "object": "price"}
+
+    def create_payment_link(match, query, body):
+        payment_link_id = next(ids)
+        return 200, {
+            "id": f"plink_{payment_link_id}",
+            "object": "payment_link",
+            "url": f"https://buy.stripe.test/{payment_link_id}",
+        }
+
+    def capture_payment_intent(match, query, body):
+        params = parse_qs(body.decode())
+        return 200, {
+            "id": match["id"],
+            "object": "payment_intent",
+            "status": "succeeded",
+            "amount_received": int(params["amount_to_capture"][0]),
+        }
+
+    def cancel_payment_intent(match, query, body):
+        return 200, {
+            "id": match["id"],
+            "object": "payment_intent",
+            "status": "canceled",
+        }
+
+    return FakeService(
+        "stripe",
+        [
+            ("POST", "/v1/checkout/sessions", create_checkout_session),
+            ("POST", "/v1/prices", create_price),
+            ("POST", "/v1/payment_links", create_payment_link),
+            (
+                "POST",
+                "/v1/payment_intents/(?P<id>[^/]+)/capture",
+                capture_payment_intent,
+            ),
+            ("POST", "/v1/payment_intents/(?P<id>[^/]+)/cancel", cancel_payment_intent),
+        ],
+        latency,
+    )
+
+
+def fake_citrineos(latency: float = 0.0) -> FakeService:
+    """The CitrineOS message API under /ocpp and data API under /data."""
+
+    def put_authorization(match, query, body):
+        return 200, json.loads(body)
+
+    def send_message(match, query, body):
+        return 200, {"success": True, "payload": match["action"]}
+
+    return FakeService(
+        "citrineos",
+        [
+            ("PUT", "/data/evdriver/authorization", put_authorization),
+            ("POST", "/ocpp/(?P<module>[^/]+)/(?P<action>[^/]+)", send_message),
+        ],
+        latency,
+    )
+
+
+def fake_directus(latency: float = 0.0) -> FakeService:
+    """The Directus file upload used for Scan and Charge QR codes."""
+    ids = count(1)
+
+    def upload_file(match, query, body):
+        return 200, {"data": {"id": f"file-{next(ids)}"}}
+
+    return FakeService(
+        "directus",
+        [("POST", "/files", upload_file)],
+        latency,
+    )
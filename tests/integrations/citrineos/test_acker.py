@@ -0,0 +1,106 @@
+import asyncio
+import unittest
+
+from tests.amqp import FakeChannel, FakeMessage
+
+from integrations.citrineos.acker import MessageAcker, ThroughputMeter
+
+
+class MessageAckerTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.channel = FakeChannel()
+        self.addCleanup(self.channel.close)
+
+    def deliver(self, acker: MessageAcker, count: int) -> list[FakeMessage]:
+        messages = []
+        for _ in range(count):
+            message = FakeMessage({})
+            self.channel.deliver(message)
+            acker.track(message)
+            messages.append(message)
+        return messages
+
+    async def test_batch_size_one_acks_every_message(self):
+        acker = MessageAcker(batch_size=1)
+        messages = self.deliver(acker, 3)
+
+        for message in messages:
+            await acker.ack(message)
+
+        self.assertTrue(all(message.acked for message in messages))
+        self.assertEqual(self.channel.frames, 3)
+
+    async def test_full_batch_is_acked_with_one_frame(self):
+        acker = MessageAcker(batch_size=5, max_delay=10)
+        messages = self.deliver(acker, 10)
+
+        for message in messages:
+            await acker.ack(message)
+
+        self.assertTrue(all(message.acked for message in messages))
+        self.assertEqual(self.channel.frames, 2)
+
+    async def test_message_in_progress_is_not_covered_by_batch_ack(self):
+        acker = MessageAcker(batch_size=3, max_delay=10)
+        messages = self.deliver(acker, 4)
+
+        for message in messages[1:]:
+            await acker.ack(message)
+        await acker.flush()
+
+        self.assertFalse(any(message.acked for message in messages))
+
+        await acker.ack(messages[0])
+
+        self.assertTrue(all(message.acked for message in messages))
+        self.assertEqual(self.channel.frames, 1)
+
+    async def test_failed_and_requeued_messages_are_settled_on_their_own(self):
+        acker = MessageAcker(batch_size=4, max_delay=10)
+        messages = self.deliver(acker, 4)
+
+        await acker.ack(messages[0])
+        await acker.reject(messages[1])
+        await acker.requeue(messages[2])
+        await acker.ack(messages[3])
+        await acker.flush()
+
+        self.assertTrue(messages[0].acked)
+        self.assertTrue(messages[1].rejected)
+        self.assertTrue(messages[2].requeued)
+        self.assertTrue(messages[3].acked)
+        self.assertEqual(self.channel.frames, 3)
+        self.assertEqual(self.channel.unsettled, {})
+
+    async def test_partial_batch_is_acked_after_max_delay(self):
+        acker = MessageAcker(batch_size=10, max_delay=0.01)
+        messages = self.deliver(acker, 2)
+
+        for message in messages:
+            await acker.ack(message)
+        self.assertFalse(any(message.acked for message in messages))
+        await asyncio.sleep(0.05)
+
+        self.assertTrue(all(message.acked for message in messages))
+        self.assertEqual(self.channel.frames, 1)
+
+
+class ThroughputMeterTests(unittest.IsolatedAsyncioTestCase):
+    async def test_rate_counts_settled_messages_since_last_report(self):
+        channel = FakeChannel()
+        self.addCleanup(channel.close)
+        acker = MessageAcker(batch_size=1)
+        meter = ThroughputMeter(acker)
+
+        for _ in range(5):
+            message = FakeMessage({})
+            channel.deliver(message)
+            await acker.ack(message)
+        await asyncio.sleep(0.01)
+
+        self.assertGreater(meter.rate(), 0)
+        self.assertEqual(meter.rate(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import unittest
+from unittest.mock import patch
+
+from tests.amqp import FakeQueue
+
+from integrations.citrineos.backpressure import (
+    AdmissionController,
+    parse_latency_limits,
+)
+from utils.dependency_stats import DependencyStats
+
+
+class ParseLatencyLimitsTests(unittest.TestCase):
+    def test_parses_limits_in_seconds(self):
+        self.assertEqual(
+            parse_latency_limits("postgres:500, stripe:5000,"),
+            {"postgres": 0.5, "stripe": 5.0},
+        )
+
+
+class AdmissionControllerTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.queue = FakeQueue()
+        self.postgres = DependencyStats("postgres")
+        self.controller = AdmissionController(
+            pause=self.pause,
+            resume=self.resume,
+            stats={"postgres": self.postgres},
+            latency_limits={"postgres": 0.5},
+            max_error_rate=0.5,
+            max_in_flight=3,
+            min_calls=2,
+            resume_after=5,
+        )
+
+    async def pause(self):
+        await self.queue.cancel("consumer-1")
+
+    async def resume(self):
+        self.queue.cancelled = False
+        await self.queue.consume(lambda message: None)
+
+    def record(self, count: int, seconds: float, error: bool = False):
+        for _ in range(count):
+            self.postgres.started()
+            self.postgres.finished(seconds, error)
+
+    async def test_healthy_dependency_is_not_throttled(self):
+        self.record(10, 0.1)
+        self.record(2, 0.1, error=True)
+
+        await self.controller.check()
+
+        self.assertFalse(self.controller.throttled)
+        self.assertFalse(self.queue.cancelled)
+
+    async def test_pauses_on_high_latency(self):
+        self.record(3, 0.8)
+
+        await self.controller.check()
+
+        self.assertTrue(self.controller.throttled)
+        self.assertTrue(self.queue.cancelled)
+        self.assertEqual(
+            self.controller.throttle_reasons, ["postgres: average latency 800ms"]
+        )
+
+    async def test_pauses_on_high_error_rate(self):
+        self.record(1, 0.1)
+        self.record(2, 0.1, error=True)
+
+        await self.controller.check()
+
+        self.assertEqual(
+            self.controller.throttle_reasons, ["postgres: 2/3 calls failed"]
+        )
+
+    async def test_pauses_on_too_many_calls_in_flight(self):
+        for _ in range(4):
+            self.postgres.started()
+
+        await self.controller.check()
+
+        self.assertEqual(
+            self.controller.throttle_reasons, ["postgres: 4 calls in flight"]
+        )
+
+    async def test_ignores_latency_below_min_calls(self):
+        self.record(1, 10)
+
+        await self.controller.check()
+
+        self.assertFalse(self.controller.throttled)
+
+    async def test_resumes_after_dependency_was_healthy_long_enough(self):
+        self.record(3, 0.8)
+        with patch("integrations.citrineos.backpressure.time.monotonic") as now:
+            await self.controller.check()
+            self.postgres = DependencyStats("postgres")
+            self.controller.stats = {"postgres": self.postgres}
+
+            now.return_value = 100
+            await self.controller.check()
+            now.return_value = 104
+            await self.controller.check()
+
+            self.assertTrue(self.controller.throttled)
+            self.assertTrue(self.queue.cancelled)
+
+            now.return_value = 105
+            await self.controller.check()
+
+        self.assertFalse(self.controller.throttled)
+        self.assertFalse(self.queue.cancelled)
+        self.assertEqual(self.controller.throttle_count, 1)
+
+    async def test_overload_while_paused_restarts_the_resume_period(self):
+        self.record(3, 0.8)
+        await self.controller.check()
+        self.controller.stats = {"postgres": DependencyStats("postgres")}
+        with patch("integrations.citrineos.backpressure.time.monotonic") as now:
+            now.return_value = 100
+            await self.controller.check()
+            self.controller.stats = {"postgres": self.postgres}
+            await self.controller.check()
+            self.controller.stats = {"postgres": DependencyStats("postgres")}
+            now.return_value = 104
+            await self.controller.check()
+            now.return_value = 105
+            await self.controller.check()
+
+            self.assertTrue(self.controller.throttled)
+
+            now.return_value = 109
+            await self.controller.check()
+
+        self.assertFalse(self.controller.throttled)
+        self.assertEqual(self.controller.throttle_count, 1)
@@ -0,0 +1,588 @@
+import asyncio
+import json
+import tempfile
+import threading
+import unittest
+from datetime import timedelta
+from functools import partial
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, Mock, patch
+
+from prometheus_client import REGISTRY
+
+from tests.amqp import FakeMessage, a_connected_queue, wait_until
+from tests.database import add_charging_station, sqlite_sessionmaker
+
+from db.init_db import Checkout, MeterSample, Tariff
+from integrations.citrineos.backpressure import AdmissionController
+from integrations.citrineos.citrineos import (
+    CitrineOSeventHeaders,
+    CitrineOSIntegration,
+    CitrineOsEventAction,
+    InvalidCitrineOSevent,
+    decode_incoming_event,
+)
+from schemas.transaction_event import TransactionEventRequest
+from utils.cache import topology_cache
+from utils.dependency_stats import POSTGRES, DependencyStats
+from utils.meter_values import InvalidMeterValueError
+from utils.ocpp_event_dedup import OcppEventDeduplicator
+
+
+class ProcessIncomingEventTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.integration = CitrineOSIntegration(fileIntegration=None)
+        self.integration.event_deduplicator = OcppEventDeduplicator(
+            window=timedelta(hours=1), session_factory=sqlite_sessionmaker()
+        )
+        patcher = patch.object(
+            self.integration, "process_transaction_updated", new_callable=AsyncMock
+        )
+        self.process_transaction_updated = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def receive(self, message):
+        await self.integration.process_incoming_event(
+            event_message=message, exchange=None
+        )
+
+    async def test_redelivered_transaction_event_is_processed_once(self):
+        message = a_transaction_event_message(seqNo=5)
+
+        await self.receive(message)
+        await self.receive(message)
+
+        self.process_transaction_updated.assert_awaited_once()
+
+    async def test_next_transaction_event_is_processed(self):
+        await self.receive(a_transaction_event_message(seqNo=5))
+        await self.receive(a_transaction_event_message(seqNo=6))
+
+        self.assertEqual(self.process_transaction_updated.await_count, 2)
+
+    async def test_status_notification_is_processed(self):
+        with patch.object(
+            self.integration, "process_status_notification", new_callable=AsyncMock
+        ) as process_status_notification:
+            await self.receive(
+                FakeMessage(
+                    {
+                        "action": "StatusNotification",
+                        "payload": {
+                            "timestamp": "2024-05-01T10:00:00Z",
+                            "connectorId": 1,
+                            "evseId": 1,
+                            "connectorStatus": "Occupied",
+                        },
+                    },
+                    {"stationId": "CS01", "action": "StatusNotification"},
+                )
+            )
+
+        status_notification = process_status_notification.await_args.kwargs[
+            "status_notification"
+        ]
+        self.assertEqual(status_notification.connectorStatus, "Occupied")
+
+    async def test_invalid_events_are_dropped(self):
+        for message in [
+            FakeMessage(b"not json", {"stationId": "CS01"}),
+            FakeMessage({"action": "Heartbeat", "payload": {}}, {"stationId": "CS01"}),
+        ]:
+            with self.subTest(body=message.body):
+                await self.receive(message)
+
+        self.process_transaction_updated.assert_not_awaited()
+
+    async def test_invalid_meter_value_is_dropped(self):
+        self.process_transaction_updated.side_effect = InvalidMeterValueError("value")
+
+        await self.receive(a_transaction_event_message(seqNo=5))
+
+        self.process_transaction_updated.assert_awaited_once()
+
+    async def test_failed_transaction_event_is_processed_again(self):
+        self.process_transaction_updated.side_effect = [Exception("DB down"), None]
+        message = a_transaction_event_message(seqNo=5)
+
+        with self.assertRaises(Exception):
+            await self.receive(message)
+        await self.receive(message)
+
+        self.assertEqual(self.process_transaction_updated.await_count, 2)
+
+
+class UpdateCheckoutWithMeterValuesTests(unittest.TestCase):
+    def test_accumulates_energy_and_sets_power_and_soc(self):
+        integration = CitrineOSIntegration(fileIntegration=None)
+        checkout = Checkout()
+
+        for energy, power, soc in [(1000, 7400, 40), (3500, 11000, 45)]:
+            transaction_event = TransactionEventRequest(
+                eventType="Updated",
+                timestamp="2024-05-01T10:00:00Z",
+                triggerReason="MeterValuePeriodic",
+                transactionInfo={"transactionId": "tx-1"},
+                meterValue=[
+                    {
+                        "sampledValue": [
+                            {"value": energy},
+                            {"value": 230, "measurand": "Voltage", "phase": "L1-N"},
+                            {
+                                "value": power,
+                                "measurand": "Power.Active.Import",
+                                "unitOfMeasure": {"unit": "W"},
+                            },
+                            {"value": soc, "measurand": "SoC"},
+                        ]
+                    }
+                ],
+            )
+            checkout = integration.update_checkout_with_meter_values(
+                transaction_event=transaction_event, db_checkout=checkout
+            )
+
+        self.assertEqual(checkout.transaction_kwh, 2.5)
+        self.assertEqual(checkout.transaction_last_meter_reading, 3.5)
+        self.assertEqual(checkout.power_active_import, 11.0)
+        self.assertEqual(checkout.transaction_soc, 45)
+
+    def test_records_a_meter_sample_per_event_with_readings(self):
+        integration = CitrineOSIntegration(fileIntegration=None)
+        SessionLocal = sqlite_sessionmaker()
+        with SessionLocal() as db:
+            checkout = Checkout()
+            db.add(checkout)
+            db.commit()
+
+            for meter_value in [[{"sampledValue": [{"value": 1500}]}], None]:
+                integration.update_checkout_with_meter_values(
+                    transaction_event=TransactionEventRequest(
+                        eventType="Updated",
+                        timestamp="2024-05-01T10:00:00Z",
+                        triggerReason="MeterValuePeriodic",
+                        transactionInfo={"transactionId": "tx-1"},
+                        meterValue=meter_value,
+                    ),
+                    db_checkout=checkout,
+                )
+                db.commit()
+
+            [sample] = db.query(MeterSample).all()
+            self.assertEqual(sample.checkout_id, checkout.id)
+            self.assertEqual(sample.transaction_kwh, 0)
+            self.assertEqual(checkout.transaction_last_meter_reading, 1.5)
+
+
+class ScanAndChargeTests(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.SessionLocal = sqlite_sessionmaker(f"sqlite:///{tmp_dir.name}/events.db")
+        self.addCleanup(self.SessionLocal.kw["bind"].dispose)
+        with self.SessionLocal() as db:
+            add_charging_station(db, evse_id="DE*ABC*E1")
+
+        self.checked_out = {}
+        self.integration = CitrineOSIntegration(
+            fileIntegration=Mock(
+                upload_file=self.recording("upload_file", "https://files.test/qr.png")
+            )
+        )
+        for patcher in [
+            patch("db.init_db.SessionLocal", self.SessionLocal),
+            patch(
+                "integrations.citrineos.citrineos.stripe.Price.create",
+                self.recording("Price.create", SimpleNamespace(id="price_1")),
+            ),
+            patch(
+                "integrations.citrineos.citrineos.stripe.PaymentLink.create",
+                self.recording(
+                    "PaymentLink.create", SimpleNamespace(url="https://pay.test/1")
+                ),
+            ),
+            patch.object(
+                self.integration,
+                "send_citrineos_message",
+                self.recording("send_citrineos_message", None),
+            ),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def recording(self, name, result):
+        def call(*args, **kwargs):
+            self.checked_out[name] = self.SessionLocal.kw["bind"].pool.checkedout()
+            return result
+
+        return call
+
+    def start_transaction(self):
+        self.integration._process_transaction_started_scan_and_charge(
+            TransactionEventRequest(
+                eventType="Started",
+                timestamp="2024-05-01T10:00:00Z",
+                triggerReason="CablePluggedIn",
+                transactionInfo={"transactionId": "tx-1"},
+            ),
+            CitrineOSeventHeaders(stationId="station-DE*ABC*E1"),
+        )
+
+    def test_returns_connections_to_the_pool(self):
+        # Handlers run once per event in the consumer, a session left open keeps its
+        # connection checked out until garbage collection
+        self.start_transaction()
+
+        self.assertEqual(self.SessionLocal.kw["bind"].pool.checkedout(), 0)
+
+    def test_holds_no_connection_during_external_calls(self):
+        self.start_transaction()
+
+        self.assertEqual(
+            self.checked_out,
+            {
+                "Price.create": 0,
+                "PaymentLink.create": 0,
+                "upload_file": 0,
+                "send_citrineos_message": 0,
+            },
+        )
+        with self.SessionLocal() as db:
+            self.assertEqual(db.query(Tariff).one().stripe_price_id, "price_1")
+            self.assertEqual(db.query(Checkout).one().qr_code_message_id, 0)
+
+    def test_drops_the_tariff_with_its_new_price_from_the_cache(self):
+        with self.SessionLocal() as db:
+            tariff_id = db.query(Tariff).one().id
+        topology_cache.set(f"tariffs:{tariff_id}", b"cached", ttl=60)
+
+        self.start_transaction()
+
+        self.assertIsNone(topology_cache.get(f"tariffs:{tariff_id}"))
+
+
+class DecodeIncomingEventTests(unittest.TestCase):
+    def test_returns_action_and_payload_of_handled_events(self):
+        for action in ["TransactionEvent", "StatusNotification"]:
+            with self.subTest(action=action):
+                message = FakeMessage(
+                    {"action": action, "payload": {"evseId": 1}}, {"action": action}
+                )
+
+                self.assertEqual(
+                    decode_incoming_event(message),
+                    (CitrineOsEventAction(action), {"evseId": 1}),
+                )
+
+    def test_unhandled_header_action_is_skipped_without_parsing_the_body(self):
+        message = FakeMessage(b"not json", {"action": "Heartbeat"})
+
+        self.assertIsNone(decode_incoming_event(message))
+
+    def test_unhandled_body_action_is_skipped(self):
+        message = FakeMessage({"action": "Heartbeat", "payload": {}})
+
+        self.assertIsNone(decode_incoming_event(message))
+
+    def test_invalid_body_is_rejected(self):
+        for body in [b"not json", b"[1, 2]"]:
+            with self.subTest(body=body):
+                with self.assertRaises(InvalidCitrineOSevent):
+                    decode_incoming_event(FakeMessage(body))
+
+
+class ReceiveEventsTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.integration = CitrineOSIntegration(fileIntegration=None)
+        connected_queue = a_connected_queue()
+        self.connection, _, self.queue, self.retry_router = connected_queue
+        patcher = patch.object(
+            self.integration,
+            "connect_event_queue",
+            new_callable=AsyncMock,
+            return_value=connected_queue,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.processed = []
+        self.failures = {}
+        self.release = asyncio.Event()
+        self.release.set()
+        patcher = patch.object(
+            self.integration, "process_incoming_event", side_effect=self.process
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def process(self, event_message, exchange):
+        body = json.loads(event_message.body)
+        await asyncio.sleep(0.001 * (body["n"] % 3))
+        await self.release.wait()
+        if self.failures.get(body["n"]):
+            self.failures[body["n"]] -= 1
+            raise Exception("DB down")
+        self.processed.append((event_message.headers["stationId"], body["n"]))
+
+    async def start(self, workers, ack_batch_size=1):
+        self.stop = asyncio.Event()
+        self.consumer = asyncio.create_task(
+            self.integration.receive_events(
+                workers=workers, stop=self.stop, ack_batch_size=ack_batch_size
+            )
+        )
+        await wait_until(lambda: self.queue.callback is not None)
+
+    async def test_reports_messages_waiting_in_the_broker_queue(self):
+        self.queue.ready = [FakeMessage({"n": n}) for n in range(3)]
+        report = asyncio.create_task(
+            self.integration._report_waiting_messages(self.queue)
+        )
+
+        await wait_until(
+            lambda: REGISTRY.get_sample_value("citrineos_consumer_waiting_messages")
+            == 3
+        )
+        report.cancel()
+
+    async def test_events_of_a_station_are_processed_in_order(self):
+        await self.start(workers=3)
+
+        messages = [
+            FakeMessage({"n": n}, {"stationId": f"CS{n % 4}"}) for n in range(20)
+        ]
+        for message in messages:
+            await self.queue.publish(message)
+        await wait_until(lambda: len(self.processed) == 20)
+        self.stop.set()
+        await self.consumer
+
+        for station in range(4):
+            numbers = [n for s, n in self.processed if s == f"CS{station}"]
+            self.assertEqual(numbers, sorted(numbers))
+        self.assertTrue(all(message.acked for message in messages))
+
+    async def test_batched_acks_settle_every_message(self):
+        await self.start(workers=3, ack_batch_size=8)
+
+        messages = [
+            FakeMessage({"n": n}, {"stationId": f"CS{n % 4}"}) for n in range(20)
+        ]
+        for message in messages:
+            await self.queue.publish(message)
+        await wait_until(lambda: len(self.processed) == 20)
+        self.stop.set()
+        await self.consumer
+
+        self.assertTrue(all(message.acked for message in messages))
+        self.assertLess(self.queue.channel.frames, 20)
+
+    async def expire_retries(self) -> None:
+        """Delivers the messages in the retry queues again, like their TTL does."""
+        published = self.retry_router.exchange.published
+        while published:
+            routing_key, message = published.pop(0)
+            self.assertIn(".retry.", routing_key)
+            await self.queue.publish(FakeMessage(message.body, message.headers))
+
+    async def test_failed_message_is_published_for_retry(self):
+        await self.start(workers=1)
+        self.failures = {0: 1}
+
+        message = FakeMessage({"n": 0}, {"stationId": "CS01"})
+        await self.queue.publish(message)
+        await wait_until(lambda: message.acked)
+        self.stop.set()
+        await self.consumer
+
+        [(routing_key, retry)] = self.retry_router.exchange.published
+        self.assertEqual(routing_key, "paymentService.retry.10ms")
+        self.assertEqual(retry.headers["retry-attempts"], 1)
+        self.assertEqual(retry.headers["stationId"], "CS01")
+
+    async def test_later_events_of_a_station_are_parked_behind_its_retry(self):
+        await self.start(workers=2, ack_batch_size=8)
+        self.failures = {0: 1}
+
+        messages = [
+            FakeMessage({"n": 0}, {"stationId": "CS01"}),
+            FakeMessage({"n": 1}, {"stationId": "CS01"}),
+            FakeMessage({"n": 2}, {"stationId": "CS02"}),
+        ]
+        for message in messages:
+            await self.queue.publish(message)
+        # Nothing waits unacknowledged in the consumer
+        await wait_until(lambda: all(message.acked for message in messages))
+        self.assertEqual(
+            [
+                (routing_key, json.loads(message.body)["n"])
+                for routing_key, message in self.retry_router.exchange.published
+            ],
+            [("paymentService.retry.10ms", 0), ("paymentService.retry.10ms", 1)],
+        )
+
+        await self.expire_retries()
+        await wait_until(lambda: len(self.processed) == 3)
+        self.stop.set()
+        await self.consumer
+
+        self.assertEqual(
+            [n for station, n in self.processed if station == "CS01"], [0, 1]
+        )
+        self.assertEqual(self.retry_router.exchange.published, [])
+
+    async def test_parked_events_follow_a_retry_that_fails_again(self):
+        await self.start(workers=1)
+        self.failures = {0: 2}
+
+        for n in range(2):
+            await self.queue.publish(FakeMessage({"n": n}, {"stationId": "CS01"}))
+        await wait_until(lambda: len(self.retry_router.exchange.published) == 2)
+        await self.expire_retries()
+        await wait_until(lambda: len(self.retry_router.exchange.published) == 2)
+
+        self.assertEqual(
+            [routing_key for routing_key, _ in self.retry_router.exchange.published],
+            ["paymentService.retry.100ms", "paymentService.retry.100ms"],
+        )
+        await self.expire_retries()
+        await wait_until(lambda: len(self.processed) == 2)
+        self.stop.set()
+        await self.consumer
+
+        self.assertEqual(self.processed, [("CS01", 0), ("CS01", 1)])
+
+    async def test_failed_message_is_rejected_if_retry_cannot_be_published(self):
+        await self.start(workers=1)
+        self.failures = {0: 1}
+        self.retry_router.exchange.publish = AsyncMock(side_effect=Exception("down"))
+
+        message = FakeMessage({"n": 0}, {"stationId": "CS01"})
+        await self.queue.publish(message)
+        await wait_until(lambda: message.rejected)
+        self.stop.set()
+        await self.consumer
+
+        self.assertFalse(message.requeued)
+
+    async def test_stop_drains_messages_in_progress_and_requeues_the_rest(self):
+        await self.start(workers=1)
+        self.release.clear()
+
+        in_progress = FakeMessage({"n": 0}, {"stationId": "CS01"})
+        waiting = FakeMessage({"n": 1}, {"stationId": "CS01"})
+        await self.queue.publish(in_progress)
+        await self.queue.publish(waiting)
+        await asyncio.sleep(0.01)
+
+        self.stop.set()
+        await asyncio.sleep(0.01)
+        self.release.set()
+        await self.consumer
+
+        self.assertTrue(in_progress.acked)
+        self.assertTrue(waiting.requeued)
+        self.assertFalse(waiting.acked)
+        self.assertEqual(self.processed, [("CS01", 0)])
+        self.assertTrue(self.queue.cancelled)
+        self.assertTrue(self.connection.closed)
+
+
+class ConcurrentHandlersTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        # Events are claimed concurrently, which the shared in-memory database does
+        # not support
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        SessionLocal = sqlite_sessionmaker(f"sqlite:///{tmp_dir.name}/events.db")
+        self.addCleanup(SessionLocal.kw["bind"].dispose)
+        self.integration = CitrineOSIntegration(fileIntegration=None)
+        self.integration.event_deduplicator = OcppEventDeduplicator(
+            window=timedelta(hours=1), session_factory=SessionLocal
+        )
+        connected_queue = a_connected_queue()
+        self.queue = connected_queue[2]
+        patcher = patch.object(
+            self.integration,
+            "connect_event_queue",
+            new_callable=AsyncMock,
+            return_value=connected_queue,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def consume(self, handler, **controller_options):
+        patcher = patch.object(
+            self.integration, "_process_transaction_updated", side_effect=handler
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch(
+            "integrations.citrineos.citrineos.AdmissionController",
+            partial(AdmissionController, check_interval=0.01, **controller_options),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.stop = asyncio.Event()
+        self.consumer = asyncio.create_task(
+            self.integration.receive_events(workers=2, stop=self.stop)
+        )
+        await wait_until(lambda: self.queue.callback is not None)
+        # CS01 and CS04 are assigned to different workers
+        messages = [
+            a_transaction_event_message(station_id=station_id)
+            for station_id in ["CS01", "CS04"]
+        ]
+        for message in messages:
+            await self.queue.publish(message)
+        return messages
+
+    async def test_handlers_of_different_workers_run_concurrently(self):
+        # Passes only if both handlers are blocked at the same time
+        barrier = threading.Barrier(2, timeout=5)
+
+        messages = await self.consume(lambda transaction_event: barrier.wait())
+        await wait_until(lambda: all(message.acked for message in messages))
+        self.stop.set()
+        await self.consumer
+
+        self.assertFalse(barrier.broken)
+
+    async def test_pauses_while_concurrent_handlers_overload_a_dependency(self):
+        postgres = DependencyStats(POSTGRES)
+        release = threading.Event()
+
+        def handler(transaction_event):
+            with postgres.track():
+                release.wait(timeout=5)
+
+        messages = await self.consume(
+            handler, stats={POSTGRES: postgres}, max_in_flight=1
+        )
+        controller = self.integration.admission_controller
+        await wait_until(lambda: controller.throttled)
+        self.assertTrue(self.queue.cancelled)
+        self.assertEqual(controller.throttle_reasons, ["postgres: 2 calls in flight"])
+
+        release.set()
+        await wait_until(lambda: all(message.acked for message in messages))
+        self.stop.set()
+        await self.consumer
+
+
+def a_transaction_event_message(station_id="CS01", **fields):
+    payload = {
+        "eventType": "Updated",
+        "timestamp": "2024-05-01T10:00:00Z",
+        "triggerReason": "MeterValuePeriodic",
+        "transactionInfo": {"transactionId": "tx-1", "remoteStartId": 1},
+    }
+    payload.update(fields)
+    return FakeMessage(
+        {"action": "TransactionEvent", "payload": payload}, {"stationId": station_id}
+    )
+
+
+if __name__ == "__main__":
+    unittest.main()
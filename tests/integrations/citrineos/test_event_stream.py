@@ -0,0 +1,276 @@
+import asyncio
+import io
+import os
+import unittest
+from datetime import datetime, timezone
+from itertools import groupby
+from unittest.mock import AsyncMock, patch
+
+from prometheus_client import CollectorRegistry
+
+os.environ.setdefault("CONFIG_PATH", ".env.test")
+
+from tests.amqp import FakeExchange
+
+from integrations.citrineos.citrineos import (
+    CitrineOSeventHeaders,
+    CitrineOsEventAction,
+    decode_incoming_event,
+)
+from integrations.citrineos.event_stream import (
+    InProcessConsumer,
+    ReplayedMessage,
+    broker_publisher,
+    event_label,
+    generate_events,
+    histogram_deltas,
+    read_events,
+    replay_events,
+    write_events,
+)
+from schemas.status_notification import StatusNotificationRequest
+from schemas.transaction_event import TransactionEventRequest
+from utils.meter_values import ENERGY, extract_meter_readings
+from utils.metrics import Histogram, histogram_totals
+
+START = datetime(2024, 8, 15, 8, 0, tzinfo=timezone.utc)
+
+
+def some_events(**kwargs) -> list:
+    return list(
+        generate_events(
+            **{"stations": 5, "hours": 6, "meter_interval": 300, "start": START}
+            | kwargs
+        )
+    )
+
+
+class GenerateEventsTests(unittest.TestCase):
+    def test_is_ordered_by_time_and_repeatable(self):
+        events = some_events()
+
+        self.assertGreater(len(events), 50)
+        self.assertEqual([event.at for event in events], sorted(e.at for e in events))
+        self.assertEqual(events, some_events())
+        self.assertNotEqual(events, some_events(seed=1))
+
+    def test_generates_sessions_per_station(self):
+        events = sorted(some_events(), key=lambda event: event.headers["stationId"])
+
+        for station_id, station_events in groupby(
+            events, key=lambda event: event.headers["stationId"]
+        ):
+            steps = " ".join(
+                event.body["payload"].get("eventType")
+                or event.body["payload"]["connectorStatus"]
+                for event in station_events
+            )
+            with self.subTest(station_id=station_id):
+                self.assertRegex(
+                    steps, r"^(Occupied Started( Updated)* Ended Available ?)+$"
+                )
+
+    def test_events_are_valid_citrineos_events(self):
+        for event in some_events(stations=2):
+            message = ReplayedMessage(event)
+            action, payload = decode_incoming_event(message)
+            CitrineOSeventHeaders.model_validate(message.headers)
+            with self.subTest(event=event_label(event), at=event.at):
+                self.assertEqual(message.headers["action"], action.value)
+                self.assertEqual(message.headers["state"], "1")
+                if action == CitrineOsEventAction.TRANSACTIONEVENT:
+                    transaction_event = TransactionEventRequest.model_validate(payload)
+                    self.assertEqual(
+                        transaction_event.timestamp.timestamp(),
+                        START.timestamp() + event.at,
+                    )
+                    self.assertEqual(
+                        [
+                            measurand
+                            for measurand, _ in extract_meter_readings(
+                                transaction_event.meterValue
+                            )
+                        ],
+                        [ENERGY, "Power.Active.Import", "SoC"],
+                    )
+                else:
+                    StatusNotificationRequest.model_validate(payload)
+
+    def test_meter_readings_and_sequence_numbers_increase_per_transaction(self):
+        transactions = {}
+        for event in some_events():
+            payload = event.body["payload"]
+            if event.headers["action"] == "TransactionEvent":
+                transactions.setdefault(
+                    payload["transactionInfo"]["transactionId"], []
+                ).append(payload)
+
+        for transaction_id, payloads in transactions.items():
+            with self.subTest(transaction_id=transaction_id):
+                self.assertEqual(
+                    [payload["seqNo"] for payload in payloads],
+                    list(range(len(payloads))),
+                )
+                energy = [
+                    payload["meterValue"][0]["sampledValue"][0]["value"]
+                    for payload in payloads
+                ]
+                self.assertEqual(energy, sorted(energy))
+                self.assertLess(energy[0], energy[-1])
+
+    def test_remote_starts_consecutive_checkouts(self):
+        started = [
+            event.body["payload"]
+            for event in some_events(first_remote_start_id=100)
+            if event_label(event) == "TransactionEvent Started"
+        ]
+
+        self.assertEqual(
+            sorted(payload["transactionInfo"]["remoteStartId"] for payload in started),
+            list(range(100, 100 + len(started))),
+        )
+        self.assertEqual(
+            {payload["triggerReason"] for payload in started}, {"RemoteStart"}
+        )
+        self.assertNotIn("idToken", started[0])
+
+    def test_writes_and_reads_json_lines(self):
+        events = some_events(stations=2)
+        file = io.BytesIO()
+
+        self.assertEqual(write_events(events, file), len(events))
+        file.seek(0)
+
+        self.assertEqual(list(read_events(file)), events)
+
+
+class ReplayEventsTests(unittest.IsolatedAsyncioTestCase):
+    def fake_clock(self) -> list[float]:
+        """Patches the loop clock and sleep, sleeping advances the returned clock."""
+        clock = [100.0]
+
+        async def sleep(delay):
+            clock[0] += delay
+
+        for patcher in [
+            patch.object(asyncio.get_running_loop(), "time", lambda: clock[0]),
+            patch("integrations.citrineos.event_stream.asyncio.sleep", sleep),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return clock
+
+    async def test_publishes_at_rate(self):
+        clock = self.fake_clock()
+        events = some_events(stations=1)[:10]
+        published = []
+
+        async def publish(event):
+            published.append((clock[0], event))
+
+        stats = await replay_events(events, publish, rate=200)
+
+        self.assertEqual([event for _, event in published], events)
+        self.assertEqual(stats.published, 10)
+        for index, (at, _) in enumerate(published):
+            self.assertAlmostEqual(at - 100.0, index / 200)
+            self.assertAlmostEqual(stats.lags[index], 0.0)
+
+    async def test_keeps_recorded_timing_at_speed(self):
+        clock = self.fake_clock()
+        events = some_events(stations=1)[:3]
+        published_at = []
+
+        async def publish(event):
+            published_at.append(clock[0])
+            # Publishing the first event takes longer than the gap to the second
+            if event is events[0]:
+                clock[0] += (events[1].at - events[0].at) / 10 + 0.5
+
+        stats = await replay_events(events, publish, speed=10)
+
+        self.assertAlmostEqual(published_at[0] - 100.0, events[0].at / 10)
+        self.assertAlmostEqual(
+            published_at[1], published_at[0] + 0.5 + (events[1].at - events[0].at) / 10
+        )
+        self.assertAlmostEqual(published_at[2] - 100.0, events[2].at / 10)
+        self.assertAlmostEqual(stats.lags[0], 0.0)
+        self.assertAlmostEqual(stats.lags[1], 0.5)
+        self.assertAlmostEqual(stats.lags[2], 0.0)
+
+    async def test_publishes_to_exchange_with_headers(self):
+        event = some_events(stations=1)[0]
+        exchange = FakeExchange()
+
+        await replay_events([event], broker_publisher(exchange))
+
+        routing_key, message = exchange.published[0]
+        self.assertEqual(routing_key, "")
+        self.assertEqual(message.headers, event.headers)
+        self.assertEqual(message.body, ReplayedMessage(event).body)
+
+    async def test_processes_events_in_order_per_station(self):
+        events = some_events()
+        processed = []
+
+        async def process_incoming_event(event_message, exchange):
+            await asyncio.sleep(0)
+            processed.append(event_message.headers["stationId"])
+            processed.append(event_message.body)
+
+        integration = AsyncMock(process_incoming_event=process_incoming_event)
+        consumer = InProcessConsumer(integration, workers=3)
+        await replay_events(events, consumer.publish)
+        await consumer.drain()
+
+        self.assertEqual(len(processed), 2 * len(events))
+        for station_id in {event.headers["stationId"] for event in events}:
+            with self.subTest(station_id=station_id):
+                self.assertEqual(
+                    [
+                        body
+                        for processed_station_id, body in zip(
+                            processed[::2], processed[1::2]
+                        )
+                        if processed_station_id == station_id
+                    ],
+                    [
+                        ReplayedMessage(event).body
+                        for event in events
+                        if event.headers["stationId"] == station_id
+                    ],
+                )
+        self.assertEqual(
+            sum(len(durations) for durations in consumer.durations.values()),
+            len(events),
+        )
+        self.assertEqual(consumer.errors, 0)
+
+    async def test_counts_processing_errors(self):
+        integration = AsyncMock()
+        integration.process_incoming_event.side_effect = Exception("DB down")
+        consumer = InProcessConsumer(integration, workers=1)
+
+        with patch("integrations.citrineos.event_stream.exception"):
+            await replay_events(some_events(stations=1)[:2], consumer.publish)
+            await consumer.drain()
+
+        self.assertEqual(consumer.errors, 2)
+
+
+class HistogramDeltasTests(unittest.TestCase):
+    def test_returns_observations_since_snapshot(self):
+        histogram = Histogram(
+            "handler_seconds",
+            "Handlers.",
+            ("handler",),
+            registry=CollectorRegistry(),
+        )
+        histogram.labels("a").observe(1)
+        before = histogram_totals(histogram)
+        histogram.labels("a").observe(0.5)
+        histogram.labels("b").observe(2)
+
+        self.assertEqual(
+            histogram_deltas(histogram, before), {"a": (1, 0.5), "b": (1, 2.0)}
+        )
@@ -0,0 +1,178 @@
+import unittest
+from unittest.mock import patch
+
+from tests.amqp import FakeChannel, FakeExchange, FakeMessage, FakeQueue
+
+from integrations.citrineos.replay import replay_dead_letters
+from integrations.citrineos.retry import (
+    ATTEMPTS_HEADER,
+    LAST_ERROR_HEADER,
+    RETRY_ID_HEADER,
+    EventRetryRouter,
+    parse_retry_delays,
+)
+
+
+class EventRetryRouterTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.exchange = FakeExchange()
+        self.router = EventRetryRouter(
+            self.exchange,
+            queue_name="paymentService",
+            retry_delays=[1000, 10000],
+            max_attempts=4,
+        )
+
+    async def fail(self, headers: dict) -> tuple[str, object]:
+        message = FakeMessage({"action": "TransactionEvent"}, headers)
+        self.assertTrue(await self.router.route_failed(message, Exception("DB down")))
+        return self.exchange.published[-1]
+
+    async def test_declares_retry_queues_dead_lettering_to_event_queue(self):
+        channel = FakeChannel()
+        self.addCleanup(channel.close)
+
+        await self.router.declare(channel)
+
+        self.assertEqual(
+            channel.declared_queues,
+            {
+                "paymentService.retry.1000ms": {
+                    "x-message-ttl": 1000,
+                    "x-dead-letter-exchange": "",
+                    "x-dead-letter-routing-key": "paymentService",
+                },
+                "paymentService.retry.10000ms": {
+                    "x-message-ttl": 10000,
+                    "x-dead-letter-exchange": "",
+                    "x-dead-letter-routing-key": "paymentService",
+                },
+                "paymentService.dead": None,
+            },
+        )
+
+    async def test_failures_back_off_through_retry_queues(self):
+        cases = [
+            ({"stationId": "CS01"}, "paymentService.retry.1000ms", 1),
+            ({ATTEMPTS_HEADER: 1}, "paymentService.retry.10000ms", 2),
+            ({ATTEMPTS_HEADER: 2}, "paymentService.retry.10000ms", 3),
+            ({ATTEMPTS_HEADER: 3}, "paymentService.dead", 4),
+        ]
+        for headers, expected_queue, expected_attempts in cases:
+            with self.subTest(headers=headers):
+                routing_key, message = await self.fail(headers)
+
+                self.assertEqual(routing_key, expected_queue)
+                self.assertEqual(message.headers[ATTEMPTS_HEADER], expected_attempts)
+                self.assertIn("DB down", message.headers[LAST_ERROR_HEADER])
+
+    async def test_copy_keeps_body_and_headers(self):
+        _, message = await self.fail(
+            {"stationId": "CS01", "action": "TransactionEvent"}
+        )
+
+        self.assertEqual(message.body, b'{"action": "TransactionEvent"}')
+        self.assertEqual(message.headers["stationId"], "CS01")
+        self.assertEqual(message.headers["action"], "TransactionEvent")
+
+    async def test_without_retry_delays_failures_are_dead_lettered(self):
+        self.router.retry_delays = []
+
+        routing_key, _ = await self.fail({})
+
+        self.assertEqual(routing_key, "paymentService.dead")
+
+    async def test_later_events_of_a_station_are_parked_behind_its_retry(self):
+        failed = FakeMessage({"n": 0}, {"stationId": "CS01"})
+        later = FakeMessage({"n": 1}, {"stationId": "CS01"})
+        other = FakeMessage({"n": 2}, {"stationId": "CS02"})
+        await self.router.route_failed(failed, Exception("DB down"), "CS01")
+        _, retry = self.exchange.published[-1]
+
+        self.assertTrue(self.router.is_waiting("CS01", later))
+        self.assertFalse(self.router.is_waiting("CS02", other))
+        self.assertTrue(await self.router.park("CS01", later))
+        routing_key, parked = self.exchange.published[-1]
+        self.assertEqual(routing_key, "paymentService.retry.1000ms")
+        self.assertEqual(parked.headers, {"stationId": "CS01"})
+
+        # The failed event itself is processed when it comes back
+        self.assertFalse(self.router.is_waiting("CS01", retry))
+        self.router.succeeded("CS01", retry)
+        self.assertFalse(self.router.is_waiting("CS01", later))
+
+    async def test_parked_events_follow_the_retry_to_the_next_queue(self):
+        failed = FakeMessage({"n": 0}, {"stationId": "CS01"})
+        await self.router.route_failed(failed, Exception("DB down"), "CS01")
+        _, retry = self.exchange.published[-1]
+        await self.router.route_failed(retry, Exception("DB down"), "CS01")
+        _, second_retry = self.exchange.published[-1]
+
+        self.assertEqual(
+            second_retry.headers[RETRY_ID_HEADER], retry.headers[RETRY_ID_HEADER]
+        )
+        await self.router.park("CS01", FakeMessage({"n": 1}, {"stationId": "CS01"}))
+        routing_key, _ = self.exchange.published[-1]
+        self.assertEqual(routing_key, "paymentService.retry.10000ms")
+
+    async def test_dead_lettering_releases_the_parked_events(self):
+        self.router.max_attempts = 2
+        later = FakeMessage({"n": 1}, {"stationId": "CS01"})
+        failed = FakeMessage({"n": 0}, {"stationId": "CS01"})
+        await self.router.route_failed(failed, Exception("DB down"), "CS01")
+        _, retry = self.exchange.published[-1]
+
+        await self.router.route_failed(retry, Exception("DB down"), "CS01")
+
+        self.assertEqual(self.exchange.published[-1][0], "paymentService.dead")
+        self.assertFalse(self.router.is_waiting("CS01", later))
+
+    async def test_stops_waiting_for_a_retry_that_does_not_come_back(self):
+        failed = FakeMessage({"n": 0}, {"stationId": "CS01"})
+        later = FakeMessage({"n": 1}, {"stationId": "CS01"})
+        await self.router.route_failed(failed, Exception("DB down"), "CS01")
+
+        with patch("integrations.citrineos.retry.time.monotonic", return_value=1e12):
+            self.assertFalse(self.router.is_waiting("CS01", later))
+        self.assertFalse(self.router.is_waiting("CS01", later))
+
+    def test_parse_retry_delays(self):
+        self.assertEqual(parse_retry_delays("1000, 10000,"), [1000, 10000])
+        self.assertEqual(parse_retry_delays(""), [])
+
+
+class ReplayDeadLettersTests(unittest.IsolatedAsyncioTestCase):
+    async def test_replays_dead_letters_with_fresh_attempts(self):
+        dead_letter_queue = FakeQueue()
+        self.addCleanup(dead_letter_queue.channel.close)
+        messages = [
+            FakeMessage(
+                {"n": n},
+                {
+                    "stationId": "CS01",
+                    ATTEMPTS_HEADER: 5,
+                    LAST_ERROR_HEADER: "x",
+                    RETRY_ID_HEADER: "r1",
+                },
+            )
+            for n in range(3)
+        ]
+        dead_letter_queue.ready.extend(messages)
+        exchange = FakeExchange()
+
+        replayed = await replay_dead_letters(
+            dead_letter_queue, exchange, "paymentService", limit=2
+        )
+
+        self.assertEqual(replayed, 2)
+        self.assertEqual(
+            [routing_key for routing_key, _ in exchange.published],
+            ["paymentService", "paymentService"],
+        )
+        self.assertEqual(exchange.published[0][1].headers, {"stationId": "CS01"})
+        self.assertTrue(messages[0].acked and messages[1].acked)
+        self.assertEqual(dead_letter_queue.ready, [messages[2]])
+
+
+if __name__ == "__main__":
+    unittest.main()
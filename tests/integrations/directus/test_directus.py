@@ -0,0 +1,57 @@
+import os
+import unittest
+from io import BytesIO
+from unittest.mock import Mock, patch
+
+os.environ.setdefault("CONFIG_PATH", ".env.test")
+
+from integrations.directus.directus import DirectusIntegration
+
+
+class DirectusIntegrationTests(unittest.TestCase):
+    def setUp(self):
+        post = patch("integrations.directus.directus.requests.post")
+        self.post = post.start()
+        self.addCleanup(post.stop)
+        self.post.return_value.json.return_value = {
+            "data": {
+                "access_token": "access-token",
+                "refresh_token": "refresh-token",
+                "expires": 900000,
+            }
+        }
+        timer = patch("integrations.directus.directus.threading.Timer")
+        timer.start()
+        self.addCleanup(timer.stop)
+        request_dependency = patch(
+            "integrations.directus.directus.request_dependency",
+            return_value=Mock(json=Mock(return_value={"data": {"id": "file-1"}})),
+        )
+        self.request_dependency = request_dependency.start()
+        self.addCleanup(request_dependency.stop)
+
+    def upload(self, directus: DirectusIntegration) -> str:
+        return directus.upload_file(BytesIO(b"png"), "image/png", "qr.png", "QR")
+
+    def test_logs_in_on_first_upload(self):
+        directus = DirectusIntegration("http://directus", "admin@example.com", "pw")
+        self.post.assert_not_called()
+
+        self.assertEqual(self.upload(directus), "http://directus/assets/file-1")
+        self.upload(directus)
+
+        self.post.assert_called_once()
+        self.assertEqual(
+            self.request_dependency.call_args.kwargs["auth"].access_token,
+            "access-token",
+        )
+
+    def test_uses_static_token_without_logging_in(self):
+        directus = DirectusIntegration("http://directus", static_token="static")
+
+        self.upload(directus)
+
+        self.post.assert_not_called()
+        self.assertEqual(
+            self.request_dependency.call_args.kwargs["auth"].access_token, "static"
+        )
@@ -0,0 +1,212 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from model.tariff_schedule import (
+    ENERGY,
+    IDLE,
+    TIME,
+    RateElement,
+    compile_rate_schedule,
+)
+
+# A Monday
+MONDAY = datetime(2024, 5, 6, tzinfo=timezone.utc)
+PEAK = RateElement(ENERGY, 0.50, start_minute=17 * 60, end_minute=21 * 60)
+
+
+def at(hours: float, day: datetime = MONDAY) -> datetime:
+    return day + timedelta(hours=hours)
+
+
+class CompileRateScheduleTests(unittest.TestCase):
+    def test_splits_week_at_restrictions(self):
+        schedule = compile_rate_schedule((PEAK,), 0.30, 0.05)
+
+        self.assertEqual(len(schedule.boundaries), 1 + 2 * 7)
+        self.assertEqual(schedule.boundaries[:3], [0, 17 * 60, 21 * 60])
+        self.assertEqual(schedule.rates[0].energy_tiers, ((0.0, 0.30),))
+        self.assertEqual(schedule.rates[1].energy_tiers, ((0.0, 0.50),))
+
+    def test_merges_periods_with_same_rates(self):
+        schedule = compile_rate_schedule(
+            (RateElement(TIME, 0.05, start_minute=0, end_minute=12 * 60),), 0.30, 0.05
+        )
+
+        self.assertEqual(schedule.boundaries, [0])
+
+    def test_is_compiled_once(self):
+        self.assertIs(
+            compile_rate_schedule((PEAK,), 0.30, 0.05),
+            compile_rate_schedule((PEAK,), 0.30, 0.05),
+        )
+        self.assertIsNot(
+            compile_rate_schedule((PEAK,), 0.30, 0.05),
+            compile_rate_schedule((PEAK,), 0.35, 0.05),
+        )
+
+    def test_first_applying_element_sets_price(self):
+        schedule = compile_rate_schedule(
+            (PEAK, RateElement(ENERGY, 0.10, start_minute=0, end_minute=24 * 60)),
+            0.30,
+            0.05,
+        )
+
+        self.assertEqual(schedule.rates_at(at(18)).energy_tiers, ((0.0, 0.50),))
+        self.assertEqual(schedule.rates_at(at(12)).energy_tiers, ((0.0, 0.10),))
+
+
+class PriceSessionTests(unittest.TestCase):
+    def test_flat_prices_without_elements_applying(self):
+        costs = compile_rate_schedule((PEAK,), 0.30, 0.05).price_session(
+            at(10), at(12), 20
+        )
+
+        self.assertAlmostEqual(costs.energy, Decimal("6.00"))
+        self.assertAlmostEqual(costs.time, Decimal("6.00"))
+        self.assertEqual(costs.idle, 0)
+
+    def test_splits_energy_at_time_of_use_boundaries(self):
+        costs = compile_rate_schedule((PEAK,), 0.30, 0.05).price_session(
+            at(16), at(18), 20
+        )
+
+        self.assertAlmostEqual(costs.energy, Decimal("8.00"))
+
+    def test_prices_energy_when_it_was_metered(self):
+        costs = compile_rate_schedule((PEAK,), 0.30, 0.05).price_session(
+            at(16), at(18), 20, [(at(16), 0), (at(17), 18), (at(18), 20)]
+        )
+
+        self.assertAlmostEqual(costs.energy, Decimal("6.40"))
+
+    def test_splits_energy_at_tiers(self):
+        schedule = compile_rate_schedule(
+            (
+                RateElement(ENERGY, 0.40, max_kwh=10),
+                RateElement(ENERGY, 0.20, min_kwh=10),
+            ),
+            0.30,
+            0.05,
+        )
+
+        self.assertAlmostEqual(
+            schedule.price_session(at(10), at(12), 25).energy, Decimal("7.00")
+        )
+
+    def test_charges_idle_minutes_after_grace_period(self):
+        schedule = compile_rate_schedule(
+            (RateElement(IDLE, 0.10, grace_minutes=15),), 0.30, 0
+        )
+
+        costs = schedule.price_session(
+            at(10),
+            at(12),
+            20,
+            [(at(10), 0), (at(11), 20), (at(11.5), 20), (at(12), 20)],
+        )
+
+        self.assertAlmostEqual(costs.energy, Decimal("6.00"))
+        self.assertAlmostEqual(costs.idle, Decimal("4.50"))
+        self.assertAlmostEqual(costs.idle_minutes, Decimal("45"))
+
+    def test_charges_idle_minutes_after_last_reading_until_end(self):
+        schedule = compile_rate_schedule((RateElement(IDLE, 0.10),), 0.30, 0)
+
+        costs = schedule.price_session(at(10), at(12), 20, [(at(10), 0), (at(11), 20)])
+
+        self.assertAlmostEqual(costs.idle, Decimal("6.00"))
+        self.assertAlmostEqual(costs.idle_minutes, Decimal("60"))
+
+    def test_running_session_is_not_idle_after_reading_with_energy(self):
+        schedule = compile_rate_schedule((RateElement(IDLE, 0.5),), 0.30, 0)
+
+        costs = schedule.price_session(
+            at(10),
+            at(10.5) - timedelta(minutes=1),
+            5,
+            [(at(10), 0), (at(10.25), 5)],
+            ended=False,
+        )
+
+        self.assertEqual(costs.idle, 0)
+
+    def test_running_session_stays_idle_after_reading_without_energy(self):
+        schedule = compile_rate_schedule((RateElement(IDLE, 0.10),), 0.30, 0)
+
+        costs = schedule.price_session(
+            at(10),
+            at(11),
+            5,
+            [(at(10), 0), (at(10.25), 5), (at(10.5), 5)],
+            ended=False,
+        )
+
+        self.assertAlmostEqual(costs.idle_minutes, Decimal("45"))
+
+    def test_energy_after_last_reading_is_not_idle(self):
+        schedule = compile_rate_schedule((RateElement(IDLE, 0.10),), 0.30, 0)
+
+        costs = schedule.price_session(at(10), at(12), 30, [(at(10), 0), (at(11), 20)])
+
+        self.assertEqual(costs.idle, 0)
+
+    def test_restricts_days_of_week(self):
+        schedule = compile_rate_schedule(
+            (RateElement(TIME, 0, days_of_week="SATURDAY,SUNDAY"),), 0.30, 0.05
+        )
+
+        costs = schedule.price_session(
+            at(23, MONDAY + timedelta(days=4)), at(1, MONDAY + timedelta(days=5)), 0
+        )
+
+        self.assertAlmostEqual(costs.time, Decimal("3.00"))
+
+    def test_time_windows_wrap_past_midnight(self):
+        schedule = compile_rate_schedule(
+            (RateElement(ENERGY, 0.10, start_minute=22 * 60, end_minute=6 * 60),),
+            0.30,
+            0.05,
+        )
+
+        self.assertAlmostEqual(
+            schedule.price_session(at(21), at(23), 10).energy, Decimal("2.00")
+        )
+        self.assertAlmostEqual(
+            schedule.price_session(at(5), at(7), 10).energy, Decimal("2.00")
+        )
+
+    def test_times_of_day_are_in_time_zone(self):
+        schedule = compile_rate_schedule((PEAK,), 0.30, 0.05, "Europe/Berlin")
+
+        # 17:00 to 18:00 in summer time
+        self.assertAlmostEqual(
+            schedule.price_session(at(15), at(16), 10).energy, Decimal("5.00")
+        )
+
+    def test_daylight_saving_time_start(self):
+        schedule = compile_rate_schedule(
+            (RateElement(TIME, 1, start_minute=0, end_minute=2 * 60),),
+            0,
+            0,
+            "Europe/Berlin",
+        )
+
+        # From 0:00 until the clocks skip from 2:00 to 3:00, at 1:00 UTC
+        costs = schedule.price_session(
+            datetime(2024, 3, 30, 23, tzinfo=timezone.utc),
+            datetime(2024, 3, 31, 3, tzinfo=timezone.utc),
+            0,
+        )
+
+        self.assertAlmostEqual(costs.time, Decimal("120"))
+
+    def test_accepts_naive_times_in_utc(self):
+        schedule = compile_rate_schedule((PEAK,), 0.30, 0.05)
+
+        self.assertEqual(
+            schedule.price_session(
+                at(16).replace(tzinfo=None), at(18).replace(tzinfo=None), 20
+            ),
+            schedule.price_session(at(16), at(18), 20),
+        )
@@ -1,7 +1,8 @@
 import unittest
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from unittest.mock import patch
 
+from model.tariff_schedule import IDLE, RateElement, compile_rate_schedule
 from model.transaction_summary import TransactionSummary
 from moneyed import Money
 from decimal import Decimal
@@ -208,6 +209,19 @@ class TransactionSummaryTests(unittest.TestCase):
                     )
                     dt_mock.now.assert_called_with(timezone.utc)
 
+    def test_time_consumption_min_of_session_in_progress_read_from_sqlite(self):
+        # SQLite returns the stored UTC times without their timezone
+        for start_time in [
+            datetime.now(timezone.utc) - timedelta(minutes=30),
+            datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=30),
+        ]:
+            with self.subTest(start_time=start_time):
+                summary = a_transaction_summary(start_time=start_time, end_time=None)
+
+                self.assertAlmostEqual(
+                    summary.time_consumption_min, Decimal(30), delta=1
+                )
+
     def test_time_costs(self):
         currency = "USD"
         for (
@@ -956,6 +970,33 @@ class TransactionSummaryTests(unittest.TestCase):
                 )
                 self.assertEqual(summary.total_costs_gross, expected_total_costs_gross)
 
+    def test_rate_schedule_prices_energy_time_and_idle_minutes(self):
+        summary = a_transaction_summary(
+            start_time=datetime(2023, 8, 14, 10, 0),
+            end_time=datetime(2023, 8, 14, 11, 0),
+            kwh=20,
+            rate_schedule=compile_rate_schedule(
+                (RateElement(IDLE, 0.10, grace_minutes=10),), 0.30, 0.05
+            ),
+            meter_readings=[
+                (datetime(2023, 8, 14, 10, 0), 0),
+                (datetime(2023, 8, 14, 10, 30), 20),
+                (datetime(2023, 8, 14, 11, 0), 20),
+            ],
+        )
+
+        self.assertEqual(summary.energy_costs, Money(amount="6.00", currency="USD"))
+        self.assertEqual(summary.time_costs, Money(amount="3.00", currency="USD"))
+        self.assertEqual(summary.idle_costs, Money(amount="2.00", currency="USD"))
+        self.assertEqual(summary.idle_consumption_min, Decimal("20"))
+        self.assertEqual(summary.total_costs_net, Money(amount="14.00", currency="USD"))
+
+    def test_no_idle_costs_without_rate_schedule(self):
+        summary = a_transaction_summary()
+
+        self.assertIsNone(summary.idle_costs)
+        self.assertIsNone(summary.idle_consumption_min)
+
 
 def a_transaction_summary(**overrides) -> TransactionSummary:
     defaults = {
@@ -0,0 +1,104 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import AsyncMock, patch
+
+os.environ.setdefault("CONFIG_PATH", ".env.test")
+
+from fastapi.testclient import TestClient
+
+import main
+from config import Config
+from integrations.directus.directus import DirectusIntegration
+
+
+class CreateAppTests(unittest.TestCase):
+    def setUp(self):
+        frontend = tempfile.TemporaryDirectory()
+        self.addCleanup(frontend.cleanup)
+        with open(os.path.join(frontend.name, "index.html"), "w") as file:
+            file.write("<html>{{ CLIENT_API_URL }}</html>")
+        self.frontend_directory = frontend.name
+
+        for target, patcher in [
+            ("init_db", patch("main.init_db")),
+            ("login", patch.object(DirectusIntegration, "login")),
+            ("signal_handler", patch("main.install_profile_signal_handler")),
+        ]:
+            setattr(self, target, patcher.start())
+            self.addCleanup(patcher.stop)
+        for field, value in [
+            ("MESSAGE_BROKER_EMBEDDED_CONSUMER", False),
+            ("EVENT_LOOP_LAG_THRESHOLD_MS", 0),
+        ]:
+            patcher = patch.object(Config, field, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def an_app(self):
+        app = main.create_app(self.frontend_directory)
+        app.webhook_inbox = AsyncMock()
+        return app
+
+    def test_importing_main_does_not_create_the_app(self):
+        self.assertNotIn("app", vars(main))
+
+    def test_creating_the_app_does_not_connect(self):
+        self.an_app()
+
+        self.init_db.assert_not_called()
+        self.login.assert_not_called()
+
+    def test_startup_creates_schema_and_logs_in_to_directus(self):
+        with (
+            patch.object(Config, "CITRINEOS_SCAN_AND_CHARGE", True),
+            TestClient(self.an_app()) as client,
+        ):
+            self.assertEqual(client.get("/health_check").status_code, 200)
+            wait_until(lambda: self.login.called)
+
+        self.init_db.assert_called_once_with()
+        self.login.assert_called_once_with()
+
+    def test_starts_while_directus_is_down(self):
+        self.login.side_effect = ConnectionError("Directus is down")
+
+        with (
+            patch.object(Config, "CITRINEOS_SCAN_AND_CHARGE", True),
+            patch("main.warning") as warning,
+            TestClient(self.an_app()) as client,
+        ):
+            wait_until(lambda: warning.called)
+            self.assertEqual(
+                client.get("/").text, "<html>http://localhost:9010/api</html>"
+            )
+
+    def test_does_not_log_in_to_directus_without_scan_and_charge(self):
+        with (
+            patch.object(Config, "CITRINEOS_SCAN_AND_CHARGE", False),
+            TestClient(self.an_app()),
+        ):
+            pass
+
+        self.login.assert_not_called()
+
+    def test_ready_reports_checks(self):
+        checks = {"database": {"status": "down", "error": "refused"}}
+
+        with TestClient(self.an_app()) as client:
+            with patch("main.check_readiness", return_value=(True, {})):
+                self.assertEqual(client.get("/ready").status_code, 200)
+            with patch("main.check_readiness", return_value=(False, checks)):
+                response = client.get("/ready")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json(), {"status": "not_ready", "checks": checks})
+
+
+def wait_until(condition, timeout: float = 1) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not met in time")
+        time.sleep(0.001)
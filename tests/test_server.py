@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import unittest
+from unittest.mock import Mock, patch
+
+os.environ.setdefault("CONFIG_PATH", ".env.test")
+
+import server
+from config import Config
+from server import ConsumerSupervisor
+from utils.cache import LocalCacheBackend, RedisCacheBackend
+
+SLEEP = [sys.executable, "-c", "import time; time.sleep(60)"]
+EXIT = [sys.executable, "-c", "raise SystemExit(3)"]
+
+
+class ConsumerSupervisorTests(unittest.TestCase):
+    def test_stops_consumer(self):
+        supervisor = ConsumerSupervisor(SLEEP)
+        supervisor.start()
+        wait_until(lambda: supervisor.process is not None)
+
+        supervisor.stop()
+
+        self.assertIsNotNone(supervisor.process.poll())
+
+    def test_restarts_consumer_that_exits(self):
+        supervisor = ConsumerSupervisor(EXIT, restart_delay=0.01)
+        processes = {None}
+
+        with patch("server.warning") as warning:
+            supervisor.start()
+            wait_until(
+                lambda: processes.add(supervisor.process) or len(processes) >= 3,
+                timeout=10,
+            )
+            supervisor.stop()
+
+        warning.assert_any_call(
+            " [Server] Event consumer exited with %d, restarting in %ss", 3, 0.01
+        )
+
+    def test_drops_live_metrics_of_exited_consumer(self):
+        supervisor = ConsumerSupervisor(EXIT, restart_delay=60)
+
+        with patch("server.warning"), patch("server.mark_process_dead") as dead:
+            supervisor.start()
+            wait_until(lambda: dead.called)
+            pid = supervisor.process.pid
+            supervisor.stop()
+
+        dead.assert_any_call(pid)
+
+
+class MainTests(unittest.TestCase):
+    def setUp(self):
+        for patcher in [
+            patch("server.uvicorn.run"),
+            patch("server.ConsumerSupervisor"),
+            patch.dict(os.environ),
+            patch.object(Config, "MESSAGE_BROKER_EMBEDDED_CONSUMER", True),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_runs_separate_consumer_with_shared_cache(self):
+        with (
+            patch("server.cache_backend", return_value=RedisCacheBackend(Mock())),
+            patch.object(Config, "WEBSERVER_WORKERS", 4),
+        ):
+            server.main()
+
+        server.ConsumerSupervisor.return_value.start.assert_called_once()
+        self.assertFalse(Config.MESSAGE_BROKER_EMBEDDED_CONSUMER)
+        self.assertEqual(os.environ["MESSAGE_BROKER_EMBEDDED_CONSUMER"], "false")
+
+    def test_embeds_consumer_without_shared_cache(self):
+        with patch("server.cache_backend", return_value=LocalCacheBackend()):
+            server.main()
+
+        server.ConsumerSupervisor.assert_not_called()
+        self.assertTrue(Config.MESSAGE_BROKER_EMBEDDED_CONSUMER)
+        self.assertNotIn("workers", server.uvicorn.run.call_args.kwargs)
+
+    def test_refuses_several_workers_without_shared_cache(self):
+        with (
+            patch("server.cache_backend", return_value=LocalCacheBackend()),
+            patch.object(Config, "WEBSERVER_WORKERS", 4),
+            patch("server.error"),
+        ):
+            with self.assertRaises(SystemExit):
+                server.main()
+
+        server.ConsumerSupervisor.assert_not_called()
+
+
+def wait_until(condition, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not met in time")
+        time.sleep(0.001)
@@ -0,0 +1,139 @@
+import os
+import unittest
+from unittest.mock import patch
+
+os.environ.setdefault("CONFIG_PATH", ".env.test")
+
+from utils.cache import (
+    Cache,
+    LocalCacheBackend,
+    RedisCacheBackend,
+    create_cache_backend,
+)
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.expiries = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, px, nx=False):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        self.expiries[key] = px
+        return True
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    def ping(self):
+        return True
+
+
+class LocalCacheBackendTests(unittest.TestCase):
+    def test_expires_entries_after_ttl(self):
+        backend = LocalCacheBackend()
+
+        with patch("utils.cache.time.monotonic", return_value=100):
+            backend.set("evses", b"[]", ttl=10)
+            self.assertEqual(backend.get("evses"), b"[]")
+        with patch("utils.cache.time.monotonic", return_value=110):
+            self.assertIsNone(backend.get("evses"))
+
+    def test_evicts_least_recently_used_entries(self):
+        backend = LocalCacheBackend(max_entries=2)
+        backend.set("a", b"1", ttl=60)
+        backend.set("b", b"2", ttl=60)
+        backend.get("a")
+
+        backend.set("c", b"3", ttl=60)
+
+        self.assertEqual(backend.get("a"), b"1")
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("c"), b"3")
+
+    def test_adds_only_missing_or_expired_entries(self):
+        backend = LocalCacheBackend()
+
+        with patch("utils.cache.time.monotonic", return_value=100):
+            self.assertTrue(backend.add("a", b"1", ttl=10))
+            self.assertFalse(backend.add("a", b"2", ttl=10))
+        with patch("utils.cache.time.monotonic", return_value=110):
+            self.assertTrue(backend.add("a", b"3", ttl=10))
+            self.assertEqual(backend.get("a"), b"3")
+
+    def test_deletes_entries(self):
+        backend = LocalCacheBackend()
+        backend.set("a", b"1", ttl=60)
+
+        backend.delete("a", "missing")
+
+        self.assertIsNone(backend.get("a"))
+
+
+class RedisCacheBackendTests(unittest.TestCase):
+    def test_prefixes_keys_and_expires_in_milliseconds(self):
+        client = FakeRedis()
+        backend = RedisCacheBackend(client)
+
+        backend.set("evses", b"[]", ttl=1.5)
+
+        self.assertEqual(client.values, {"citrineos-payment:evses": b"[]"})
+        self.assertEqual(client.expiries, {"citrineos-payment:evses": 1500})
+        self.assertEqual(backend.get("evses"), b"[]")
+        backend.delete("evses")
+        self.assertIsNone(backend.get("evses"))
+
+    def test_falls_back_to_local_backend_without_redis(self):
+        with patch("utils.cache.redis", None), patch("utils.cache.warning") as warning:
+            backend = create_cache_backend("redis://localhost:6379/0")
+
+        self.assertIsInstance(backend, LocalCacheBackend)
+        warning.assert_called_once()
+
+    def test_uses_local_backend_without_url(self):
+        self.assertIsInstance(create_cache_backend(""), LocalCacheBackend)
+
+
+class CacheTests(unittest.TestCase):
+    def test_separates_namespaces(self):
+        backend = RedisCacheBackend(FakeRedis())
+        topology, pricing = Cache("topology", backend), Cache("pricing", backend)
+        topology.set("1", b"[]", ttl=60)
+        pricing.set("1", b"{}", ttl=60)
+
+        topology.delete("1")
+
+        self.assertIsNone(topology.get("1"))
+        self.assertEqual(pricing.get("1"), b"{}")
+
+    def test_deletions_are_seen_by_caches_sharing_backend(self):
+        backend = RedisCacheBackend(FakeRedis())
+        worker, consumer = Cache("topology", backend), Cache("topology", backend)
+        worker.set("evses:1", b"{}", ttl=60)
+
+        consumer.delete("evses:1")
+
+        self.assertIsNone(worker.get("evses:1"))
+
+    def test_value_read_before_deletion_is_not_cached(self):
+        cache = Cache("pricing", LocalCacheBackend())
+        self.assertIsNone(cache.get("checkouts:1"))
+        # The checkout changes while the old row is being read
+        cache.delete("checkouts:1")
+
+        cache.fill("checkouts:1", b"old", ttl=60)
+
+        self.assertIsNone(cache.get("checkouts:1"))
+
+    def test_fills_missing_entries(self):
+        cache = Cache("pricing", LocalCacheBackend())
+
+        cache.fill("checkouts:1", b"new", ttl=60)
+
+        self.assertEqual(cache.get("checkouts:1"), b"new")
@@ -0,0 +1,115 @@
+import os
+import unittest
+from unittest.mock import patch
+
+os.environ.setdefault("CONFIG_PATH", ".env.test")
+
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError, CircuitState
+
+
+class CircuitBreakerTests(unittest.TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(
+            "test",
+            failure_rate=0.5,
+            min_calls=4,
+            window=10,
+            open_seconds=30,
+            half_open_calls=2,
+        )
+        patcher = patch("utils.circuit_breaker.time.monotonic", return_value=100)
+        self.now = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def call(self, failed: bool) -> None:
+        self.breaker.before_call()
+        self.breaker.after_call(failed)
+
+    def open(self) -> None:
+        for failed in [False, False, True, True]:
+            self.call(failed)
+
+    def test_stays_closed_below_failure_rate(self):
+        for failed in [False, False, True, False, True, False]:
+            self.call(failed)
+
+        self.assertEqual(self.breaker.state, CircuitState.CLOSED)
+
+    def test_waits_for_min_calls(self):
+        for _ in range(3):
+            self.call(True)
+
+        self.assertEqual(self.breaker.state, CircuitState.CLOSED)
+
+    def test_opens_at_failure_rate_and_fails_fast(self):
+        self.open()
+
+        self.assertEqual(self.breaker.state, CircuitState.OPEN)
+        self.now.return_value = 110
+        with self.assertRaises(CircuitOpenError) as context:
+            self.breaker.before_call()
+        self.assertEqual(context.exception.retry_after, 20)
+        self.assertEqual(self.breaker.rejected_calls, 1)
+
+    def test_failures_leave_the_window(self):
+        self.call(True)
+        self.call(True)
+        self.now.return_value = 111
+        self.call(False)
+        self.call(False)
+        self.call(True)
+
+        self.assertEqual(self.breaker.state, CircuitState.CLOSED)
+
+    def test_half_open_lets_limited_probes_through(self):
+        self.open()
+        self.now.return_value = 130
+
+        self.breaker.before_call()
+        self.breaker.before_call()
+
+        self.assertEqual(self.breaker.state, CircuitState.HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_closes_after_successful_probes(self):
+        self.open()
+        self.now.return_value = 130
+
+        self.call(False)
+        self.assertEqual(self.breaker.state, CircuitState.HALF_OPEN)
+        self.call(False)
+
+        self.assertEqual(self.breaker.state, CircuitState.CLOSED)
+        # Failures from before the circuit opened are forgotten
+        self.call(True)
+        self.assertEqual(self.breaker.state, CircuitState.CLOSED)
+        self.assertEqual(
+            self.breaker.transitions,
+            {CircuitState.CLOSED: 1, CircuitState.OPEN: 1, CircuitState.HALF_OPEN: 1},
+        )
+
+    def test_failed_probe_opens_again(self):
+        self.open()
+        self.now.return_value = 130
+
+        self.call(True)
+
+        self.assertEqual(self.breaker.state, CircuitState.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_guard_counts_only_accepted_errors_as_failures(self):
+        for _ in range(4):
+            with self.assertRaises(KeyError):
+                with self.breaker.guard(is_failure=lambda e: isinstance(e, OSError)):
+                    raise KeyError()
+
+        self.assertEqual(self.breaker.state, CircuitState.CLOSED)
+
+        for _ in range(4):
+            with self.assertRaises(OSError):
+                with self.breaker.guard(is_failure=lambda e: isinstance(e, OSError)):
+                    raise OSError()
+
+        self.assertEqual(self.breaker.state, CircuitState.OPEN)
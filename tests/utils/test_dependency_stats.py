@@ -0,0 +1,100 @@
+import os
+import unittest
+from unittest.mock import patch
+
+os.environ.setdefault("CONFIG_PATH", ".env.test")
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from utils.dependency_stats import (
+    POSTGRES,
+    DependencyStats,
+    dependency_stats,
+    instrument_engine,
+)
+
+
+class DependencyStatsTests(unittest.TestCase):
+    def test_snapshot_averages_calls_in_window(self):
+        stats = DependencyStats("test", window=10)
+        with patch("utils.dependency_stats.time.monotonic", return_value=100):
+            stats.started()
+            stats.finished(0.2)
+            stats.started()
+            stats.finished(0.4, error=True)
+
+            calls, errors, latency = stats.snapshot()
+
+        self.assertEqual((calls, errors), (2, 1))
+        self.assertAlmostEqual(latency, 0.3)
+
+    def test_old_calls_leave_the_window(self):
+        stats = DependencyStats("test", window=10)
+        with patch("utils.dependency_stats.time.monotonic", return_value=100):
+            stats.started()
+            stats.finished(1.0, error=True)
+        with patch("utils.dependency_stats.time.monotonic", return_value=105):
+            stats.started()
+            stats.finished(0.5)
+
+            self.assertEqual(stats.snapshot(), (2, 1, 0.75))
+        with patch("utils.dependency_stats.time.monotonic", return_value=112):
+            self.assertEqual(stats.snapshot(), (1, 0, 0.5))
+        with patch("utils.dependency_stats.time.monotonic", return_value=120):
+            self.assertEqual(stats.snapshot(), (0, 0, 0.0))
+
+        self.assertEqual((stats.total_calls, stats.total_errors), (2, 1))
+
+    def test_track_counts_calls_in_flight_and_errors(self):
+        stats = DependencyStats("test")
+
+        with stats.track():
+            self.assertEqual(stats.in_flight, 1)
+        with self.assertRaises(RuntimeError):
+            with stats.track():
+                raise RuntimeError()
+
+        self.assertEqual(stats.in_flight, 0)
+        self.assertEqual(stats.snapshot()[:2], (2, 1))
+
+
+class InstrumentEngineTests(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        instrument_engine(self.engine)
+        self.stats = dependency_stats[POSTGRES]
+        self.calls = self.stats.total_calls
+        self.errors = self.stats.total_errors
+
+    def test_records_statements(self):
+        with self.engine.connect() as connection:
+            connection.execute(text("select 1"))
+            connection.execute(text("select 2"))
+
+        self.assertEqual(self.stats.total_calls - self.calls, 2)
+        self.assertEqual(self.stats.total_errors, self.errors)
+        self.assertEqual(self.stats.in_flight, 0)
+
+    def test_records_executemany_as_one_call(self):
+        with self.engine.connect() as connection:
+            connection.execute(text("create table t (id integer primary key)"))
+            connection.execute(
+                text("insert into t values (:id)"), [{"id": 1}, {"id": 2}]
+            )
+
+        self.assertEqual(self.stats.total_calls - self.calls, 2)
+        self.assertEqual(self.stats.in_flight, 0)
+
+    def test_constraint_violations_are_not_counted_as_errors(self):
+        with self.engine.connect() as connection:
+            connection.execute(text("create table t (id integer primary key)"))
+            connection.execute(text("insert into t values (1)"))
+            with self.assertRaises(IntegrityError):
+                connection.execute(text("insert into t values (1)"))
+            with self.assertRaises(OperationalError):
+                connection.execute(text("select * from missing"))
+
+        self.assertEqual(self.stats.total_calls - self.calls, 4)
+        self.assertEqual(self.stats.total_errors - self.errors, 1)
+        self.assertEqual(self.stats.in_flight, 0)
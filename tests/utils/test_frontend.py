@@ -0,0 +1,142 @@
+import gzip
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+os.environ.setdefault("CONFIG_PATH", ".env.test")
+
+from starlette.applications import Starlette
+from starlette.datastructures import Headers
+from starlette.testclient import TestClient
+
+from utils.frontend import (
+    IMMUTABLE,
+    REVALIDATE,
+    FrontendIndex,
+    FrontendStaticFiles,
+    accepted_encodings,
+    compress_assets,
+)
+
+BUNDLE = "static/js/main.3f2a9c1d.js"
+SCRIPT = b"console.log('charging');" * 100
+
+
+class FrontendTestCase(unittest.TestCase):
+    def setUp(self):
+        build = tempfile.TemporaryDirectory()
+        self.addCleanup(build.cleanup)
+        self.build = build.name
+        os.makedirs(os.path.join(self.build, "static", "js"))
+        for path, content in [
+            ("index.html", b'<script>window.API = "{{ CLIENT_API_URL }}"</script>'),
+            (BUNDLE, SCRIPT),
+            ("manifest.json", b'{"name": "payment"}'),
+            ("favicon.png", b"\x89PNG"),
+        ]:
+            with open(os.path.join(self.build, path), "wb") as file:
+                file.write(content)
+
+
+class FrontendIndexTests(FrontendTestCase):
+    def test_renders_once_with_etag(self):
+        index = FrontendIndex(self.build, {"CLIENT_API_URL": "https://pay.example/api"})
+        os.remove(os.path.join(self.build, "index.html"))
+
+        response = index.response(Headers())
+
+        self.assertEqual(
+            response.body, b'<script>window.API = "https://pay.example/api"</script>'
+        )
+        self.assertEqual(response.headers["cache-control"], REVALIDATE)
+        self.assertRegex(response.headers["etag"], r'^"[0-9a-f]{32}"$')
+
+    def test_answers_not_modified_for_current_etag(self):
+        index = FrontendIndex(self.build, {"CLIENT_API_URL": "/api"})
+        etag = index.response(Headers()).headers["etag"]
+
+        response = index.response(Headers({"if-none-match": f'"other", {etag}'}))
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.body, b"")
+
+    def test_serves_gzip_when_accepted(self):
+        index = FrontendIndex(self.build, {"CLIENT_API_URL": "/api"})
+        plain = index.response(Headers())
+
+        response = index.response(Headers({"accept-encoding": "gzip, deflate, br"}))
+
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.body), plain.body)
+        self.assertNotEqual(response.headers["etag"], plain.headers["etag"])
+
+
+class FrontendStaticFilesTests(FrontendTestCase):
+    def a_client(self) -> TestClient:
+        app = Starlette()
+        app.mount("/", FrontendStaticFiles(directory=self.build))
+        return TestClient(app)
+
+    def test_serves_hashed_assets_as_immutable(self):
+        response = self.a_client().get(f"/{BUNDLE}")
+
+        self.assertEqual(response.content, SCRIPT)
+        self.assertEqual(response.headers["cache-control"], IMMUTABLE)
+        self.assertEqual(
+            self.a_client().get("/favicon.png").headers["cache-control"], REVALIDATE
+        )
+
+    def test_serves_precompressed_assets(self):
+        with patch("utils.frontend.brotli", None):
+            compress_assets(self.build)
+        client = self.a_client()
+
+        compressed = client.get(
+            f"/{BUNDLE}", headers={"accept-encoding": "br;q=0, gzip"}
+        )
+        plain = client.get(f"/{BUNDLE}", headers={"accept-encoding": "identity"})
+
+        self.assertEqual(compressed.headers["content-encoding"], "gzip")
+        self.assertEqual(
+            compressed.headers["content-type"], plain.headers["content-type"]
+        )
+        self.assertEqual(compressed.headers["vary"], "Accept-Encoding")
+        self.assertLess(
+            int(compressed.headers["content-length"]),
+            int(plain.headers["content-length"]),
+        )
+        self.assertEqual(compressed.content, SCRIPT)
+        self.assertNotIn("content-encoding", plain.headers)
+        self.assertEqual(plain.content, SCRIPT)
+
+    def test_answers_not_modified_for_compressed_etag(self):
+        compress_assets(self.build)
+        client = self.a_client()
+        etag = client.get(f"/{BUNDLE}", headers={"accept-encoding": "gzip"}).headers[
+            "etag"
+        ]
+
+        response = client.get(
+            f"/{BUNDLE}", headers={"accept-encoding": "gzip", "if-none-match": etag}
+        )
+
+        self.assertEqual(response.status_code, 304)
+
+
+class CompressAssetsTests(FrontendTestCase):
+    def test_skips_files_that_do_not_shrink(self):
+        with patch("utils.frontend.brotli", None):
+            written = compress_assets(self.build)
+
+        self.assertEqual(written, 1)
+        self.assertTrue(os.path.exists(os.path.join(self.build, BUNDLE + ".gz")))
+        self.assertFalse(os.path.exists(os.path.join(self.build, "manifest.json.gz")))
+        self.assertFalse(os.path.exists(os.path.join(self.build, "favicon.png.gz")))
+
+
+class AcceptedEncodingsTests(unittest.TestCase):
+    def test_drops_refused_encodings(self):
+        self.assertEqual(
+            accepted_encodings("gzip;q=0.8, br;q=0, deflate"), {"gzip", "deflate"}
+        )
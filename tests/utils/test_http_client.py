@@ -0,0 +1,53 @@
+import os
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import requests
+
+os.environ.setdefault("CONFIG_PATH", ".env.test")
+
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError, CircuitState
+from utils.dependency_stats import CITRINEOS, DependencyStats
+from utils.http_client import request_dependency
+
+
+class RequestDependencyTests(unittest.TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(CITRINEOS, min_calls=2, failure_rate=0.5)
+        self.stats = DependencyStats(CITRINEOS)
+        for patcher in [
+            patch.dict("utils.http_client.circuit_breakers", {CITRINEOS: self.breaker}),
+            patch.dict("utils.http_client.dependency_stats", {CITRINEOS: self.stats}),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        request_patcher = patch("utils.http_client.requests.request")
+        self.request = request_patcher.start()
+        self.addCleanup(request_patcher.stop)
+
+    def test_passes_timeout_and_returns_response(self):
+        self.request.return_value = SimpleNamespace(status_code=404)
+
+        response = request_dependency(
+            CITRINEOS, "POST", "http://citrineos.test", timeout=5, json={}
+        )
+
+        self.assertEqual(response.status_code, 404)
+        self.request.assert_called_once_with(
+            "POST", "http://citrineos.test", timeout=5, headers=None, json={}
+        )
+        self.assertEqual(self.stats.snapshot()[:2], (1, 0))
+
+    def test_server_errors_and_timeouts_open_the_circuit(self):
+        self.request.return_value = SimpleNamespace(status_code=502)
+        request_dependency(CITRINEOS, "POST", "http://citrineos.test", timeout=5)
+        self.request.side_effect = requests.Timeout()
+        with self.assertRaises(requests.Timeout):
+            request_dependency(CITRINEOS, "POST", "http://citrineos.test", timeout=5)
+
+        self.assertEqual(self.breaker.state, CircuitState.OPEN)
+        self.assertEqual(self.stats.snapshot()[:2], (2, 2))
+        with self.assertRaises(CircuitOpenError):
+            request_dependency(CITRINEOS, "POST", "http://citrineos.test", timeout=5)
+        self.assertEqual(self.request.call_count, 2)
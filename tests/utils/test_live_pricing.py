@@ -0,0 +1,183 @@
+import os
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+os.environ.setdefault("CONFIG_PATH", ".env.test")
+
+from tests.database import add_charging_station, sqlite_sessionmaker
+
+from api.endpoints.checkouts import complete_checkout
+from db.init_db import Checkout, MeterSample, TariffElement
+from utils.cache import LocalCacheBackend, pricing_cache
+from utils.live_pricing import LiveCheckout, get_live_checkout
+from utils.utils import generate_pricing
+
+START = datetime(2024, 5, 1, 10, 0)
+
+
+class LivePricingTests(unittest.TestCase):
+    def setUp(self):
+        self.SessionLocal = sqlite_sessionmaker()
+        with self.SessionLocal() as db:
+            evse = add_charging_station(db)
+            checkout = Checkout(
+                payment_intent_id="pi_1",
+                connector_id=evse.connectors[0].id,
+                tariff_id=evse.connectors[0].tariff_id,
+                transaction_start_time=START,
+                transaction_kwh=20.0,
+            )
+            db.add(checkout)
+            db.commit()
+            self.checkout_id = checkout.id
+
+        for patcher in [
+            patch.object(pricing_cache, "_backend", LocalCacheBackend()),
+            patch("db.init_db.SessionLocal", self.SessionLocal),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def live_checkout(self) -> LiveCheckout:
+        with self.SessionLocal() as db:
+            return get_live_checkout(db, self.checkout_id)
+
+    def test_prices_like_generate_pricing(self):
+        with self.SessionLocal() as db:
+            db.get(Checkout, self.checkout_id).transaction_end_time = datetime(
+                2024, 5, 1, 11, 30
+            )
+            db.commit()
+
+        self.assertEqual(
+            self.live_checkout().checkout().pricing, generate_pricing(self.checkout_id)
+        )
+
+    def test_prices_time_of_running_session_on_read(self):
+        live_checkout = self.live_checkout()
+
+        after_one_hour = live_checkout.checkout(now=datetime(2024, 5, 1, 11, 0))
+        after_two_hours = live_checkout.checkout(now=datetime(2024, 5, 1, 12, 0))
+
+        self.assertEqual(after_one_hour.pricing.time_costs, 300)
+        self.assertEqual(after_two_hours.pricing.time_costs, 600)
+        self.assertEqual(after_two_hours.pricing.energy_costs, 600)
+        self.assertEqual(
+            after_two_hours.pricing.total_costs_net
+            - after_one_hour.pricing.total_costs_net,
+            300,
+        )
+
+    def test_serves_reads_between_changes_from_cache(self):
+        self.live_checkout()
+
+        with patch("utils.live_pricing.LiveCheckout.from_rows") as from_rows:
+            cached = self.live_checkout()
+
+        from_rows.assert_not_called()
+        self.assertEqual(cached.checkout().transaction_kwh, 20.0)
+
+    def test_committed_changes_drop_checkout_from_cache(self):
+        self.live_checkout()
+
+        with self.SessionLocal() as db:
+            db.get(Checkout, self.checkout_id).transaction_kwh = 25.0
+            db.flush()
+            self.assertEqual(self.live_checkout().checkout().transaction_kwh, 20.0)
+            db.commit()
+
+        self.assertEqual(self.live_checkout().checkout().transaction_kwh, 25.0)
+
+    def test_committed_bulk_updates_drop_checkout_from_cache(self):
+        self.live_checkout()
+
+        with self.SessionLocal() as db:
+            complete_checkout(db, self.checkout_id, "pi_2", "https://checkout/2")
+
+        self.assertEqual(self.live_checkout().checkout().payment_intent_id, "pi_2")
+
+    def test_round_trips_through_bytes(self):
+        live_checkout = self.live_checkout()
+        now = datetime(2024, 5, 1, 10, 45)
+
+        self.assertEqual(
+            LiveCheckout.from_bytes(live_checkout.to_bytes()).checkout(now),
+            live_checkout.checkout(now),
+        )
+
+    def add_rate_elements(self):
+        with self.SessionLocal() as db:
+            checkout = db.get(Checkout, self.checkout_id)
+            db.add_all(
+                [
+                    TariffElement(
+                        tariff_id=checkout.tariff_id,
+                        dimension="energy",
+                        price=0.50,
+                        start_minute=10 * 60 + 30,
+                        end_minute=12 * 60,
+                    ),
+                    TariffElement(
+                        tariff_id=checkout.tariff_id,
+                        dimension="idle",
+                        price=0.10,
+                        grace_minutes=10,
+                    ),
+                ]
+            )
+            checkout.meter_samples.add_all(
+                [
+                    MeterSample(sampled_at=START, transaction_kwh=0.0),
+                    MeterSample(
+                        sampled_at=datetime(2024, 5, 1, 10, 30), transaction_kwh=10.0
+                    ),
+                    MeterSample(
+                        sampled_at=datetime(2024, 5, 1, 11, 0), transaction_kwh=20.0
+                    ),
+                    MeterSample(
+                        sampled_at=datetime(2024, 5, 1, 11, 30), transaction_kwh=20.0
+                    ),
+                ]
+            )
+            db.commit()
+
+    def test_prices_rate_elements_from_meter_samples(self):
+        self.add_rate_elements()
+        with self.SessionLocal() as db:
+            db.get(Checkout, self.checkout_id).transaction_end_time = datetime(
+                2024, 5, 1, 11, 30
+            )
+            db.commit()
+
+        pricing = self.live_checkout().checkout().pricing
+
+        self.assertEqual(pricing.energy_costs, 10 * 30 + 10 * 50)
+        self.assertEqual(pricing.idle_costs, 20 * 10)
+        self.assertEqual(pricing.idle_consumption_min, 20)
+        self.assertEqual(pricing, generate_pricing(self.checkout_id))
+
+    def test_running_session_is_not_idle_while_charging_between_readings(self):
+        self.add_rate_elements()
+
+        pricing = self.live_checkout().checkout(datetime(2024, 5, 1, 11, 25)).pricing
+
+        self.assertEqual(pricing.idle_costs, 0)
+        self.assertEqual(pricing.idle_consumption_min, 0)
+
+    def test_running_session_stays_idle_after_reading_without_energy(self):
+        self.add_rate_elements()
+
+        pricing = self.live_checkout().checkout(datetime(2024, 5, 1, 11, 45)).pricing
+
+        self.assertEqual(pricing.idle_consumption_min, 35)
+
+    def test_round_trips_rate_elements_through_bytes(self):
+        self.add_rate_elements()
+        live_checkout = self.live_checkout()
+        now = datetime(2024, 5, 1, 11, 45)
+
+        self.assertEqual(
+            LiveCheckout.from_bytes(live_checkout.to_bytes()).checkout(now),
+            live_checkout.checkout(now),
+        )
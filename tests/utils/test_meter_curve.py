@@ -0,0 +1,70 @@
+import unittest
+from datetime import datetime, timedelta
+
+from utils.meter_curve import downsample_meter_samples
+
+START = datetime(2024, 5, 1, 10, 0)
+
+
+class DownsampleMeterSamplesTests(unittest.TestCase):
+    def test_averages_power_and_keeps_last_energy_and_soc_per_bucket(self):
+        samples = [
+            (START, 0.0, 10.0, 40.0),
+            (START + timedelta(minutes=1), 0.2, 12.0, None),
+            (START + timedelta(minutes=2), 0.4, None, 41.0),
+            (START + timedelta(minutes=3), 0.6, 8.0, 42.0),
+        ]
+
+        points = list(
+            downsample_meter_samples(samples, START, samples[-1][0], points=2)
+        )
+
+        self.assertEqual(
+            points,
+            [
+                {
+                    "time": START + timedelta(minutes=1),
+                    "transaction_kwh": 0.2,
+                    "transaction_soc": 40.0,
+                    "power_active_import": 11.0,
+                },
+                {
+                    "time": START + timedelta(minutes=3),
+                    "transaction_kwh": 0.6,
+                    "transaction_soc": 42.0,
+                    "power_active_import": 8.0,
+                },
+            ],
+        )
+
+    def test_returns_at_most_the_requested_number_of_points(self):
+        samples = [
+            (START + timedelta(seconds=10 * n), n / 100, 11.0, None)
+            for n in range(1000)
+        ]
+
+        for points in [1, 7, 100, 2000]:
+            with self.subTest(points=points):
+                curve = list(
+                    downsample_meter_samples(
+                        iter(samples), START, samples[-1][0], points
+                    )
+                )
+
+                self.assertEqual(len(curve), min(points, len(samples)))
+                self.assertEqual(curve[-1]["transaction_kwh"], 9.99)
+
+    def test_single_sample(self):
+        curve = list(
+            downsample_meter_samples([(START, 1.0, 2.0, 3.0)], START, START, 5)
+        )
+
+        self.assertEqual(len(curve), 1)
+        self.assertEqual(curve[0]["power_active_import"], 2.0)
+
+    def test_no_samples(self):
+        self.assertEqual(list(downsample_meter_samples([], START, START, 5)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
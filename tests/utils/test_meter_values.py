@@ -0,0 +1,145 @@
+import itertools
+import unittest
+
+from schemas.transaction_event import (
+    MeasurandEnumType,
+    SampledValueType,
+    UnitOfMeasureType,
+)
+from utils.meter_values import (
+    ENERGY,
+    POWER,
+    SOC,
+    InvalidMeterValueError,
+    MeterReading,
+    extract_meter_readings,
+)
+
+MEASURANDS = [ENERGY, POWER, SOC, None]
+UNITS_OF_MEASURE = [
+    None,
+    {},
+    {"unit": None},
+    {"unit": "Wh"},
+    {"unit": "kWh"},
+    {"unit": "W"},
+    {"unit": "kW"},
+    {"unit": "Percent"},
+]
+MULTIPLIERS = [None, 0, 3, -1, 1.5, "missing"]
+
+
+class ExtractMeterReadingsTests(unittest.TestCase):
+    def test_scales_every_unit_combination_like_the_pydantic_models(self):
+        for measurand, unit_of_measure, multiplier in itertools.product(
+            MEASURANDS, UNITS_OF_MEASURE, MULTIPLIERS
+        ):
+            sampled_value = {"value": 1234.5}
+            if measurand is not None:
+                sampled_value["measurand"] = measurand
+            if unit_of_measure is not None:
+                sampled_value["unitOfMeasure"] = dict(unit_of_measure)
+                if multiplier != "missing":
+                    sampled_value["unitOfMeasure"]["multiplier"] = multiplier
+            with self.subTest(sampled_value=sampled_value):
+                self.assertEqual(
+                    extract_meter_readings([{"sampledValue": [sampled_value]}]),
+                    reference_readings(sampled_value),
+                )
+
+    def test_reads_only_phaseless_energy_power_and_soc(self):
+        sampled_values = [
+            {"value": 230.1, "measurand": "Voltage", "phase": "L1-N"},
+            {"value": 16, "measurand": "Current.Import", "phase": "L1"},
+            {"value": 5000, "measurand": ENERGY, "phase": "L1"},
+            {"value": 16, "measurand": "Current.Import"},
+            {"value": 11000, "measurand": POWER, "unitOfMeasure": {"unit": "W"}},
+            {"value": 57, "measurand": SOC, "phase": None},
+        ]
+
+        self.assertEqual(
+            extract_meter_readings([{"sampledValue": sampled_values}]),
+            [MeterReading(POWER, 11.0), MeterReading(SOC, 57.0)],
+        )
+
+    def test_reads_latest_meter_value_in_sampling_order(self):
+        meter_values = [
+            {"sampledValue": [{"value": 1000}]},
+            {"sampledValue": [{"value": 2000}, {"value": 2500}]},
+        ]
+
+        self.assertEqual(
+            extract_meter_readings(meter_values),
+            [MeterReading(ENERGY, 2.0), MeterReading(ENERGY, 2.5)],
+        )
+
+    def test_no_meter_values(self):
+        for meter_values in [None, []]:
+            with self.subTest(meter_values=meter_values):
+                self.assertEqual(extract_meter_readings(meter_values), [])
+
+    def test_numeric_strings_are_read_like_pydantic(self):
+        self.assertEqual(
+            extract_meter_readings(
+                [
+                    {
+                        "sampledValue": [
+                            {"value": "1500", "unitOfMeasure": {"multiplier": "1"}}
+                        ]
+                    }
+                ]
+            ),
+            [MeterReading(ENERGY, 15.0)],
+        )
+
+    def test_invalid_meter_values_are_rejected(self):
+        for meter_values in [
+            ["not an object"],
+            [{"sampledValue": None}],
+            [{"sampledValue": ["not an object"]}],
+            [{"sampledValue": [{"measurand": ENERGY}]}],
+            [{"sampledValue": [{"value": "high"}]}],
+            [{"sampledValue": [{"value": True}]}],
+            [{"sampledValue": [{"value": 1, "unitOfMeasure": "Wh"}]}],
+            [{"sampledValue": [{"value": 1, "unitOfMeasure": {"multiplier": "k"}}]}],
+        ]:
+            with self.subTest(meter_values=meter_values):
+                with self.assertRaises(InvalidMeterValueError):
+                    extract_meter_readings(meter_values)
+
+
+def reference_readings(raw_sampled_value: dict) -> list[MeterReading]:
+    """The scaling of update_checkout_with_meter_values on pydantic models."""
+    sampled_value = SampledValueType(**raw_sampled_value)
+    # Without a unitOfMeasure the models raised, the OCPP default is used instead
+    unit_of_measure = sampled_value.unitOfMeasure or UnitOfMeasureType()
+    value = sampled_value.value
+    if (
+        sampled_value.measurand == MeasurandEnumType.EnergyActiveImportRegister
+        and sampled_value.phase is None
+    ):
+        if unit_of_measure.unit is None or unit_of_measure.unit == "Wh":
+            value = value / 1000
+        if unit_of_measure.multiplier is not None:
+            value = value * 10**unit_of_measure.multiplier
+        return [MeterReading(ENERGY, value)]
+    elif (
+        sampled_value.measurand == MeasurandEnumType.PowerActiveImport
+        and sampled_value.phase is None
+    ):
+        if unit_of_measure.unit is None or unit_of_measure.unit == "W":
+            value = value / 1000
+        if unit_of_measure.multiplier is not None:
+            value = value * 10**unit_of_measure.multiplier
+        return [MeterReading(POWER, value)]
+    elif (
+        sampled_value.measurand == MeasurandEnumType.SoC and sampled_value.phase is None
+    ):
+        if unit_of_measure.multiplier is not None:
+            value = value * 10**unit_of_measure.multiplier
+        return [MeterReading(SOC, value)]
+    return []
+
+
+if __name__ == "__main__":
+    unittest.main()
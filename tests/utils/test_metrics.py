@@ -0,0 +1,112 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY, CollectorRegistry, Gauge
+
+from utils.metrics import (
+    EVENTS,
+    Histogram,
+    RequestMetricsMiddleware,
+    histogram_totals,
+    render_metrics,
+    set_gauge_function,
+)
+
+
+class MetricsTests(unittest.TestCase):
+    def test_renders_metrics_in_text_format(self):
+        EVENTS.labels("TransactionEvent", "Started").inc()
+
+        self.assertIn(
+            b'citrineos_events_total{action="TransactionEvent",event_type="Started"}',
+            render_metrics(),
+        )
+
+    def test_gauge_function_is_read_when_scraped(self):
+        registry = CollectorRegistry()
+        waiting = Gauge("waiting", "Waiting messages.", registry=registry)
+        set_gauge_function(waiting, lambda: 7)
+
+        self.assertEqual(registry.get_sample_value("waiting"), 7)
+
+    def test_histogram_totals(self):
+        duration = Histogram(
+            "duration_seconds",
+            "Duration.",
+            ("route",),
+            buckets=(0.1, 1),
+            registry=CollectorRegistry(),
+        )
+        for seconds in [0.05, 0.1, 0.5, 3]:
+            duration.labels("/a").observe(seconds)
+
+        self.assertEqual(histogram_totals(duration), {("/a",): (4, 3.65)})
+
+    def test_collects_metrics_of_all_processes_in_multiprocess_mode(self):
+        with tempfile.TemporaryDirectory() as directory:
+            env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": directory}
+            record = (
+                "import time\n"
+                "from utils.metrics import EVENTS, DB_POOL_SIZE, set_gauge_function\n"
+                "EVENTS.labels('TransactionEvent', 'Started').inc()\n"
+                "set_gauge_function(DB_POOL_SIZE, lambda: 5)\n"
+                "time.sleep(0.2)\n"
+            )
+            for _ in range(2):
+                subprocess.run([sys.executable, "-c", record], env=env, check=True)
+
+            rendered = subprocess.run(
+                [
+                    sys.executable,
+                    "-c",
+                    "import sys\n"
+                    "from utils.metrics import render_metrics\n"
+                    "sys.stdout.buffer.write(render_metrics())\n",
+                ],
+                env=env,
+                check=True,
+                capture_output=True,
+            ).stdout.decode()
+
+        self.assertIn(
+            'citrineos_events_total{action="TransactionEvent",event_type="Started"}'
+            " 2.0",
+            rendered,
+        )
+        self.assertIn("db_pool_size 10.0", rendered)
+
+
+class RequestMetricsMiddlewareTests(unittest.TestCase):
+    def test_observes_requests_by_route_template(self):
+        app = FastAPI()
+        app.add_middleware(RequestMetricsMiddleware)
+
+        @app.get("/evses/{evse_id}")
+        async def get_evse(evse_id: str):
+            return {"id": evse_id}
+
+        def count(route, status):
+            return (
+                REGISTRY.get_sample_value(
+                    "http_request_duration_seconds_count",
+                    {"method": "GET", "route": route, "status": status},
+                )
+                or 0
+            )
+
+        counts = count("/evses/{evse_id}", "200"), count("other", "404")
+
+        client = TestClient(app)
+        client.get("/evses/1")
+        client.get("/evses/2")
+        client.get("/unknown")
+
+        self.assertEqual(
+            (count("/evses/{evse_id}", "200"), count("other", "404")),
+            (counts[0] + 2, counts[1] + 1),
+        )
@@ -0,0 +1,159 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from tests.database import sqlite_sessionmaker
+
+from db.init_db import ProcessedOcppEvent
+from schemas.transaction_event import TransactionEventRequest
+from utils.ocpp_event_dedup import (
+    OcppEventDeduplicator,
+    OcppEventInProgressError,
+    OcppEventStatusEnumType,
+    get_transaction_event_key,
+)
+
+
+class GetTransactionEventKeyTests(unittest.TestCase):
+    def test_uses_seq_no_when_present(self):
+        event = a_transaction_event(seqNo=3)
+
+        self.assertEqual(
+            get_transaction_event_key("CS01", event), ("CS01", "tx-1", "3", "Updated")
+        )
+
+    def test_falls_back_to_timestamp(self):
+        event = a_transaction_event()
+
+        self.assertEqual(
+            get_transaction_event_key("CS01", event),
+            ("CS01", "tx-1", "2024-05-01T10:00:00+00:00", "Updated"),
+        )
+
+
+class OcppEventDeduplicatorTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.SessionLocal = sqlite_sessionmaker()
+        self.deduplicator = self.a_deduplicator()
+
+    def a_deduplicator(self, cache_size=100):
+        return OcppEventDeduplicator(
+            cache_size=cache_size,
+            window=timedelta(hours=1),
+            claim_timeout=timedelta(minutes=5),
+            session_factory=self.SessionLocal,
+        )
+
+    def add_event(self, key, status, claimed_at):
+        station_id, transaction_id, sequence, event_type = key
+        with self.SessionLocal() as db:
+            db.add(
+                ProcessedOcppEvent(
+                    station_id=station_id,
+                    transaction_id=transaction_id,
+                    sequence=sequence,
+                    event_type=event_type,
+                    status=status,
+                    received_at=claimed_at,
+                    claimed_at=claimed_at,
+                )
+            )
+            db.commit()
+
+    async def test_first_delivery_is_claimed(self):
+        self.assertTrue(await self.deduplicator.claim(("CS01", "tx-1", "1", "Started")))
+
+        with self.SessionLocal() as db:
+            self.assertEqual(db.query(ProcessedOcppEvent).count(), 1)
+
+    async def test_redelivery_is_dropped_from_memory(self):
+        key = ("CS01", "tx-1", "1", "Started")
+        await self.deduplicator.claim(key)
+
+        with patch.object(self.deduplicator, "_insert") as insert:
+            self.assertFalse(await self.deduplicator.claim(key))
+        insert.assert_not_called()
+
+    async def test_redelivery_after_restart_is_dropped_by_database(self):
+        key = ("CS01", "tx-1", "1", "Started")
+        await self.deduplicator.claim(key)
+        await self.deduplicator.complete(key)
+
+        self.assertFalse(await self.a_deduplicator().claim(key))
+
+    async def test_redelivery_during_processing_elsewhere_is_retried(self):
+        key = ("CS01", "tx-1", "1", "Started")
+        await self.deduplicator.claim(key)
+
+        other = self.a_deduplicator()
+        with self.assertRaises(OcppEventInProgressError):
+            await other.claim(key)
+        self.assertFalse(other.is_duplicate(key))
+
+    async def test_expired_claim_is_taken_over(self):
+        key = ("CS01", "tx-1", "1", "Started")
+        self.add_event(
+            key,
+            OcppEventStatusEnumType.CLAIMED,
+            datetime.now(timezone.utc) - timedelta(minutes=10),
+        )
+
+        self.assertTrue(await self.deduplicator.claim(key))
+        with self.assertRaises(OcppEventInProgressError):
+            await self.a_deduplicator().claim(key)
+
+    async def test_events_differing_in_any_part_of_the_key_are_claimed(self):
+        keys = [
+            ("CS01", "tx-1", "1", "Updated"),
+            ("CS02", "tx-1", "1", "Updated"),
+            ("CS01", "tx-2", "1", "Updated"),
+            ("CS01", "tx-1", "2", "Updated"),
+            ("CS01", "tx-1", "1", "Ended"),
+        ]
+        for key in keys:
+            with self.subTest(key=key):
+                self.assertTrue(await self.deduplicator.claim(key))
+
+    async def test_cache_is_bounded(self):
+        deduplicator = self.a_deduplicator(cache_size=2)
+        for seq_no in range(5):
+            key = ("CS01", "tx-1", str(seq_no), "Updated")
+            await deduplicator.claim(key)
+            await deduplicator.complete(key)
+
+        self.assertEqual(len(deduplicator._seen), 2)
+        self.assertFalse(await deduplicator.claim(("CS01", "tx-1", "0", "Updated")))
+
+    async def test_released_event_can_be_claimed_again(self):
+        key = ("CS01", "tx-1", "1", "Started")
+        await self.deduplicator.claim(key)
+
+        await self.deduplicator.release(key)
+
+        self.assertTrue(await self.deduplicator.claim(key))
+
+    async def test_prune_deletes_expired_keys(self):
+        self.add_event(
+            ("CS01", "tx-1", "1", "Started"),
+            OcppEventStatusEnumType.DONE,
+            datetime.now(timezone.utc) - timedelta(hours=2),
+        )
+        await self.deduplicator.claim(("CS01", "tx-1", "2", "Updated"))
+
+        self.assertEqual(self.deduplicator._prune(), 1)
+        self.assertTrue(await self.deduplicator.claim(("CS01", "tx-1", "1", "Started")))
+
+
+def a_transaction_event(**fields) -> TransactionEventRequest:
+    event = {
+        "eventType": "Updated",
+        "timestamp": "2024-05-01T10:00:00Z",
+        "triggerReason": "MeterValuePeriodic",
+        "transactionInfo": {"transactionId": "tx-1", "remoteStartId": 1},
+    }
+    event.update(fields)
+    return TransactionEventRequest(**event)
+
+
+if __name__ == "__main__":
+    unittest.main()
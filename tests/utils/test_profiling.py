@@ -0,0 +1,93 @@
+import asyncio
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+os.environ.setdefault("CONFIG_PATH", ".env.test")
+
+from utils import profiling
+from utils.profiling import (
+    EventLoopLagMonitor,
+    ProfilerBusyError,
+    StackSampler,
+    profile,
+    write_profile,
+)
+
+
+def wait_in_worker(stop: threading.Event) -> None:
+    stop.wait()
+
+
+class StackSamplerTests(unittest.TestCase):
+    def test_samples_stacks_of_other_threads_root_first(self):
+        stop = threading.Event()
+        worker = threading.Thread(target=wait_in_worker, args=(stop,), name="worker")
+        worker.start()
+        self.addCleanup(worker.join)
+        self.addCleanup(stop.set)
+
+        sampler = StackSampler(interval=0.001).run(0.05)
+
+        stacks = [
+            (stack.split(";"), count)
+            for stack, count in sampler.stacks.items()
+            if stack.startswith("worker;")
+        ]
+        self.assertEqual(len(stacks), 1)
+        frames, count = stacks[0]
+        self.assertTrue(frames[-1].startswith("wait ("))
+        self.assertIn("wait_in_worker (test_profiling.py:", ";".join(frames))
+        self.assertEqual(count, sampler.samples)
+        self.assertIn(f"{';'.join(frames)} {count}\n", sampler.folded())
+
+    def test_only_one_profile_runs_at_a_time(self):
+        with profiling._profile_lock:
+            with self.assertRaises(ProfilerBusyError):
+                profile(0.01)
+
+    def test_writes_folded_stacks_to_output_dir(self):
+        with (
+            tempfile.TemporaryDirectory() as directory,
+            patch.object(profiling.Config, "PROFILE_OUTPUT_DIR", directory),
+        ):
+            # Profiles run off the main thread, like from the signal handler
+            with ThreadPoolExecutor() as executor:
+                path = executor.submit(write_profile, 0.02).result()
+
+            self.assertEqual(os.path.dirname(path), directory)
+            self.assertTrue(path.endswith(".folded"))
+            with open(path) as file:
+                self.assertIn("MainThread;", file.read())
+
+
+def block_the_loop(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+class EventLoopLagMonitorTests(unittest.IsolatedAsyncioTestCase):
+    async def test_logs_stack_of_blocking_call(self):
+        monitor = EventLoopLagMonitor(threshold=0.05)
+        monitor.start()
+        self.addCleanup(monitor.stop)
+        await asyncio.sleep(0.05)
+
+        with self.assertLogs(level="WARNING") as logs:
+            block_the_loop(0.3)
+            await asyncio.sleep(0.1)
+
+        self.assertIn("block_the_loop", logs.output[0])
+        self.assertIn("was blocked for", logs.output[-1])
+
+    async def test_responsive_loop_is_not_logged(self):
+        monitor = EventLoopLagMonitor(threshold=0.05)
+        monitor.start()
+        self.addCleanup(monitor.stop)
+
+        with self.assertNoLogs(level="WARNING"):
+            for _ in range(20):
+                await asyncio.sleep(0.01)
@@ -0,0 +1,88 @@
+import asyncio
+import os
+import time
+import unittest
+from unittest.mock import Mock, patch
+
+os.environ.setdefault("CONFIG_PATH", ".env.test")
+
+from tests.database import sqlite_sessionmaker
+
+from config import Config
+from utils.cache import LocalCacheBackend
+from utils.readiness import check_readiness
+
+
+class CheckReadinessTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.broker = await asyncio.start_server(
+            lambda reader, writer: writer.close(), "127.0.0.1", 0
+        )
+        self.addAsyncCleanup(self.broker.wait_closed)
+        self.addCleanup(self.broker.close)
+        broker_port = self.broker.sockets[0].getsockname()[1]
+
+        self.cache = LocalCacheBackend()
+        for patcher in [
+            patch("db.init_db.SessionLocal", sqlite_sessionmaker()),
+            patch("utils.readiness.cache_backend", lambda: self.cache),
+            patch.object(Config, "MESSAGE_BROKER_HOST", "127.0.0.1"),
+            patch.object(Config, "MESSAGE_BROKER_PORT", broker_port),
+            patch.object(Config, "READINESS_TIMEOUT_SECONDS", 0.5),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def test_ready_when_all_dependencies_respond(self):
+        ready, checks = await check_readiness()
+
+        self.assertTrue(ready)
+        self.assertEqual(checks["database"], {"status": "up"})
+        self.assertEqual(checks["broker"], {"status": "up"})
+        self.assertEqual(checks["cache"], {"status": "up", "backend": "local"})
+        self.assertEqual(
+            checks["integrations"],
+            {
+                "stripe": {"circuit": "closed"},
+                "citrineos": {"circuit": "closed"},
+                "directus": {"circuit": "closed"},
+            },
+        )
+
+    async def test_not_ready_while_broker_is_down(self):
+        self.broker.close()
+        await self.broker.wait_closed()
+
+        ready, checks = await check_readiness()
+
+        self.assertFalse(ready)
+        self.assertEqual(checks["broker"]["status"], "down")
+        self.assertEqual(checks["database"], {"status": "up"})
+
+    async def test_not_ready_once_embedded_consumer_stopped(self):
+        consumer_task = Mock(done=Mock(return_value=True))
+
+        ready, checks = await check_readiness(consumer_task)
+
+        self.assertFalse(ready)
+        self.assertEqual(
+            checks["broker"],
+            {"status": "down", "error": "The embedded event consumer stopped"},
+        )
+
+    async def test_not_ready_while_database_is_down(self):
+        with patch(
+            "db.init_db.SessionLocal", Mock(side_effect=ConnectionError("refused"))
+        ):
+            ready, checks = await check_readiness()
+
+        self.assertFalse(ready)
+        self.assertEqual(checks["database"], {"status": "down", "error": "refused"})
+
+    async def test_fails_checks_that_time_out(self):
+        self.cache.ping = lambda: time.sleep(1)
+
+        ready, checks = await check_readiness()
+
+        self.assertFalse(ready)
+        self.assertEqual(checks["cache"], {"status": "down", "error": "Timed out"})
@@ -0,0 +1,101 @@
+import time
+import unittest
+
+import stripe
+from stripe.error import SignatureVerificationError
+
+from utils.stripe_webhook import verify_stripe_signature
+
+PAYLOAD = b'{"id": "evt_1", "type": "checkout.session.completed"}'
+
+
+class VerifyStripeSignatureTests(unittest.TestCase):
+    def test_accepts_payload_signed_with_secret(self):
+        header = a_signature_header(PAYLOAD, "whsec_connect")
+
+        secret = verify_stripe_signature(PAYLOAD, header, ["whsec_connect"])
+
+        self.assertEqual(secret, "whsec_connect")
+
+    def test_returns_matching_secret(self):
+        for signing_secret in ["whsec_connect", "whsec_account"]:
+            with self.subTest(signing_secret=signing_secret):
+                header = a_signature_header(PAYLOAD, signing_secret)
+
+                secret = verify_stripe_signature(
+                    PAYLOAD, header, ["whsec_connect", "whsec_account"]
+                )
+
+                self.assertEqual(secret, signing_secret)
+
+    def test_agrees_with_stripe_library(self):
+        header = a_signature_header(PAYLOAD, "whsec_connect")
+
+        self.assertTrue(
+            stripe.WebhookSignature.verify_header(
+                PAYLOAD.decode(), header, "whsec_connect", 300
+            )
+        )
+        self.assertEqual(
+            verify_stripe_signature(PAYLOAD, header, ["whsec_connect"]),
+            "whsec_connect",
+        )
+
+    def test_accepts_any_of_multiple_signatures(self):
+        valid_header = a_signature_header(PAYLOAD, "whsec_connect")
+        timestamp, signature = [item.split("=")[1] for item in valid_header.split(",")]
+        header = f"t={timestamp},v1={'0' * 64},v1={signature},v0=ignored"
+
+        secret = verify_stripe_signature(PAYLOAD, header, ["whsec_connect"])
+
+        self.assertEqual(secret, "whsec_connect")
+
+    def test_rejects_invalid_signatures(self):
+        for description, payload, header in [
+            ("missing header", PAYLOAD, None),
+            ("empty header", PAYLOAD, ""),
+            ("no timestamp", PAYLOAD, "v1=abc"),
+            ("malformed timestamp", PAYLOAD, "t=abc,v1=abc"),
+            ("no v1 signature", PAYLOAD, f"t={int(time.time())},v0=abc"),
+            (
+                "unknown secret",
+                PAYLOAD,
+                a_signature_header(PAYLOAD, "whsec_other"),
+            ),
+            (
+                "tampered payload",
+                PAYLOAD + b" ",
+                a_signature_header(PAYLOAD, "whsec_connect"),
+            ),
+            (
+                "expired timestamp",
+                PAYLOAD,
+                a_signature_header(
+                    PAYLOAD, "whsec_connect", timestamp=int(time.time()) - 301
+                ),
+            ),
+        ]:
+            with self.subTest(description):
+                with self.assertRaises(SignatureVerificationError):
+                    verify_stripe_signature(payload, header, ["whsec_connect"])
+
+    def test_ignores_tolerance_when_disabled(self):
+        header = a_signature_header(PAYLOAD, "whsec_connect", timestamp=1)
+
+        secret = verify_stripe_signature(
+            PAYLOAD, header, ["whsec_connect"], tolerance=0
+        )
+
+        self.assertEqual(secret, "whsec_connect")
+
+
+def a_signature_header(payload: bytes, secret: str, timestamp: int = None) -> str:
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signature = stripe.WebhookSignature._compute_signature(
+        f"{timestamp}.{payload.decode()}", secret
+    )
+    return f"t={timestamp},v1={signature}"
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import unittest
+from unittest.mock import patch
+
+os.environ.setdefault("CONFIG_PATH", ".env.test")
+
+from utils import tracing
+from utils.tracing import inject_trace_headers, start_span, traced
+
+try:
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+        InMemorySpanExporter,
+    )
+except ImportError:
+    TracerProvider = None
+
+TRACE_ID = "0af7651916cd43dd8448eb211c80319c"
+TRACEPARENT = f"00-{TRACE_ID}-b7ad6b7169203331-01"
+
+
+class TracingDisabledTests(unittest.IsolatedAsyncioTestCase):
+    async def test_spans_are_noops(self):
+        @traced("handler")
+        async def handler(value):
+            return value * 2
+
+        with start_span("event", carrier={"traceparent": TRACEPARENT}) as span:
+            self.assertIsNone(span)
+        self.assertEqual(await handler(2), 4)
+
+    def test_headers_are_left_alone(self):
+        headers = {"Accept": "application/json"}
+
+        self.assertIs(inject_trace_headers(headers), headers)
+        self.assertIsNone(inject_trace_headers(None))
+
+    def test_missing_sdk_keeps_tracing_off(self):
+        with (
+            patch.object(tracing.Config, "TRACING_EXPORTER", "console"),
+            patch.object(tracing, "trace", None),
+            self.assertLogs(level="WARNING"),
+        ):
+            tracing.configure_tracing()
+
+        self.assertIsNone(tracing._tracer)
+
+
+@unittest.skipIf(TracerProvider is None, "opentelemetry-sdk is not installed")
+class TracingEnabledTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.exporter = InMemorySpanExporter()
+        provider = TracerProvider()
+        provider.add_span_processor(SimpleSpanProcessor(self.exporter))
+        patcher = patch.object(tracing, "_tracer", provider.get_tracer("test"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_event_span_continues_the_trace_of_the_message(self):
+        @traced("process_incoming_event")
+        async def handler():
+            return inject_trace_headers({})
+
+        with start_span(
+            "paymentService process",
+            kind="consumer",
+            carrier={"traceparent": TRACEPARENT.encode(), "stationId": "CS01"},
+        ):
+            headers = await handler()
+
+        child, parent = self.exporter.get_finished_spans()
+        self.assertEqual(child.name, "process_incoming_event")
+        self.assertEqual(child.parent.span_id, parent.context.span_id)
+        self.assertEqual(format(parent.context.trace_id, "032x"), TRACE_ID)
+        self.assertIn(TRACE_ID, headers["traceparent"])
@@ -1,6 +1,6 @@
 import os
 import unittest
-from contextlib import contextmanager
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
 from unittest.mock import MagicMock, Mock, patch
 
@@ -1037,23 +1037,22 @@ class GeneratePricingTests(unittest.TestCase):
 
 @contextmanager
 def model_data(data):
+    def query(model):
+        return MagicMock(
+            options=lambda *options: query(model),
+            filter=lambda expr: MagicMock(
+                first=lambda: data.get(model)
+                if data.get(model) and expr.right.value == data[model].id
+                else None
+            ),
+        )
+
     with patch(
-        "utils.utils.get_db",
-        return_value=iter(
-            [
-                Mock(
-                    query=Mock(
-                        side_effect=lambda model: MagicMock(
-                            filter=lambda expr: MagicMock(
-                                first=lambda: data.get(model)
-                                if data.get(model)
-                                and expr.right.value == data[model].id
-                                else None
-                            )
-                        )
-                    )
-                )
-            ]
+        "utils.utils.db_session",
+        return_value=nullcontext(
+            Mock(
+                query=Mock(side_effect=query),
+            )
         ),
     ):
         yield
@@ -0,0 +1,289 @@
+import asyncio
+import json
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+from tests.amqp import wait_until
+from tests.database import sqlite_sessionmaker
+
+from db.init_db import WebhookEvent
+from utils.webhook_inbox import (
+    WebhookEventStatusEnumType,
+    WebhookInbox,
+    store_webhook_event,
+)
+
+
+class StoreWebhookEventTests(unittest.TestCase):
+    def setUp(self):
+        self.SessionLocal = sqlite_sessionmaker()
+
+    def test_stores_pending_event(self):
+        event = an_event("evt_1", checkout_id=7)
+
+        with self.SessionLocal() as db:
+            inbox_event_id = store_webhook_event(db, event, payload_of(event), 7)
+
+        with self.SessionLocal() as db:
+            db_event = db.query(WebhookEvent).one()
+            self.assertEqual(db_event.id, inbox_event_id)
+            self.assertEqual(db_event.event_id, "evt_1")
+            self.assertEqual(db_event.event_type, "checkout.session.completed")
+            self.assertEqual(db_event.checkout_id, 7)
+            self.assertEqual(db_event.status, WebhookEventStatusEnumType.PENDING)
+            self.assertEqual(json.loads(db_event.payload), event)
+
+    def test_redelivered_event_is_not_stored_again(self):
+        event = an_event("evt_1", checkout_id=7)
+
+        with self.SessionLocal() as db:
+            first = store_webhook_event(db, event, payload_of(event), 7)
+            second = store_webhook_event(db, event, payload_of(event), 7)
+
+        self.assertIsNotNone(first)
+        self.assertIsNone(second)
+        with self.SessionLocal() as db:
+            self.assertEqual(db.query(WebhookEvent).count(), 1)
+
+
+class WebhookInboxTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        # Workers use their own connections concurrently, which the shared
+        # in-memory database does not support
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.SessionLocal = sqlite_sessionmaker(f"sqlite:///{tmp_dir.name}/inbox.db")
+        self.addCleanup(self.SessionLocal.kw["bind"].dispose)
+        self.processed = []
+        self.failures = {}
+
+    def handler(self, db, event):
+        # Sleep so workers interleave
+        time.sleep(0.001 * (event["sequence"] % 3))
+        self.assertIsNot(threading.current_thread(), threading.main_thread())
+        if self.failures.get(event["id"], 0) > 0:
+            self.failures[event["id"]] -= 1
+            raise requests.ConnectionError("CitrineOS unavailable")
+        if event.get("invalid"):
+            raise ValueError("Metadata missing")
+        self.processed.append((event["checkout_id"], event["sequence"]))
+
+    def inbox(self, workers=1, retry_delays=(10, 20), **options):
+        return WebhookInbox(
+            self.handler,
+            workers=workers,
+            session_factory=self.SessionLocal,
+            retry_delays=list(retry_delays),
+            **options,
+        )
+
+    def store(self, event_id, checkout_id, sequence, **fields):
+        event = an_event(event_id, checkout_id, sequence=sequence, **fields)
+        with self.SessionLocal() as db:
+            return store_webhook_event(db, event, payload_of(event), checkout_id)
+
+    def statuses(self):
+        with self.SessionLocal() as db:
+            return {
+                row.event_id: (row.status, row.attempts, row.last_error)
+                for row in db.query(WebhookEvent).all()
+            }
+
+    async def test_processes_events_of_a_checkout_in_order(self):
+        inbox = self.inbox(workers=3)
+        await inbox.start()
+
+        for sequence in range(12):
+            checkout_id = sequence % 4
+            inbox_event_id = self.store(f"evt_{sequence}", checkout_id, sequence)
+            inbox.submit(inbox_event_id, checkout_id)
+        await inbox.join()
+        await inbox.stop()
+
+        self.assertEqual(len(self.processed), 12)
+        for checkout_id in range(4):
+            sequences = [s for c, s in self.processed if c == checkout_id]
+            self.assertEqual(sequences, sorted(sequences))
+        for status, attempts, _ in self.statuses().values():
+            self.assertEqual(status, WebhookEventStatusEnumType.DONE)
+            self.assertEqual(attempts, 1)
+
+    async def test_failed_event_is_retried_with_backoff(self):
+        self.failures["evt_1"] = 2
+        inbox = self.inbox()
+        await inbox.start()
+
+        started = time.monotonic()
+        inbox.submit(self.store("evt_1", 1, 1), 1)
+        inbox.submit(self.store("evt_2", 1, 2), 1)
+        await wait_until(lambda: len(self.processed) == 2)
+        await inbox.stop()
+
+        self.assertGreaterEqual(time.monotonic() - started, 0.03)
+        self.assertEqual(self.processed, [(1, 1), (1, 2)])
+        status, attempts, _ = self.statuses()["evt_1"]
+        self.assertEqual(status, WebhookEventStatusEnumType.DONE)
+        self.assertEqual(attempts, 3)
+
+    async def test_events_of_other_checkouts_pass_an_event_waiting_for_retry(self):
+        self.failures["evt_1"] = 1
+        inbox = self.inbox(retry_delays=[50])
+        await inbox.start()
+
+        inbox.submit(self.store("evt_1", 1, 1), 1)
+        inbox.submit(self.store("evt_2", 1, 2), 1)
+        inbox.submit(self.store("evt_3", 2, 3), 2)
+        await wait_until(lambda: len(self.processed) == 3)
+        await inbox.stop()
+
+        self.assertEqual(self.processed, [(2, 3), (1, 1), (1, 2)])
+
+    async def test_held_events_are_released_when_the_retried_event_fails(self):
+        self.failures["evt_1"] = 3
+        inbox = self.inbox(max_attempts=2)
+        await inbox.start()
+
+        inbox.submit(self.store("evt_1", 1, 1), 1)
+        inbox.submit(self.store("evt_2", 1, 2), 1)
+        await wait_until(lambda: self.processed == [(1, 2)])
+        await inbox.stop()
+
+        self.assertEqual(self.statuses()["evt_1"][0], WebhookEventStatusEnumType.FAILED)
+
+    async def test_start_holds_events_behind_a_pending_retry(self):
+        self.store("evt_1", 1, 1)
+        self.store("evt_2", 1, 2)
+        with self.SessionLocal() as db:
+            db.query(WebhookEvent).filter(WebhookEvent.event_id == "evt_1").update(
+                {
+                    WebhookEvent.next_attempt_at: datetime.now(timezone.utc)
+                    + timedelta(milliseconds=50)
+                }
+            )
+            db.commit()
+
+        inbox = self.inbox()
+        await inbox.start()
+        await wait_until(lambda: len(self.processed) == 2)
+        await inbox.stop()
+
+        self.assertEqual(self.processed, [(1, 1), (1, 2)])
+
+    async def test_event_is_marked_failed_after_last_attempt(self):
+        self.failures["evt_1"] = 3
+        inbox = self.inbox(max_attempts=2)
+        await inbox.start()
+
+        inbox.submit(self.store("evt_1", 1, 1), 1)
+        await wait_until(
+            lambda: self.statuses()["evt_1"][0] == WebhookEventStatusEnumType.FAILED
+        )
+        await inbox.stop()
+
+        status, attempts, last_error = self.statuses()["evt_1"]
+        self.assertEqual(attempts, 2)
+        self.assertIn("CitrineOS unavailable", last_error)
+        self.assertEqual(self.processed, [])
+
+    async def test_event_failing_on_other_errors_is_not_retried(self):
+        inbox = self.inbox()
+        await inbox.start()
+
+        inbox.submit(self.store("evt_1", 1, 1, invalid=True), 1)
+        await wait_until(
+            lambda: self.statuses()["evt_1"][0] == WebhookEventStatusEnumType.FAILED
+        )
+        await asyncio.sleep(0.05)
+        await inbox.stop()
+
+        status, attempts, last_error = self.statuses()["evt_1"]
+        self.assertEqual(attempts, 1)
+        self.assertIn("Metadata missing", last_error)
+
+    async def test_stop_leaves_retries_pending_for_next_start(self):
+        self.failures["evt_1"] = 1
+        inbox = self.inbox(retry_delays=[50])
+        await inbox.start()
+        inbox.submit(self.store("evt_1", 1, 1), 1)
+        await inbox.join()
+        await inbox.stop()
+        self.assertEqual(
+            self.statuses()["evt_1"][0], WebhookEventStatusEnumType.PENDING
+        )
+
+        inbox = self.inbox(retry_delays=[50])
+        await inbox.start()
+        await wait_until(lambda: self.processed == [(1, 1)])
+        await inbox.stop()
+
+    async def test_event_is_processed_once(self):
+        inbox = self.inbox(workers=2)
+        await inbox.start()
+
+        inbox_event_id = self.store("evt_1", 1, 1)
+        inbox.submit(inbox_event_id, 1)
+        inbox.submit(inbox_event_id, 2)
+        await inbox.join()
+        await inbox.stop()
+
+        self.assertEqual(self.processed, [(1, 1)])
+
+    async def test_start_resumes_pending_and_interrupted_events(self):
+        self.store("evt_1", 1, 1)
+        self.store("evt_2", 2, 2)
+        now = datetime.now(timezone.utc)
+        self.set_processing(self.store("evt_3", 3, 3), claimed_at=now)
+        self.set_processing(
+            self.store("evt_4", 4, 4), claimed_at=now - timedelta(minutes=15)
+        )
+        self.set_processing(
+            self.store("evt_5", 5, 5),
+            claimed_at=now - timedelta(minutes=15),
+            attempts=5,
+        )
+
+        inbox = self.inbox(workers=2, max_attempts=5, processing_timeout=600)
+        await inbox.start()
+        await inbox.join()
+        await inbox.stop()
+
+        self.assertCountEqual(self.processed, [(1, 1), (2, 2), (4, 4)])
+        statuses = self.statuses()
+        self.assertEqual(statuses["evt_3"][0], WebhookEventStatusEnumType.PROCESSING)
+        self.assertEqual(statuses["evt_4"][:2], (WebhookEventStatusEnumType.DONE, 2))
+        self.assertEqual(statuses["evt_5"][0], WebhookEventStatusEnumType.FAILED)
+
+    def set_processing(self, inbox_event_id, claimed_at, attempts=1):
+        with self.SessionLocal() as db:
+            db.query(WebhookEvent).filter(WebhookEvent.id == inbox_event_id).update(
+                {
+                    WebhookEvent.status: WebhookEventStatusEnumType.PROCESSING,
+                    WebhookEvent.claimed_at: claimed_at,
+                    WebhookEvent.attempts: attempts,
+                }
+            )
+            db.commit()
+
+
+def an_event(event_id, checkout_id, **fields) -> dict:
+    event = {
+        "id": event_id,
+        "type": "checkout.session.completed",
+        "checkout_id": checkout_id,
+        "data": {"object": {"metadata": {"checkoutId": str(checkout_id)}}},
+    }
+    event.update(fields)
+    return event
+
+
+def payload_of(event: dict) -> bytes:
+    return json.dumps(event).encode()
+
+
+if __name__ == "__main__":
+    unittest.main()
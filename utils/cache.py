@@ -0,0 +1,187 @@
+import threading
+import time
+from collections import OrderedDict
+from logging import info, warning
+
+from config import Config
+
+try:
+    import redis
+except ImportError:  # The shared cache is optional
+    redis = None
+
+KEY_PREFIX = "citrineos-payment:"
+# A deleted entry is replaced by this marker for DELETED_SECONDS, so a reader that
+# read the rows before they changed cannot put them back into the cache afterwards
+DELETED = b""
+DELETED_SECONDS = 5
+
+
+class LocalCacheBackend:
+    """
+    Keeps entries in a bounded in-process LRU.
+
+    Every process has its own entries, so an entry deleted or replaced in one
+    process stays visible in the others until it expires.
+    """
+
+    name = "local"
+    shared = False
+
+    def __init__(self, max_entries: int = Config.CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        """Sets the entry unless the key has one, returns whether it was set."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return False
+        self.set(key, value, ttl)
+        return True
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def ping(self) -> None:
+        pass
+
+
+class RedisCacheBackend:
+    """
+    Keeps entries in Redis, shared by all web workers and event consumers.
+
+    Redis is reached over the network on every call, so it only pays off for
+    entries that are more expensive to compute than a round trip.
+    """
+
+    name = "redis"
+    shared = True
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key: str) -> bytes | None:
+        return self.client.get(KEY_PREFIX + key)
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        self.client.set(KEY_PREFIX + key, value, px=max(1, int(ttl * 1000)))
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        """Sets the entry unless the key has one, returns whether it was set."""
+        return bool(
+            self.client.set(
+                KEY_PREFIX + key, value, px=max(1, int(ttl * 1000)), nx=True
+            )
+        )
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            self.client.delete(*(KEY_PREFIX + key for key in keys))
+
+    def ping(self) -> None:
+        self.client.ping()
+
+
+def create_cache_backend(url: str = Config.CACHE_URL):
+    """
+    Returns the Redis backend for a redis:// or rediss:// `url`, else the local one.
+
+    Falls back to the local backend if the redis package is not installed.
+    """
+    if not url:
+        return LocalCacheBackend()
+    if redis is None:
+        warning(
+            " [Cache] CACHE_URL is set, but redis is not installed: pip install redis. "
+            "Caching in process memory instead."
+        )
+        return LocalCacheBackend()
+    info(" [Cache] Sharing caches through %s", url.split("@")[-1])
+    return RedisCacheBackend(
+        redis.Redis.from_url(
+            url,
+            socket_timeout=Config.CACHE_TIMEOUT_SECONDS,
+            socket_connect_timeout=Config.CACHE_TIMEOUT_SECONDS,
+        )
+    )
+
+
+class Cache:
+    """A namespace of cache entries, so caches sharing a backend do not collide."""
+
+    def __init__(self, namespace: str, backend=None):
+        self.namespace = namespace
+        self._backend = backend
+
+    @property
+    def backend(self):
+        # Created on first use, so importing this module does not connect anywhere
+        if self._backend is None:
+            self._backend = cache_backend()
+        return self._backend
+
+    def get(self, key: str) -> bytes | None:
+        return self.backend.get(self._key(key)) or None
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        self.backend.set(self._key(key), value, ttl)
+
+    def fill(self, key: str, value: bytes, ttl: float) -> None:
+        """
+        Caches a value computed after a miss, unless the key was deleted meanwhile.
+
+        A value read before a change and cached after its deletion would be served
+        until it expires.
+        """
+        self.backend.add(self._key(key), value, ttl)
+
+    def delete(self, *keys: str) -> None:
+        for key in keys:
+            self.backend.set(self._key(key), DELETED, DELETED_SECONDS)
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+
+_cache_backend = None
+_cache_backend_lock = threading.Lock()
+
+
+def cache_backend():
+    """Returns the backend shared by all caches of the process."""
+    global _cache_backend
+    if _cache_backend is None:
+        with _cache_backend_lock:
+            if _cache_backend is None:
+                _cache_backend = create_cache_backend()
+    return _cache_backend
+
+
+# Locations, EVSEs, connectors and tariffs served by the API
+topology_cache = Cache("topology")
+# Prices of checkouts
+pricing_cache = Cache("pricing")
@@ -0,0 +1,173 @@
+import threading
+import time
+from contextlib import contextmanager
+from enum import Enum
+from logging import info, warning
+from typing import Callable, Iterator
+
+from config import Config
+from utils.dependency_stats import CITRINEOS, DIRECTUS, STRIPE, dependency_stats
+from utils.metrics import (
+    CIRCUIT_BREAKER_REJECTED_CALLS,
+    CIRCUIT_BREAKER_STATE,
+    CIRCUIT_BREAKER_TRANSITIONS,
+    set_gauge_function,
+)
+from utils.tracing import start_span
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit for {name} is open")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Fails calls to a dependency fast while most of its recent calls failed.
+
+    While closed, the outcomes of calls are counted in one-second buckets over
+    `window` seconds. Once at least `min_calls` calls were made and the share of
+    failures reaches `failure_rate`, the circuit opens and calls raise
+    CircuitOpenError for `open_seconds`. After that the circuit is half-open and lets
+    `half_open_calls` probes through: if they all succeed it closes, if one fails it
+    opens again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = Config.CIRCUIT_BREAKER_FAILURE_RATE,
+        min_calls: int = Config.CIRCUIT_BREAKER_MIN_CALLS,
+        window: int = Config.CIRCUIT_BREAKER_WINDOW_SECONDS,
+        open_seconds: float = Config.CIRCUIT_BREAKER_OPEN_SECONDS,
+        half_open_calls: int = Config.CIRCUIT_BREAKER_HALF_OPEN_CALLS,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.half_open_calls = max(1, half_open_calls)
+        self.state = CircuitState.CLOSED
+        self.transitions = {state: 0 for state in CircuitState}
+        self.rejected_calls = 0
+        self._opened_at = 0.0
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        self._buckets = [[0, 0, 0] for _ in range(window)]  # second, calls, failures
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """Raises CircuitOpenError if the call must not be made."""
+        with self._lock:
+            if self.state == CircuitState.CLOSED:
+                return
+            if self.state == CircuitState.OPEN:
+                retry_after = self._opened_at + self.open_seconds - time.monotonic()
+                if retry_after > 0:
+                    self._reject()
+                    raise CircuitOpenError(self.name, retry_after)
+                self._transition(CircuitState.HALF_OPEN)
+            if self._probes_started >= self.half_open_calls:
+                self._reject()
+                raise CircuitOpenError(self.name, self.open_seconds)
+            self._probes_started += 1
+
+    def after_call(self, failed: bool) -> None:
+        with self._lock:
+            if self.state == CircuitState.HALF_OPEN:
+                if failed:
+                    self._transition(CircuitState.OPEN)
+                else:
+                    self._probes_succeeded += 1
+                    if self._probes_succeeded >= self.half_open_calls:
+                        self._transition(CircuitState.CLOSED)
+            elif self.state == CircuitState.CLOSED:
+                calls, failures = self._record(failed)
+                if calls >= self.min_calls and failures / calls >= self.failure_rate:
+                    self._transition(CircuitState.OPEN)
+
+    @contextmanager
+    def guard(
+        self, is_failure: Callable[[BaseException], bool] = lambda error: True
+    ) -> Iterator[None]:
+        """Runs the block as a call, failing it if it raises an error `is_failure` accepts."""
+        self.before_call()
+        failed = False
+        try:
+            yield
+        except BaseException as error:
+            failed = is_failure(error)
+            raise
+        finally:
+            self.after_call(failed)
+
+    def _record(self, failed: bool) -> tuple[int, int]:
+        now = int(time.monotonic())
+        bucket = self._buckets[now % self.window]
+        if bucket[0] != now:
+            bucket[:] = [now, 0, 0]
+        bucket[1] += 1
+        bucket[2] += failed
+        calls = failures = 0
+        for second, bucket_calls, bucket_failures in self._buckets:
+            if second > now - self.window:
+                calls += bucket_calls
+                failures += bucket_failures
+        return calls, failures
+
+    def _reject(self) -> None:
+        self.rejected_calls += 1
+        CIRCUIT_BREAKER_REJECTED_CALLS.labels(self.name).inc()
+
+    def _transition(self, state: CircuitState) -> None:
+        log = warning if state == CircuitState.OPEN else info
+        log(" [CircuitBreaker] %s: %s -> %s", self.name, self.state.value, state.value)
+        self.state = state
+        self.transitions[state] += 1
+        CIRCUIT_BREAKER_TRANSITIONS.labels(self.name, state.value).inc()
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        if state == CircuitState.OPEN:
+            self._opened_at = time.monotonic()
+        elif state == CircuitState.CLOSED:
+            for bucket in self._buckets:
+                bucket[:] = [0, 0, 0]
+
+
+circuit_breakers: dict[str, CircuitBreaker] = {
+    name: CircuitBreaker(name) for name in [STRIPE, CITRINEOS, DIRECTUS]
+}
+for _name in circuit_breakers:
+    for _state in CircuitState:
+        set_gauge_function(
+            CIRCUIT_BREAKER_STATE.labels(_name, _state.value),
+            lambda name=_name, state=_state: circuit_breakers[name].state == state,
+        )
+
+
+@contextmanager
+def call_dependency(
+    name: str, is_failure: Callable[[BaseException], bool] = lambda error: True
+) -> Iterator[None]:
+    """
+    Runs the block as a call to a dependency behind its circuit breaker.
+
+    Calls rejected by an open circuit are not recorded in the dependency stats.
+    """
+    with (
+        start_span(name, kind="client"),
+        circuit_breakers[name].guard(is_failure),
+        dependency_stats[name].track(),
+    ):
+        yield
@@ -0,0 +1,169 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from utils.metrics import (
+    DEPENDENCY_CALL_DURATION,
+    DEPENDENCY_CALL_ERRORS,
+    DEPENDENCY_CALLS_IN_FLIGHT,
+    set_gauge_function,
+)
+from utils.tracing import end_manual_span, start_manual_span, tracing_enabled
+
+POSTGRES = "postgres"
+STRIPE = "stripe"
+CITRINEOS = "citrineos"
+DIRECTUS = "directus"
+
+DEFAULT_WINDOW = 10  # in seconds
+
+
+class DependencyStats:
+    """
+    Calls to one downstream dependency over a sliding time window.
+
+    Calls are counted in one-second buckets, so recording is O(1) and the window
+    empties on its own when no calls are made. Calls are recorded from the event
+    loop and from worker threads alike.
+    """
+
+    def __init__(self, name: str, window: int = DEFAULT_WINDOW):
+        self.name = name
+        self.window = window
+        self.in_flight = 0
+        self.total_calls = 0
+        self.total_errors = 0
+        self._buckets = [[0, 0, 0, 0.0] for _ in range(window)]  # second, calls, ...
+        self._lock = threading.Lock()
+        self._duration = DEPENDENCY_CALL_DURATION.labels(name)
+        self._errors = DEPENDENCY_CALL_ERRORS.labels(name)
+
+    def started(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+
+    def finished(self, seconds: float, error: bool = False) -> None:
+        now = int(time.monotonic())
+        with self._lock:
+            self.in_flight -= 1
+            self.total_calls += 1
+            self.total_errors += error
+            bucket = self._buckets[now % self.window]
+            if bucket[0] != now:
+                bucket[:] = [now, 0, 0, 0.0]
+            bucket[1] += 1
+            bucket[2] += error
+            bucket[3] += seconds
+        self._duration.observe(seconds)
+        if error:
+            self._errors.inc()
+
+    def snapshot(self) -> tuple[int, int, float]:
+        """
+        Returns:
+            tuple - The calls, errors and average latency in seconds in the window.
+        """
+        oldest = int(time.monotonic()) - self.window
+        calls = errors = 0
+        latency = 0.0
+        with self._lock:
+            for second, bucket_calls, bucket_errors, bucket_latency in self._buckets:
+                if second > oldest:
+                    calls += bucket_calls
+                    errors += bucket_errors
+                    latency += bucket_latency
+        return calls, errors, latency / calls if calls else 0.0
+
+    @contextmanager
+    def track(self) -> Iterator[None]:
+        self.started()
+        started = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.finished(time.perf_counter() - started, error)
+
+
+dependency_stats: dict[str, DependencyStats] = {
+    name: DependencyStats(name) for name in [POSTGRES, STRIPE, CITRINEOS, DIRECTUS]
+}
+for _stats in dependency_stats.values():
+    set_gauge_function(
+        DEPENDENCY_CALLS_IN_FLIGHT.labels(_stats.name),
+        lambda stats=_stats: stats.in_flight,
+    )
+
+
+def track_dependency(name: str):
+    """Context manager recording a call to a downstream dependency."""
+    return dependency_stats[name].track()
+
+
+def instrument_engine(engine: Engine, name: str = POSTGRES) -> None:
+    """Records every statement executed on the engine as a call to `name`."""
+    stats = dependency_stats[name]
+    dialect = engine.dialect
+    # Constraint violations and bad statements say nothing about database health
+    health_errors = (
+        dialect.loaded_dbapi.OperationalError,
+        dialect.loaded_dbapi.InterfaceError,
+    )
+
+    # The dialect events wrap the DBAPI call alone. Any connection event listener,
+    # like before_cursor_execute, would slow down every statement of the engine.
+    def execute(dialect_execute, cursor, statement, *args) -> bool:
+        context = args[-1]
+        span = None
+        if tracing_enabled():
+            span = start_manual_span(
+                f"{name} {statement.split(None, 1)[0]}",
+                attributes={"db.system": "postgresql", "db.statement": statement},
+            )
+        stats.started()
+        started = time.perf_counter()
+        try:
+            dialect_execute(cursor, statement, *args)
+        except BaseException as e:
+            stats.finished(
+                time.perf_counter() - started, error=isinstance(e, health_errors)
+            )
+            end_manual_span(span, e)
+            context.dependency_recorded = True
+            raise
+        stats.finished(time.perf_counter() - started)
+        end_manual_span(span)
+        # Tells SQLAlchemy the statement was executed
+        return True
+
+    @event.listens_for(engine, "do_execute")
+    def _do_execute(cursor, statement, parameters, context):
+        return execute(dialect.do_execute, cursor, statement, parameters, context)
+
+    @event.listens_for(engine, "do_execute_no_params")
+    def _do_execute_no_params(cursor, statement, context):
+        return execute(dialect.do_execute_no_params, cursor, statement, context)
+
+    @event.listens_for(engine, "do_executemany")
+    def _do_executemany(cursor, statement, parameters, context):
+        return execute(dialect.do_executemany, cursor, statement, parameters, context)
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context):
+        context = exception_context.execution_context
+        if getattr(context, "dependency_recorded", False):
+            return
+        if isinstance(
+            exception_context.sqlalchemy_exception, (OperationalError, InterfaceError)
+        ):
+            # Failed outside of a statement, e.g. while connecting
+            stats.started()
+            stats.finished(0.0, error=True)
@@ -0,0 +1,199 @@
+"""
+Serving of the built frontend.
+
+Compresses the assets of a frontend build next to the originals, so they are
+served compressed without compressing them per request:
+
+    python -m utils.frontend frontend/build
+
+Writes a .gz file for every compressible asset, and a .br file if brotli is
+installed. Run it again after every build.
+"""
+
+import argparse
+import gzip
+import hashlib
+import os
+import re
+from logging import basicConfig, info
+from mimetypes import guess_type
+
+import jinja2
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional, browsers fall back to gzip
+    brotli = None
+
+# Served for a year without revalidation, a new build changes their names
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Cached, but revalidated with the ETag on every use
+REVALIDATE = "no-cache"
+# Build tools add a hash of the content to the names of bundles and media
+HASHED_NAME = re.compile(r"\.[0-9a-f]{8,}\.(?:chunk\.)?[a-z0-9]+$")
+COMPRESSIBLE = (".js", ".css", ".html", ".svg", ".json", ".map", ".txt", ".ico")
+# Brotli first, it compresses better
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+
+def accepted_encodings(accept_encoding: str) -> set[str]:
+    encodings = set()
+    for part in accept_encoding.split(","):
+        encoding, _, params = part.partition(";")
+        quality = params.strip().removeprefix("q=")
+        try:
+            if quality and float(quality) == 0:
+                continue
+        except ValueError:
+            pass
+        encodings.add(encoding.strip().lower())
+    return encodings
+
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    return etag in [tag.strip(" W/") for tag in if_none_match.split(",")]
+
+
+class FrontendIndex:
+    """
+    The index.html of the frontend, rendered once.
+
+    Its only variable is the API URL from the config, so the page is rendered and
+    compressed on creation and every request is served from memory. Browsers
+    revalidate it with its ETag, as it names the current bundles.
+    """
+
+    def __init__(self, directory: str, context: dict):
+        environment = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(directory), autoescape=True
+        )
+        body = environment.get_template("index.html").render(context).encode()
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        self.bodies = {
+            None: (body, f'"{etag}"'),
+            "gzip": (gzip.compress(body, mtime=0), f'"{etag}-gzip"'),
+        }
+
+    def response(self, request_headers: Headers) -> Response:
+        encoding = (
+            "gzip"
+            if "gzip" in accepted_encodings(request_headers.get("accept-encoding", ""))
+            else None
+        )
+        body, etag = self.bodies[encoding]
+        headers = {"etag": etag, "cache-control": REVALIDATE, "vary": "Accept-Encoding"}
+        if encoding is not None:
+            headers["content-encoding"] = encoding
+        if etag_matches(etag, request_headers.get("if-none-match", "")):
+            return NotModifiedResponse(Headers(headers))
+        return Response(body, media_type="text/html", headers=headers)
+
+
+class FrontendStaticFiles(StaticFiles):
+    """
+    Serves the frontend build with cache headers and precompressed assets.
+
+    Assets with a content hash in their name are immutable. When a .br or .gz file
+    written by `python -m utils.frontend` exists next to an asset and the browser
+    accepts its encoding, it is served instead of the asset.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The build does not change while serving, so each asset is looked up once
+        self._compressed_variants: dict[str, dict[str, tuple]] = {}
+
+    def compressed_variants(self, full_path: str) -> dict[str, tuple]:
+        """Returns the path and stat of each compressed file of an asset by encoding."""
+        variants = self._compressed_variants.get(full_path)
+        if variants is None:
+            variants = {}
+            if full_path.endswith(COMPRESSIBLE):
+                for encoding, suffix in ENCODINGS.items():
+                    try:
+                        variants[encoding] = (
+                            full_path + suffix,
+                            os.stat(full_path + suffix),
+                        )
+                    except FileNotFoundError:
+                        pass
+            self._compressed_variants[full_path] = variants
+        return variants
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        full_path = str(full_path)
+        headers = {
+            "cache-control": IMMUTABLE
+            if HASHED_NAME.search(os.path.basename(full_path))
+            else REVALIDATE
+        }
+
+        variants = self.compressed_variants(full_path)
+        if variants:
+            headers["vary"] = "Accept-Encoding"
+        accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+        encoding = next((name for name in variants if name in accepted), None)
+        media_type = guess_type(full_path)[0] or "text/plain"
+        if encoding is not None:
+            full_path, stat_result = variants[encoding]
+            headers["content-encoding"] = encoding
+
+        response = FileResponse(
+            full_path,
+            status_code=status_code,
+            headers=headers,
+            media_type=media_type,
+            stat_result=stat_result,
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def compress_assets(directory: str) -> int:
+    """Writes the compressed files of all assets in `directory`, returns how many."""
+    written = 0
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if not name.endswith(COMPRESSIBLE):
+                continue
+            path = os.path.join(root, name)
+            with open(path, "rb") as file:
+                content = file.read()
+            compressed = {".gz": gzip.compress(content, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed[".br"] = brotli.compress(content)
+            for suffix, data in compressed.items():
+                # Small files can grow when compressed
+                if len(data) < len(content):
+                    with open(path + suffix, "wb") as file:
+                        file.write(data)
+                    written += 1
+    return written
+
+
+def main() -> None:
+    basicConfig(level="INFO")
+    parser = argparse.ArgumentParser(
+        description="Compress the assets of a frontend build"
+    )
+    parser.add_argument("directory", help="the frontend build, e.g. frontend/build")
+    args = parser.parse_args()
+    if brotli is None:
+        info(" [Frontend] brotli is not installed, writing gzip files only")
+    written = compress_assets(args.directory)
+    info(" [Frontend] Wrote %d compressed files to %s", written, args.directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import time
+
+import requests
+
+from utils.circuit_breaker import circuit_breakers
+from utils.dependency_stats import dependency_stats
+from utils.tracing import inject_trace_headers, start_span
+
+
+def request_dependency(
+    name: str, method: str, url: str, timeout: float, **kwargs
+) -> requests.Response:
+    """
+    Sends an HTTP request to a dependency behind its circuit breaker.
+
+    Connection errors, timeouts and 5xx responses count as failed calls. The response
+    is returned whatever its status, so callers keep handling it as before. The
+    request carries the current trace in its headers.
+
+    Raises:
+        CircuitOpenError - If the circuit of the dependency is open.
+    """
+    breaker = circuit_breakers[name]
+    stats = dependency_stats[name]
+    breaker.before_call()
+    stats.started()
+    started = time.perf_counter()
+    failed = True
+    try:
+        with start_span(
+            f"{name} {method}",
+            kind="client",
+            attributes={"http.request.method": method, "url.full": url},
+        ) as span:
+            headers = inject_trace_headers(kwargs.pop("headers", None))
+            response = requests.request(
+                method, url, timeout=timeout, headers=headers, **kwargs
+            )
+            if span is not None:
+                span.set_attribute("http.response.status_code", response.status_code)
+        failed = response.status_code >= 500
+        return response
+    finally:
+        stats.finished(time.perf_counter() - started, error=failed)
+        breaker.after_call(failed)
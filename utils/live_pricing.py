@@ -0,0 +1,254 @@
+from datetime import datetime
+from logging import warning
+
+import orjson
+from sqlalchemy import event, select
+from sqlalchemy.orm import ORMExecuteState, Session, joinedload
+
+from config import Config
+from db.init_db import (
+    Checkout as CheckoutModel,
+    MeterSample,
+    Tariff as TariffModel,
+    TariffElement,
+)
+from model.tariff_schedule import RateElement, RateSchedule, compile_rate_schedule
+from model.transaction_summary import TransactionSummary, current_time_for
+from schemas.checkouts import Checkout, Pricing
+from utils.cache import pricing_cache
+from utils.metrics import RESPONSE_CACHE_LOOKUPS
+
+TARIFF_FIELDS = (
+    "currency",
+    "tax_rate",
+    "payment_fee",
+    "price_kwh",
+    "price_minute",
+    "price_session",
+)
+
+
+def pricing_from_summary(transaction_summary: TransactionSummary) -> Pricing:
+    return Pricing(
+        currency=transaction_summary.currency,
+        tax_rate=transaction_summary.tax_rate,
+        payment_fee=transaction_summary.payment_fee,
+        energy_consumption_kwh=transaction_summary.kwh,
+        energy_costs=transaction_summary.energy_costs.get_amount_in_sub_unit()
+        if transaction_summary.energy_costs is not None
+        else None,
+        time_consumption_min=transaction_summary.time_consumption_min,
+        time_costs=transaction_summary.time_costs.get_amount_in_sub_unit()
+        if transaction_summary.time_costs is not None
+        else None,
+        idle_consumption_min=transaction_summary.idle_consumption_min,
+        idle_costs=transaction_summary.idle_costs.get_amount_in_sub_unit()
+        if transaction_summary.idle_costs is not None
+        else None,
+        session_consumption=1,
+        session_costs=transaction_summary.session_costs.get_amount_in_sub_unit()
+        if transaction_summary.session_costs is not None
+        else None,
+        payment_costs_tax_rate=0,
+        total_costs_net=transaction_summary.total_costs_net.get_amount_in_sub_unit(),
+        tax_costs=transaction_summary.tax_costs.get_amount_in_sub_unit(),
+        total_costs_gross=transaction_summary.total_costs_gross.get_amount_in_sub_unit(),
+        payment_costs_gross=transaction_summary.payment_costs_gross.get_amount_in_sub_unit(),
+        payment_costs_net=transaction_summary.payment_costs_net.get_amount_in_sub_unit(),
+    )
+
+
+def rate_elements(db_elements: list[TariffElement]) -> tuple[RateElement, ...]:
+    return tuple(
+        RateElement(*(getattr(db_element, field) for field in RateElement._fields))
+        for db_element in db_elements
+    )
+
+
+def rate_schedule_for(
+    elements: tuple[RateElement, ...],
+    price_kwh: float | None,
+    price_minute: float | None,
+) -> RateSchedule | None:
+    """Returns the compiled schedule of a tariff, None for one with flat prices only."""
+    if not elements:
+        return None
+    return compile_rate_schedule(
+        elements, price_kwh, price_minute, Config.TARIFF_TIME_ZONE
+    )
+
+
+def meter_readings(db: Session, checkout_id: int) -> list[tuple[datetime, float]]:
+    return [
+        (sampled_at, transaction_kwh)
+        for sampled_at, transaction_kwh in db.query(
+            MeterSample.sampled_at, MeterSample.transaction_kwh
+        )
+        .filter(MeterSample.checkout_id == checkout_id)
+        .order_by(MeterSample.sampled_at)
+    ]
+
+
+class LiveCheckout:
+    """
+    A checkout with the constants of its tariff, priced when read.
+
+    Everything but the time of a running session only changes with a write to the
+    checkout, so it is cached between writes. Reading it computes the time costs
+    up to now, and the totals depending on them, without the database. A tariff
+    with rate elements also needs the meter readings of the session, which are
+    cached with it.
+    """
+
+    def __init__(
+        self,
+        checkout: dict,
+        tariff: dict | None,
+        elements: tuple[RateElement, ...] = (),
+        meter_readings: list[tuple[datetime, float]] = (),
+    ):
+        self.checkout_fields = checkout
+        self.tariff = tariff
+        self.elements = elements
+        self.meter_readings = meter_readings
+
+    @classmethod
+    def from_rows(
+        cls,
+        db_checkout: CheckoutModel,
+        db_tariff: TariffModel | None,
+        meter_readings: list[tuple[datetime, float]] = (),
+    ) -> "LiveCheckout":
+        checkout = Checkout.model_validate(db_checkout).model_dump(
+            mode="json", exclude={"pricing"}
+        )
+        tariff = None
+        elements = ()
+        if db_tariff is not None:
+            tariff = {field: getattr(db_tariff, field) for field in TARIFF_FIELDS}
+            elements = rate_elements(db_tariff.elements)
+        return cls(checkout, tariff, elements, meter_readings if elements else ())
+
+    @classmethod
+    def from_bytes(cls, value: bytes) -> "LiveCheckout":
+        fields = orjson.loads(value)
+        return cls(
+            fields["checkout"],
+            fields["tariff"],
+            tuple(RateElement(*element) for element in fields.get("elements", ())),
+            [
+                (datetime.fromisoformat(sampled_at), transaction_kwh)
+                for sampled_at, transaction_kwh in fields.get("meter_readings", ())
+            ],
+        )
+
+    def to_bytes(self) -> bytes:
+        fields = {"checkout": self.checkout_fields, "tariff": self.tariff}
+        if self.elements:
+            fields["elements"] = [list(element) for element in self.elements]
+            fields["meter_readings"] = self.meter_readings
+        return orjson.dumps(fields)
+
+    def checkout(self, now: datetime | None = None) -> Checkout:
+        checkout = Checkout.model_validate(self.checkout_fields)
+        if self.tariff is None:
+            return checkout
+
+        if checkout.transaction_end_time is None and checkout.transaction_start_time:
+            # One point in time for all costs of the response
+            now = now or current_time_for(checkout.transaction_start_time)
+        checkout.pricing = pricing_from_summary(
+            TransactionSummary(
+                kwh=checkout.transaction_kwh,
+                start_time=checkout.transaction_start_time,
+                end_time=checkout.transaction_end_time,
+                now=now,
+                rate_schedule=rate_schedule_for(
+                    self.elements, self.tariff["price_kwh"], self.tariff["price_minute"]
+                ),
+                meter_readings=self.meter_readings,
+                **self.tariff,
+            )
+        )
+        return checkout
+
+
+def live_checkout_key(checkout_id: int) -> str:
+    return f"checkouts:{checkout_id}"
+
+
+def get_live_checkout(db: Session, checkout_id: int) -> LiveCheckout | None:
+    """
+    Returns the checkout from the pricing cache, reading and caching it on a miss.
+
+    Entries are dropped whenever a session commits a change to their checkout, like
+    a meter update or a bulk update of the checkout, and expire after LIVE_PRICING_CACHE_TTL_SECONDS.
+    """
+    key = live_checkout_key(checkout_id)
+    entry = pricing_cache.get(key)
+    if entry is not None:
+        RESPONSE_CACHE_LOOKUPS.labels(pricing_cache.namespace, "hit").inc()
+        return LiveCheckout.from_bytes(entry)
+
+    RESPONSE_CACHE_LOOKUPS.labels(pricing_cache.namespace, "miss").inc()
+    db_checkout = (
+        db.query(CheckoutModel).filter(CheckoutModel.id == checkout_id).first()
+    )
+    if db_checkout is None:
+        return None
+    db_tariff = (
+        db.query(TariffModel)
+        .options(joinedload(TariffModel.elements))
+        .filter(TariffModel.id == db_checkout.tariff_id)
+        .first()
+    )
+    readings = ()
+    if db_tariff is not None and db_tariff.elements:
+        readings = meter_readings(db, checkout_id)
+    live_checkout = LiveCheckout.from_rows(db_checkout, db_tariff, readings)
+    pricing_cache.fill(
+        key, live_checkout.to_bytes(), Config.LIVE_PRICING_CACHE_TTL_SECONDS
+    )
+    return live_checkout
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_checkouts(session: Session, flush_context) -> None:
+    changed = session.info.setdefault("changed_checkout_ids", set())
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(instance, CheckoutModel) and instance.id is not None:
+            changed.add(instance.id)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk_changed_checkouts(orm_execute_state: ORMExecuteState) -> None:
+    # Bulk updates and deletes skip the flush, read which checkouts they change
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ is not CheckoutModel:
+        return
+    query = select(CheckoutModel.id)
+    if orm_execute_state.statement.whereclause is not None:
+        query = query.where(orm_execute_state.statement.whereclause)
+    session = orm_execute_state.session
+    changed = session.info.setdefault("changed_checkout_ids", set())
+    changed.update(session.scalars(query))
+
+
+@event.listens_for(Session, "after_commit")
+def _drop_changed_checkouts(session: Session) -> None:
+    changed = session.info.pop("changed_checkout_ids", None)
+    if not changed:
+        return
+    try:
+        for checkout_id in changed:
+            pricing_cache.delete(live_checkout_key(checkout_id))
+    except Exception:
+        # The change is committed, only its cached copy lives until it expires
+        warning(" [Pricing] Could not drop checkouts %s from the cache", changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_checkouts(session: Session) -> None:
+    session.info.pop("changed_checkout_ids", None)
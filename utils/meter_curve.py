@@ -0,0 +1,62 @@
+from datetime import datetime
+from typing import Iterable, Iterator
+
+
+def downsample_meter_samples(
+    samples: Iterable[tuple[datetime, float | None, float | None, float | None]],
+    start: datetime,
+    end: datetime,
+    points: int,
+) -> Iterator[dict]:
+    """
+    Downsamples time-ordered meter samples into at most `points` curve points.
+
+    The time range is split into equal buckets. Each point averages the power of its
+    bucket and keeps the last energy and SoC reading, at the time of the last sample.
+    Samples are consumed one by one, so any number of them can be streamed through.
+
+    Parameters:
+        samples: Iterable - (sampled_at, transaction_kwh, power_active_import,
+            transaction_soc) tuples ordered by sampled_at.
+        start: datetime - The time of the first sample.
+        end: datetime - The time of the last sample.
+        points: int - The maximum number of points.
+    """
+    duration = (end - start).total_seconds()
+    bucket = None
+    point = None
+    power_sum = 0.0
+    power_count = 0
+
+    for sampled_at, transaction_kwh, power_active_import, transaction_soc in samples:
+        offset = (sampled_at - start).total_seconds()
+        sample_bucket = (
+            min(int(offset / duration * points), points - 1) if duration > 0 else 0
+        )
+        if sample_bucket != bucket:
+            if point is not None:
+                yield _finish_point(point, power_sum, power_count)
+            bucket = sample_bucket
+            point = {
+                "time": sampled_at,
+                "transaction_kwh": None,
+                "transaction_soc": None,
+            }
+            power_sum, power_count = 0.0, 0
+
+        point["time"] = sampled_at
+        if transaction_kwh is not None:
+            point["transaction_kwh"] = transaction_kwh
+        if transaction_soc is not None:
+            point["transaction_soc"] = transaction_soc
+        if power_active_import is not None:
+            power_sum += power_active_import
+            power_count += 1
+
+    if point is not None:
+        yield _finish_point(point, power_sum, power_count)
+
+
+def _finish_point(point: dict, power_sum: float, power_count: int) -> dict:
+    point["power_active_import"] = power_sum / power_count if power_count else None
+    return point
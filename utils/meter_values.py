@@ -0,0 +1,87 @@
+from typing import Any, NamedTuple
+
+from schemas.transaction_event import MeasurandEnumType
+
+ENERGY = MeasurandEnumType.EnergyActiveImportRegister.value
+POWER = MeasurandEnumType.PowerActiveImport.value
+SOC = MeasurandEnumType.SoC.value
+
+# OCPP defaults of SampledValueType and UnitOfMeasureType
+DEFAULT_MEASURAND = ENERGY
+DEFAULT_UNIT = "Wh"
+DEFAULT_MULTIPLIER = 0
+
+# Readings are stored in kWh and kW. Energy in Wh and power in W is divided by 1000,
+# as is a sample with an explicit null unit. Other units are taken as they are.
+UNIT_DIVISORS = {
+    ENERGY: {None: 1000, "Wh": 1000},
+    POWER: {None: 1000, "W": 1000},
+    SOC: {},
+}
+MULTIPLIER_SCALES = {multiplier: 10**multiplier for multiplier in range(-9, 10)}
+
+
+class InvalidMeterValueError(ValueError):
+    pass
+
+
+class MeterReading(NamedTuple):
+    measurand: str
+    value: float
+
+
+def extract_meter_readings(meter_values: list[Any] | None) -> list[MeterReading]:
+    """
+    Extracts the phase-less energy, power and SoC readings of the latest meter value.
+
+    Works on the raw JSON of TransactionEventRequest.meterValue and only looks at the
+    sampled values it needs. Readings are returned in the order they were sampled,
+    already scaled to kWh, kW and percent.
+    """
+    if not meter_values:
+        return []
+    latest_meter_value = meter_values[-1]
+    if not isinstance(latest_meter_value, dict):
+        raise InvalidMeterValueError("meterValue is not an object")
+    sampled_values = latest_meter_value.get("sampledValue")
+    if not isinstance(sampled_values, list):
+        raise InvalidMeterValueError("meterValue.sampledValue is not a list")
+
+    readings = []
+    for sampled_value in sampled_values:
+        if not isinstance(sampled_value, dict):
+            raise InvalidMeterValueError("sampledValue is not an object")
+        measurand = sampled_value.get("measurand", DEFAULT_MEASURAND)
+        unit_divisors = UNIT_DIVISORS.get(measurand)
+        if unit_divisors is None or sampled_value.get("phase") is not None:
+            continue
+
+        value = _to_float(sampled_value.get("value"))
+        unit_of_measure = sampled_value.get("unitOfMeasure") or {}
+        if not isinstance(unit_of_measure, dict):
+            raise InvalidMeterValueError("unitOfMeasure is not an object")
+        divisor = unit_divisors.get(unit_of_measure.get("unit", DEFAULT_UNIT))
+        if divisor is not None:
+            value = value / divisor
+        multiplier = unit_of_measure.get("multiplier", DEFAULT_MULTIPLIER)
+        if multiplier is not None:
+            value = value * _scale(multiplier)
+        readings.append(MeterReading(measurand, value))
+    return readings
+
+
+def _to_float(value: Any) -> float:
+    if isinstance(value, bool) or value is None:
+        raise InvalidMeterValueError(f"Invalid number: {value!r}")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise InvalidMeterValueError(f"Invalid number: {value!r}")
+
+
+def _scale(multiplier: Any) -> float:
+    if isinstance(multiplier, (int, float)) and not isinstance(multiplier, bool):
+        scale = MULTIPLIER_SCALES.get(multiplier)
+        if scale is not None:
+            return scale
+    return 10 ** _to_float(multiplier)
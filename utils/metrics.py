@@ -0,0 +1,271 @@
+import os
+import threading
+import time
+from functools import wraps
+from logging import exception
+from typing import Callable
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+
+# Request, handler and dependency call durations in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# With several processes, like uvicorn workers and the standalone consumer, every
+# process writes its values to files in PROMETHEUS_MULTIPROC_DIR and /metrics of
+# any worker reads all of them. The directory has to be set before the processes
+# start.
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+GAUGE_REFRESH_INTERVAL = 5  # in seconds, for gauges read from a function
+
+_gauge_functions: list[tuple[Gauge, Callable[[], float]]] = []
+_gauge_functions_lock = threading.Lock()
+_gauge_refresh_thread: threading.Thread | None = None
+
+
+def render_metrics() -> bytes:
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def start_metrics_server(port: int) -> None:
+    """Serves the metrics of this process on `port`, for processes without the API."""
+    start_http_server(port)
+
+
+def clear_multiprocess_metrics() -> None:
+    """Removes the values of earlier runs, before the processes start."""
+    if not MULTIPROCESS:
+        return
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    for name in os.listdir(directory):
+        if name.endswith(".db"):
+            os.remove(os.path.join(directory, name))
+
+
+def mark_process_dead(pid: int) -> None:
+    """Drops the live gauges of a process that exited."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
+
+
+def set_gauge_function(gauge: Gauge, function: Callable[[], float]) -> None:
+    """
+    Reads the value of `gauge` from `function`.
+
+    A single process reads it when the metrics are scraped. In multiprocess mode the
+    scraping process cannot call functions of the others, so the value is written
+    every GAUGE_REFRESH_INTERVAL seconds instead.
+    """
+    global _gauge_refresh_thread
+    if not MULTIPROCESS:
+        gauge.set_function(function)
+        return
+    with _gauge_functions_lock:
+        _gauge_functions.append((gauge, function))
+        if _gauge_refresh_thread is None:
+            _gauge_refresh_thread = threading.Thread(
+                target=_refresh_gauges, name="metrics-gauge-refresh", daemon=True
+            )
+            _gauge_refresh_thread.start()
+
+
+def _refresh_gauges() -> None:
+    while True:
+        with _gauge_functions_lock:
+            gauge_functions = list(_gauge_functions)
+        for gauge, function in gauge_functions:
+            try:
+                gauge.set(function())
+            except Exception:
+                exception(" [Metrics] Reading a gauge failed")
+        time.sleep(GAUGE_REFRESH_INTERVAL)
+
+
+def histogram_totals(histogram: Histogram) -> dict[tuple[str, ...], tuple[int, float]]:
+    """Returns the count and sum of observations of this process per label values."""
+    totals: dict[tuple[str, ...], list] = {}
+    for metric in histogram.collect():
+        for sample in metric.samples:
+            if sample.name.endswith("_count"):
+                index = 0
+            elif sample.name.endswith("_sum"):
+                index = 1
+            else:
+                continue
+            values = tuple(sample.labels.values())
+            totals.setdefault(values, [0, 0.0])[index] = sample.value
+    return {values: (int(count), total) for values, (count, total) in totals.items()}
+
+
+def timed(histogram: Histogram, *label_values: str):
+    """Decorates a coroutine function to observe its duration in `histogram`."""
+    child = histogram.labels(*label_values)
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Duration of API requests by route template.",
+    ("method", "route", "status"),
+    buckets=DEFAULT_BUCKETS,
+)
+EVENT_HANDLER_DURATION = Histogram(
+    "citrineos_event_handler_duration_seconds",
+    "Duration of CitrineOS event handlers.",
+    ("handler",),
+    buckets=DEFAULT_BUCKETS,
+)
+EVENTS = Counter(
+    "citrineos_events_total",
+    "CitrineOS events received by action and TransactionEvent eventType.",
+    ("action", "event_type"),
+)
+DEPENDENCY_CALL_DURATION = Histogram(
+    "dependency_call_duration_seconds",
+    "Duration of calls to PostgreSQL, Stripe, CitrineOS and Directus.",
+    ("dependency",),
+    buckets=DEFAULT_BUCKETS,
+)
+DEPENDENCY_CALL_ERRORS = Counter(
+    "dependency_call_errors_total",
+    "Failed calls to PostgreSQL, Stripe, CitrineOS and Directus.",
+    ("dependency",),
+)
+PAYMENT_CAPTURES = Counter(
+    "payment_captures_total",
+    "Stripe payment captures by result.",
+    ("result",),
+)
+DEPENDENCY_CALLS_IN_FLIGHT = Gauge(
+    "dependency_calls_in_flight",
+    "Calls to PostgreSQL, Stripe, CitrineOS and Directus in progress.",
+    ("dependency",),
+    multiprocess_mode="livesum",
+)
+CIRCUIT_BREAKER_STATE = Gauge(
+    "circuit_breaker_state",
+    "1 for the current state of the circuit breaker of a dependency, in any process.",
+    ("dependency", "state"),
+    multiprocess_mode="livemax",
+)
+CIRCUIT_BREAKER_TRANSITIONS = Counter(
+    "circuit_breaker_transitions_total",
+    "Circuit breaker state changes by the state entered.",
+    ("dependency", "state"),
+)
+CIRCUIT_BREAKER_REJECTED_CALLS = Counter(
+    "circuit_breaker_rejected_calls_total",
+    "Calls failed fast by an open circuit breaker.",
+    ("dependency",),
+)
+CONSUMER_WAITING_MESSAGES = Gauge(
+    "citrineos_consumer_waiting_messages",
+    "Events ready in the broker queue and not yet delivered to a consumer.",
+    multiprocess_mode="livemax",
+)
+CONSUMER_THROUGHPUT = Gauge(
+    "citrineos_consumer_throughput",
+    "Events settled per second over the last throughput interval.",
+    multiprocess_mode="livesum",
+)
+CONSUMER_PAUSED = Gauge(
+    "citrineos_consumer_paused",
+    "1 while the consumer is paused because a dependency is overloaded.",
+    multiprocess_mode="livemax",
+)
+CONSUMER_PAUSES = Counter(
+    "citrineos_consumer_pauses_total",
+    "Times the consumer was paused because a dependency was overloaded.",
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "Database connections of the pools by state.",
+    ("state",),
+    multiprocess_mode="livesum",
+)
+DB_POOL_SIZE = Gauge(
+    "db_pool_size",
+    "Configured size of the database pools.",
+    multiprocess_mode="livesum",
+)
+RESPONSE_CACHE_LOOKUPS = Counter(
+    "response_cache_lookups_total",
+    "Lookups of cached API responses by cache and result.",
+    ("cache", "result"),
+)
+EVENT_LOOP_LAG = Gauge(
+    "event_loop_lag_seconds",
+    "How long the event loop is behind its heartbeat.",
+    multiprocess_mode="livemax",
+)
+
+
+class RequestMetricsMiddleware:
+    """
+    Observes the duration of every HTTP request by method, route template and status.
+
+    Requests not matching an API route, like static files, are labelled "other" to
+    keep the number of series bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        # Looking up a child in prometheus_client takes a lock, this dict does not
+        self._children: dict[tuple[str, str, int], object] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            key = (
+                scope["method"],
+                getattr(scope.get("route"), "path", "other"),
+                status,
+            )
+            child = self._children.get(key)
+            if child is None:
+                child = self._children.setdefault(
+                    key, HTTP_REQUEST_DURATION.labels(key[0], key[1], str(status))
+                )
+            child.observe(time.perf_counter() - started)
@@ -0,0 +1,209 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from logging import debug
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+from config import Config
+from db.init_db import SessionLocal, ProcessedOcppEvent as ProcessedOcppEventModel
+from schemas.transaction_event import TransactionEventRequest
+
+OcppEventKey = tuple[str, str, str, str]
+
+PRUNE_INTERVAL = 1000  # claimed events between two deletes of expired keys
+
+
+class OcppEventStatusEnumType(str, Enum):
+    CLAIMED = "Claimed"
+    DONE = "Done"
+
+
+class OcppEventInProgressError(Exception):
+    """The event is being processed by another consumer, it is retried later."""
+
+
+def get_transaction_event_key(
+    station_id: str, transaction_event: TransactionEventRequest
+) -> OcppEventKey:
+    """
+    Returns the identity of a TransactionEvent.
+
+    The seqNo is unique per station and incremented for every TransactionEvent. If the
+    station does not send one, the timestamp of the event is used instead.
+    """
+    sequence = (
+        str(transaction_event.seqNo)
+        if transaction_event.seqNo is not None
+        else transaction_event.timestamp.isoformat()
+    )
+    return (
+        station_id,
+        transaction_event.transactionInfo.transactionId,
+        sequence,
+        transaction_event.eventType.value,
+    )
+
+
+class OcppEventDeduplicator:
+    """
+    Drops OCPP events that were already processed.
+
+    Recently seen keys are kept in a bounded in-memory LRU, so broker redeliveries are
+    dropped without any database work. Keys are also stored in the database for
+    OCPP_EVENT_DEDUP_WINDOW_HOURS, which covers restarts and several consumers.
+
+    A key is stored as claimed before the event is processed and marked done after.
+    A claim older than OCPP_EVENT_DEDUP_CLAIM_TIMEOUT_SECONDS was left by a consumer
+    that stopped while processing, its event is processed again on redelivery.
+    """
+
+    def __init__(
+        self,
+        cache_size: int = Config.OCPP_EVENT_DEDUP_CACHE_SIZE,
+        window: timedelta = timedelta(hours=Config.OCPP_EVENT_DEDUP_WINDOW_HOURS),
+        claim_timeout: timedelta = timedelta(
+            seconds=Config.OCPP_EVENT_DEDUP_CLAIM_TIMEOUT_SECONDS
+        ),
+        session_factory: sessionmaker = SessionLocal,
+    ):
+        self.cache_size = cache_size
+        self.window = window
+        self.claim_timeout = claim_timeout
+        self.session_factory = session_factory
+        self._seen: OrderedDict[OcppEventKey, None] = OrderedDict()
+        self._claims_since_prune = 0
+
+    def is_duplicate(self, key: OcppEventKey) -> bool:
+        """Checks the in-memory cache only."""
+        if key in self._seen:
+            self._seen.move_to_end(key)
+            return True
+        return False
+
+    async def claim(self, key: OcppEventKey) -> bool:
+        """
+        Records the event as being processed.
+
+        Returns:
+            bool - False if the event was already processed and should be dropped.
+
+        Raises:
+            OcppEventInProgressError - If another consumer claimed the event recently.
+        """
+        if self.is_duplicate(key):
+            return False
+        # Remember the key before leaving the event loop, so a redelivery arriving
+        # while the insert runs is dropped as well.
+        self._remember(key)
+        try:
+            claimed = await run_in_threadpool(self._insert, key)
+        except Exception:
+            self._seen.pop(key, None)
+            raise
+        if claimed:
+            await self._prune_if_due()
+        return claimed
+
+    async def complete(self, key: OcppEventKey) -> None:
+        """Records a claimed event as processed."""
+        await run_in_threadpool(self._complete, key)
+
+    async def release(self, key: OcppEventKey) -> None:
+        """Forgets an event whose processing failed, so a redelivery is processed."""
+        self._seen.pop(key, None)
+        await run_in_threadpool(self._delete, key)
+
+    def _remember(self, key: OcppEventKey) -> None:
+        self._seen[key] = None
+        if len(self._seen) > self.cache_size:
+            self._seen.popitem(last=False)
+
+    def _insert(self, key: OcppEventKey) -> bool:
+        station_id, transaction_id, sequence, event_type = key
+        now = datetime.now(timezone.utc)
+        with self.session_factory() as db:
+            db.add(
+                ProcessedOcppEventModel(
+                    station_id=station_id,
+                    transaction_id=transaction_id,
+                    sequence=sequence,
+                    event_type=event_type,
+                    status=OcppEventStatusEnumType.CLAIMED,
+                    received_at=now,
+                    claimed_at=now,
+                )
+            )
+            try:
+                db.commit()
+                return True
+            except IntegrityError:
+                db.rollback()
+
+            # Only one consumer can take over an expired claim
+            taken_over = (
+                self._filter_key(db, key)
+                .filter(
+                    ProcessedOcppEventModel.status == OcppEventStatusEnumType.CLAIMED,
+                    ProcessedOcppEventModel.claimed_at < now - self.claim_timeout,
+                )
+                .update(
+                    {ProcessedOcppEventModel.claimed_at: now},
+                    synchronize_session=False,
+                )
+            )
+            db.commit()
+            if taken_over == 1:
+                return True
+            status = (
+                self._filter_key(db, key)
+                .with_entities(ProcessedOcppEventModel.status)
+                .scalar()
+            )
+        if status == OcppEventStatusEnumType.DONE:
+            return False
+        raise OcppEventInProgressError(key)
+
+    def _complete(self, key: OcppEventKey) -> None:
+        with self.session_factory() as db:
+            self._filter_key(db, key).update(
+                {ProcessedOcppEventModel.status: OcppEventStatusEnumType.DONE},
+                synchronize_session=False,
+            )
+            db.commit()
+
+    def _delete(self, key: OcppEventKey) -> None:
+        with self.session_factory() as db:
+            self._filter_key(db, key).delete(synchronize_session=False)
+            db.commit()
+
+    async def _prune_if_due(self) -> None:
+        self._claims_since_prune += 1
+        if self._claims_since_prune < PRUNE_INTERVAL:
+            return
+        self._claims_since_prune = 0
+        deleted = await run_in_threadpool(self._prune)
+        debug(" [CitrineOS] Deleted %d expired OCPP event keys", deleted)
+
+    def _prune(self) -> int:
+        expired_before = datetime.now(timezone.utc) - self.window
+        with self.session_factory() as db:
+            deleted = (
+                db.query(ProcessedOcppEventModel)
+                .filter(ProcessedOcppEventModel.received_at < expired_before)
+                .delete(synchronize_session=False)
+            )
+            db.commit()
+        return deleted
+
+    @staticmethod
+    def _filter_key(db: Session, key: OcppEventKey):
+        station_id, transaction_id, sequence, event_type = key
+        return db.query(ProcessedOcppEventModel).filter(
+            ProcessedOcppEventModel.station_id == station_id,
+            ProcessedOcppEventModel.transaction_id == transaction_id,
+            ProcessedOcppEventModel.sequence == sequence,
+            ProcessedOcppEventModel.event_type == event_type,
+        )
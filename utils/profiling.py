@@ -0,0 +1,191 @@
+import asyncio
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import datetime, timezone
+from logging import exception, info, warning
+
+from config import Config
+from utils.metrics import EVENT_LOOP_LAG
+
+
+class ProfilerBusyError(Exception):
+    pass
+
+
+# One profile at a time, whether started by the endpoint or by a signal
+_profile_lock = threading.Lock()
+
+
+class StackSampler:
+    """
+    Samples the stacks of all threads of the process at a fixed interval.
+
+    Samples are taken with sys._current_frames from a separate thread, so the event
+    loop, the threadpool running sync routes and Stripe calls, and every other
+    thread are covered without instrumenting any code. Stacks are counted in the
+    folded format read by flamegraph.pl, speedscope and inferno: one line per
+    distinct stack, frames separated by ";", root first, followed by the count.
+    """
+
+    def __init__(self, interval: float = Config.PROFILE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+
+    def sample(self) -> None:
+        own_thread = threading.get_ident()
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:"
+                    f"{frame.f_lineno})"
+                )
+                frame = frame.f_back
+            frames.append(thread_names.get(thread_id, str(thread_id)))
+            self.stacks[";".join(reversed(frames))] += 1
+        self.samples += 1
+
+    def run(self, duration: float) -> "StackSampler":
+        """Samples until `duration` seconds have passed, blocking the calling thread."""
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            self.sample()
+            time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+        return self
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+
+def profile(duration: float) -> StackSampler:
+    """
+    Samples all threads for `duration` seconds.
+
+    Raises:
+        ProfilerBusyError - If another profile is running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusyError("A profile is already running")
+    try:
+        return StackSampler().run(duration)
+    finally:
+        _profile_lock.release()
+
+
+def write_profile(duration: float = Config.PROFILE_DURATION_SECONDS) -> str:
+    """Profiles the process and writes the folded stacks to a file, returning its path."""
+    sampler = profile(duration)
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path = os.path.join(
+        Config.PROFILE_OUTPUT_DIR or tempfile.gettempdir(),
+        f"profile-{os.getpid()}-{timestamp}.folded",
+    )
+    with open(path, "w") as file:
+        file.write(sampler.folded())
+    info(" [Profiler] Wrote %d samples to %s", sampler.samples, path)
+    return path
+
+
+def install_profile_signal_handler(signal_number: int = signal.SIGUSR1) -> None:
+    """
+    Writes a profile of the running process when it receives `signal_number`.
+
+    Must be called from the main thread. The profile runs in a new thread, so the
+    process keeps working while it is sampled.
+    """
+
+    def write_profile_in_thread():
+        try:
+            write_profile()
+        except ProfilerBusyError:
+            warning(" [Profiler] Ignoring signal, a profile is already running")
+        except Exception:
+            exception(" [Profiler] Could not write profile")
+
+    def handle_signal(signal_number, frame):
+        info(" [Profiler] Profiling for %d seconds", Config.PROFILE_DURATION_SECONDS)
+        threading.Thread(
+            target=write_profile_in_thread, name="profiler", daemon=True
+        ).start()
+
+    signal.signal(signal_number, handle_signal)
+
+
+class EventLoopLagMonitor:
+    """
+    Logs the stack of code blocking the event loop for more than `threshold` seconds.
+
+    A callback on the loop records a heartbeat every `threshold / 4` seconds. A
+    watchdog thread checks the heartbeat and, once it is older than `threshold`,
+    logs where the loop thread is stuck, e.g. in a blocking HTTP request. A stall
+    is logged once, with its total duration when the loop is responsive again.
+    """
+
+    def __init__(self, threshold: float = Config.EVENT_LOOP_LAG_THRESHOLD_MS / 1000):
+        self.threshold = threshold
+        self.interval = threshold / 4
+        self._heartbeat = time.monotonic()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id: int | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        """Starts monitoring the running event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._loop.call_soon(self._beat)
+        self._thread = threading.Thread(
+            target=self._watch, name="event-loop-lag-monitor", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _lag(self) -> float:
+        return max(0.0, time.monotonic() - self._heartbeat - self.interval)
+
+    def _beat(self) -> None:
+        self._heartbeat = time.monotonic()
+        if not self._stop.is_set():
+            self._loop.call_later(self.interval, self._beat)
+
+    def _watch(self) -> None:
+        stalled_since = None
+        while not self._stop.wait(self.interval):
+            heartbeat = self._heartbeat
+            if stalled_since is not None and heartbeat != stalled_since:
+                warning(
+                    " [EventLoop] Event loop was blocked for %dms",
+                    (heartbeat - stalled_since - self.interval) * 1000,
+                )
+                stalled_since = None
+
+            lag = time.monotonic() - heartbeat - self.interval
+            EVENT_LOOP_LAG.set(max(0.0, lag))
+            if stalled_since is None and lag > self.threshold:
+                stalled_since = heartbeat
+                frame = sys._current_frames().get(self._loop_thread_id)
+                warning(
+                    " [EventLoop] Event loop blocked for more than %dms in:\n%s",
+                    lag * 1000,
+                    "".join(traceback.format_stack(frame)) if frame else "unknown",
+                )
@@ -0,0 +1,79 @@
+import asyncio
+from asyncio import Task
+
+from sqlalchemy import text
+
+from config import Config
+from db.init_db import db_session
+from utils.cache import cache_backend
+from utils.circuit_breaker import circuit_breakers
+
+
+async def check_database() -> dict:
+    def select_one():
+        with db_session() as session:
+            session.execute(text("SELECT 1"))
+
+    await asyncio.to_thread(select_one)
+    return {}
+
+
+async def check_broker(event_consumer_task: Task | None = None) -> dict:
+    """
+    Checks that the message broker accepts connections.
+
+    Also fails once the event consumer embedded in this process stopped, as events
+    are then no longer processed although the broker is up.
+    """
+    if event_consumer_task is not None and event_consumer_task.done():
+        raise RuntimeError("The embedded event consumer stopped")
+    _, writer = await asyncio.open_connection(
+        Config.MESSAGE_BROKER_HOST, Config.MESSAGE_BROKER_PORT
+    )
+    writer.close()
+    await writer.wait_closed()
+    return {}
+
+
+async def check_cache() -> dict:
+    backend = cache_backend()
+    await asyncio.to_thread(backend.ping)
+    return {"backend": backend.name}
+
+
+async def check_readiness(event_consumer_task: Task | None = None) -> tuple[bool, dict]:
+    """
+    Returns whether the app can serve requests and the result of each check.
+
+    The app is ready when the database, the message broker and the cache respond
+    within READINESS_TIMEOUT_SECONDS. The circuits of Stripe, CitrineOS and Directus
+    are reported without affecting readiness, as requests not needing an open
+    circuit are still served and restarting the app does not close it.
+    """
+    checks = {
+        "database": check_database(),
+        "broker": check_broker(event_consumer_task),
+        "cache": check_cache(),
+    }
+    results = await asyncio.gather(
+        *(
+            asyncio.wait_for(check, Config.READINESS_TIMEOUT_SECONDS)
+            for check in checks.values()
+        ),
+        return_exceptions=True,
+    )
+
+    report = {}
+    for name, result in zip(checks, results):
+        if isinstance(result, asyncio.TimeoutError):
+            report[name] = {"status": "down", "error": "Timed out"}
+        elif isinstance(result, Exception):
+            report[name] = {"status": "down", "error": str(result) or repr(result)}
+        else:
+            report[name] = {"status": "up"} | result
+    ready = all(check["status"] == "up" for check in report.values())
+    report["integrations"] = {
+        name: {"circuit": breaker.state.value}
+        for name, breaker in circuit_breakers.items()
+    }
+    return ready, report
@@ -0,0 +1,42 @@
+import hashlib
+from typing import Callable
+
+from fastapi import Request, Response
+
+from config import Config
+from utils.cache import Cache
+from utils.frontend import REVALIDATE, etag_matches
+from utils.metrics import RESPONSE_CACHE_LOOKUPS
+
+ETAG_LENGTH = 32
+
+
+def cached_json_response(
+    request: Request,
+    cache: Cache,
+    key: str,
+    render: Callable[[], bytes],
+    ttl: float = Config.TOPOLOGY_CACHE_TTL_SECONDS,
+) -> Response:
+    """
+    Returns the JSON body cached under `key`, rendering and caching it on a miss.
+
+    Bodies are cached serialized together with their strong ETag, so a hit costs
+    neither a query nor serialization. Clients sending the current ETag in
+    If-None-Match get a 304 without a body. `render` raises HTTPException for
+    responses that must not be cached, like 404s.
+    """
+    entry = cache.get(key)
+    if entry is None:
+        RESPONSE_CACHE_LOOKUPS.labels(cache.namespace, "miss").inc()
+        body = render()
+        etag = hashlib.sha256(body).hexdigest()[:ETAG_LENGTH].encode()
+        entry = etag + body
+        cache.fill(key, entry, ttl)
+    else:
+        RESPONSE_CACHE_LOOKUPS.labels(cache.namespace, "hit").inc()
+
+    headers = {"etag": f'"{entry[:ETAG_LENGTH].decode()}"', "cache-control": REVALIDATE}
+    if etag_matches(headers["etag"], request.headers.get("if-none-match", "")):
+        return Response(status_code=304, headers=headers)
+    return Response(entry[ETAG_LENGTH:], media_type="application/json", headers=headers)
@@ -0,0 +1,63 @@
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Callable, Iterator, TypeVar
+
+from anyio import CapacityLimiter, to_thread
+import stripe
+
+from config import Config
+from utils.circuit_breaker import call_dependency
+from utils.dependency_stats import STRIPE
+
+T = TypeVar("T")
+
+_stripe_limiter: CapacityLimiter | None = None
+
+# Errors telling that Stripe itself is unavailable, not that the request was invalid
+STRIPE_OUTAGE_ERRORS = (
+    stripe.error.APIConnectionError,
+    stripe.error.APIError,
+    stripe.error.RateLimitError,
+)
+
+
+def configure_stripe() -> None:
+    stripe.api_key = Config.STRIPE_API_KEY
+    stripe.default_http_client = stripe.http_client.RequestsClient(
+        timeout=Config.STRIPE_REQUEST_TIMEOUT_SECONDS
+    )
+
+
+@contextmanager
+def stripe_call() -> Iterator[None]:
+    """Runs the block as a Stripe call behind the Stripe circuit breaker."""
+    with call_dependency(
+        STRIPE, is_failure=lambda error: isinstance(error, STRIPE_OUTAGE_ERRORS)
+    ):
+        yield
+
+
+def _get_stripe_limiter() -> CapacityLimiter:
+    # The limiter has to be created inside the running event loop.
+    global _stripe_limiter
+    if _stripe_limiter is None:
+        _stripe_limiter = CapacityLimiter(Config.STRIPE_MAX_CONCURRENT_REQUESTS)
+    return _stripe_limiter
+
+
+async def run_stripe_call(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Runs a blocking Stripe SDK call in a worker thread.
+
+    Stripe calls use their own capacity limiter instead of the shared threadpool used
+    for sync routes and dependencies, so a slow Stripe API only queues coroutines
+    waiting for Stripe and does not starve the rest of the API.
+    """
+    return await to_thread.run_sync(
+        partial(_guarded_call, func, *args, **kwargs), limiter=_get_stripe_limiter()
+    )
+
+
+def _guarded_call(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    with stripe_call():
+        return func(*args, **kwargs)
@@ -0,0 +1,83 @@
+import hmac
+import time
+from hashlib import sha256
+from typing import Sequence
+
+from stripe.error import SignatureVerificationError
+
+EXPECTED_SCHEME = "v1"
+DEFAULT_TOLERANCE = 300  # in seconds, same as stripe.Webhook
+
+
+def _get_timestamp_and_signatures(header: str) -> tuple[int, list[bytes]]:
+    timestamp = None
+    signatures = []
+    for item in header.split(","):
+        key, _, value = item.strip().partition("=")
+        if key == "t":
+            timestamp = int(value)
+        elif key == EXPECTED_SCHEME:
+            signatures.append(value.encode("ascii"))
+    if timestamp is None:
+        raise ValueError("No timestamp in header")
+    return timestamp, signatures
+
+
+def verify_stripe_signature(
+    payload: bytes,
+    sig_header: str | None,
+    secrets: Sequence[str],
+    tolerance: int = DEFAULT_TOLERANCE,
+) -> str:
+    """
+    Verifies the Stripe-Signature header against the raw request body.
+
+    Works like stripe.WebhookSignature.verify_header, but hashes the body bytes as
+    they are instead of decoding and re-encoding them, and checks several endpoint
+    secrets with a single header parse.
+
+    Parameters:
+        payload: bytes - The raw request body.
+        sig_header: str - The value of the Stripe-Signature header.
+        secrets: Sequence[str] - The endpoint secrets to try, in order.
+        tolerance: int - Maximum age of the signature timestamp in seconds.
+
+    Returns:
+        str - The first secret the payload was signed with.
+    """
+    if not sig_header:
+        raise SignatureVerificationError("No signature header", sig_header, payload)
+    try:
+        timestamp, signatures = _get_timestamp_and_signatures(sig_header)
+    except Exception:
+        raise SignatureVerificationError(
+            "Unable to extract timestamp and signatures from header",
+            sig_header,
+            payload,
+        )
+    if not signatures:
+        raise SignatureVerificationError(
+            f"No signatures found with expected scheme {EXPECTED_SCHEME}",
+            sig_header,
+            payload,
+        )
+
+    signed_prefix = b"%d." % timestamp
+    for secret in secrets:
+        mac = hmac.new(secret.encode("utf-8"), signed_prefix, sha256)
+        mac.update(payload)
+        expected_signature = mac.hexdigest().encode("ascii")
+        if any(hmac.compare_digest(expected_signature, s) for s in signatures):
+            if tolerance and timestamp < time.time() - tolerance:
+                raise SignatureVerificationError(
+                    f"Timestamp outside the tolerance zone ({timestamp})",
+                    sig_header,
+                    payload,
+                )
+            return secret
+
+    raise SignatureVerificationError(
+        "No signatures found matching the expected signature for payload",
+        sig_header,
+        payload,
+    )
@@ -0,0 +1,192 @@
+import inspect
+from contextlib import contextmanager
+from functools import wraps
+from logging import info, warning
+from typing import Any, Iterator, Mapping
+
+from config import Config
+
+try:
+    from opentelemetry import propagate, trace
+    from opentelemetry.trace import SpanKind, Status, StatusCode
+except ImportError:  # Tracing is optional
+    trace = None
+
+TRACER_NAME = "citrineos-payment"
+
+# Set by configure_tracing, spans are only created while it is set
+_tracer = None
+
+
+def configure_tracing() -> None:
+    """
+    Exports spans to the exporter set in TRACING_EXPORTER.
+
+    "console" writes spans to stdout, "otlp" sends them with OTLP over HTTP to
+    TRACING_OTLP_ENDPOINT. Without an exporter, or without the OpenTelemetry SDK
+    installed, tracing stays off and costs a None check per span.
+    """
+    global _tracer
+    exporter_name = Config.TRACING_EXPORTER.lower()
+    if not exporter_name:
+        return
+    if trace is None:
+        warning(
+            " [Tracing] TRACING_EXPORTER is set, but OpenTelemetry is not installed: "
+            "pip install opentelemetry-sdk opentelemetry-exporter-otlp-proto-http"
+        )
+        return
+
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+    if exporter_name == "console":
+        exporter = ConsoleSpanExporter()
+    elif exporter_name == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+            OTLPSpanExporter,
+        )
+
+        exporter = OTLPSpanExporter(endpoint=Config.TRACING_OTLP_ENDPOINT or None)
+    else:
+        raise ValueError(f"Unknown TRACING_EXPORTER: {Config.TRACING_EXPORTER}")
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": Config.TRACING_SERVICE_NAME}),
+        sampler=ParentBased(TraceIdRatioBased(Config.TRACING_SAMPLE_RATIO)),
+    )
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer(TRACER_NAME)
+    info(" [Tracing] Exporting spans to %s", exporter_name)
+
+
+@contextmanager
+def start_span(
+    name: str,
+    kind: str = "internal",
+    attributes: Mapping[str, Any] | None = None,
+    carrier: Mapping[str, Any] | None = None,
+) -> Iterator[Any]:
+    """
+    Runs the block in a span, or yields None while tracing is off.
+
+    Parameters:
+        kind: str - "internal", "server", "client", "producer" or "consumer".
+        carrier: Mapping - Headers of an incoming message or request to continue
+            the trace of.
+    """
+    if _tracer is None:
+        yield None
+        return
+    context = propagate.extract(_text_headers(carrier)) if carrier else None
+    with _tracer.start_as_current_span(
+        name,
+        context=context,
+        kind=SpanKind[kind.upper()],
+        attributes=attributes,
+    ) as span:
+        yield span
+
+
+def traced(name: str):
+    """Decorates a function or coroutine function to run it in a span called `name`."""
+
+    def decorator(func):
+        if not inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            def sync_wrapper(*args, **kwargs):
+                if _tracer is None:
+                    return func(*args, **kwargs)
+                with start_span(name):
+                    return func(*args, **kwargs)
+
+            return sync_wrapper
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return await func(*args, **kwargs)
+            with start_span(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def inject_trace_headers(headers: dict | None = None) -> dict | None:
+    """Adds the headers continuing the current trace, like `traceparent`."""
+    if _tracer is None:
+        return headers
+    headers = dict(headers or {})
+    propagate.inject(headers)
+    return headers
+
+
+def tracing_enabled() -> bool:
+    return _tracer is not None
+
+
+def start_manual_span(name: str, kind: str = "client", attributes=None):
+    """Starts a span that is ended by the caller, or returns None while tracing is off."""
+    if _tracer is None:
+        return None
+    return _tracer.start_span(name, kind=SpanKind[kind.upper()], attributes=attributes)
+
+
+def end_manual_span(span, error: BaseException | None = None) -> None:
+    if span is None:
+        return
+    if error is not None:
+        span.record_exception(error)
+        span.set_status(Status(StatusCode.ERROR))
+    span.end()
+
+
+def _text_headers(headers: Mapping[str, Any]) -> dict[str, str]:
+    # AMQP header values may be bytes
+    return {
+        key: value.decode() if isinstance(value, bytes) else str(value)
+        for key, value in headers.items()
+    }
+
+
+class TracingMiddleware:
+    """Runs every HTTP request in a server span continuing the caller's trace."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or _tracer is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {
+            key.decode("latin-1"): value.decode("latin-1")
+            for key, value in scope["headers"]
+        }
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                span.set_attribute("http.response.status_code", message["status"])
+            await send(message)
+
+        with start_span(
+            scope["method"],
+            kind="server",
+            attributes={
+                "http.request.method": scope["method"],
+                "url.path": scope["path"],
+            },
+            carrier=headers,
+        ) as span:
+            await self.app(scope, receive, send_with_status)
+            route = scope.get("route")
+            if route is not None:
+                span.update_name(f"{scope['method']} {route.path}")
+                span.set_attribute("http.route", route.path)
@@ -0,0 +1,391 @@
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from logging import debug, exception, info, warning
+from typing import Callable
+
+import requests
+from anyio import CapacityLimiter, to_thread
+from orjson import loads
+from sqlalchemy import or_
+from sqlalchemy.exc import (
+    IntegrityError,
+    InterfaceError,
+    OperationalError,
+    TimeoutError as PoolTimeoutError,
+)
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+from config import Config
+from db.init_db import SessionLocal, WebhookEvent as WebhookEventModel
+from integrations.citrineos.retry import parse_retry_delays
+from model.tariff_schedule import as_utc
+from utils.circuit_breaker import CircuitOpenError
+from utils.stripe_client import STRIPE_OUTAGE_ERRORS
+
+# Errors of a dependency that is unavailable for now, after which an event is
+# retried. Any other error fails the event for good: its handler may already have
+# cancelled the payment, a retry would act on it anyway.
+TRANSIENT_ERRORS = (
+    CircuitOpenError,
+    requests.ConnectionError,
+    requests.Timeout,
+    OperationalError,
+    InterfaceError,
+    PoolTimeoutError,
+    *STRIPE_OUTAGE_ERRORS,
+)
+
+
+class WebhookEventStatusEnumType(str, Enum):
+    PENDING = "Pending"
+    PROCESSING = "Processing"
+    DONE = "Done"
+    FAILED = "Failed"
+
+
+def store_webhook_event(
+    db: Session, event: dict, payload: bytes, checkout_id: int | None
+) -> int | None:
+    """
+    Stores a verified Stripe event in the inbox.
+
+    Returns:
+        int - The inbox id of the event, or None if the event was already received.
+    """
+    db_event = WebhookEventModel(
+        event_id=event.get("id"),
+        event_type=event.get("type"),
+        checkout_id=checkout_id,
+        payload=payload.decode("utf-8"),
+        status=WebhookEventStatusEnumType.PENDING,
+        attempts=0,
+        received_at=datetime.now(timezone.utc),
+    )
+    db.add(db_event)
+    try:
+        db.flush()
+        inbox_event_id = db_event.id
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return None
+    return inbox_event_id
+
+
+class WebhookInbox:
+    """
+    Processes stored Stripe webhook events in the background.
+
+    Each event is assigned to a worker by its checkout id, so the events of one
+    checkout are processed one after another in the order they were received. The
+    handler runs in a worker thread. An event whose processing failed on one of
+    TRANSIENT_ERRORS is retried after the next of `retry_delays` milliseconds and
+    marked failed after `max_attempts` attempts. Other errors mark it failed right
+    away. While an event waits for its retry, later events of its checkout are held
+    back and processed after it. Events left pending by a previous run are picked up
+    on start, as are events interrupted while processing: those processing for
+    longer than `processing_timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Session, dict], None],
+        workers: int = Config.STRIPE_WEBHOOK_WORKERS,
+        session_factory: sessionmaker = SessionLocal,
+        retry_delays: list[int] = None,
+        max_attempts: int = Config.STRIPE_WEBHOOK_MAX_ATTEMPTS,
+        processing_timeout: float = Config.STRIPE_WEBHOOK_PROCESSING_TIMEOUT_SECONDS,
+    ):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.session_factory = session_factory
+        self.retry_delays = (
+            retry_delays
+            if retry_delays is not None
+            else parse_retry_delays(Config.STRIPE_WEBHOOK_RETRY_DELAYS_MS)
+        )
+        self.max_attempts = max(1, max_attempts)
+        self.processing_timeout = processing_timeout
+        self._queues: list[asyncio.Queue] = []
+        self._tasks: list[asyncio.Task] = []
+        self._limiter: CapacityLimiter | None = None
+        self._retries: dict[int, asyncio.TimerHandle] = {}
+        # Checkout id to its event waiting for a retry, and the later events of the
+        # checkout held back until it succeeded or failed for good, in order
+        self._waiting: dict[int, int] = {}
+        self._held: dict[int, deque[int]] = {}
+
+    async def start(self) -> None:
+        self._queues = [asyncio.Queue() for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._work(queue)) for queue in self._queues]
+        # The handlers have threads of their own, so they do not wait behind sync
+        # API routes
+        self._limiter = CapacityLimiter(self.workers)
+
+        pending_events, interrupted_events = await run_in_threadpool(
+            self._get_unfinished_events
+        )
+        if interrupted_events:
+            warning(
+                " [Webhooks] %d webhook events were interrupted during processing: %r",
+                len(interrupted_events),
+                interrupted_events,
+            )
+        now = datetime.now(timezone.utc)
+        for inbox_event_id, checkout_id, next_attempt_at in pending_events:
+            delay = (
+                (as_utc(next_attempt_at) - now).total_seconds()
+                if next_attempt_at is not None
+                else 0
+            )
+            if next_attempt_at is not None and checkout_id is not None:
+                # Later events of the checkout wait for the first one to retry
+                self._waiting.setdefault(checkout_id, inbox_event_id)
+            self.submit_later(delay, inbox_event_id, checkout_id)
+        info(
+            " [Webhooks] Started %d webhook workers, resuming %d pending events",
+            self.workers,
+            len(pending_events),
+        )
+
+    def submit(self, inbox_event_id: int, checkout_id: int | None) -> None:
+        key = checkout_id if checkout_id is not None else inbox_event_id
+        self._queues[key % len(self._queues)].put_nowait((inbox_event_id, checkout_id))
+
+    def submit_later(
+        self, delay: float, inbox_event_id: int, checkout_id: int | None
+    ) -> None:
+        if delay <= 0:
+            self.submit(inbox_event_id, checkout_id)
+            return
+        self._retries[inbox_event_id] = asyncio.get_running_loop().call_later(
+            delay, self._submit_retry, inbox_event_id, checkout_id
+        )
+
+    def _submit_retry(self, inbox_event_id: int, checkout_id: int | None) -> None:
+        del self._retries[inbox_event_id]
+        self.submit(inbox_event_id, checkout_id)
+
+    async def join(self) -> None:
+        """Waits until all submitted events are processed."""
+        for queue in self._queues:
+            await queue.join()
+
+    async def stop(self, timeout: float = 10) -> None:
+        """
+        Stops the workers after the events already submitted are processed.
+
+        Events waiting for a retry stay pending and are retried after the next start.
+        """
+        for retry in self._retries.values():
+            retry.cancel()
+        self._retries = {}
+        self._waiting = {}
+        self._held = {}
+        for queue in self._queues:
+            queue.put_nowait(None)
+        if self._tasks:
+            _, still_running = await asyncio.wait(self._tasks, timeout=timeout)
+            for task in still_running:
+                task.cancel()
+        self._tasks = []
+
+    async def _work(self, queue: asyncio.Queue) -> None:
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+                await self.process(*item)
+            except Exception:
+                exception(" [Webhooks] Error while processing webhook event %r", item)
+            finally:
+                queue.task_done()
+
+    async def process(self, inbox_event_id: int, checkout_id: int | None) -> None:
+        if checkout_id is None:
+            retry_delay = await self._process_in_thread(inbox_event_id)
+            if retry_delay is not None:
+                self.submit_later(retry_delay, inbox_event_id, checkout_id)
+            return
+
+        if self._waiting.get(checkout_id, inbox_event_id) != inbox_event_id:
+            self._held.setdefault(checkout_id, deque()).append(inbox_event_id)
+            return
+        while True:
+            retry_delay = await self._process_in_thread(inbox_event_id)
+            if retry_delay is not None:
+                self._waiting[checkout_id] = inbox_event_id
+                self.submit_later(retry_delay, inbox_event_id, checkout_id)
+                return
+            # Release the held events in order, before any event submitted later
+            self._waiting.pop(checkout_id, None)
+            held = self._held.get(checkout_id)
+            if not held:
+                self._held.pop(checkout_id, None)
+                return
+            inbox_event_id = held.popleft()
+
+    async def _process_in_thread(self, inbox_event_id: int) -> float | None:
+        return await to_thread.run_sync(
+            self._process, inbox_event_id, limiter=self._limiter
+        )
+
+    def _process(self, inbox_event_id: int) -> float | None:
+        """
+        Returns:
+            float - Seconds after which the event is retried, or None if it is not.
+        """
+        with self.session_factory() as db:
+            claimed = self._claim(db, inbox_event_id)
+            if claimed is None:
+                debug(" [Webhooks] Webhook event %r already claimed", inbox_event_id)
+                return None
+            payload, attempts = claimed
+
+            try:
+                self.handler(db, loads(payload))
+            except Exception as e:
+                if not isinstance(e, TRANSIENT_ERRORS):
+                    exception(
+                        " [Webhooks] Processing failed for webhook event %r, not retrying",
+                        inbox_event_id,
+                    )
+                    self._set_status(
+                        db, inbox_event_id, WebhookEventStatusEnumType.FAILED, repr(e)
+                    )
+                    return None
+                if attempts >= self.max_attempts:
+                    exception(
+                        " [Webhooks] Processing failed for webhook event %r after %d attempts",
+                        inbox_event_id,
+                        attempts,
+                    )
+                    self._set_status(
+                        db, inbox_event_id, WebhookEventStatusEnumType.FAILED, repr(e)
+                    )
+                    return None
+
+                delays = self.retry_delays or [0]
+                retry_delay = delays[min(attempts, len(delays)) - 1] / 1000
+                exception(
+                    " [Webhooks] Processing failed for webhook event %r, retrying in %ss",
+                    inbox_event_id,
+                    retry_delay,
+                )
+                self._set_status(
+                    db,
+                    inbox_event_id,
+                    WebhookEventStatusEnumType.PENDING,
+                    repr(e),
+                    next_attempt_at=datetime.now(timezone.utc)
+                    + timedelta(seconds=retry_delay),
+                )
+                return retry_delay
+
+            self._set_status(db, inbox_event_id, WebhookEventStatusEnumType.DONE)
+            return None
+
+    def _get_unfinished_events(
+        self,
+    ) -> tuple[list[tuple[int, int, datetime]], list[str]]:
+        """Returns the pending events, after returning interrupted ones to pending."""
+        interrupted_before = datetime.now(timezone.utc) - timedelta(
+            seconds=self.processing_timeout
+        )
+        with self.session_factory() as db:
+            interrupted = db.query(WebhookEventModel).filter(
+                WebhookEventModel.status == WebhookEventStatusEnumType.PROCESSING,
+                or_(
+                    WebhookEventModel.claimed_at.is_(None),
+                    WebhookEventModel.claimed_at < interrupted_before,
+                ),
+            )
+            interrupted_events = [row.event_id for row in interrupted]
+            interrupted.filter(WebhookEventModel.attempts >= self.max_attempts).update(
+                {
+                    WebhookEventModel.status: WebhookEventStatusEnumType.FAILED,
+                    WebhookEventModel.last_error: "Interrupted during processing",
+                },
+                synchronize_session=False,
+            )
+            interrupted.update(
+                {
+                    WebhookEventModel.status: WebhookEventStatusEnumType.PENDING,
+                    WebhookEventModel.next_attempt_at: None,
+                },
+                synchronize_session=False,
+            )
+            db.commit()
+
+            pending_events = (
+                db.query(
+                    WebhookEventModel.id,
+                    WebhookEventModel.checkout_id,
+                    WebhookEventModel.next_attempt_at,
+                )
+                .filter(WebhookEventModel.status == WebhookEventStatusEnumType.PENDING)
+                .order_by(WebhookEventModel.id)
+                .all()
+            )
+        return [tuple(row) for row in pending_events], interrupted_events
+
+    def _claim(self, db: Session, inbox_event_id: int) -> tuple[str, int] | None:
+        # Only one worker, in any process, can move an event out of pending
+        now = datetime.now(timezone.utc)
+        claimed = (
+            db.query(WebhookEventModel)
+            .filter(
+                WebhookEventModel.id == inbox_event_id,
+                WebhookEventModel.status == WebhookEventStatusEnumType.PENDING,
+                or_(
+                    WebhookEventModel.next_attempt_at.is_(None),
+                    WebhookEventModel.next_attempt_at <= now,
+                ),
+            )
+            .update(
+                {
+                    WebhookEventModel.status: WebhookEventStatusEnumType.PROCESSING,
+                    WebhookEventModel.attempts: WebhookEventModel.attempts + 1,
+                    WebhookEventModel.claimed_at: now,
+                },
+                synchronize_session=False,
+            )
+        )
+        if claimed != 1:
+            db.rollback()
+            return None
+        payload, attempts = (
+            db.query(WebhookEventModel.payload, WebhookEventModel.attempts)
+            .filter(WebhookEventModel.id == inbox_event_id)
+            .one()
+        )
+        db.commit()
+        return payload, attempts
+
+    def _set_status(
+        self,
+        db: Session,
+        inbox_event_id: int,
+        status: WebhookEventStatusEnumType,
+        last_error: str | None = None,
+        next_attempt_at: datetime | None = None,
+    ) -> None:
+        db.rollback()
+        db.query(WebhookEventModel).filter(
+            WebhookEventModel.id == inbox_event_id
+        ).update(
+            {
+                WebhookEventModel.status: status,
+                WebhookEventModel.last_error: last_error,
+                WebhookEventModel.next_attempt_at: next_attempt_at,
+                WebhookEventModel.processed_at: datetime.now(timezone.utc)
+                if status != WebhookEventStatusEnumType.PENDING
+                else None,
+            },
+            synchronize_session=False,
+        )
+        db.commit()